@@ -89,6 +89,7 @@ def make_app(global_config=None):
 def setup_paasta_api():
     # pyinotify is a better solution than turning off file caching completely
     service_configuration_lib.disable_yaml_cache()
+    marathon_tools.enable_formatted_app_dict_cache()
 
     settings.system_paasta_config = load_system_paasta_config()
     settings.cluster = settings.system_paasta_config.get_cluster()
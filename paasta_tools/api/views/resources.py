@@ -15,6 +15,10 @@
 """
 PaaSTA resource utilization, etc.
 """
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
 from pyramid.response import Response
 from pyramid.view import view_config
 
@@ -22,6 +26,38 @@ from paasta_tools.mesos_tools import get_mesos_master
 from paasta_tools.metrics import metastatus_lib
 
 
+# MesosMaster.state is cached on the master for a few seconds, so reusing one master across requests
+# lets us also reuse the utilization we already computed from the state it returned.
+_mesos_master = None
+# (mesos state, {(groupings, filters): utilization}), only ever for the latest state we have seen
+_utilization_cache: Tuple[Optional[Dict], Dict[Tuple, Dict]] = (None, {})
+
+
+def get_master():
+    global _mesos_master
+    if _mesos_master is None:
+        _mesos_master = get_mesos_master()
+    return _mesos_master
+
+
+def get_resource_utilization(mesos_state, groupings, filters):
+    global _utilization_cache
+    cached_state, utilizations = _utilization_cache
+    if cached_state is not mesos_state:
+        utilizations = {}
+        _utilization_cache = (mesos_state, utilizations)
+
+    key = (tuple(groupings), tuple(sorted((attr, tuple(vals)) for attr, vals in filters.items())))
+    if key not in utilizations:
+        utilizations[key] = metastatus_lib.get_resource_utilization_by_grouping(
+            grouping_func=metastatus_lib.key_func_for_attribute_multi(groupings),
+            mesos_state=mesos_state,
+            filters=[metastatus_lib.make_filter_slave_func(attr, vals) for attr, vals in filters.items()],
+            sort_func=metastatus_lib.sort_func_for_attributes(groupings),
+        )
+    return utilizations[key]
+
+
 def parse_filters(filters):
     # The swagger config verifies that the data is in this format
     #  "pattern": "(.*):(.*,)*(.*)"
@@ -34,28 +70,17 @@ def parse_filters(filters):
 
 @view_config(route_name='resources.utilization', request_method='GET', renderer='json')
 def resources_utilization(request):
-    master = get_mesos_master()
-    mesos_state = master.state
+    mesos_state = get_master().state
 
     groupings = request.swagger_data.get('groupings', ['superregion'])
     # swagger actually makes the key None if it's not set
     if groupings is None:
         groupings = ['superregion']
-    grouping_function = metastatus_lib.key_func_for_attribute_multi(groupings)
-    sorting_function = metastatus_lib.sort_func_for_attributes(groupings)
 
     filters = request.swagger_data.get('filter', [])
     filters = parse_filters(filters)
-    filter_funcs = [
-        metastatus_lib.make_filter_slave_func(attr, vals) for attr, vals in filters.items()
-    ]
-
-    resource_info_dict = metastatus_lib.get_resource_utilization_by_grouping(
-        grouping_func=grouping_function,
-        mesos_state=mesos_state,
-        filters=filter_funcs,
-        sort_func=sorting_function,
-    )
+
+    resource_info_dict = get_resource_utilization(mesos_state, groupings, filters)
 
     response_body = []
     for k, v in resource_info_dict.items():
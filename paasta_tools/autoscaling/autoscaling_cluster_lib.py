@@ -13,9 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import asyncio
+import functools
 import logging
 import math
 import os
+import threading
 import time
 from collections import defaultdict
 from collections import namedtuple
@@ -24,6 +26,7 @@ from datetime import timedelta
 from math import ceil
 from math import floor
 from typing import Any
+from typing import Callable
 from typing import Dict
 from typing import Iterable
 from typing import List
@@ -47,6 +50,7 @@ from paasta_tools.mesos_tools import slave_pid_to_ip
 from paasta_tools.mesos_tools import SlaveTaskCount
 from paasta_tools.metrics.metastatus_lib import get_resource_utilization_by_grouping
 from paasta_tools.metrics.metastatus_lib import ResourceInfo
+from paasta_tools.metrics.metastatus_lib import ResourceUtilizationDict
 from paasta_tools.metrics.metrics_lib import get_metrics_interface
 from paasta_tools.paasta_maintenance import is_safe_to_kill
 from paasta_tools.utils import load_system_paasta_config
@@ -103,6 +107,25 @@ log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
 
+async def run_in_executor(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Runs a blocking call (boto3, mesos maintenance, ...) in the event loop's default executor,
+    so that the other coroutines draining and terminating slaves keep running while it waits"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+_boto3_sessions = threading.local()
+
+
+def get_boto3_client(service_name: str, region_name: Optional[str]=None) -> Any:
+    """Like boto3.client, but with a Session per thread. boto3.client uses boto3's default Session,
+    which isn't thread-safe, and clients are made from the executor's threads at the same time."""
+    session = getattr(_boto3_sessions, 'session', None)
+    if session is None:
+        session = _boto3_sessions.session = boto3.session.Session()
+    return session.client(service_name, region_name=region_name)
+
+
 class Timer(object):
     def __init__(self, timeout: int) -> None:
         self.timeout = timedelta(seconds=timeout)
@@ -142,6 +165,9 @@ class ClusterAutoscaler(object):
         self.instances: List[Dict] = []
         self.sfr: Optional[Dict[str, Any]] = None
         self.enable_metrics = enable_metrics
+        # Held while a coroutine works out a new capacity from self.capacity and sets it, as set_capacity
+        # runs in an executor and another coroutine could otherwise read self.capacity before it is updated
+        self.capacity_lock = asyncio.Lock()
 
         self.setup_metrics()
 
@@ -214,7 +240,7 @@ class ClusterAutoscaler(object):
         :returns: a list of instance description dictionaries"""
         if not instance_filters:
             instance_filters = []
-        ec2_client = boto3.client('ec2', region_name=region)
+        ec2_client = get_boto3_client('ec2', region_name=region)
         try:
             instance_descriptions = ec2_client.describe_instances(InstanceIds=instance_ids, Filters=instance_filters)
         except ClientError as e:
@@ -244,7 +270,7 @@ class ClusterAutoscaler(object):
         :returns: a list of instance description dictionaries"""
         if not instance_filters:
             instance_filters = []
-        ec2_client = boto3.client('ec2', region_name=region)
+        ec2_client = get_boto3_client('ec2', region_name=region)
         try:
             instance_descriptions = ec2_client.describe_instance_status(
                 InstanceIds=instance_ids,
@@ -339,7 +365,7 @@ class ClusterAutoscaler(object):
                 error_message += "(refusing to go past %.2f%% missing instances)" % MISSING_SLAVE_PANIC_THRESHOLD
                 raise ClusterAutoscalingError(error_message)
 
-    def can_kill(
+    async def can_kill(
         self,
         hostname: str,
         should_drain: bool,
@@ -355,7 +381,7 @@ class ClusterAutoscaler(object):
         if not should_drain:
             self.log.info("Not draining, waiting %s longer before killing" % timer.left())
             return False
-        if is_safe_to_kill(hostname):
+        if await run_in_executor(is_safe_to_kill, hostname):
             self.log.info("Slave %s is ready to kill, with %s left on timer" % (hostname, timer.left()))
             timer.start()
             return True
@@ -380,7 +406,7 @@ class ClusterAutoscaler(object):
         :param should_drain: whether we should drain hosts before waiting to stop them
         :param timer: a Timer object to keep terminates happening once every n seconds accross co-routines
         """
-        ec2_client = boto3.client('ec2', region_name=region)
+        ec2_client = await run_in_executor(get_boto3_client, 'ec2', region_name=region)
         self.log.info("Starting TERMINATING: {} (Hostname = {}, IP = {})".format(
             slave.instance_id,
             slave.hostname,
@@ -397,14 +423,16 @@ class ClusterAutoscaler(object):
                     )
                     break
                 # Check if no tasks are running or we have reached the maintenance window
-                if self.can_kill(slave.hostname, should_drain, dry_run, timer):
+                if await self.can_kill(slave.hostname, should_drain, dry_run, timer):
                     self.log.info("TERMINATING: {} (Hostname = {}, IP = {})".format(
                         instance_id,
                         slave.hostname,
                         slave.ip,
                     ))
                     try:
-                        ec2_client.terminate_instances(InstanceIds=[instance_id], DryRun=dry_run)
+                        await run_in_executor(
+                            ec2_client.terminate_instances, InstanceIds=[instance_id], DryRun=dry_run,
+                        )
                     except ClientError as e:
                         if e.response['Error'].get('Code') == 'DryRunOperation':
                             pass
@@ -421,7 +449,7 @@ class ClusterAutoscaler(object):
                 slave.pid,
             ))
             try:
-                ec2_client.terminate_instances(InstanceIds=[instance_id], DryRun=dry_run)
+                await run_in_executor(ec2_client.terminate_instances, InstanceIds=[instance_id], DryRun=dry_run)
             except ClientError as e:
                 if e.response['Error'].get('Code') == 'DryRunOperation':
                     pass
@@ -449,12 +477,12 @@ class ClusterAutoscaler(object):
             return
         elif delta > 0:
             self.log.info("Increasing resource capacity to: {}".format(target_capacity))
-            self.set_capacity(target_capacity)
+            await run_in_executor(self.set_capacity, target_capacity)
             return
         elif delta < 0:
-            mesos_state = get_mesos_master().state_summary()
+            mesos_state = await run_in_executor(get_mesos_master().state_summary)
             slaves_list = get_mesos_task_count_by_slave(mesos_state, pool=self.resource['pool'])
-            filtered_slaves = self.filter_aws_slaves(slaves_list)
+            filtered_slaves = await run_in_executor(self.filter_aws_slaves, slaves_list)
             killable_capacity = round(sum([slave.instance_weight for slave in filtered_slaves]), 2)
             amount_to_decrease = round(delta * -1, 2)
             if amount_to_decrease > killable_capacity:
@@ -504,21 +532,24 @@ class ClusterAutoscaler(object):
         if should_drain:
             try:
                 drain_host_string = "{}|{}".format(slave_to_kill.hostname, slave_to_kill.ip)
-                drain([drain_host_string], start, duration)
+                await run_in_executor(drain, [drain_host_string], start, duration)
             except HTTPError as e:
                 self.log.error("Failed to start drain "
                                "on {}: {}\n Trying next host".format(slave_to_kill.hostname, e))
                 raise
-        self.log.info("Decreasing resource from {} to: {}".format(self.capacity, self.capacity + capacity_diff))
         # Instance weights can be floats but the target has to be an integer
         # because this is all AWS allows on the API call to set target capacity
         try:
-            self.set_capacity(self.capacity + capacity_diff)
+            async with self.capacity_lock:
+                self.log.info("Decreasing resource from {} to: {}".format(
+                    self.capacity, self.capacity + capacity_diff,
+                ))
+                await run_in_executor(self.set_capacity, self.capacity + capacity_diff)
         except FailSetResourceCapacity:
             self.log.error("Couldn't update resource capacity, stopping autoscaler")
             self.log.info("Undraining {}".format(slave_to_kill.pid))
             if should_drain:
-                undrain([drain_host_string])
+                await run_in_executor(undrain, [drain_host_string])
             raise
         self.log.info("Waiting for instance to drain before we terminate")
         try:
@@ -532,30 +563,37 @@ class ClusterAutoscaler(object):
             )
         except ClientError as e:
             self.log.error("Failure when terminating: {}: {}".format(slave_to_kill.pid, e))
-            self.log.error("Setting resource capacity back to {}".format(self.capacity - capacity_diff))
-            self.set_capacity(self.capacity - capacity_diff)
+            async with self.capacity_lock:
+                self.log.error("Setting resource capacity back to {}".format(self.capacity - capacity_diff))
+                await run_in_executor(self.set_capacity, self.capacity - capacity_diff)
             self.log.info("Undraining {}".format(slave_to_kill.pid))
             if should_drain:
-                undrain([drain_host_string])
+                await run_in_executor(undrain, [drain_host_string])
 
     def filter_aws_slaves(self, slaves_list: Iterable[Dict[str, SlaveTaskCount]]) -> List['PaastaAwsSlave']:
         ips = self.get_instance_ips(self.instances, region=self.resource['region'])
         self.log.debug("IPs in AWS resources: {}".format(ips))
-        slaves = [
-            slave for slave in slaves_list
-            if slave_pid_to_ip(slave['task_counts'].slave['pid']) in ips
-        ]
-        slave_ips = [slave_pid_to_ip(slave['task_counts'].slave['pid']) for slave in slaves]
+        aws_ips = set(ips)
+        slaves_with_ips = [(slave, slave_pid_to_ip(slave['task_counts'].slave['pid'])) for slave in slaves_list]
+        slaves_with_ips = [(slave, slave_ip) for slave, slave_ip in slaves_with_ips if slave_ip in aws_ips]
+        slave_ips = [slave_ip for _, slave_ip in slaves_with_ips]
         instance_type_weights = self.get_instance_type_weights()
         instance_statuses = self.instance_status_for_instance_ids(
             instance_ids=[instance['InstanceId'] for instance in self.instances],
         )
         instance_descriptions = self.instance_descriptions_for_ips(slave_ips)
 
+        # Index the descriptions and statuses once rather than scanning them for every slave
+        descriptions_by_ip: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for instance_description in instance_descriptions:
+            descriptions_by_ip[instance_description['PrivateIpAddress']].append(instance_description)
+        statuses_by_instance_id: Dict[str, List[Dict[str, Union[str, Dict, List]]]] = defaultdict(list)
+        for instance_status in instance_statuses['InstanceStatuses']:
+            statuses_by_instance_id[str(instance_status['InstanceId'])].append(instance_status)
+
         paasta_aws_slaves = []
-        for slave in slaves:
-            slave_ip = slave_pid_to_ip(slave['task_counts'].slave['pid'])
-            matching_descriptions = self.filter_instance_description_for_ip(slave_ip, instance_descriptions)
+        for slave, slave_ip in slaves_with_ips:
+            matching_descriptions = descriptions_by_ip.get(slave_ip)
             if matching_descriptions:
                 assert len(matching_descriptions) == 1, (
                     "There should be only one instance with the same IP."
@@ -568,10 +606,7 @@ class ClusterAutoscaler(object):
                     )
                 )
                 description = matching_descriptions[0]
-                matching_status = self.filter_instance_status_for_instance_id(
-                    instance_id=description['InstanceId'],
-                    instance_statuses=instance_statuses,
-                )
+                matching_status = statuses_by_instance_id.get(description['InstanceId'], [])
                 assert len(matching_status) == 1, "There should be only one InstanceStatus per instance"
             else:
                 description = None
@@ -656,16 +691,16 @@ class ClusterAutoscaler(object):
         terminate_tasks = {}
         self.capacity = current_capacity
         timer = Timer(300)
+        kill_preference = ec2_fitness.make_kill_preference_heap(filtered_slaves)
+        self.log.info("Resource slave kill preference: {}".format([
+            slave.hostname
+            for slave in ec2_fitness.sort_by_kill_preference(kill_preference)
+        ]))
         while True:
-            filtered_sorted_slaves = ec2_fitness.sort_by_ec2_fitness(filtered_slaves)[::-1]
-            if len(filtered_sorted_slaves) == 0:
+            if len(kill_preference) == 0:
                 self.log.info("ALL slaves killed so moving on to next resource!")
                 break
-            self.log.info("Resource slave kill preference: {}".format([
-                slave.hostname
-                for slave in filtered_sorted_slaves
-            ]))
-            slave_to_kill = filtered_sorted_slaves.pop(0)
+            slave_to_kill = ec2_fitness.pop_kill_preference(kill_preference)
             instance_capacity = slave_to_kill.instance_weight
             new_capacity = current_capacity - instance_capacity
             if new_capacity < target_capacity:
@@ -705,7 +740,6 @@ class ClusterAutoscaler(object):
             killed_slaves += 1
 
             current_capacity = new_capacity
-            filtered_slaves = filtered_sorted_slaves
 
         # Now we wait for each task to actually finish...
         for hostname, task in terminate_tasks.items():
@@ -732,7 +766,7 @@ class SpotAutoscaler(ClusterAutoscaler):
         spotfleet_request_id: str,
         region: Optional[str]=None,
     ) -> Dict[str, Any]:
-        ec2_client = boto3.client('ec2', region_name=region)
+        ec2_client = get_boto3_client('ec2', region_name=region)
         try:
             sfrs = ec2_client.describe_spot_fleet_requests(SpotFleetRequestIds=[spotfleet_request_id])
         except ClientError as e:
@@ -749,7 +783,7 @@ class SpotAutoscaler(ClusterAutoscaler):
         spotfleet_request_id: str,
         region: Optional[str]=None,
     ) -> List[Dict[str, str]]:
-        ec2_client = boto3.client('ec2', region_name=region)
+        ec2_client = get_boto3_client('ec2', region_name=region)
         spot_fleet_instances = ec2_client.describe_spot_fleet_instances(
             SpotFleetRequestId=spotfleet_request_id,
         )['ActiveInstances']
@@ -845,7 +879,7 @@ class SpotAutoscaler(ClusterAutoscaler):
         function ensures we wait a few seconds in case we've just modified
         a SFR"""
         rounded_capacity = int(floor(capacity))
-        ec2_client = boto3.client('ec2', region_name=self.resource['region'])
+        ec2_client = get_boto3_client('ec2', region_name=self.resource['region'])
         with Timeout(seconds=AWS_SPOT_MODIFY_TIMEOUT):
             try:
                 state = None
@@ -904,7 +938,7 @@ class AsgAutoscaler(ClusterAutoscaler):
         return True if self.asg else False
 
     def get_asg(self, asg_name: str, region: Optional[str]=None) -> Optional[Dict[str, Any]]:
-        asg_client = boto3.client('autoscaling', region_name=region)
+        asg_client = get_boto3_client('autoscaling', region_name=region)
         asgs = asg_client.describe_auto_scaling_groups(AutoScalingGroupNames=[asg_name])
         try:
             return asgs['AutoScalingGroups'][0]
@@ -985,7 +1019,7 @@ class AsgAutoscaler(ClusterAutoscaler):
     def set_capacity(self, capacity: float) -> Optional[Any]:
         if self.dry_run:
             return True
-        asg_client = boto3.client('autoscaling', region_name=self.resource['region'])
+        asg_client = get_boto3_client('autoscaling', region_name=self.resource['region'])
         try:
             ret = asg_client.update_auto_scaling_group(
                 AutoScalingGroupName=self.resource['id'],
@@ -1066,12 +1100,61 @@ class PaastaAwsSlave(object):
             return 1
 
 
+class ClusterUtilization(object):
+    """The resource utilization of every pool in every region of a mesos state.
+
+    The utilization of all the pools is worked out in a single pass over the slaves and tasks
+    of the state, the first time any of it is needed, so it should be computed once per mesos
+    state and shared by everything that looks at that state.
+    """
+
+    def __init__(self, mesos_state: MesosState, system_config: SystemPaastaConfig) -> None:
+        self.mesos_state = mesos_state
+        self.system_config = system_config
+        self._utilization_by_pool_region: Optional[Dict[Tuple[str, str], ResourceUtilizationDict]] = None
+        self.boosted_cpu_loads: Dict[Tuple[str, str], float] = {}
+
+    def get_utilization(self, region: str, pool: str) -> Optional[ResourceUtilizationDict]:
+        if self._utilization_by_pool_region is None:
+            try:
+                self._utilization_by_pool_region = get_resource_utilization_by_grouping(
+                    lambda slave: (slave['attributes']['pool'], slave['attributes']['datacenter'],),
+                    self.mesos_state,
+                )
+            except KeyError:
+                # A slave without a pool or datacenter attribute
+                self._utilization_by_pool_region = {}
+        return self._utilization_by_pool_region.get((pool, region,))
+
+    def load_boosted_cpu_loads(self, region_pools: Iterable[Tuple[str, str]]) -> None:
+        """Look up the boosted cpu load of each (region, pool) in one go, so that
+        get_boosted_cpu_load does not need to go to ZooKeeper for each of them"""
+        if not self.system_config.get_cluster_boost_enabled():
+            return
+        current_loads = {}
+        for region, pool in region_pools:
+            utilization = self.get_utilization(region, pool)
+            if utilization is not None and not math.isclose(utilization['total'].cpus, 0):
+                current_loads[(region, pool)] = utilization['total'].cpus - utilization['free'].cpus
+        self.boosted_cpu_loads.update(cluster_boost.get_boosted_loads(current_loads))
+
+    def get_boosted_cpu_load(self, region: str, pool: str, current_load: float) -> float:
+        boosted_load = self.boosted_cpu_loads.get((region, pool))
+        if boosted_load is None:
+            boosted_load = cluster_boost.get_boosted_load(region=region, pool=pool, current_load=current_load)
+        return boosted_load
+
+
 def get_all_utilization_errors(
     autoscaling_resources: Dict[str, Dict[str, str]],
     all_pool_settings: Dict[str, Dict],
     mesos_state: MesosState,
     system_config: SystemPaastaConfig,
 ) -> Dict[Tuple[str, str], float]:
+    cluster_utilization = ClusterUtilization(mesos_state, system_config)
+    cluster_utilization.load_boosted_cpu_loads(
+        {(resource['region'], resource['pool']) for resource in autoscaling_resources.values()},
+    )
     errors: Dict[Tuple[str, str], float] = {}
     for identifier, resource in autoscaling_resources.items():
         pool = resource['pool']
@@ -1090,6 +1173,7 @@ def get_all_utilization_errors(
             region=region,
             pool=pool,
             target_utilization=target_utilization,
+            cluster_utilization=cluster_utilization,
         )
 
     return errors
@@ -1219,11 +1303,9 @@ def get_autoscaling_info_for_all_resources(mesos_state: MesosState) -> List[Auto
     system_config = load_system_paasta_config()
     autoscaling_resources = system_config.get_cluster_autoscaling_resources()
     pool_settings = system_config.get_resource_pool_settings()
-    system_config = load_system_paasta_config()
-    all_pool_settings = system_config.get_resource_pool_settings()
     utilization_errors = get_all_utilization_errors(
         autoscaling_resources=autoscaling_resources,
-        all_pool_settings=all_pool_settings,
+        all_pool_settings=pool_settings,
         mesos_state=mesos_state,
         system_config=system_config,
     )
@@ -1273,6 +1355,7 @@ def get_mesos_utilization_error(
     region: str,
     pool: str,
     target_utilization: float,
+    cluster_utilization: Optional[ClusterUtilization]=None,
 ) -> float:
     """Return the relative capacity needed to reach the cluster target usage.
     Example: If the current capacity is 10 unit (could be CPU, memory, disk, gpu...)
@@ -1280,13 +1363,14 @@ def get_mesos_utilization_error(
     An 12.5% increase in capacity is required => 9/11.25 = 80% usage
     When the boost feature is enabled, the current_load will be artifically increased
     and stored into boosted_load. If the boost is disabled, boosted_load = current_load
+
+    Pass a cluster_utilization computed from mesos_state when getting the error of several
+    pools, so the utilization of the cluster is only worked out once.
     """
-    try:
-        region_pool_utilization_dict = get_resource_utilization_by_grouping(
-            lambda slave: (slave['attributes']['pool'], slave['attributes']['datacenter'],),
-            mesos_state,
-        )[(pool, region,)]
-    except KeyError:
+    if cluster_utilization is None:
+        cluster_utilization = ClusterUtilization(mesos_state, system_config)
+    region_pool_utilization_dict = cluster_utilization.get_utilization(region, pool)
+    if region_pool_utilization_dict is None:
         log.info(
             "Failed to find utilization for region %s, pool %s, returning 0 error" %
             (region, pool),
@@ -1306,7 +1390,7 @@ def get_mesos_utilization_error(
 
         # We apply the boost only on the cpu resource.
         if resource == 'cpus'and system_config.get_cluster_boost_enabled():
-            boosted_load = cluster_boost.get_boosted_load(region=region, pool=pool, current_load=current_load)
+            boosted_load = cluster_utilization.get_boosted_cpu_load(region, pool, current_load)
         else:
             boosted_load = current_load
 
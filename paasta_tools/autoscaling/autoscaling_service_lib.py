@@ -15,6 +15,8 @@
 import logging
 import struct
 import time
+from collections import defaultdict
+from collections import deque
 from collections import namedtuple
 from contextlib import contextmanager
 from datetime import datetime
@@ -82,6 +84,13 @@ DECISION_POLICY_KEY = 'decision_policy'
 AUTOSCALING_DELAY = 300
 MAX_TASK_DELTA = 0.3
 
+# How many requests the metrics providers make at once during a run of the
+# autoscaler, in total and to any one host.
+AUTOSCALING_METRICS_CONCURRENCY = 200
+AUTOSCALING_METRICS_CONCURRENCY_PER_HOST = 10
+# How long a run of the autoscaler waits for the metrics of all instances
+AUTOSCALING_METRICS_TIMEOUT = 120
+
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
@@ -226,6 +235,141 @@ def deserialize_historical_load(historical_load_bytes):
     return historical_load
 
 
+class MetricsFetchBudget:
+    """Limits how many requests the metrics providers make at once, in total
+    and to any one host. Sharing one budget between all the instances of an
+    autoscaler run lets their metrics be fetched concurrently without
+    overwhelming a mesos slave or service that many of them live on.
+    """
+
+    def __init__(
+        self,
+        concurrency=AUTOSCALING_METRICS_CONCURRENCY,
+        concurrency_per_host=AUTOSCALING_METRICS_CONCURRENCY_PER_HOST,
+    ):
+        self.pool = pool.Pool(concurrency)
+        self.concurrency_per_host = concurrency_per_host
+        self.running_per_host = defaultdict(int)
+        self.queued_per_host = defaultdict(deque)
+        self.jobs = set()
+
+    def spawn(self, host, func, *args):
+        """Returns a greenlet that runs func(*args) once there is room in the
+        budget for another request to host. Requests to a host that already has
+        concurrency_per_host requests in flight are queued without taking a
+        slot in the pool, so a slow host doesn't hold up requests to the others.
+        Blocks while the whole budget is in use."""
+        job = gevent.Greenlet(func, *args)
+        self.jobs.add(job)
+        job.rawlink(lambda _: self._finished(job, host))
+        if self.running_per_host[host] < self.concurrency_per_host:
+            self.running_per_host[host] += 1
+            self.pool.start(job)
+        else:
+            self.queued_per_host[host].append(job)
+        return job
+
+    def kill(self):
+        """Kills the requests that are still running or queued"""
+        gevent.killall(list(self.jobs))
+
+    def _finished(self, job, host):
+        self.jobs.discard(job)
+        queued = self.queued_per_host[host]
+        if queued:
+            # The finished request's host slot goes straight to the next one. This runs in the hub, which can't
+            # wait for a slot in the pool, so the next request is started from a greenlet of its own.
+            gevent.spawn(self.pool.start, queued.popleft())
+        else:
+            self.running_per_host[host] -= 1
+
+
+def zk_cpu_last_time_path(zk_path_prefix):
+    return "%s/cpu_last_time" % zk_path_prefix
+
+
+def zk_cpu_data_path(zk_path_prefix):
+    return "%s/cpu_data" % zk_path_prefix
+
+
+class MesosCpuDataStore:
+    """The cpu times mesos_cpu_metrics_provider saves in zookeeper between runs.
+
+    prefetch() reads the data of many instances with pipelined async requests,
+    and writes are queued until flush(), so an autoscaler run makes a couple of
+    round trips to zookeeper rather than four per instance.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.writes = {}
+
+    def prefetch(self, marathon_service_configs):
+        with ZookeeperPool() as zk:
+            results = []
+            for marathon_service_config in marathon_service_configs:
+                autoscaling_root = compose_autoscaling_zookeeper_root(
+                    service=marathon_service_config.service,
+                    instance=marathon_service_config.instance,
+                )
+                results.append((
+                    autoscaling_root,
+                    zk.get_async(zk_cpu_last_time_path(autoscaling_root)),
+                    zk.get_async(zk_cpu_data_path(autoscaling_root)),
+                ))
+            for autoscaling_root, last_time_result, cpu_data_result in results:
+                try:
+                    self.data[autoscaling_root] = (
+                        last_time_result.get()[0].decode('utf8'),
+                        cpu_data_result.get()[0].decode('utf8'),
+                    )
+                except NoNodeError:
+                    self.data[autoscaling_root] = None
+                except Exception as e:
+                    # get() will try again on its own
+                    log.warning("Failed to prefetch cpu data for %s: %s" % (autoscaling_root, e))
+
+    def get(self, autoscaling_root):
+        """Returns the (last_time, cpu_data) saved for an instance, or None if
+        nothing has been saved yet"""
+        if autoscaling_root not in self.data:
+            with ZookeeperPool() as zk:
+                try:
+                    self.data[autoscaling_root] = (
+                        zk.get(zk_cpu_last_time_path(autoscaling_root))[0].decode('utf8'),
+                        zk.get(zk_cpu_data_path(autoscaling_root))[0].decode('utf8'),
+                    )
+                except NoNodeError:
+                    self.data[autoscaling_root] = None
+        return self.data[autoscaling_root]
+
+    def set(self, autoscaling_root, last_time, cpu_data):
+        self.writes[autoscaling_root] = (last_time, cpu_data)
+
+    def flush(self):
+        with ZookeeperPool() as zk:
+            results = []
+            for autoscaling_root, (last_time, cpu_data) in self.writes.items():
+                if self.get(autoscaling_root) is None:
+                    zk.ensure_path(zk_cpu_data_path(autoscaling_root))
+                    zk.ensure_path(zk_cpu_last_time_path(autoscaling_root))
+                results.append((
+                    autoscaling_root,
+                    zk.set_async(zk_cpu_data_path(autoscaling_root), cpu_data.encode('utf8')),
+                    zk.set_async(zk_cpu_last_time_path(autoscaling_root), last_time.encode('utf8')),
+                ))
+            for autoscaling_root, cpu_data_result, last_time_result in results:
+                try:
+                    cpu_data_result.get()
+                    last_time_result.get()
+                except Exception as e:
+                    log.error("Failed to save cpu data for %s: %s" % (autoscaling_root, e))
+                    self.data.pop(autoscaling_root, None)
+                else:
+                    self.data[autoscaling_root] = self.writes[autoscaling_root]
+        self.writes.clear()
+
+
 def get_json_body_from_service(host, port, endpoint, timeout=2):
     return requests.get(
         'http://%s:%s/%s' % (host, port, endpoint),
@@ -258,7 +402,9 @@ def get_http_utilization_for_a_task(task, service, endpoint, json_mapper):
         log.error("Caught exception when querying %s on %s:%s : %s" % (service, task.host, task.ports[0], str(e)))
 
 
-def get_http_utilization_for_all_tasks(marathon_service_config, marathon_tasks, endpoint, json_mapper):
+def get_http_utilization_for_all_tasks(
+    marathon_service_config, marathon_tasks, endpoint, json_mapper, metrics_budget=None,
+):
     """
     Gets the mean utilization of a service across all of its tasks by fetching
     json from an http endpoint and applying a function that maps it to a
@@ -268,6 +414,7 @@ def get_http_utilization_for_all_tasks(marathon_service_config, marathon_tasks,
     :param marathon_tasks: Marathon tasks to get data from
     :param endpoint: The http endpoint to get the stats from
     :param json_mapper: A function that takes a dictionary for a task and returns that task's utilization
+    :param metrics_budget: The MetricsFetchBudget to make requests under. Defaults to 20 at a time.
 
     :returns: the service's mean utilization, from 0 to 1
     """
@@ -277,9 +424,10 @@ def get_http_utilization_for_all_tasks(marathon_service_config, marathon_tasks,
     service = marathon_service_config.get_service()
 
     monkey.patch_socket()
-    gevent_pool = pool.Pool(20)
+    if metrics_budget is None:
+        metrics_budget = MetricsFetchBudget(concurrency=20)
     jobs = [
-        gevent_pool.spawn(get_http_utilization_for_a_task, task, service, endpoint, json_mapper)
+        metrics_budget.spawn(task.host, get_http_utilization_for_a_task, task, service, endpoint, json_mapper)
         for task in marathon_tasks
     ]
     gevent.joinall(jobs)
@@ -296,7 +444,9 @@ def get_http_utilization_for_all_tasks(marathon_service_config, marathon_tasks,
 
 
 @register_autoscaling_component('uwsgi', SERVICE_METRICS_PROVIDER_KEY)
-def uwsgi_metrics_provider(marathon_service_config, marathon_tasks, endpoint='status/uwsgi', **kwargs):
+def uwsgi_metrics_provider(
+    marathon_service_config, marathon_tasks, endpoint='status/uwsgi', metrics_budget=None, **kwargs,
+):
     """
     Gets the mean utilization of a service across all of its tasks, where
     the utilization of a task is the percentage of non-idle workers as read
@@ -305,6 +455,7 @@ def uwsgi_metrics_provider(marathon_service_config, marathon_tasks, endpoint='st
     :param marathon_service_config: the MarathonServiceConfig to get data from
     :param marathon_tasks: Marathon tasks to get data from
     :param endpoint: The http endpoint to get the uwsgi stats from
+    :param metrics_budget: The MetricsFetchBudget to make requests under
 
     :returns: the service's mean utilization, from 0 to 1
     """
@@ -314,11 +465,13 @@ def uwsgi_metrics_provider(marathon_service_config, marathon_tasks, endpoint='st
         utilization = [1.0 if worker['status'] != 'idle' else 0.0 for worker in workers]
         return mean(utilization)
 
-    return get_http_utilization_for_all_tasks(marathon_service_config, marathon_tasks, endpoint, uwsgi_mapper)
+    return get_http_utilization_for_all_tasks(
+        marathon_service_config, marathon_tasks, endpoint, uwsgi_mapper, metrics_budget=metrics_budget,
+    )
 
 
 @register_autoscaling_component('http', SERVICE_METRICS_PROVIDER_KEY)
-def http_metrics_provider(marathon_service_config, marathon_tasks, endpoint='status', **kwargs):
+def http_metrics_provider(marathon_service_config, marathon_tasks, endpoint='status', metrics_budget=None, **kwargs):
     """
     Gets the mean utilization of a service across all of its tasks, where
     the utilization of a task is read from a HTTP endpoint on the host. The
@@ -328,6 +481,7 @@ def http_metrics_provider(marathon_service_config, marathon_tasks, endpoint='sta
     :param marathon_service_config: the MarathonServiceConfig to get data from
     :param marathon_tasks: Marathon tasks to get data from
     :param endpoint: The http endpoint to get the task utilization from
+    :param metrics_budget: The MetricsFetchBudget to make requests under
 
     :returns: the service's mean utilization, from 0 to 1
     """
@@ -335,13 +489,15 @@ def http_metrics_provider(marathon_service_config, marathon_tasks, endpoint='sta
     def utilization_mapper(json):
         return float(json['utilization'])
 
-    return get_http_utilization_for_all_tasks(marathon_service_config, marathon_tasks, endpoint, utilization_mapper)
+    return get_http_utilization_for_all_tasks(
+        marathon_service_config, marathon_tasks, endpoint, utilization_mapper, metrics_budget=metrics_budget,
+    )
 
 
 @register_autoscaling_component('mesos_cpu', SERVICE_METRICS_PROVIDER_KEY)
 def mesos_cpu_metrics_provider(
     marathon_service_config, system_paasta_config, marathon_tasks, mesos_tasks, log_utilization_data={},
-    noop=False, **kwargs,
+    noop=False, metrics_budget=None, cpu_data_store=None, **kwargs,
 ):
     """
     Gets the mean cpu utilization of a service across all of its tasks.
@@ -350,6 +506,9 @@ def mesos_cpu_metrics_provider(
     :param marathon_tasks: Marathon tasks to get data from
     :param mesos_tasks: Mesos tasks to get data from
     :param log_utilization_data: A dict used to transfer utilization data to autoscale_marathon_instance()
+    :param metrics_budget: The MetricsFetchBudget to fetch task stats under
+    :param cpu_data_store: The MesosCpuDataStore to read and queue writes of the previous run's cpu data with.
+                           If not given, the data is read and written to zookeeper right away.
 
     :returns: the service's mean utilization, from 0 to 1
     """
@@ -358,22 +517,24 @@ def mesos_cpu_metrics_provider(
         service=marathon_service_config.service,
         instance=marathon_service_config.instance,
     )
-    zk_last_time_path = '%s/cpu_last_time' % autoscaling_root
-    zk_last_cpu_data = '%s/cpu_data' % autoscaling_root
-
-    with ZookeeperPool() as zk:
-        try:
-            last_time = zk.get(zk_last_time_path)[0].decode('utf8')
-            last_cpu_data = zk.get(zk_last_cpu_data)[0].decode('utf8')
-            log_utilization_data[last_time] = last_cpu_data
-            last_time = float(last_time)
-            last_cpu_data = (datum for datum in last_cpu_data.split(',') if datum)
-        except NoNodeError:
-            last_time = 0.0
-            last_cpu_data = []
+    flush_cpu_data = cpu_data_store is None
+    if cpu_data_store is None:
+        cpu_data_store = MesosCpuDataStore()
+
+    saved_cpu_data = cpu_data_store.get(autoscaling_root)
+    if saved_cpu_data is not None:
+        last_time, last_cpu_data = saved_cpu_data
+        log_utilization_data[last_time] = last_cpu_data
+        last_time = float(last_time)
+        last_cpu_data = (datum for datum in last_cpu_data.split(',') if datum)
+    else:
+        last_time = 0.0
+        last_cpu_data = []
 
     monkey.patch_socket()
-    jobs = [gevent.spawn(task.stats_callable) for task in mesos_tasks]
+    if metrics_budget is None:
+        metrics_budget = MetricsFetchBudget()
+    jobs = [metrics_budget.spawn(task['slave_id'], task.stats_callable) for task in mesos_tasks]
     gevent.joinall(jobs, timeout=60)
     mesos_tasks = dict(zip([task['id'] for task in mesos_tasks], [job.value for job in jobs]))
 
@@ -398,11 +559,9 @@ def mesos_cpu_metrics_provider(
     log_utilization_data[str(current_time)] = cpu_data_csv
 
     if not noop:
-        with ZookeeperPool() as zk:
-            zk.ensure_path(zk_last_cpu_data)
-            zk.ensure_path(zk_last_time_path)
-            zk.set(zk_last_cpu_data, str(cpu_data_csv).encode('utf8'))
-            zk.set(zk_last_time_path, str(current_time).encode('utf8'))
+        cpu_data_store.set(autoscaling_root, str(current_time), str(cpu_data_csv))
+        if flush_cpu_data:
+            cpu_data_store.flush()
 
     utilization = {}
     for datum in last_cpu_data:
@@ -535,6 +694,8 @@ def get_utilization(
     log_utilization_data,
     marathon_tasks,
     mesos_tasks,
+    metrics_budget=None,
+    cpu_data_store=None,
 ):
     autoscaling_metrics_provider = get_service_metrics_provider(autoscaling_params[SERVICE_METRICS_PROVIDER_KEY])
 
@@ -544,29 +705,90 @@ def get_utilization(
         marathon_tasks=marathon_tasks,
         mesos_tasks=mesos_tasks,
         log_utilization_data=log_utilization_data,
+        metrics_budget=metrics_budget,
+        cpu_data_store=cpu_data_store,
         **autoscaling_params,
     )
 
 
+def get_all_utilizations(system_paasta_config, instances_with_tasks):
+    """Gets the utilization of many instances at once. Their metrics providers
+    run concurrently, sharing one MetricsFetchBudget, and the mesos_cpu
+    provider's zookeeper reads and writes are batched for the whole run.
+
+    :param instances_with_tasks: A list of (marathon_service_config, marathon_tasks, mesos_tasks)
+    :returns: A list with, for each instance, either a (utilization, log_utilization_data) tuple
+              or the exception its metrics provider raised
+    """
+    monkey.patch_socket()
+    metrics_budget = MetricsFetchBudget()
+    cpu_data_store = MesosCpuDataStore()
+    cpu_data_store.prefetch([
+        marathon_service_config for marathon_service_config, _, _ in instances_with_tasks
+        if marathon_service_config.get_autoscaling_params()[SERVICE_METRICS_PROVIDER_KEY] == 'mesos_cpu'
+    ])
+
+    def get_instance_utilization(marathon_service_config, marathon_tasks, mesos_tasks):
+        log_utilization_data = {}
+        try:
+            utilization = get_utilization(
+                marathon_service_config=marathon_service_config,
+                system_paasta_config=system_paasta_config,
+                autoscaling_params=marathon_service_config.get_autoscaling_params(),
+                log_utilization_data=log_utilization_data,
+                marathon_tasks=marathon_tasks,
+                mesos_tasks=mesos_tasks,
+                metrics_budget=metrics_budget,
+                cpu_data_store=cpu_data_store,
+            )
+        except Exception as e:
+            return e
+        return utilization, log_utilization_data
+
+    jobs = [gevent.spawn(get_instance_utilization, *instance) for instance in instances_with_tasks]
+    gevent.joinall(jobs, timeout=AUTOSCALING_METRICS_TIMEOUT)
+    # A killed job counts as successful, with a GreenletExit as its value, so the jobs that timed out are
+    # picked out before they are killed
+    timed_out_jobs = {job for job in jobs if not job.ready()}
+    gevent.killall(list(timed_out_jobs))
+    metrics_budget.kill()
+    cpu_data_store.flush()
+    return [
+        job.value if job.successful() and job not in timed_out_jobs
+        else MetricsProviderNoDataError("Timed out getting utilization")
+        for job in jobs
+    ]
+
+
 def is_task_data_insufficient(marathon_service_config, marathon_tasks, current_instances):
     too_many_instances_running = len(marathon_tasks) > int((1 + MAX_TASK_DELTA) * current_instances)
     too_few_instances_running = len(marathon_tasks) < int((1 - MAX_TASK_DELTA) * current_instances)
     return too_many_instances_running or too_few_instances_running
 
 
-def autoscale_marathon_instance(marathon_service_config, system_paasta_config, marathon_tasks, mesos_tasks):
+def autoscale_marathon_instance(
+    marathon_service_config, system_paasta_config, marathon_tasks, mesos_tasks,
+    utilization=None, log_utilization_data=None,
+):
+    """Scales an instance based on its utilization.
+
+    :param utilization: The instance's utilization, if already known (see get_all_utilizations).
+                        Otherwise it is fetched from its metrics provider.
+    :param log_utilization_data: The log_utilization_data that came with utilization
+    """
     current_instances = marathon_service_config.get_instances()
     task_data_insufficient = is_task_data_insufficient(marathon_service_config, marathon_tasks, current_instances)
     autoscaling_params = marathon_service_config.get_autoscaling_params()
-    log_utilization_data = {}
-    utilization = get_utilization(
-        marathon_service_config=marathon_service_config,
-        system_paasta_config=system_paasta_config,
-        autoscaling_params=autoscaling_params,
-        log_utilization_data=log_utilization_data,
-        marathon_tasks=marathon_tasks,
-        mesos_tasks=mesos_tasks,
-    )
+    if utilization is None:
+        log_utilization_data = {}
+        utilization = get_utilization(
+            marathon_service_config=marathon_service_config,
+            system_paasta_config=system_paasta_config,
+            autoscaling_params=autoscaling_params,
+            log_utilization_data=log_utilization_data,
+            marathon_tasks=marathon_tasks,
+            mesos_tasks=mesos_tasks,
+        )
     error = get_error_from_utilization(
         utilization=utilization,
         setpoint=autoscaling_params['setpoint'],
@@ -700,6 +922,7 @@ def autoscale_services(soa_dir=DEFAULT_SOA_DIR):
             all_mesos_tasks = get_all_running_tasks()
             if configs:
                 with ZookeeperPool():
+                    instances_with_tasks = []
                     for config in configs:
                         try:
                             marathon_tasks, mesos_tasks = filter_autoscaling_tasks(
@@ -707,11 +930,23 @@ def autoscale_services(soa_dir=DEFAULT_SOA_DIR):
                                 all_mesos_tasks,
                                 config,
                             )
+                        except Exception as e:
+                            write_to_log(config=config, line='Caught Exception %s' % e)
+                            continue
+                        instances_with_tasks.append((config, list(marathon_tasks.values()), mesos_tasks))
+
+                    utilizations = get_all_utilizations(system_paasta_config, instances_with_tasks)
+                    for (config, marathon_tasks, mesos_tasks), utilization in zip(instances_with_tasks, utilizations):
+                        try:
+                            if isinstance(utilization, Exception):
+                                raise utilization
                             autoscale_marathon_instance(
                                 config,
                                 system_paasta_config,
-                                list(marathon_tasks.values()),
+                                marathon_tasks,
                                 mesos_tasks,
+                                utilization=utilization[0],
+                                log_utilization_data=utilization[1],
                             )
                         except Exception as e:
                             write_to_log(config=config, line='Caught Exception %s' % e)
@@ -12,6 +12,8 @@ import logging
 from collections import namedtuple
 from datetime import datetime
 from time import time as get_time
+from typing import Dict
+from typing import Tuple
 
 from kazoo.client import KazooClient
 from kazoo.exceptions import NoNodeError
@@ -89,6 +91,28 @@ def get_boosted_load(region: str, pool: str, current_load: float) -> float:
         return current_load
 
 
+def get_boosted_loads(current_loads: Dict[Tuple[str, str], float]) -> Dict[Tuple[str, str], float]:
+    """Return the boosted load of several pools at once, as get_boosted_load would.
+
+    :param current_loads: a dict of (region, pool): current load
+    :returns: a dict of (region, pool): boosted load
+
+    All the lookups share a single ZooKeeper connection instead of connecting once per pool.
+    Like get_boosted_load, this fails gracefully and returns the current loads on any error.
+    """
+    if not current_loads:
+        return {}
+    try:
+        with ZookeeperPool():
+            return {
+                (region, pool): get_boosted_load(region=region, pool=pool, current_load=current_load)
+                for (region, pool), current_load in current_loads.items()
+            }
+    except Exception as e:
+        log.error('get_boost failed with: {}'.format(e))
+        return dict(current_loads)
+
+
 def get_boost_factor(region: str, pool: str) -> float:
     """This function returns the boost factor value if a boost is active
     """
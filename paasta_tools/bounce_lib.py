@@ -39,7 +39,7 @@ from requests.exceptions import RequestException
 
 from paasta_tools import marathon_tools
 from paasta_tools.long_running_service_tools import BounceMethodConfigDict
-from paasta_tools.smartstack_tools import get_registered_marathon_tasks
+from paasta_tools.smartstack_tools import HaproxyView
 from paasta_tools.utils import compose_job_id
 from paasta_tools.utils import load_system_paasta_config
 from paasta_tools.utils import timeout
@@ -202,16 +202,25 @@ def kill_old_ids(old_ids, client):
         delete_marathon_app(app, client)
 
 
-def is_task_in_smartstack(task, service, nerve_ns, system_paasta_config):
+def get_haproxy_view(service, nerve_ns, system_paasta_config):
+    """Returns a HaproxyView of the backends of service.nerve_ns, for looking up many tasks during one bounce."""
+    return HaproxyView(
+        synapse_port=system_paasta_config.get_synapse_port(),
+        synapse_haproxy_url_format=system_paasta_config.get_synapse_haproxy_url_format(),
+        services=[compose_job_id(service, nerve_ns)],
+    )
+
+
+def is_task_in_smartstack(task, service, nerve_ns, system_paasta_config, haproxy_view=None):
+    """Returns whether a task is registered and UP in the haproxy on its own host.
+
+    :param haproxy_view: A HaproxyView to look the task up in, so that checking many tasks only fetches the haproxy
+                         csv once per host. Defaults to a new view.
+    """
+    if haproxy_view is None:
+        haproxy_view = get_haproxy_view(service, nerve_ns, system_paasta_config)
     try:
-        registered_tasks = get_registered_marathon_tasks(
-            synapse_host=task.host,
-            synapse_port=system_paasta_config.get_synapse_port(),
-            synapse_haproxy_url_format=system_paasta_config.get_synapse_haproxy_url_format(),
-            service=compose_job_id(service, nerve_ns),
-            marathon_tasks=[task],
-        )
-        return task in registered_tasks
+        return haproxy_view.is_task_registered(task, compose_job_id(service, nerve_ns))
     except (ConnectionError, RequestException) as e:
         log.warning("Failed to connect to smartstack on %s, assuming task %s is unhealthy: %s" % (task.host, task, e))
         return False
@@ -250,11 +259,17 @@ def get_happy_tasks(app, service, nerve_ns, system_paasta_config, min_task_uptim
         if not marathon_tools.is_task_healthy(task, require_all=False, default_healthy=True):
             continue
 
-        if check_haproxy:
-            if not is_task_in_smartstack(task, service, nerve_ns, system_paasta_config):
-                continue
-
         happy.append(task)
+
+    if check_haproxy and happy:
+        # Fetch the haproxy csv of every host we need up front and in parallel, rather than once per task.
+        haproxy_view = get_haproxy_view(service, nerve_ns, system_paasta_config)
+        haproxy_view.fetch({task.host for task in happy})
+        happy = [
+            task for task in happy
+            if is_task_in_smartstack(task, service, nerve_ns, system_paasta_config, haproxy_view=haproxy_view)
+        ]
+
     return happy
 
 
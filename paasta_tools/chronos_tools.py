@@ -15,16 +15,18 @@ import argparse
 import csv
 import datetime
 import logging
+import os
 import re
 from collections import defaultdict
 from time import sleep
+from typing import Dict
+from typing import Tuple
 from urllib.parse import urlsplit
 
 import chronos
 import dateutil
 import isodate
 import pytz
-import service_configuration_lib
 from croniter import croniter
 from crontab import CronSlices
 
@@ -35,6 +37,8 @@ from paasta_tools.tron import tron_command_context
 from paasta_tools.utils import deep_merge_dictionaries
 from paasta_tools.utils import DEFAULT_SOA_DIR
 from paasta_tools.utils import get_config_hash
+from paasta_tools.utils import get_file_fingerprint
+from paasta_tools.utils import get_service_configuration_paths
 from paasta_tools.utils import get_service_instance_list
 from paasta_tools.utils import get_services_for_cluster
 from paasta_tools.utils import InstanceConfig
@@ -45,6 +49,8 @@ from paasta_tools.utils import NoConfigurationForServiceError
 from paasta_tools.utils import paasta_print
 from paasta_tools.utils import PaastaColors
 from paasta_tools.utils import PaastaNotConfiguredError
+from paasta_tools.utils import read_extra_service_information
+from paasta_tools.utils import read_service_configuration
 from paasta_tools.utils import time_cache
 from paasta_tools.utils import timeout
 
@@ -191,10 +197,9 @@ class InvalidChronosConfigError(Exception):
     pass
 
 
-@time_cache(ttl=30)
 def read_chronos_jobs_for_service(service, cluster, soa_dir=DEFAULT_SOA_DIR):
     chronos_conf_file = 'chronos-%s' % cluster
-    return service_configuration_lib.read_extra_service_information(
+    return read_extra_service_information(
         service,
         chronos_conf_file,
         soa_dir=soa_dir,
@@ -208,7 +213,7 @@ def load_chronos_job_config(
     load_deployments: bool=True,
     soa_dir: str=DEFAULT_SOA_DIR,
 ) -> 'ChronosJobConfig':
-    general_config = service_configuration_lib.read_service_configuration(
+    general_config = read_service_configuration(
         service,
         soa_dir=soa_dir,
     )
@@ -1086,78 +1091,167 @@ def dfs(node, neighbours_mapping, ignore_cycles=False, node_status=None):
     return visited_nodes
 
 
-@time_cache(ttl=30)
-def _get_related_jobs_and_configs(cluster, soa_dir=DEFAULT_SOA_DIR):
+class ChronosJobGraph:
     """
-    For all the Chronos jobs defined in cluster, extract the list of topologically sorted related Chronos.
-    Two individual jobs are considered related each other if exists a dependency relationship between them.
+    The dependency graph of all the Chronos jobs defined in a cluster.
 
-    :param cluster: cluster from which extracting the jobs
-    :return: tuple(related jobs mapping, jobs configuration)
+    Two jobs are related to each other if there is a chain of parent relationships between them. Related jobs
+    are grouped into connected components with union-find, and the topological order of a component is kept
+    once it has been computed, so looking up the jobs related to a job is a dictionary access.
+
+    ``update`` only reloads the configs of the services whose chronos-<cluster>.yaml (or the service.yaml and
+    deployments.json it is merged with) changed since the last update, and only recomputes the connected
+    components if jobs were added or removed, or the parents of some job changed.
     """
-    chronos_configs = {
-        (service, instance): load_chronos_job_config(
-            service=service,
-            instance=instance,
-            cluster=cluster,
-            soa_dir=soa_dir,
-        )
-        for service in service_configuration_lib.read_services_configuration(soa_dir=soa_dir)
-        for instance in read_chronos_jobs_for_service(service=service, cluster=cluster, soa_dir=soa_dir)
-    }
 
-    adjacency_list = defaultdict(set)  # List of adjacency used by dfs algorithm
-    for instance, config in chronos_configs.items():
-        for parent in config.get_parents():
-            parent = decompose_job_id(paasta_to_chronos_job_name(parent))
-            # Map the graph a undirected graph to simplify identification of connected components
-            adjacency_list[parent].add(instance)
-            adjacency_list[instance].add(parent)
+    def __init__(self, cluster, soa_dir=DEFAULT_SOA_DIR):
+        self.cluster = cluster
+        self.soa_dir = soa_dir
+        self.service_fingerprints = {}  # service -> fingerprints of the files its job configs were loaded from
+        self.service_jobs = {}  # service -> list of (service, instance) defined by the service
+        self.configs = {}  # (service, instance) -> ChronosJobConfig
+        self.parents = {}  # (service, instance) -> list of (service, instance) of its parents
+        self.components = {}  # (service, instance) -> frozenset of the jobs related to it, itself included
+        self.orders = {}  # connected component -> its jobs in topological order
+
+    def _service_paths(self, service):
+        service_dir = os.path.join(os.path.abspath(self.soa_dir), service)
+        return [
+            os.path.join(service_dir, 'chronos-%s.yaml' % self.cluster),
+            os.path.join(service_dir, 'deployments.json'),
+        ] + get_service_configuration_paths(service, self.soa_dir)
+
+    def _load_service(self, service):
+        jobs = read_chronos_jobs_for_service(service, self.cluster, soa_dir=self.soa_dir)
+        return {
+            (service, instance): load_chronos_job_config(
+                service=service,
+                instance=instance,
+                cluster=self.cluster,
+                soa_dir=self.soa_dir,
+            )
+            for instance in jobs
+            if not instance.startswith('_')
+        }
+
+    def _remove_service(self, service):
+        for job in self.service_jobs.pop(service, []):
+            del self.configs[job]
+            del self.parents[job]
+        self.service_fingerprints.pop(service, None)
 
-    def cached_dfs(known_dfs_results, node, neighbours_mapping, ignore_cycles=False):
+    def update(self):
         """
-        Cached version of DFS algorithm (tuned for extraction of connected components).
-
-        :param known_dfs_results: previous results of DFS
-        :type known_dfs_results: list
-        :param node: starting node for DFS execution
-        :param neighbours_mapping: graph adjacency list
-        :type neighbours_mapping: dict
-        :param ignore_cycles: raise an exception if a cycle is identified in the graph
-        :type ignore_cycles: bool
-
-        :return: set of nodes part of the same connected component of `node`
-        :type: set
+        Reload the jobs of every service whose config files changed since the last update.
+
+        :return: True if jobs were added or removed, or the parents of a job changed
         """
-        for known_dfs_result in known_dfs_results:
-            if node in known_dfs_result:
-                return known_dfs_result
-
-        visited_nodes = set(dfs(
-            node=node,
-            neighbours_mapping=neighbours_mapping,
-            ignore_cycles=ignore_cycles,
-        ))
-        known_dfs_results.append(visited_nodes)
-
-        return visited_nodes
-
-    # Build connected components
-    known_connected_components = []
-    for instance in chronos_configs:
-        cached_dfs(  # Using cached version of DFS to avoid all algorithm execution if the result it already know
-            known_dfs_results=known_connected_components,
-            node=instance,
-            ignore_cycles=True,  # Operating on an undirected graph to simplify identification of connected components
-            neighbours_mapping=adjacency_list,
-        )
+        services = set(os.listdir(os.path.abspath(self.soa_dir)))
+        graph_changed = False
+        for service in set(self.service_jobs) - services:
+            self._remove_service(service)
+            graph_changed = True
+
+        for service in services:
+            paths = self._service_paths(service)
+            if get_file_fingerprint(paths[0]) is None:
+                if service in self.service_jobs:
+                    self._remove_service(service)
+                    graph_changed = True
+                continue
+            fingerprints = tuple(get_file_fingerprint(path) for path in paths)
+            if self.service_fingerprints.get(service) == fingerprints:
+                continue
 
-    connected_components = {}
-    for connected_component in known_connected_components:
-        for node in connected_component:
-            connected_components[node] = connected_component
+            configs = self._load_service(service)
+            old_parents = {job: self.parents[job] for job in self.service_jobs.get(service, [])}
+            self._remove_service(service)
+            new_parents = {
+                job: [decompose_job_id(paasta_to_chronos_job_name(parent)) for parent in config.get_parents() or []]
+                for job, config in configs.items()
+            }
+            self.configs.update(configs)
+            self.parents.update(new_parents)
+            self.service_jobs[service] = list(configs)
+            self.service_fingerprints[service] = fingerprints
+            graph_changed = graph_changed or old_parents != new_parents
+
+        if graph_changed or not self.components:
+            self._build_components()
+        return graph_changed
+
+    def _build_components(self):
+        leaders = {}
+
+        def find(job):
+            leaders.setdefault(job, job)
+            while leaders[job] != job:
+                leaders[job] = leaders[leaders[job]]
+                job = leaders[job]
+            return job
+
+        for job, parents in self.parents.items():
+            leader = find(job)
+            for parent in parents:
+                parent_leader = find(parent)
+                if parent_leader != leader:
+                    leaders[parent_leader] = leader
+
+        members = defaultdict(set)
+        for job in leaders:
+            members[find(job)].add(job)
+        self.components = {}
+        for component in members.values():
+            component = frozenset(component)
+            for job in component:
+                self.components[job] = component
+        self.orders = {}
+
+    def related_jobs(self, service, instance):
+        """
+        :return: the jobs related to (service, instance), itself included
+        :type: frozenset
+        """
+        return self.components[(service, instance)]
 
-    return connected_components, chronos_configs
+    def topological_order(self, service, instance):
+        """
+        :return: the jobs related to (service, instance), ordered such that every job comes after its parents
+        :type: list
+        """
+        component = self.related_jobs(service, instance)
+        if component not in self.orders:
+            neighbours_mapping = {job: self.parents.get(job, []) for job in component}
+            order, node_status = [], {}
+            for job in sorted(component):
+                order.extend(
+                    dfs(
+                        node=job,
+                        neighbours_mapping=neighbours_mapping,
+                        node_status=node_status,
+                        ignore_cycles=False,
+                    ),
+                )
+            self.orders[component] = [job for job in order if job in self.configs]
+        return list(self.orders[component])
+
+
+_chronos_job_graphs: Dict[Tuple[str, str], ChronosJobGraph] = {}
+
+
+def get_chronos_job_graph(cluster, soa_dir=DEFAULT_SOA_DIR, use_cache=True):
+    """
+    Return the dependency graph of the Chronos jobs defined in cluster, updated with the latest soa-configs.
+    The graph is kept between calls, so only the services that changed since the last call are reloaded.
+
+    :param use_cache: if False, build the graph from scratch
+    """
+    key = (cluster, os.path.abspath(soa_dir))
+    if not use_cache or key not in _chronos_job_graphs:
+        _chronos_job_graphs[key] = ChronosJobGraph(cluster, soa_dir=soa_dir)
+    graph = _chronos_job_graphs[key]
+    graph.update()
+    return graph
 
 
 def get_related_jobs_configs(cluster, service, instance, soa_dir=DEFAULT_SOA_DIR, use_cache=True):
@@ -1166,16 +1260,11 @@ def get_related_jobs_configs(cluster, service, instance, soa_dir=DEFAULT_SOA_DIR
 
     :return: job-config mapping. Job identifier is a tuple (service, instance)
     """
-    kwargs = {}
-    if not use_cache:
-        kwargs['ttl'] = -1  # Disable usage of time_cached value
-
-    connected_components, chronos_configs = _get_related_jobs_and_configs(cluster, soa_dir=soa_dir, **kwargs)
-    related_jobs = connected_components[(service, instance)]
+    graph = get_chronos_job_graph(cluster, soa_dir=soa_dir, use_cache=use_cache)
     return {
-        job: config
-        for job, config in chronos_configs.items()
-        if job in related_jobs
+        job: graph.configs[job]
+        for job in graph.related_jobs(service, instance)
+        if job in graph.configs
     }
 
 
@@ -1186,32 +1275,4 @@ def topological_sort_related_jobs(cluster, service, instance, soa_dir=DEFAULT_SO
             The list is ordered such that job with index `i` could be executed in respect of its dependencies
             if all jobs with index smaller than `i` have terminated.
     """
-    def _sort(nodes):
-        adjacency_list = {
-            node: [
-                decompose_job_id(paasta_to_chronos_job_name(parent_job))
-                for parent_job in chronos_configs[node].get_parents()
-            ]
-            for node in related_jobs
-        }
-
-        order, enter, node_status = list(), {n for n in nodes}, {}
-
-        while enter:
-            order.extend(
-                dfs(
-                    node=enter.pop(),
-                    neighbours_mapping=adjacency_list,
-                    node_status=node_status,
-                    ignore_cycles=False,
-                ),
-            )
-
-        return order
-
-    connected_components, chronos_configs = _get_related_jobs_and_configs(cluster, soa_dir=soa_dir)
-    related_jobs = connected_components[(service, instance)]
-
-    return _sort(
-        nodes=related_jobs,
-    )
+    return get_chronos_job_graph(cluster, soa_dir=soa_dir).topological_order(service, instance)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# Copyright 2015-2018 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from paasta_tools.utils import compile_soa_configs_snapshot
+from paasta_tools.utils import DEFAULT_SOA_DIR
+from paasta_tools.utils import get_soa_configs_snapshot_path
+from paasta_tools.utils import load_system_paasta_config
+from paasta_tools.utils import paasta_print
+
+
+def add_subparser(subparsers):
+    compile_parser = subparsers.add_parser(
+        'compile-soa-configs',
+        help="Compile soa-configs into a snapshot for faster loading",
+        description=(
+            "'paasta compile-soa-configs' parses the soa-configs files of every service "
+            "for the given clusters and writes them to a single snapshot next to the "
+            "soa-configs directory. PaaSTA tools load configs from the snapshot instead of "
+            "parsing the YAML themselves, for every file that hasn't changed since it was compiled.\n\n"
+            "This is meant to be run on PaaSTA servers each time soa-configs are updated."
+        ),
+    )
+    compile_parser.add_argument(
+        '-c', '--cluster',
+        dest="clusters",
+        action='append',
+        help="The cluster to compile soa-configs for. May be given multiple times. "
+             "Defaults to the local cluster.",
+    )
+    compile_parser.add_argument(
+        '-d', '--soa-dir',
+        dest="soa_dir",
+        metavar="SOA_DIR",
+        default=DEFAULT_SOA_DIR,
+        help="define a different soa config directory",
+    )
+    compile_parser.set_defaults(command=paasta_compile_soa_configs)
+
+
+def paasta_compile_soa_configs(args):
+    clusters = args.clusters
+    if not clusters:
+        clusters = [load_system_paasta_config().get_cluster()]
+    entries = compile_soa_configs_snapshot(clusters=clusters, soa_dir=args.soa_dir)
+    paasta_print("Wrote %d entries to %s" % (entries, get_soa_configs_snapshot_path(args.soa_dir)))
+    return 0
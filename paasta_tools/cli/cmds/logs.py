@@ -14,8 +14,15 @@
 # limitations under the License.
 """PaaSTA log reader for humans"""
 import argparse
+import bisect
+import collections
 import datetime
+import glob
+import heapq
+import itertools
 import logging
+import mmap
+import os
 import re
 import sys
 from collections import namedtuple
@@ -23,11 +30,14 @@ from contextlib import contextmanager
 from multiprocessing import Process
 from multiprocessing import Queue
 from queue import Empty
+from queue import Queue as ThreadQueue
+from threading import Thread
 from time import sleep
-from typing import Any
-from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Set
+from typing import TypeVar
 
 import isodate
 import pytz
@@ -51,10 +61,12 @@ from paasta_tools.cli.utils import guess_service_name
 from paasta_tools.cli.utils import lazy_choices_completer
 from paasta_tools.cli.utils import list_services
 from paasta_tools.utils import ANY_CLUSTER
+from paasta_tools.utils import atomic_file_write
 from paasta_tools.utils import datetime_convert_timezone
 from paasta_tools.utils import datetime_from_utc_to_local
 from paasta_tools.utils import DEFAULT_LOGLEVEL
 from paasta_tools.utils import DEFAULT_SOA_DIR
+from paasta_tools.utils import format_log_fields
 from paasta_tools.utils import format_log_line
 from paasta_tools.utils import load_system_paasta_config
 from paasta_tools.utils import list_clusters
@@ -67,6 +79,10 @@ DEFAULT_COMPONENTS = ['build', 'deploy', 'monitoring', 'oom', 'stdout', 'stderr'
 
 log = logging.getLogger(__name__)
 
+# How many lines of each scribe stream may be downloaded ahead of printing them when
+# printing logs by time or the last N lines.
+STREAM_BUFFER_LINES = 1000
+
 
 def add_subparser(subparsers):
     status_parser = subparsers.add_parser(
@@ -203,6 +219,133 @@ def check_timestamp_in_range(timestamp, start_time, end_time):
         return True
 
 
+# A log line parsed once, to be filtered, sorted and printed: timestamp is its parsed 'timestamp' field
+# (None if that is missing or invalid), fields is the decoded JSON object and raw_line the line itself.
+LogRecord = namedtuple('LogRecord', 'timestamp, fields, raw_line')
+
+MIN_LOG_TIMESTAMP = pytz.utc.localize(datetime.datetime.min)
+
+# Strings that JSON-encode to themselves in double quotes: printable ASCII other than '"' and '\\'.
+PLAIN_JSON_STRING_RE = re.compile(r'[ !#-\[\]-~]*')
+
+
+def parse_log_timestamp(timestamp):
+    try:
+        return isodate.parse_datetime(timestamp)
+    except (AttributeError, ValueError):
+        return None
+
+
+def parse_log_record(line, clusters=None, service=None):
+    """Parses a JSON-formatted log line into a LogRecord, or returns None if it isn't a JSON object."""
+    try:
+        fields = json.loads(line)
+    except ValueError:
+        log.debug('Trouble parsing line as json. Skipping. Line: %r' % line)
+        return None
+    if not isinstance(fields, dict):
+        log.debug('Line is not a JSON object. Skipping. Line: %r' % line)
+        return None
+    return LogRecord(parse_log_timestamp(fields.get('timestamp')), fields, line)
+
+
+def log_record_sort_key(record):
+    """Returns the timezone-aware timestamp to sort a LogRecord by, assuming UTC if it has no timezone."""
+    timestamp = record.timestamp
+    if timestamp is None:
+        return MIN_LOG_TIMESTAMP
+    if not timestamp.tzinfo:
+        return pytz.utc.localize(timestamp)
+    return timestamp
+
+
+def json_string_needles_re(values):
+    """Returns a regex, as str and as bytes patterns, matching the substrings of which a JSON-encoded log line
+    must contain at least one if one of its fields is one of values. Returns None if that can't be told
+    without decoding the line, because some value would be escaped in JSON."""
+    needles = set()
+    for value in values:
+        if not isinstance(value, str) or not PLAIN_JSON_STRING_RE.fullmatch(value):
+            return None
+        needles.add('"%s"' % value)
+        # Some JSON encoders escape forward slashes
+        needles.add('"%s"' % value.replace('/', '\\/'))
+    pattern = '|'.join(re.escape(needle) for needle in sorted(needles))
+    return re.compile(pattern), re.compile(pattern.encode('utf-8'))
+
+
+def make_log_line_prefilter(*field_values):
+    """Returns a function that tells whether a JSON-encoded log line could pass a filter requiring each of a
+    few of its fields to be one of the given values, by looking for the values in the line rather than
+    decoding it. A None in field_values is a field that isn't filtered on.
+
+    The function never rejects a line that would pass the filter, but lets some through that wouldn't,
+    so lines it lets through still have to be filtered properly."""
+    fields_res = [json_string_needles_re(values) for values in field_values if values is not None]
+    checked_res = [field_res for field_res in fields_res if field_res is not None]
+    str_res = [str_re for str_re, _ in checked_res]
+    bytes_res = [bytes_re for _, bytes_re in checked_res]
+
+    def line_may_pass(line):
+        for needles_re in (bytes_res if isinstance(line, bytes) else str_res):
+            if needles_re.search(line) is None:
+                return False
+        return True
+    return line_may_pass
+
+
+def make_message_prefilter(substring):
+    """Returns a function that tells whether a raw log line contains substring."""
+    needles = (substring, substring.encode('utf-8'))
+
+    def line_may_pass(line):
+        return needles[isinstance(line, bytes)] in line
+    return line_may_pass
+
+
+def paasta_log_line_prefilter(levels, service, components, clusters, instances):
+    return make_log_line_prefilter(list(clusters) + [ANY_CLUSTER], levels, components, instances)
+
+
+def paasta_app_output_prefilter(levels, service, components, clusters, instances):
+    return make_log_line_prefilter(list(clusters) + [ANY_CLUSTER], components, instances)
+
+
+def marathon_log_line_prefilter(levels, service, components, clusters, instances):
+    return make_message_prefilter(format_job_id(service, ''))
+
+
+def chronos_log_line_prefilter(levels, service, components, clusters, instances):
+    return make_message_prefilter(chronos_tools.compose_job_id(service, ''))
+
+
+def paasta_log_record_passes_filter(
+    record,
+    levels,
+    service,
+    components,
+    clusters,
+    instances,
+    start_time=None,
+    end_time=None,
+):
+    """Given a LogRecord, return True if the line should be
+    displayed given the provided levels, components, and clusters; return False
+    otherwise.
+    """
+    if not check_timestamp_in_range(record.timestamp, start_time, end_time):
+        return False
+    fields = record.fields
+    return (
+        fields.get('level') in levels and
+        fields.get('component') in components and (
+            fields.get('cluster') in clusters or
+            fields.get('cluster') == ANY_CLUSTER
+        ) and
+        (instances is None or fields.get('instance') in instances)
+    )
+
+
 def paasta_log_line_passes_filter(
     line,
     levels,
@@ -217,22 +360,31 @@ def paasta_log_line_passes_filter(
     displayed given the provided levels, components, and clusters; return False
     otherwise.
     """
-    try:
-        parsed_line = json.loads(line)
-    except ValueError:
-        log.debug('Trouble parsing line as json. Skipping. Line: %r' % line)
-        return False
+    record = parse_log_record(line)
+    return record is not None and paasta_log_record_passes_filter(
+        record, levels, service, components, clusters, instances, start_time=start_time, end_time=end_time,
+    )
 
-    timestamp = isodate.parse_datetime(parsed_line.get('timestamp'))
-    if not check_timestamp_in_range(timestamp, start_time, end_time):
+
+def paasta_app_output_record_passes_filter(
+    record,
+    levels,
+    service,
+    components,
+    clusters,
+    instances,
+    start_time=None,
+    end_time=None,
+):
+    if not check_timestamp_in_range(record.timestamp, start_time, end_time):
         return False
+    fields = record.fields
     return (
-        parsed_line.get('level') in levels and
-        parsed_line.get('component') in components and (
-            parsed_line.get('cluster') in clusters or
-            parsed_line.get('cluster') == ANY_CLUSTER
+        fields.get('component') in components and (
+            fields.get('cluster') in clusters or
+            fields.get('cluster') == ANY_CLUSTER
         ) and
-        (instances is None or parsed_line.get('instance') in instances)
+        (instances is None or fields.get('instance') in instances)
     )
 
 
@@ -246,21 +398,9 @@ def paasta_app_output_passes_filter(
     start_time=None,
     end_time=None,
 ):
-    try:
-        parsed_line = json.loads(line)
-    except ValueError:
-        log.debug('Trouble parsing line as json. Skipping. Line: %r' % line)
-        return False
-
-    timestamp = isodate.parse_datetime(parsed_line.get('timestamp'))
-    if not check_timestamp_in_range(timestamp, start_time, end_time):
-        return False
-    return (
-        parsed_line.get('component') in components and (
-            parsed_line.get('cluster') in clusters or
-            parsed_line.get('cluster') == ANY_CLUSTER
-        ) and
-        (instances is None or parsed_line.get('instance') in instances)
+    record = parse_log_record(line)
+    return record is not None and paasta_app_output_record_passes_filter(
+        record, levels, service, components, clusters, instances, start_time=start_time, end_time=end_time,
     )
 
 
@@ -285,38 +425,59 @@ def extract_utc_timestamp_from_log_line(line):
     return utc_timestamp
 
 
-def parse_marathon_log_line(line, clusters, service):
+def parse_framework_log_record(line, clusters, service, component):
+    """Parses a line of a marathon or chronos log into a LogRecord of the given component, or returns None
+    if the line doesn't start with a timestamp."""
     line = line.decode('utf-8')
     utc_timestamp = extract_utc_timestamp_from_log_line(line)
     if not utc_timestamp:
-        return ''
-    else:
-        return format_log_line(
-            level='event',
-            cluster=clusters[0],
-            service=service,
-            instance='ALL',
-            component='marathon',
-            line=line.strip(),
-            timestamp=utc_timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f"),
-        )
+        return None
+    log_line_args = dict(
+        level='event',
+        cluster=clusters[0],
+        service=service,
+        instance='ALL',
+        component=component,
+        line=line.strip(),
+        timestamp=utc_timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f"),
+    )
+    return LogRecord(utc_timestamp, format_log_fields(**log_line_args), format_log_line(**log_line_args))
+
+
+def parse_marathon_log_record(line, clusters, service):
+    return parse_framework_log_record(line, clusters, service, 'marathon')
+
+
+def parse_chronos_log_record(line, clusters, service):
+    return parse_framework_log_record(line, clusters, service, 'chronos')
+
+
+def parse_marathon_log_line(line, clusters, service):
+    record = parse_marathon_log_record(line, clusters, service)
+    return '' if record is None else record.raw_line
 
 
 def parse_chronos_log_line(line, clusters, service):
-    line = line.decode('utf-8')
-    utc_timestamp = extract_utc_timestamp_from_log_line(line)
-    if not utc_timestamp:
-        return ''
-    else:
-        return format_log_line(
-            level='event',
-            cluster=clusters[0],
-            service=service,
-            instance='ALL',
-            component='chronos',
-            line=line.strip(),
-            timestamp=utc_timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f"),
-        )
+    record = parse_chronos_log_record(line, clusters, service)
+    return '' if record is None else record.raw_line
+
+
+def marathon_log_record_passes_filter(
+    record,
+    levels,
+    service,
+    components,
+    clusters,
+    instances,
+    start_time=None,
+    end_time=None,
+):
+    """Given a LogRecord where the message is a Marathon log line,
+    return True if the line should be displayed given the provided service; return False
+    otherwise."""
+    if not check_timestamp_in_range(record.timestamp, start_time, end_time):
+        return False
+    return format_job_id(service, '') in record.fields.get('message', '')
 
 
 def marathon_log_line_passes_filter(
@@ -332,16 +493,28 @@ def marathon_log_line_passes_filter(
     """Given a (JSON-formatted) log line where the message is a Marathon log line,
     return True if the line should be displayed given the provided service; return False
     otherwise."""
-    try:
-        parsed_line = json.loads(line)
-    except ValueError:
-        log.debug('Trouble parsing line as json. Skipping. Line: %r' % line)
-        return False
+    record = parse_log_record(line)
+    return record is not None and marathon_log_record_passes_filter(
+        record, levels, service, components, clusters, instances, start_time=start_time, end_time=end_time,
+    )
+
 
-    timestamp = isodate.parse_datetime(parsed_line.get('timestamp'))
-    if not check_timestamp_in_range(timestamp, start_time, end_time):
+def chronos_log_record_passes_filter(
+    record,
+    levels,
+    service,
+    components,
+    clusters,
+    instances,
+    start_time=None,
+    end_time=None,
+):
+    """Given a LogRecord where the message is a Chronos log line,
+    return True if the line should be displayed given the provided service; return False
+    otherwise."""
+    if not check_timestamp_in_range(record.timestamp, start_time, end_time):
         return False
-    return format_job_id(service, '') in parsed_line.get('message', '')
+    return chronos_tools.compose_job_id(service, '') in record.fields.get('message', '')
 
 
 def chronos_log_line_passes_filter(
@@ -354,19 +527,44 @@ def chronos_log_line_passes_filter(
     start_time=None,
     end_time=None,
 ):
-    """Given a (JSON-formatted) log line where the message is a Marathon log line,
+    """Given a (JSON-formatted) log line where the message is a Chronos log line,
     return True if the line should be displayed given the provided service; return False
     otherwise."""
-    try:
-        parsed_line = json.loads(line)
-    except ValueError:
-        log.debug('Trouble parsing line as json. Skipping. Line: %r' % line)
-        return False
+    record = parse_log_record(line)
+    return record is not None and chronos_log_record_passes_filter(
+        record, levels, service, components, clusters, instances, start_time=start_time, end_time=end_time,
+    )
 
-    timestamp = isodate.parse_datetime(parsed_line.get('timestamp'))
-    if not check_timestamp_in_range(timestamp, start_time, end_time):
-        return False
-    return chronos_tools.compose_job_id(service, '') in parsed_line.get('message', '')
+
+def filter_log_records(
+    lines,
+    levels,
+    service,
+    components,
+    clusters,
+    instances,
+    filter_fn,
+    parse_fn=parse_log_record,
+    prefilter_fn=None,
+    start_time=None,
+    end_time=None,
+):
+    """Yields a LogRecord for each of lines that passes filter_fn, in order. Each line is parsed at most once,
+    and not at all if the function returned by prefilter_fn rejects it.
+    """
+    if prefilter_fn is not None:
+        line_may_pass = prefilter_fn(levels, service, components, clusters, instances)
+    else:
+        line_may_pass = None
+    for line in lines:
+        if line_may_pass is not None and not line_may_pass(line):
+            continue
+        record = parse_fn(line, clusters, service)
+        if record is not None and filter_fn(
+            record, levels, service, components, clusters,
+            instances, start_time=start_time, end_time=end_time,
+        ):
+            yield record
 
 
 def print_log(line, requested_levels, raw_mode=False):
@@ -379,11 +577,22 @@ def print_log(line, requested_levels, raw_mode=False):
         paasta_print(prettify_log_line(line, requested_levels))
 
 
+def print_log_record(record, requested_levels, raw_mode=False):
+    """Like print_log, for a line that has been parsed into a LogRecord already."""
+    if raw_mode:
+        paasta_print(record.raw_line, end=' ')
+    else:
+        paasta_print(prettify_log_record(record, requested_levels))
+
+
 def prettify_timestamp(timestamp):
     """Returns more human-friendly form of 'timestamp' without microseconds and
     in local time.
     """
-    dt = isodate.parse_datetime(timestamp)
+    return prettify_datetime(isodate.parse_datetime(timestamp))
+
+
+def prettify_datetime(dt):
     pretty_timestamp = datetime_from_utc_to_local(dt)
     return pretty_timestamp.strftime("%Y-%m-%d %H:%M:%S")
 
@@ -417,25 +626,67 @@ def prettify_log_line(line, requested_levels):
     """Given a line from the log, which is expected to be JSON and have all the
     things we expect, return a pretty formatted string containing relevant values.
     """
-    try:
-        parsed_line = json.loads(line)
-    except ValueError:
-        log.debug('Trouble parsing line as json. Skipping. Line: %r' % line)
+    record = parse_log_record(line)
+    if record is None:
         return "Invalid JSON: %s" % line
+    return prettify_log_record(record, requested_levels)
 
+
+def prettify_log_record(record, requested_levels):
+    """Like prettify_log_line, for a line that has been parsed into a LogRecord already."""
+    fields = record.fields
     try:
-        pretty_level = prettify_level(parsed_line['level'], requested_levels)
+        pretty_level = prettify_level(fields['level'], requested_levels)
         return "%(timestamp)s %(component)s %(cluster)s %(instance)s - %(level)s%(message)s" % ({
-            'timestamp': prettify_timestamp(parsed_line['timestamp']),
-            'component': prettify_component(parsed_line['component']),
-            'cluster': '[%s]' % parsed_line['cluster'],
-            'instance': '[%s]' % parsed_line['instance'],
+            'timestamp': (
+                prettify_timestamp(fields['timestamp']) if record.timestamp is None
+                else prettify_datetime(record.timestamp)
+            ),
+            'component': prettify_component(fields['component']),
+            'cluster': '[%s]' % fields['cluster'],
+            'instance': '[%s]' % fields['instance'],
             'level': '%s' % pretty_level,
-            'message': parsed_line['message'],
+            'message': fields['message'],
         })
     except KeyError:
-        log.debug('JSON parsed correctly but was missing a key. Skipping. Line: %r' % line)
-        return "JSON missing keys: %s" % line
+        log.debug('JSON parsed correctly but was missing a key. Skipping. Line: %r' % record.raw_line)
+        return "JSON missing keys: %s" % record.raw_line
+
+
+T = TypeVar('T')
+
+
+def iterate_in_background(iterable: Iterable[T], buffer_size: int=STREAM_BUFFER_LINES) -> Iterator[T]:
+    """Iterates over iterable in a daemon thread, yielding its items as they come in. At most
+    buffer_size items are kept around waiting to be consumed. Any exception raised while iterating
+    is re-raised here."""
+    items: ThreadQueue = ThreadQueue(maxsize=buffer_size)
+
+    def fill():
+        try:
+            for item in iterable:
+                items.put((True, item))
+        except Exception as e:
+            items.put((False, e))
+        else:
+            items.put((False, None))
+
+    Thread(target=fill, daemon=True).start()
+    while True:
+        more, item = items.get()
+        if not more:
+            if item is not None:
+                raise item
+            return
+        yield item
+
+
+def merge_sorted_log_streams(streams: List[Iterable[LogRecord]]) -> Iterator[LogRecord]:
+    """Reads the LogRecord streams concurrently and merges them into one stream ordered by
+    timestamp. Each stream is expected to be in timestamp order already; lines that come out of order
+    within a stream are still yielded, just not in their sorted place. Lines with the same timestamp
+    come out in the order of the streams they are from."""
+    return heapq.merge(*(iterate_in_background(stream) for stream in streams), key=log_record_sort_key)
 
 
 # The map of name -> LogReader subclasses, used by configure_log.
@@ -489,7 +740,12 @@ class LogReader(object):
         raise NotImplementedError("print_logs_by_offset is not implemented")
 
 
-ScribeComponentStreamInfo = namedtuple('ScribeComponentStreamInfo', 'per_cluster, stream_name_fn, filter_fn, parse_fn')
+# parse_fn parses a line of the stream into a LogRecord, filter_fn tells whether a LogRecord should be shown
+# and prefilter_fn returns a function that cheaply rejects most of the lines filter_fn would, before parsing.
+ScribeComponentStreamInfo = namedtuple(
+    'ScribeComponentStreamInfo',
+    'per_cluster, stream_name_fn, filter_fn, parse_fn, prefilter_fn',
+)
 
 
 @register_log_reader('scribereader')
@@ -502,32 +758,37 @@ class ScribeLogReader(LogReader):
         'default': ScribeComponentStreamInfo(
             per_cluster=False,
             stream_name_fn=get_log_name_for_service,
-            filter_fn=paasta_log_line_passes_filter,
-            parse_fn=None,
+            filter_fn=paasta_log_record_passes_filter,
+            parse_fn=parse_log_record,
+            prefilter_fn=paasta_log_line_prefilter,
         ),
         'stdout': ScribeComponentStreamInfo(
             per_cluster=False,
             stream_name_fn=lambda service: get_log_name_for_service(service, prefix='app_output'),
-            filter_fn=paasta_app_output_passes_filter,
-            parse_fn=None,
+            filter_fn=paasta_app_output_record_passes_filter,
+            parse_fn=parse_log_record,
+            prefilter_fn=paasta_app_output_prefilter,
         ),
         'stderr': ScribeComponentStreamInfo(
             per_cluster=False,
             stream_name_fn=lambda service: get_log_name_for_service(service, prefix='app_output'),
-            filter_fn=paasta_app_output_passes_filter,
-            parse_fn=None,
+            filter_fn=paasta_app_output_record_passes_filter,
+            parse_fn=parse_log_record,
+            prefilter_fn=paasta_app_output_prefilter,
         ),
         'marathon': ScribeComponentStreamInfo(
             per_cluster=True,
             stream_name_fn=lambda service, cluster: 'stream_marathon_%s' % cluster,
-            filter_fn=marathon_log_line_passes_filter,
-            parse_fn=parse_marathon_log_line,
+            filter_fn=marathon_log_record_passes_filter,
+            parse_fn=parse_marathon_log_record,
+            prefilter_fn=marathon_log_line_prefilter,
         ),
         'chronos': ScribeComponentStreamInfo(
             per_cluster=True,
             stream_name_fn=lambda service, cluster: 'stream_chronos_%s' % cluster,
-            filter_fn=chronos_log_line_passes_filter,
-            parse_fn=parse_chronos_log_line,
+            filter_fn=chronos_log_record_passes_filter,
+            parse_fn=parse_chronos_log_record,
+            prefilter_fn=chronos_log_line_prefilter,
         ),
     }
 
@@ -617,6 +878,8 @@ class ScribeLogReader(LogReader):
                 'instances': instances,
                 'queue': queue,
                 'filter_fn': stream_info.filter_fn,
+                'parse_fn': stream_info.parse_fn,
+                'prefilter_fn': stream_info.prefilter_fn,
             }
 
             if stream_info.per_cluster:
@@ -700,7 +963,7 @@ class ScribeLogReader(LogReader):
                 break
 
     def print_logs_by_time(self, service, start_time, end_time, levels, components, clusters, instances, raw_mode):
-        aggregated_logs: List[Dict[str, Any]] = []
+        streams: List[Iterator[LogRecord]] = []
 
         if 'marathon' in components or 'chronos' in components:
             paasta_print(
@@ -719,7 +982,7 @@ class ScribeLogReader(LogReader):
                 stream_name = stream_info.stream_name_fn(service)
 
             ctx = self.scribe_get_from_time(scribe_env, stream_name, start_time, end_time)
-            self.filter_and_aggregate_scribe_logs(
+            streams.append(self.filter_scribe_logs(
                 scribe_reader_ctx=ctx,
                 scribe_env=scribe_env,
                 stream_name=stream_name,
@@ -728,12 +991,12 @@ class ScribeLogReader(LogReader):
                 components=components,
                 clusters=clusters,
                 instances=instances,
-                aggregated_logs=aggregated_logs,
                 filter_fn=stream_info.filter_fn,
-                parser_fn=stream_info.parse_fn,
+                parse_fn=stream_info.parse_fn,
+                prefilter_fn=stream_info.prefilter_fn,
                 start_time=start_time,
                 end_time=end_time,
-            )
+            ))
 
         self.run_code_over_scribe_envs(
             clusters=clusters,
@@ -741,12 +1004,11 @@ class ScribeLogReader(LogReader):
             callback=callback,
         )
 
-        aggregated_logs.sort(key=lambda log_line: log_line['sort_key'])
-        for line in aggregated_logs:
-            print_log(line['raw_line'], levels, raw_mode)
+        for record in merge_sorted_log_streams(streams):
+            print_log_record(record, levels, raw_mode)
 
     def print_last_n_logs(self, service, line_count, levels, components, clusters, instances, raw_mode):
-        aggregated_logs: List[Dict[str, Any]] = []
+        streams: List[Iterator[LogRecord]] = []
 
         def callback(component, stream_info, scribe_env, cluster):
             stream_info = self.get_stream_info(component)
@@ -757,7 +1019,7 @@ class ScribeLogReader(LogReader):
                 stream_name = stream_info.stream_name_fn(service)
 
             ctx = self.scribe_get_last_n_lines(scribe_env, stream_name, line_count)
-            self.filter_and_aggregate_scribe_logs(
+            streams.append(self.filter_scribe_logs(
                 scribe_reader_ctx=ctx,
                 scribe_env=scribe_env,
                 stream_name=stream_name,
@@ -766,42 +1028,30 @@ class ScribeLogReader(LogReader):
                 components=components,
                 clusters=clusters,
                 instances=instances,
-                aggregated_logs=aggregated_logs,
                 filter_fn=stream_info.filter_fn,
-                parser_fn=stream_info.parse_fn,
-            )
+                parse_fn=stream_info.parse_fn,
+                prefilter_fn=stream_info.prefilter_fn,
+            ))
 
         self.run_code_over_scribe_envs(clusters=clusters, components=components, callback=callback)
-        aggregated_logs.sort(key=lambda log_line: log_line['sort_key'])
-        for line in aggregated_logs:
-            print_log(line['raw_line'], levels, raw_mode)
+        for record in merge_sorted_log_streams(streams):
+            print_log_record(record, levels, raw_mode)
 
-    def filter_and_aggregate_scribe_logs(
+    def filter_scribe_logs(
         self, scribe_reader_ctx, scribe_env, stream_name,
         levels, service, components, clusters, instances,
-        aggregated_logs, parser_fn=None, filter_fn=None,
+        filter_fn, parse_fn=parse_log_record, prefilter_fn=None,
         start_time=None, end_time=None,
     ):
+        """Yields a LogRecord for every line of the stream that passes filter_fn, in stream order.
+        Nothing is read from the stream until this is iterated over."""
         with scribe_reader_ctx as scribe_reader:
             try:
-                for line in scribe_reader:
-                    if parser_fn:
-                        line = parser_fn(line, clusters, service)
-                    if filter_fn:
-                        if filter_fn(
-                            line, levels, service, components, clusters,
-                            instances, start_time=start_time, end_time=end_time,
-                        ):
-                            try:
-                                parsed_line = json.loads(line)
-                                timestamp = isodate.parse_datetime(parsed_line.get('timestamp'))
-                                if not timestamp.tzinfo:
-                                    timestamp = pytz.utc.localize(timestamp)
-                            except ValueError:
-                                timestamp = pytz.utc.localize(datetime.datetime.min)
-
-                            line = {'raw_line': line, 'sort_key': timestamp}
-                            aggregated_logs.append(line)
+                yield from filter_log_records(
+                    scribe_reader, levels, service, components, clusters, instances,
+                    filter_fn=filter_fn, parse_fn=parse_fn, prefilter_fn=prefilter_fn,
+                    start_time=start_time, end_time=end_time,
+                )
             except StreamTailerSetupError as e:
                 if 'No data in stream' in str(e):
                     log.warning("Scribe stream %s is empty on %s" % (stream_name, scribe_env))
@@ -856,7 +1106,7 @@ class ScribeLogReader(LogReader):
 
     def scribe_tail(
         self, scribe_env, stream_name, service, levels, components, clusters, instances, queue, filter_fn,
-        parse_fn=None,
+        parse_fn=parse_log_record, prefilter_fn=None,
     ):
         """Creates a scribetailer for a particular environment.
 
@@ -871,11 +1121,11 @@ class ScribeLogReader(LogReader):
             host = host_and_port['host']
             port = host_and_port['port']
             tailer = scribereader.get_stream_tailer(stream_name, host, port)
-            for line in tailer:
-                if parse_fn:
-                    line = parse_fn(line, clusters, service)
-                if filter_fn(line, levels, service, components, clusters, instances):
-                    queue.put(line)
+            for record in filter_log_records(
+                tailer, levels, service, components, clusters, instances,
+                filter_fn=filter_fn, parse_fn=parse_fn, prefilter_fn=prefilter_fn,
+            ):
+                queue.put(record.raw_line)
         except KeyboardInterrupt:
             # Die peacefully rather than printing N threads worth of stack
             # traces.
@@ -926,6 +1176,293 @@ class ScribeLogReader(LogReader):
             return env
 
 
+# How many bytes apart the lines whose timestamps FileLogIndex keeps are.
+DEFAULT_LOG_INDEX_INTERVAL = 1024 * 1024
+# How many bytes FileLogReader reads at a time when reading a log file backwards.
+READ_BLOCK_SIZE = 64 * 1024
+# How many seconds FileLogReader waits between checks for new lines when tailing.
+TAIL_POLL_INTERVAL = 0.5
+
+
+def read_lines_reversed(f, block_size=READ_BLOCK_SIZE):
+    """Yields the lines of the binary file f from the last to the first, reading it backwards
+    block_size bytes at a time. Lines are decoded and end with a newline."""
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    remainder = b''
+    while position > 0:
+        read_size = min(block_size, position)
+        position -= read_size
+        f.seek(position)
+        lines = (f.read(read_size) + remainder).split(b'\n')
+        remainder = lines[0]
+        for line in reversed(lines[1:]):
+            if line:
+                yield line.decode('utf-8', 'replace') + '\n'
+    if remainder:
+        yield remainder.decode('utf-8', 'replace') + '\n'
+
+
+def read_mmap_lines(mm, start, end):
+    """Yields the complete lines of the mmap mm that start at or after byte start and before byte end,
+    which must be the start of a line. Lines are decoded and end with a newline."""
+    position = start
+    while position < end:
+        newline = mm.find(b'\n', position)
+        if newline == -1:
+            return
+        yield mm[position:newline + 1].decode('utf-8', 'replace')
+        position = newline + 1
+
+
+class FileLogIndex:
+    """A sparse index of the lines of a log file written by FileLogWriter: the offset of the first line
+    starting after every interval bytes, along with its timestamp (in seconds since the epoch).
+
+    Lines of a log file are expected to be in timestamp order, so the index tells which part of the
+    file holds the lines of a time range. The timestamps are made non-decreasing to be searchable
+    even when a few lines are out of order.
+
+    The index is kept in a hidden file beside the log file, and brought up to date whenever it is used:
+    extended if the log file has grown, rebuilt if it has been replaced or truncated.
+    """
+
+    def __init__(self, path, interval=DEFAULT_LOG_INDEX_INTERVAL):
+        self.path = path
+        self.index_path = os.path.join(os.path.dirname(path), '.%s.index' % os.path.basename(path))
+        self.interval = interval
+        self.inode = None
+        self.size = 0
+        self.offsets = []
+        self.timestamps = []
+
+    def load(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        if index.get('interval') == self.interval:
+            self.inode = index['inode']
+            self.size = index['size']
+            self.offsets = index['offsets']
+            self.timestamps = index['timestamps']
+
+    def save(self):
+        index = {
+            'interval': self.interval,
+            'inode': self.inode,
+            'size': self.size,
+            'offsets': self.offsets,
+            'timestamps': self.timestamps,
+        }
+        try:
+            with atomic_file_write(self.index_path) as f:
+                json.dump(index, f)
+        except OSError as e:
+            # The log directory may not be writable by whoever is reading the logs
+            log.debug("Could not save the index of %s: %s" % (self.path, e))
+
+    def update(self, mm, inode):
+        """Indexes the lines of mm, the mapped log file, that haven't been indexed yet. Returns whether
+        anything changed."""
+        size = len(mm)
+        if self.inode == inode and self.size == size:
+            return False
+        # A file truncated in place (e.g. by logrotate's copytruncate) may have grown past its indexed
+        # size again, so check it still starts with the same line too.
+        if self.inode != inode or self.size > size or (
+            self.offsets and self.get_line_timestamp(mm, 0, MIN_LOG_TIMESTAMP.timestamp()) != self.timestamps[0]
+        ):
+            self.inode = inode
+            self.offsets = []
+            self.timestamps = []
+
+        position = self.offsets[-1] + self.interval if self.offsets else 0
+        while position < size:
+            start = mm.find(b'\n', position - 1) + 1 if position else 0
+            if start == 0 and position:
+                break
+            timestamp = self.get_line_timestamp(
+                mm, start, self.timestamps[-1] if self.timestamps else MIN_LOG_TIMESTAMP.timestamp(),
+            )
+            if timestamp is None:
+                break
+            self.offsets.append(start)
+            self.timestamps.append(timestamp)
+            position = start + self.interval
+        self.size = size
+        return True
+
+    @staticmethod
+    def get_line_timestamp(mm, start, min_timestamp):
+        """Returns the timestamp of the line starting at byte start, or min_timestamp if it is less or can't be
+        parsed. Returns None if the line isn't complete yet."""
+        end = mm.find(b'\n', start)
+        if end == -1:
+            return None
+        record = parse_log_record(mm[start:end])
+        if record is None or record.timestamp is None:
+            return min_timestamp
+        return max(log_record_sort_key(record).timestamp(), min_timestamp)
+
+    def get_byte_range(self, start_time, end_time):
+        """Returns the (start, end) byte offsets of the part of the log file holding the lines
+        between start_time and end_time."""
+        first = bisect.bisect_left(self.timestamps, start_time.timestamp()) - 1
+        last = bisect.bisect_right(self.timestamps, end_time.timestamp())
+        start = self.offsets[first] if first >= 0 else 0
+        end = self.offsets[last] if last < len(self.offsets) else self.size
+        return start, end
+
+
+@register_log_reader('file')
+class FileLogReader(LogReader):
+    """Reads the logs written by FileLogWriter. path_format should be the one given to FileLogWriter.
+
+    All the lines of a file are expected to be JSON-formatted paasta log lines in timestamp order.
+    """
+    SUPPORTS_TAILING = True
+    SUPPORTS_LINE_COUNT = True
+    SUPPORTS_LINE_OFFSET = True
+    SUPPORTS_TIME = True
+
+    def __init__(self, path_format, index_interval=DEFAULT_LOG_INDEX_INTERVAL):
+        super(FileLogReader, self).__init__()
+        self.path_format = path_format
+        self.index_interval = index_interval
+
+    def get_log_paths(self, service, levels, components, clusters, instances):
+        """Returns the log files that lines of the given service could have been written to."""
+        paths = set()
+        for component, level, cluster, instance in itertools.product(
+            components, levels, list(clusters) + [ANY_CLUSTER], instances or ['*'],
+        ):
+            pattern = self.path_format.format(
+                service=glob.escape(service),
+                component=glob.escape(component),
+                level=glob.escape(level),
+                cluster=glob.escape(cluster),
+                instance=instance if instances is None else glob.escape(instance),
+            )
+            paths.update(path for path in glob.glob(pattern) if os.path.isfile(path))
+        return sorted(paths)
+
+    def filter_lines(
+        self, lines, service, levels, components, clusters, instances, start_time=None, end_time=None,
+    ):
+        return filter_log_records(
+            lines, levels, service, components, clusters, instances,
+            filter_fn=paasta_log_record_passes_filter,
+            parse_fn=parse_log_record,
+            prefilter_fn=paasta_log_line_prefilter,
+            start_time=start_time,
+            end_time=end_time,
+        )
+
+    def read_file_by_time(self, path, service, levels, components, clusters, instances, start_time, end_time):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                index = FileLogIndex(path, interval=self.index_interval)
+                index.load()
+                if index.update(mm, os.fstat(f.fileno()).st_ino):
+                    index.save()
+                start, end = index.get_byte_range(start_time, end_time)
+                yield from self.filter_lines(
+                    read_mmap_lines(mm, start, end), service, levels, components, clusters, instances,
+                    start_time=start_time, end_time=end_time,
+                )
+
+    def read_file(self, path, service, levels, components, clusters, instances):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield from self.filter_lines(
+                    read_mmap_lines(mm, 0, len(mm)), service, levels, components, clusters, instances,
+                )
+
+    def read_last_n_lines_of_file(self, path, line_count, service, levels, components, clusters, instances):
+        """Returns the last line_count LogRecords of the file that pass the filters, in file order."""
+        with open(path, 'rb') as f:
+            records = self.filter_lines(
+                read_lines_reversed(f), service, levels, components, clusters, instances,
+            )
+            return list(itertools.islice(records, line_count))[::-1]
+
+    def print_logs_by_time(self, service, start_time, end_time, levels, components, clusters, instances, raw_mode):
+        streams = [
+            self.read_file_by_time(path, service, levels, components, clusters, instances, start_time, end_time)
+            for path in self.get_log_paths(service, levels, components, clusters, instances)
+        ]
+        for record in merge_sorted_log_streams(streams):
+            print_log_record(record, levels, raw_mode)
+
+    def print_last_n_logs(self, service, line_count, levels, components, clusters, instances, raw_mode):
+        streams = [
+            self.read_last_n_lines_of_file(path, line_count, service, levels, components, clusters, instances)
+            for path in self.get_log_paths(service, levels, components, clusters, instances)
+        ]
+        last_records = collections.deque(merge_sorted_log_streams(streams), maxlen=line_count)
+        for record in last_records:
+            print_log_record(record, levels, raw_mode)
+
+    def print_logs_by_offset(self, service, line_count, offset, levels, components, clusters, instances, raw_mode):
+        """Prints line_count lines starting at the offset-th line (the first one being 1) of the logs, or
+        if line_count is negative, the -line_count lines ending with it."""
+        if line_count >= 0:
+            first, last = offset, offset + line_count - 1
+        else:
+            first, last = offset + line_count + 1, offset
+        streams = [
+            self.read_file(path, service, levels, components, clusters, instances)
+            for path in self.get_log_paths(service, levels, components, clusters, instances)
+        ]
+        for line_number, record in enumerate(merge_sorted_log_streams(streams), start=1):
+            if line_number > last:
+                break
+            if line_number >= first:
+                print_log_record(record, levels, raw_mode)
+
+    def tail_logs(self, service, levels, components, clusters, instances, raw_mode=False):
+        """Prints the lines added to the log files from now on, until interrupted. Files that appear
+        or get replaced (e.g. by logrotate) while tailing are read from their start."""
+        try:
+            for record in self.follow_log_files(service, levels, components, clusters, instances):
+                print_log_record(record, levels, raw_mode)
+        except KeyboardInterrupt:
+            log.warn('Terminating.')
+
+    def follow_log_files(self, service, levels, components, clusters, instances):
+        # path -> (inode, position up to which the file has been read)
+        positions = {}
+        for path in self.get_log_paths(service, levels, components, clusters, instances):
+            st = os.stat(path)
+            positions[path] = (st.st_ino, st.st_size)
+
+        while True:
+            for path in self.get_log_paths(service, levels, components, clusters, instances):
+                try:
+                    f = open(path, 'rb')
+                except OSError:
+                    continue
+                with f:
+                    inode = os.fstat(f.fileno()).st_ino
+                    known_inode, position = positions.get(path, (inode, 0))
+                    if known_inode != inode or os.fstat(f.fileno()).st_size < position:
+                        position = 0
+                    f.seek(position)
+                    data = f.read()
+                    # Leave an incomplete last line to be read once it's complete
+                    complete = data.rfind(b'\n') + 1
+                    positions[path] = (inode, position + complete)
+                lines = (line.decode('utf-8', 'replace') + '\n' for line in data[:complete].splitlines())
+                yield from self.filter_lines(lines, service, levels, components, clusters, instances)
+            sleep(TAIL_POLL_INTERVAL)
+
+
 def generate_start_end_time(from_string="30m", to_string=None):
     """Parses the --from and --to command line arguments to create python
     datetime objects representing the start and end times for log retrieval
@@ -1123,10 +1660,10 @@ def paasta_logs(args):
         )
         return 0
 
-    # If the logger doesn't support offsetting the number of lines by a particular line number
-    # there is no point in distinguishing between a positive/negative number of lines since it
-    # can only get the last N lines
-    if not log_reader.SUPPORTS_LINE_OFFSET and args.line_count is not None:
+    # If the logger doesn't support offsetting the number of lines by a particular line number, or no
+    # offset was given, there is no point in distinguishing between a positive/negative number of lines
+    # since it can only get the last N lines
+    if (not log_reader.SUPPORTS_LINE_OFFSET or args.line_offset is None) and args.line_count is not None:
         args.line_count = abs(args.line_count)
 
     # Handle line based filtering
@@ -1145,10 +1682,10 @@ def paasta_logs(args):
         log_reader.print_logs_by_offset(
             service=service,
             line_count=args.line_count,
-            line_offset=args.line_offset,
+            offset=args.line_offset,
             levels=levels,
             components=components,
-            cluters=clusters,
+            clusters=clusters,
             instances=instances,
             raw_mode=args.raw_mode,
         )
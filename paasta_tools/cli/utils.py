@@ -347,13 +347,13 @@ def list_services(**kwargs):
     return sorted(os.listdir(os.path.abspath(soa_dir)))
 
 
-def list_paasta_services():
+def list_paasta_services(soa_dir=DEFAULT_SOA_DIR):
     """Returns a sorted list of services that happen to have at
     least one service.instance (including Marathon and Chronos instances), which indicates it is on PaaSTA
     """
     the_list = []
-    for service in list_services():
-        if list_all_instances_for_service(service):
+    for service in list_services(soa_dir=soa_dir):
+        if list_all_instances_for_service(service, soa_dir=soa_dir):
             the_list.append(service)
     return the_list
 
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3.6
+"""Compares logging lines with utils.FileLogWriter, which opens, writes and closes the log file for every line,
+against utils.BufferedFileLogWriter, which keeps the files open and writes buffered lines in batches.
+
+--lines lines are logged round-robin for --services services, each to its own file in a temporary directory.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from paasta_tools.utils import BufferedFileLogWriter
+from paasta_tools.utils import FileLogWriter
+from paasta_tools.utils import paasta_print
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=50000, help="How many lines to log in each round")
+    parser.add_argument('--services', type=int, default=50, help="How many services (and log files) to log to")
+    parser.add_argument('--flock', action='store_true', help="flock the log files around every write")
+    parser.add_argument('--rounds', type=int, default=3, help="How many times to log the lines with each writer")
+    return parser.parse_args()
+
+
+def log_lines(writer_class, log_dir, args):
+    writer = writer_class(os.path.join(log_dir, '{service}.log'), flock=args.flock)
+    for i in range(args.lines):
+        writer.log('service-%d' % (i % args.services), 'benchmark line %d' % i, 'build', 'event')
+    if isinstance(writer, BufferedFileLogWriter):
+        writer.close()
+
+
+def count_lines(log_dir):
+    count = 0
+    for name in os.listdir(log_dir):
+        with open(os.path.join(log_dir, name)) as f:
+            count += sum(1 for _ in f)
+    return count
+
+
+def measure(writer_class, args):
+    best = float('inf')
+    for _ in range(args.rounds):
+        with tempfile.TemporaryDirectory() as log_dir:
+            start = time.perf_counter()
+            log_lines(writer_class, log_dir, args)
+            best = min(best, time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        tracemalloc.start()
+        log_lines(writer_class, log_dir, args)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        count = count_lines(log_dir)
+    return best, peak, count
+
+
+def main():
+    args = parse_args()
+    paasta_print("%d lines to %d files" % (args.lines, args.services))
+
+    counts = []
+    for name, writer_class in (('unbuffered', FileLogWriter), ('buffered', BufferedFileLogWriter)):
+        seconds, peak, count = measure(writer_class, args)
+        counts.append(count)
+        paasta_print(
+            "%-10s best of %d: %10.2fms  %10.0f lines/s  peak memory: %8.1fKiB" % (
+                name, args.rounds, seconds * 1000, args.lines / seconds, peak / 1024,
+            ),
+        )
+    if counts[0] != counts[1] or counts[0] != args.lines:
+        paasta_print("The writers disagree! %d and %d lines written" % tuple(counts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3.6
+"""Compares working out the deployments.json mappings of a service from its git refs by matching a pattern against
+every ref for each deploy group (how generate_deployments_for_service used to do it) against
+generate_deployments_for_service.get_deploy_group_mappings_from_refs, which classifies every ref once.
+
+The synthetic repo has --deploy-groups deploy groups, each controlling --branches-per-group branches, and --refs
+refs in total, most of them deploy and start/stop tags spread over the deploy groups.
+"""
+import argparse
+import random
+import re
+import time
+import tracemalloc
+
+from paasta_tools.generate_deployments_for_service import build_docker_image_name
+from paasta_tools.generate_deployments_for_service import get_deploy_group_mappings_from_refs
+from paasta_tools.utils import paasta_print
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--refs', type=int, default=50000, help="How many refs the repo has")
+    parser.add_argument('--deploy-groups', type=int, default=40, help="How many deploy groups the service has")
+    parser.add_argument(
+        '--branches-per-group', type=int, default=3,
+        help="How many control branches (cluster.instance) each deploy group has",
+    )
+    parser.add_argument('--rounds', type=int, default=5, help="How many times to compute the mappings each way")
+    return parser.parse_args()
+
+
+def make_refs(num_refs, deploy_group_branch_mappings):
+    random.seed(0)
+    shas = ['%040x' % random.getrandbits(160) for _ in range(max(num_refs // 4, 1))]
+    branches = list(deploy_group_branch_mappings)
+    deploy_groups = sorted(set(deploy_group_branch_mappings.values()))
+    refs = {'refs/heads/master': shas[0]}
+    while len(refs) < num_refs:
+        timestamp = '2017%02d%02dT%02d%02d%02d' % (
+            random.randint(1, 12), random.randint(1, 28),
+            random.randint(0, 23), random.randint(0, 59), random.randint(0, 59),
+        )
+        kind = random.random()
+        if kind < 0.6:
+            ref = 'refs/tags/paasta-%s-%s-deploy' % (random.choice(deploy_groups), timestamp)
+        elif kind < 0.9:
+            ref = 'refs/tags/paasta-%s-%s-%s' % (random.choice(branches), timestamp, random.choice(('start', 'stop')))
+        else:
+            ref = 'refs/heads/branch-%d' % len(refs)
+        refs[ref] = random.choice(shas)
+    return refs
+
+
+def get_latest_deployment_tag(refs, deploy_group):
+    most_recent_dtime = None
+    most_recent_ref = None
+    most_recent_sha = None
+    pattern = re.compile(r'^refs/tags/paasta-%s-(\d{8}T\d{6})-deploy$' % deploy_group)
+
+    for ref_name, sha in refs.items():
+        match = pattern.match(ref_name)
+        if match:
+            dtime = match.groups()[0]
+            if most_recent_dtime is None or dtime > most_recent_dtime:
+                most_recent_dtime = dtime
+                most_recent_ref = ref_name
+                most_recent_sha = sha
+    return most_recent_ref, most_recent_sha
+
+
+def get_desired_state(branch, remote_refs, deploy_group):
+    tag_pattern = r'^refs/tags/(?:paasta-){0,2}%s-(?P<force_bounce>[^-]+)-(?P<state>(start|stop))$' % branch
+
+    states = []
+    (_, head_sha) = get_latest_deployment_tag(remote_refs, deploy_group)
+
+    for ref_name, sha in remote_refs.items():
+        if sha == head_sha:
+            match = re.match(tag_pattern, ref_name)
+            if match:
+                gd = match.groupdict()
+                states.append((gd['state'], gd['force_bounce']))
+
+    if states:
+        sorted_states = sorted(states, key=lambda x: x[1])
+        return sorted_states[-1]
+    else:
+        return ('start', None)
+
+
+def per_deploy_group_mappings(service, deploy_group_branch_mappings, remote_refs):
+    mappings = {}
+    v2_mappings = {'deployments': {}, 'controls': {}}
+    for control_branch, deploy_group in deploy_group_branch_mappings.items():
+        (deploy_ref_name, _) = get_latest_deployment_tag(remote_refs, deploy_group)
+        if deploy_ref_name in remote_refs:
+            commit_sha = remote_refs[deploy_ref_name]
+            docker_image = build_docker_image_name(service, commit_sha)
+            desired_state, force_bounce = get_desired_state(control_branch, remote_refs, deploy_group)
+            v2_mappings['deployments'][deploy_group] = {'docker_image': docker_image, 'git_sha': commit_sha}
+            mappings['%s:paasta-%s' % (service, control_branch)] = {
+                'docker_image': docker_image,
+                'desired_state': desired_state,
+                'force_bounce': force_bounce,
+            }
+            v2_mappings['controls']['%s:%s' % (service, control_branch)] = {
+                'desired_state': desired_state,
+                'force_bounce': force_bounce,
+            }
+    return mappings, v2_mappings
+
+
+def measure(get_mappings, deploy_group_branch_mappings, refs, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        get_mappings('benchmark', deploy_group_branch_mappings, refs)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    mappings = get_mappings('benchmark', deploy_group_branch_mappings, refs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, mappings
+
+
+def main():
+    args = parse_args()
+    deploy_group_branch_mappings = {
+        'cluster%d.instance%d' % (branch, group): 'group%d' % group
+        for group in range(args.deploy_groups)
+        for branch in range(args.branches_per_group)
+    }
+    refs = make_refs(args.refs, deploy_group_branch_mappings)
+    paasta_print("%d refs, %d control branches" % (len(refs), len(deploy_group_branch_mappings)))
+
+    results = []
+    for name, get_mappings in (
+        ('per deploy group', per_deploy_group_mappings),
+        ('ref index', get_deploy_group_mappings_from_refs),
+    ):
+        seconds, peak, mappings = measure(get_mappings, deploy_group_branch_mappings, refs, args.rounds)
+        results.append(mappings)
+        paasta_print(
+            "%-16s best of %d: %10.2fms  peak memory: %8.1fKiB" % (name, args.rounds, seconds * 1000, peak / 1024),
+        )
+    if results[0] != results[1]:
+        paasta_print("The mappings disagree!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3.6
+"""Compares parsing a haproxy stats csv with csv.DictReader (how smartstack_tools used to do it) against
+smartstack_tools.parse_haproxy_csv.
+
+Record a csv from a busy synapse host with something like:
+
+    curl -s 'http://localhost:3212/;csv;norefresh' > haproxy.csv
+
+and pass it to this script. --copies makes the csv bigger by repeating its servers under new proxy names,
+to see how parsing scales with the number of services on a box.
+"""
+import argparse
+import csv
+import time
+import tracemalloc
+
+from paasta_tools.smartstack_tools import parse_haproxy_csv
+from paasta_tools.utils import paasta_print
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('csv_file', help="A haproxy stats csv")
+    parser.add_argument(
+        '--copies', type=int, default=1,
+        help="Repeat the servers in the csv this many times, each under new proxy names",
+    )
+    parser.add_argument('--rounds', type=int, default=5, help="How many times to parse the csv with each parser")
+    parser.add_argument(
+        '--service', dest='services', action='append',
+        help="Only look for backends of this service. May be given multiple times. Defaults to every service.",
+    )
+    return parser.parse_args()
+
+
+def load_lines(csv_file, copies):
+    with open(csv_file) as f:
+        header, *rows = f.read().splitlines()
+    lines = [header]
+    for copy in range(copies):
+        for row in rows:
+            if copy == 0:
+                lines.append(row)
+            else:
+                pxname, sep, rest = row.partition(',')
+                lines.append('%s_%d%s%s' % (pxname, copy, sep, rest))
+    return lines
+
+
+def dictreader_parse(lines, services):
+    backends = []
+    for line in csv.DictReader(lines):
+        line['pxname'] = line.pop('# pxname')
+        line.pop('')
+        ha_slave, ha_service = line['svname'], line['pxname']
+        if (services is None or ha_service in services) and ha_slave not in ('FRONTEND', 'BACKEND'):
+            backends.append(line)
+    return backends
+
+
+def streaming_parse(lines, services):
+    return parse_haproxy_csv(lines, services)
+
+
+def measure(parse, lines, services, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        parse(lines, services)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    backends = parse(lines, services)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, len(backends)
+
+
+def main():
+    args = parse_args()
+    lines = load_lines(args.csv_file, args.copies)
+    paasta_print("%d lines, %d bytes" % (len(lines), sum(len(line) + 1 for line in lines)))
+    for name, parse in (('csv.DictReader', dictreader_parse), ('parse_haproxy_csv', streaming_parse)):
+        seconds, peak, count = measure(parse, lines, args.services, args.rounds)
+        paasta_print(
+            "%-18s %6d backends  best of %d: %8.2fms  peak memory: %8.1fKiB" % (
+                name, count, args.rounds, seconds * 1000, peak / 1024,
+            ),
+        )
+
+
+if __name__ == '__main__':
+    main()
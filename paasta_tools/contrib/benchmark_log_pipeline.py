@@ -0,0 +1,145 @@
+#!/usr/bin/env python3.6
+"""Compares filtering, sorting and prettifying the lines of a scribe stream the way `paasta logs` used to, parsing
+every line up to three times (once per filter, sort key and prettify_log_line, after re-serializing marathon
+and chronos lines), against the LogRecord pipeline in cli/cmds/logs.py, which rejects most lines with a substring
+check and parses the rest once.
+
+The fixture is a temporary file of --lines lines, read back as bytes the way scribereader yields them. For the
+paasta stream, lines are spread over --clusters clusters, 3 levels and 2 instances, and only the event lines of
+one cluster are shown. For the marathon stream, 1 in --services lines is about the service being shown.
+"""
+import argparse
+import datetime
+import random
+import tempfile
+import time
+import tracemalloc
+
+import isodate
+import pytz
+import ujson as json
+
+from paasta_tools.cli.cmds import logs
+from paasta_tools.utils import format_log_line
+from paasta_tools.utils import paasta_print
+
+SERVICE = 'benchmark'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=1000000, help="How many lines the stream has")
+    parser.add_argument('--stream', choices=('paasta', 'marathon'), default='paasta', help="Which stream to read")
+    parser.add_argument('--clusters', type=int, default=10, help="How many clusters paasta stream lines are from")
+    parser.add_argument(
+        '--services', type=int, default=20,
+        help="How many services the marathon stream has lines about",
+    )
+    parser.add_argument('--rounds', type=int, default=1, help="How many times to read the stream each way")
+    return parser.parse_args()
+
+
+def write_fixture(f, args):
+    random.seed(0)
+    start = datetime.datetime(2017, 1, 1)
+    for i in range(args.lines):
+        timestamp = start + datetime.timedelta(milliseconds=i * 10)
+        if args.stream == 'paasta':
+            line = format_log_line(
+                level=random.choice(('event', 'debug', 'info')),
+                cluster='cluster%d' % random.randrange(args.clusters),
+                service=SERVICE,
+                instance=random.choice(('main', 'canary')),
+                component=random.choice(('build', 'deploy', 'monitoring')),
+                line='line %d of the benchmark stream' % i,
+                timestamp=timestamp.isoformat(),
+            )
+        else:
+            service = SERVICE if i % args.services == 0 else 'other%d' % (i % args.services)
+            line = '%s-07:00 marathon[1234]: INFO Received status update for task %s.main.gitabcdef.config123' % (
+                timestamp.isoformat(), service,
+            )
+        f.write(line.encode('utf-8') + b'\n')
+    f.flush()
+
+
+def make_filter_args(args):
+    if args.stream == 'paasta':
+        return dict(levels=['event'], components=['build', 'deploy', 'monitoring'], clusters=['cluster0'])
+    else:
+        return dict(levels=['event'], components=['marathon'], clusters=['cluster0'])
+
+
+def triple_parse_pipeline(lines, args):
+    filter_fn = logs.paasta_log_line_passes_filter if args.stream == 'paasta' else logs.marathon_log_line_passes_filter
+    parser_fn = None if args.stream == 'paasta' else logs.parse_marathon_log_line
+    filter_args = make_filter_args(args)
+
+    aggregated_logs = []
+    for line in lines:
+        if parser_fn:
+            line = parser_fn(line, filter_args['clusters'], SERVICE)
+        if filter_fn(line, filter_args['levels'], SERVICE, filter_args['components'], filter_args['clusters'], None):
+            try:
+                parsed_line = json.loads(line)
+                timestamp = isodate.parse_datetime(parsed_line.get('timestamp'))
+                if not timestamp.tzinfo:
+                    timestamp = pytz.utc.localize(timestamp)
+            except ValueError:
+                timestamp = pytz.utc.localize(datetime.datetime.min)
+            aggregated_logs.append({'raw_line': line, 'sort_key': timestamp})
+    aggregated_logs.sort(key=lambda log_line: log_line['sort_key'])
+    return [logs.prettify_log_line(line['raw_line'], filter_args['levels']) for line in aggregated_logs]
+
+
+def record_pipeline(lines, args):
+    stream_info = logs.ScribeLogReader.COMPONENT_STREAM_INFO['default' if args.stream == 'paasta' else 'marathon']
+    filter_args = make_filter_args(args)
+    records = logs.filter_log_records(
+        lines, filter_args['levels'], SERVICE, filter_args['components'], filter_args['clusters'], None,
+        filter_fn=stream_info.filter_fn,
+        parse_fn=stream_info.parse_fn,
+        prefilter_fn=stream_info.prefilter_fn,
+    )
+    return [
+        logs.prettify_log_record(record, filter_args['levels'])
+        for record in logs.merge_sorted_log_streams([records])
+    ]
+
+
+def measure(pipeline, fixture, args):
+    best = float('inf')
+    for _ in range(args.rounds):
+        fixture.seek(0)
+        start = time.perf_counter()
+        pipeline(fixture, args)
+        best = min(best, time.perf_counter() - start)
+
+    fixture.seek(0)
+    tracemalloc.start()
+    output = pipeline(fixture, args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, output
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryFile() as fixture:
+        write_fixture(fixture, args)
+
+        results = []
+        for name, pipeline in (('triple parse', triple_parse_pipeline), ('log records', record_pipeline)):
+            seconds, peak, output = measure(pipeline, fixture, args)
+            results.append(output)
+            paasta_print(
+                "%-12s best of %d: %10.2fms  %10.0f lines/s  peak memory: %10.1fKiB  %d lines shown" % (
+                    name, args.rounds, seconds * 1000, args.lines / seconds, peak / 1024, len(output),
+                ),
+            )
+    if results[0] != results[1]:
+        paasta_print("The pipelines disagree!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3.6
+"""Replays a batch of synthetic mesos offers through NativeScheduler.launch_tasks_for_offers, to see how
+offer packing scales with the number of instances a service wants and the number of ports in each offer.
+
+Nothing talks to mesos or zookeeper: the driver is a mock, tasks are kept in a DictTaskStore, and the service's
+docker registry comes from a temporary soa_dir.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import mock
+from addict import Dict
+
+from paasta_tools.frameworks.native_scheduler import NativeScheduler
+from paasta_tools.frameworks.native_service_config import NativeServiceConfig
+from paasta_tools.frameworks.task_store import DictTaskStore
+from paasta_tools.utils import paasta_print
+from paasta_tools.utils import SystemPaastaConfig
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--offers', type=int, default=100, help="How many offers to replay in each round")
+    parser.add_argument('--instances', type=int, default=1000, help="How many instances the service wants")
+    parser.add_argument('--ports', type=int, default=10000, help="How many ports each offer has")
+    parser.add_argument(
+        '--port-ranges', type=int, default=4,
+        help="How many ranges the ports of each offer are split into",
+    )
+    parser.add_argument(
+        '--max-per-host', type=int, default=0,
+        help="Add a [hostname, MAX_PER, n] constraint to the service. Defaults to no constraints.",
+    )
+    parser.add_argument('--rounds', type=int, default=5, help="How many times to replay the offers")
+    return parser.parse_args()
+
+
+def make_offer(index, ports, port_ranges):
+    range_size = max(ports // port_ranges, 1)
+    return Dict(
+        id=Dict(value='offer-%d' % index),
+        agent_id=Dict(value='agent-%d' % index),
+        resources=[
+            Dict(name='cpus', scalar=Dict(value=100000)),
+            Dict(name='mem', scalar=Dict(value=100000000)),
+            Dict(
+                name='ports',
+                ranges=Dict(range=[
+                    Dict(begin=31000 + i * 2 * range_size, end=31000 + i * 2 * range_size + range_size - 1)
+                    for i in range(port_ranges)
+                ]),
+            ),
+        ],
+        attributes=[
+            Dict(name='pool', text=Dict(value='default')),
+            Dict(name='hostname', text=Dict(value='host-%d' % index)),
+        ],
+    )
+
+
+def make_scheduler(soa_dir, instances, max_per_host):
+    config_dict = {'cpus': 0.1, 'mem': 50, 'instances': instances, 'cmd': 'sleep 50', 'drain_method': 'noop'}
+    if max_per_host:
+        config_dict['constraints'] = [['hostname', 'MAX_PER', str(max_per_host)]]
+    service_config = NativeServiceConfig(
+        service='benchmark',
+        instance='main',
+        cluster='benchmark',
+        config_dict=config_dict,
+        branch_dict={'docker_image': 'busybox', 'desired_state': 'start', 'force_bounce': '0'},
+        soa_dir=soa_dir,
+    )
+    scheduler = NativeScheduler(
+        service_name='benchmark',
+        instance_name='main',
+        cluster='benchmark',
+        system_paasta_config=SystemPaastaConfig({'volumes': [], 'dockercfg_location': '/foo/bar'}, '/fake'),
+        staging_timeout=60,
+        soa_dir=soa_dir,
+        service_config=service_config,
+        task_store_type=DictTaskStore,
+    )
+    scheduler.registered(driver=mock.Mock(), frameworkId={'value': 'benchmark'}, masterInfo=mock.Mock())
+    return scheduler
+
+
+def measure(soa_dir, offers, args):
+    best = float('inf')
+    for _ in range(args.rounds):
+        scheduler = make_scheduler(soa_dir, args.instances, args.max_per_host)
+        start = time.perf_counter()
+        scheduler.launch_tasks_for_offers(mock.Mock(), offers)
+        best = min(best, time.perf_counter() - start)
+
+    scheduler = make_scheduler(soa_dir, args.instances, args.max_per_host)
+    tracemalloc.start()
+    launched = scheduler.launch_tasks_for_offers(mock.Mock(), offers)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, len(launched)
+
+
+def main():
+    args = parse_args()
+    offers = [make_offer(i, args.ports, args.port_ranges) for i in range(args.offers)]
+    with tempfile.TemporaryDirectory() as soa_dir:
+        os.mkdir(os.path.join(soa_dir, 'benchmark'))
+        with open(os.path.join(soa_dir, 'benchmark', 'service.yaml'), 'w') as f:
+            f.write('docker_registry: fake\n')
+        seconds, peak, count = measure(soa_dir, offers, args)
+    paasta_print(
+        "%d offers, %d tasks launched  best of %d: %8.2fms  peak memory: %8.1fKiB" % (
+            len(offers), count, args.rounds, seconds * 1000, peak / 1024,
+        ),
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3.6
+"""Compares computing per-group resource utilization from a synthetic mesos state by filtering the tasks once per
+group (how metastatus_lib used to do it) against metastatus_lib.calculate_resource_utilization_for_slave_groupings,
+which walks the tasks once.
+
+The state has --agents agents spread over --groups values of a 'pool' attribute, and --tasks tasks spread
+over the agents, a few of which are terminal.
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from paasta_tools.mesos_tools import get_all_tasks_from_state
+from paasta_tools.mesos_tools import is_task_terminal
+from paasta_tools.metrics import metastatus_lib
+from paasta_tools.utils import paasta_print
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--agents', type=int, default=5000, help="How many agents the state has")
+    parser.add_argument('--tasks', type=int, default=100000, help="How many tasks the state has")
+    parser.add_argument('--groups', type=int, default=10, help="How many pools the agents are spread over")
+    parser.add_argument('--rounds', type=int, default=5, help="How many times to run each calculation")
+    return parser.parse_args()
+
+
+def make_state(agents, tasks, groups):
+    random.seed(0)
+    slaves = [
+        {
+            'id': 'agent-%d' % i,
+            'hostname': 'host-%d' % i,
+            'attributes': {'pool': 'pool-%d' % (i % groups)},
+            'resources': {'cpus': 32.0, 'mem': 131072.0, 'disk': 1048576.0, 'gpus': 0, 'ports': '[31000-32000]'},
+            'reserved_resources': {'maintenance': {'cpus': 32.0, 'mem': 131072.0, 'disk': 1048576.0}}
+            if i % 100 == 0 else {},
+        }
+        for i in range(agents)
+    ]
+    frameworks = [{'tasks': []} for _ in range(10)]
+    for i in range(tasks):
+        frameworks[i % len(frameworks)]['tasks'].append({
+            'state': 'TASK_FINISHED' if i % 50 == 0 else 'TASK_RUNNING',
+            'slave_id': 'agent-%d' % random.randrange(agents),
+            'resources': {'cpus': 0.25, 'mem': 1024.0, 'disk': 512.0, 'ports': '[31000-31000]'},
+        })
+    return {'slaves': slaves, 'frameworks': frameworks}
+
+
+def filter_tasks_for_slaves(slaves, tasks):
+    slave_ids = [slave['id'] for slave in slaves]
+    return [task for task in tasks if task['slave_id'] in slave_ids]
+
+
+def per_group_utilization(slave_groupings, tasks):
+    non_terminal_tasks = [task for task in tasks if not is_task_terminal(task)]
+    return {
+        attribute_value: metastatus_lib.calculate_resource_utilization_for_slaves(
+            slaves=slaves,
+            tasks=filter_tasks_for_slaves(slaves, non_terminal_tasks),
+        )
+        for attribute_value, slaves in slave_groupings.items()
+    }
+
+
+def single_pass_utilization(slave_groupings, tasks):
+    return metastatus_lib.calculate_resource_utilization_for_slave_groupings(slave_groupings, tasks)
+
+
+def measure(calculate, slave_groupings, tasks, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        calculate(slave_groupings, tasks)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    utilization = calculate(slave_groupings, tasks)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, utilization
+
+
+def main():
+    args = parse_args()
+    state = make_state(args.agents, args.tasks, args.groups)
+    tasks = get_all_tasks_from_state(state, include_orphans=True)
+    slave_groupings = metastatus_lib.group_slaves_by_key_func(
+        metastatus_lib.key_func_for_attribute('pool'), state['slaves'],
+    )
+    paasta_print("%d agents in %d groups, %d tasks" % (len(state['slaves']), len(slave_groupings), len(tasks)))
+
+    results = []
+    for name, calculate in (('per group', per_group_utilization), ('single pass', single_pass_utilization)):
+        seconds, peak, utilization = measure(calculate, slave_groupings, tasks, args.rounds)
+        results.append(utilization)
+        paasta_print(
+            "%-12s best of %d: %10.2fms  peak memory: %8.1fKiB" % (name, args.rounds, seconds * 1000, peak / 1024),
+        )
+    if results[0] != results[1]:
+        paasta_print("The calculations disagree!")
+
+
+if __name__ == '__main__':
+    main()
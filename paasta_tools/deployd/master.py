@@ -1,5 +1,7 @@
 #!/usr/bin/env python
+import heapq
 import inspect
+import itertools
 import logging
 import logging.handlers
 import socket
@@ -18,9 +20,12 @@ from paasta_tools.deployd.common import rate_limit_instances
 from paasta_tools.deployd.common import ServiceInstance
 from paasta_tools.deployd.leader import PaastaLeaderElection
 from paasta_tools.deployd.metrics import QueueMetrics
+from paasta_tools.deployd.snapshot import MarathonAppSnapshotter
+from paasta_tools.deployd.workers import PaastaDeployProcessWorker
 from paasta_tools.deployd.workers import PaastaDeployWorker
 from paasta_tools.list_marathon_service_instances import get_service_instances_that_need_bouncing
 from paasta_tools.marathon_tools import DEFAULT_SOA_DIR
+from paasta_tools.marathon_tools import enable_formatted_app_dict_cache
 from paasta_tools.metrics.metrics_lib import get_metrics_interface
 from paasta_tools.utils import get_services_for_cluster
 from paasta_tools.utils import load_system_paasta_config
@@ -59,6 +64,12 @@ class DedupedPriorityQueue(PaastaPriorityQueue):
 
 
 class Inbox(PaastaThread):
+    """Holds service instances until their bounce_by time, then hands them to the bounce queue.
+
+    Pending service instances are kept in a heap ordered by bounce_by, so the next one due is always on top. The
+    thread blocks on the inbox queue until either something new arrives or that next one is due.
+    """
+
     def __init__(self, inbox_q, bounce_q):
         super(Inbox, self).__init__()
         self.daemon = True
@@ -66,6 +77,10 @@ class Inbox(PaastaThread):
         self.inbox_q = inbox_q
         self.bounce_q = bounce_q
         self.to_bounce = {}
+        # (bounce_by, counter, service_instance_key, service_instance) for everything in to_bounce. When a service
+        # instance is replaced in to_bounce its old entry is left here, and skipped once it reaches the top.
+        self.to_bounce_heap = []
+        self.counter = itertools.count()
 
     def run(self):
         while True:
@@ -73,7 +88,7 @@ class Inbox(PaastaThread):
 
     def process_inbox(self):
         try:
-            service_instance = self.inbox_q.get(block=False)
+            service_instance = self.inbox_q.get(timeout=self.time_until_next_bounce())
         except Empty:
             service_instance = None
         if service_instance:
@@ -83,15 +98,24 @@ class Inbox(PaastaThread):
                                service_instance.instance,
                            ))
             self.process_service_instance(service_instance)
-        if self.inbox_q.empty() and self.to_bounce:
-            self.process_to_bounce()
-        time.sleep(0.1)
+        self.process_to_bounce()
+
+    def time_until_next_bounce(self):
+        """Returns how many seconds until the next service instance is due to be bounced, or None if there are none
+        waiting."""
+        if not self.to_bounce_heap:
+            return None
+        return max(self.to_bounce_heap[0][0] - time.time(), 0)
 
     def process_service_instance(self, service_instance):
         service_instance_key = "{}.{}".format(service_instance.service, service_instance.instance)
         if self.should_add_to_bounce(service_instance, service_instance_key):
             self.log.info("Enqueuing {} to be bounced in the future".format(service_instance))
             self.to_bounce[service_instance_key] = service_instance
+            heapq.heappush(
+                self.to_bounce_heap,
+                (service_instance.bounce_by, next(self.counter), service_instance_key, service_instance),
+            )
 
     def should_add_to_bounce(self, service_instance, service_instance_key):
         if service_instance_key in self.to_bounce:
@@ -101,17 +125,14 @@ class Inbox(PaastaThread):
         return True
 
     def process_to_bounce(self):
-        bounced = []
-        self.log.debug("Processing %d bounce queue entries..." % len(self.to_bounce.keys()))
-        for service_instance_key in self.to_bounce.keys():
-            if self.to_bounce[service_instance_key].bounce_by < int(time.time()):
-                service_instance = self.to_bounce[service_instance_key]
-                bounced.append(service_instance_key)
-                self.bounce_q.put(service_instance.priority, service_instance)
-        for service_instance_key in bounced:
-            self.to_bounce.pop(service_instance_key)
-        # TODO: if the bounceq is empty we could probably start adding SIs from
-        # self.to_bounce to make sure the workers always have something to do.
+        now = time.time()
+        while self.to_bounce_heap and self.to_bounce_heap[0][0] <= now:
+            _, _, service_instance_key, service_instance = heapq.heappop(self.to_bounce_heap)
+            if self.to_bounce.get(service_instance_key) is not service_instance:
+                # This entry was replaced by one with an earlier bounce_by
+                continue
+            del self.to_bounce[service_instance_key]
+            self.bounce_q.put(service_instance.priority, service_instance)
 
 
 class AddHostnameFilter(logging.Filter):
@@ -129,6 +150,7 @@ class DeployDaemon(PaastaThread):
         self.started = False
         self.daemon = True
         service_configuration_lib.disable_yaml_cache()
+        enable_formatted_app_dict_cache()
         self.config = load_system_paasta_config()
         self.setup_logging()
         self.bounce_q = DedupedPriorityQueue("BounceQueue")
@@ -136,6 +158,7 @@ class DeployDaemon(PaastaThread):
         self.control = PaastaQueue("ControlQueue")
         self.inbox = Inbox(self.inbox_q, self.bounce_q)
         self.marathon_clients = get_marathon_clients_from_config()
+        self.app_snapshotter = None
 
     def setup_logging(self):
         root_logger = logging.getLogger()
@@ -177,6 +200,13 @@ class DeployDaemon(PaastaThread):
         self.log.info("This node is elected as leader {}".format(socket.getfqdn()))
         self.metrics = get_metrics_interface('paasta.deployd')
         QueueMetrics(self.inbox, self.bounce_q, self.config.get_cluster(), self.metrics).start()
+        if self.config.get_deployd_marathon_app_snapshot_enabled():
+            self.log.info("Starting the shared marathon app snapshot")
+            self.app_snapshotter = MarathonAppSnapshotter(
+                self.marathon_clients,
+                self.config.get_deployd_marathon_app_snapshot_refresh_interval(),
+            )
+            self.app_snapshotter.start()
         self.inbox.start()
         self.log.info("Starting all watcher threads")
         self.start_watchers()
@@ -220,7 +250,7 @@ class DeployDaemon(PaastaThread):
         for i in range(number_of_dead_workers):
             self.log.error("Detected a dead worker, starting a replacement thread")
             worker_no = len(self.workers) + 1
-            worker = PaastaDeployWorker(worker_no, self.inbox_q, self.bounce_q, self.config, self.metrics)
+            worker = self.create_worker(worker_no)
             worker.start()
             self.workers.append(worker)
 
@@ -230,10 +260,24 @@ class DeployDaemon(PaastaThread):
     def start_workers(self):
         self.workers = []
         for i in range(self.config.get_deployd_number_workers()):
-            worker = PaastaDeployWorker(i, self.inbox_q, self.bounce_q, self.config, self.metrics)
+            worker = self.create_worker(i)
             worker.start()
             self.workers.append(worker)
 
+    def create_worker(self, worker_no):
+        if self.config.get_deployd_use_worker_processes():
+            worker_class = PaastaDeployProcessWorker
+        else:
+            worker_class = PaastaDeployWorker
+        return worker_class(
+            worker_no,
+            self.inbox_q,
+            self.bounce_q,
+            self.config,
+            self.metrics,
+            self.app_snapshotter,
+        )
+
     def add_all_services(self):
         instances = get_services_for_cluster(
             cluster=self.config.get_cluster(),
@@ -0,0 +1,109 @@
+import time
+from collections import namedtuple
+from threading import Condition
+from typing import cast
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from marathon import MarathonClient
+from marathon.models.app import MarathonApp
+
+from paasta_tools.deployd.common import PaastaThread
+from paasta_tools.marathon_tools import get_all_marathon_apps
+from paasta_tools.marathon_tools import MarathonClients
+
+AppsSnapshot = namedtuple('AppsSnapshot', ['fetched_at', 'apps'])
+
+
+def get_client_key(client: MarathonClient) -> Tuple[str, ...]:
+    """Workers each build their own MarathonClient objects, so snapshots are
+    keyed by the servers a client talks to rather than by the client itself"""
+    return tuple(sorted(client.servers))
+
+
+class MarathonAppSnapshotter(PaastaThread):
+    """Keeps one shared snapshot of every marathon app (with embedded tasks)
+    per marathon shard, so that each worker doesn't have to list every app in
+    the cluster for every service instance it bounces.
+
+    Every time a worker finishes with a service instance it marks it as
+    stale, and the next time that instance is processed the worker waits for
+    a snapshot fetched after that point. This way a worker never acts on a
+    view of marathon older than its own last change to that instance.
+    """
+
+    def __init__(self, marathon_clients: MarathonClients, refresh_interval: float) -> None:
+        super(MarathonAppSnapshotter, self).__init__()
+        self.daemon = True
+        self.name = "MarathonAppSnapshotter"
+        self.marathon_clients = marathon_clients
+        self.refresh_interval = refresh_interval
+        self.condition = Condition()
+        self.snapshots: Dict[Tuple[str, ...], AppsSnapshot] = {}
+        self.stale_since: Dict[Tuple[str, str], float] = {}
+
+    def run(self) -> None:
+        self.log.info("{} starting up".format(self.name))
+        while True:
+            self.refresh()
+            time.sleep(self.refresh_interval)
+
+    def refresh(self) -> None:
+        for client in self.marathon_clients.get_all_clients():
+            fetched_at = time.time()
+            try:
+                apps = get_all_marathon_apps(client, embed_tasks=True)
+            except Exception as e:
+                self.log.error("Failed to refresh marathon apps from {}: {}".format(client.servers, e))
+                continue
+            with self.condition:
+                self.snapshots[get_client_key(client)] = AppsSnapshot(fetched_at=fetched_at, apps=apps)
+                self.prune_stale_since()
+                self.condition.notify_all()
+            self.log.debug("Refreshed {} marathon apps from {}".format(len(apps), client.servers))
+
+    def prune_stale_since(self) -> None:
+        """Forget the service instances marked stale before the oldest snapshot we hold was fetched,
+        as every snapshot is already fresh enough for them. Must be called with self.condition held."""
+        oldest_fetched_at = min(snapshot.fetched_at for snapshot in self.snapshots.values())
+        self.stale_since = {
+            service_instance: marked_at
+            for service_instance, marked_at in self.stale_since.items()
+            if marked_at >= oldest_fetched_at
+        }
+
+    def mark_stale(self, service: str, instance: str) -> None:
+        with self.condition:
+            self.stale_since[(service, instance)] = time.time()
+
+    def get_apps_with_clients(
+        self,
+        service: str,
+        instance: str,
+        clients: Sequence[MarathonClient],
+        timeout: float,
+    ) -> Optional[List[Tuple[MarathonApp, MarathonClient]]]:
+        """Returns the apps of every given client paired with that client,
+        or None if no snapshot fresh enough for this service instance became
+        available within timeout seconds.
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                newer_than = self.stale_since.get((service, instance), 0)
+                snapshots = [self.snapshots.get(get_client_key(client)) for client in clients]
+                if all(snapshot is not None and snapshot.fetched_at > newer_than for snapshot in snapshots):
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+        return [
+            (app, client)
+            for client, snapshot in zip(clients, snapshots)
+            # every snapshot was checked to be there before breaking out of the loop
+            for app in cast(AppsSnapshot, snapshot).apps
+        ]
@@ -1,11 +1,17 @@
+import logging
+import logging.handlers
+import multiprocessing
 import time
 from collections import namedtuple
 
+import service_configuration_lib
+
 from paasta_tools import marathon_tools
 from paasta_tools.deployd.common import BounceTimers
 from paasta_tools.deployd.common import exponential_back_off
 from paasta_tools.deployd.common import PaastaThread
 from paasta_tools.deployd.common import ServiceInstance
+from paasta_tools.deployd.snapshot import get_client_key
 from paasta_tools.setup_marathon_job import deploy_marathon_service
 from paasta_tools.utils import load_system_paasta_config
 
@@ -13,7 +19,7 @@ BounceResults = namedtuple('BounceResults', ['bounce_again_in_seconds', 'return_
 
 
 class PaastaDeployWorker(PaastaThread):
-    def __init__(self, worker_number, inbox_q, bounce_q, config, metrics_provider):
+    def __init__(self, worker_number, inbox_q, bounce_q, config, metrics_provider, app_snapshotter=None):
         super(PaastaDeployWorker, self).__init__()
         self.daemon = True
         self.name = "Worker{}".format(worker_number)
@@ -21,6 +27,7 @@ class PaastaDeployWorker(PaastaThread):
         self.bounce_q = bounce_q
         self.metrics = metrics_provider
         self.config = config
+        self.app_snapshotter = app_snapshotter
         self.cluster = self.config.get_cluster()
         self.setup()
 
@@ -60,6 +67,24 @@ class PaastaDeployWorker(PaastaThread):
             bounce_length=bounce_length_timer,
         )
 
+    def get_marathon_apps_with_clients(self, service_instance):
+        """Returns the marathon apps from the shared snapshot, or None to make
+        deploy_marathon_service fetch them itself"""
+        if self.app_snapshotter is None:
+            return None
+        marathon_apps_with_clients = self.app_snapshotter.get_apps_with_clients(
+            service=service_instance.service,
+            instance=service_instance.instance,
+            clients=self.marathon_clients.get_all_clients(),
+            timeout=self.config.get_deployd_marathon_app_snapshot_refresh_interval() * 2,
+        )
+        if marathon_apps_with_clients is None:
+            self.log.warning("No fresh marathon app snapshot for {}.{}, fetching all apps instead".format(
+                service_instance.service,
+                service_instance.instance,
+            ))
+        return marathon_apps_with_clients
+
     def run(self):
         self.log.info("{} starting up".format(self.name))
         while True:
@@ -92,20 +117,28 @@ class PaastaDeployWorker(PaastaThread):
                     failures=failures,
                 )
                 self.inbox_q.put(service_instance)
-            time.sleep(0.1)
+
+    def deploy_service_instance(self, service_instance, marathon_apps_with_clients):
+        """Runs setup_marathon_job for a service instance and returns its (return_code, bounce_again_in_seconds)"""
+        return deploy_marathon_service(
+            service=service_instance.service,
+            instance=service_instance.instance,
+            clients=self.marathon_clients,
+            soa_dir=marathon_tools.DEFAULT_SOA_DIR,
+            marathon_apps_with_clients=marathon_apps_with_clients,
+        )
 
     def process_service_instance(self, service_instance):
         bounce_timers = self.setup_timers(service_instance)
         self.log.info("{} processing {}.{}".format(self.name, service_instance.service, service_instance.instance))
 
         bounce_timers.setup_marathon.start()
-        return_code, bounce_again_in_seconds = deploy_marathon_service(
-            service=service_instance.service,
-            instance=service_instance.instance,
-            clients=self.marathon_clients,
-            soa_dir=marathon_tools.DEFAULT_SOA_DIR,
-            marathon_apps_with_clients=None,
+        return_code, bounce_again_in_seconds = self.deploy_service_instance(
+            service_instance,
+            self.get_marathon_apps_with_clients(service_instance),
         )
+        if self.app_snapshotter is not None:
+            self.app_snapshotter.mark_stale(service_instance.service, service_instance.instance)
 
         bounce_timers.setup_marathon.stop()
         self.log.info("setup marathon completed with exit code {} for {}.{}".format(
@@ -128,3 +161,133 @@ class PaastaDeployWorker(PaastaThread):
                 service_instance.instance,
             ))
         return BounceResults(bounce_again_in_seconds, return_code, bounce_timers)
+
+
+class DeployProcessError(Exception):
+    """deploy_marathon_service raised an exception in the child process of a PaastaDeployProcessWorker"""
+    pass
+
+
+class DeployProcessDied(Exception):
+    pass
+
+
+class DeployProcessTimedOut(Exception):
+    pass
+
+
+def deploy_process_main(conn, log_queue, log_level):
+    """The main loop of the child process of a PaastaDeployProcessWorker. It receives
+    (service, instance, marathon_apps_by_client_key) jobs over conn, runs
+    deploy_marathon_service for each one and sends back ('ok', (return_code, bounce_again_in_seconds))
+    or ('error', description of the exception). Log records are put on log_queue for the
+    master to hand to its own log handlers."""
+    root_logger = logging.getLogger()
+    root_logger.setLevel(getattr(logging, log_level))
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logging.getLogger("kazoo").setLevel(logging.CRITICAL)
+    service_configuration_lib.disable_yaml_cache()
+    marathon_tools.enable_formatted_app_dict_cache()
+    system_paasta_config = load_system_paasta_config()
+    marathon_clients = marathon_tools.get_marathon_clients(marathon_tools.get_marathon_servers(system_paasta_config))
+    clients_by_key = {get_client_key(client): client for client in marathon_clients.get_all_clients()}
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        service, instance, marathon_apps_by_client_key = job
+        try:
+            if marathon_apps_by_client_key is None:
+                marathon_apps_with_clients = None
+            else:
+                marathon_apps_with_clients = [
+                    (app, clients_by_key[client_key]) for app, client_key in marathon_apps_by_client_key
+                ]
+            result = deploy_marathon_service(
+                service=service,
+                instance=instance,
+                clients=marathon_clients,
+                soa_dir=marathon_tools.DEFAULT_SOA_DIR,
+                marathon_apps_with_clients=marathon_apps_with_clients,
+            )
+        except Exception as e:
+            conn.send(('error', repr(e)))
+        else:
+            conn.send(('ok', result))
+
+
+class PaastaDeployProcessWorker(PaastaDeployWorker):
+    """A worker that runs each deploy in a child process of its own, so that the
+    CPU-heavy parts of a bounce aren't serialized on the GIL with every other worker.
+
+    Only deploy_service_instance crosses the process boundary. Queues, timers, metrics,
+    retries and the marathon app snapshot all stay in this thread in the master process,
+    and the child's log records are handled by the master's log handlers."""
+
+    def setup(self):
+        super(PaastaDeployProcessWorker, self).setup()
+        self.start_process()
+
+    def start_process(self):
+        # fork()ing a process that runs as many threads as deployd is asking for deadlocks, so spawn a fresh one
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.log_queue = context.Queue()
+        self.log_listener = logging.handlers.QueueListener(
+            self.log_queue,
+            *logging.getLogger().handlers,
+            respect_handler_level=True,
+        )
+        self.log_listener.start()
+        self.process = context.Process(
+            target=deploy_process_main,
+            args=(child_conn, self.log_queue, self.config.get_deployd_log_level()),
+            name="{}Process".format(self.name),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def restart_process(self):
+        self.process.terminate()
+        self.process.join(timeout=1)
+        self.log_listener.stop()
+        self.start_process()
+
+    def deploy_service_instance(self, service_instance, marathon_apps_with_clients):
+        if marathon_apps_with_clients is None:
+            marathon_apps_by_client_key = None
+        else:
+            # deploy_marathon_service only looks at the apps of this service instance, so don't pickle the rest
+            marathon_apps_by_client_key = [
+                (app, get_client_key(client)) for app, client in marathon_tools.get_matching_apps_with_clients(
+                    service=service_instance.service,
+                    instance=service_instance.instance,
+                    marathon_apps_with_clients=marathon_apps_with_clients,
+                )
+            ]
+        timeout = self.config.get_deployd_worker_process_timeout()
+        try:
+            self.conn.send((service_instance.service, service_instance.instance, marathon_apps_by_client_key))
+            if not self.conn.poll(timeout):
+                self.log.error("{} took more than {} seconds to deploy {}.{}, killing it".format(
+                    self.process.name,
+                    timeout,
+                    service_instance.service,
+                    service_instance.instance,
+                ))
+                self.restart_process()
+                raise DeployProcessTimedOut(timeout)
+            status, result = self.conn.recv()
+        except (EOFError, OSError) as e:
+            self.log.error("{} died while deploying {}.{}, starting a new one".format(
+                self.process.name,
+                service_instance.service,
+                service_instance.instance,
+            ))
+            self.restart_process()
+            raise DeployProcessDied(e)
+        if status == 'error':
+            raise DeployProcessError(result)
+        return result
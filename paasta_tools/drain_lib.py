@@ -11,14 +11,17 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 import re
 import time
 from typing import Any
 from typing import Callable
+from typing import Collection
 from typing import Dict
 from typing import List
 from typing import Optional
 from typing import Set
+from typing import Tuple
 from typing import Type
 from typing import TypeVar
 
@@ -30,6 +33,11 @@ from paasta_tools.utils import get_user_agent
 _drain_methods: Dict[str, Type["DrainMethod"]] = {}
 HACHECK_CONN_TIMEOUT = 3
 HACHECK_READ_TIMEOUT = 1
+HACHECK_CONNECTION_LIMIT = 100
+HACHECK_CONNECTIONS_PER_HOST = 10
+
+# The session each event loop is using for hacheck requests, and how many requests are using it
+_hacheck_sessions: Dict[asyncio.AbstractEventLoop, Tuple[aiohttp.ClientSession, int]] = {}
 
 
 _RegisterDrainMethod_T = TypeVar('_RegisterDrainMethod_T', bound=Type["DrainMethod"])
@@ -72,6 +80,9 @@ class DrainMethod(object):
                           process, because a bounce may take multiple runs of setup_marathon_job to complete.
      - is_safe_to_kill(task): Return True if this task is safe to kill, False otherwise.
 
+    A drain method may also implement prefetch(tasks) to look up the state of many tasks at once, before
+    is_draining and is_safe_to_kill are called for each of them.
+
     When implementing a drain method, be sure to decorate with @register_drain_method(name).
     """
 
@@ -96,6 +107,10 @@ class DrainMethod(object):
         """Return True if a task is drained and ready to be killed, or False if we should wait."""
         raise NotImplementedError()
 
+    async def prefetch(self, tasks: Collection[DrainTask]) -> None:
+        """Look up whatever is_draining and is_safe_to_kill need to know about all of tasks at once."""
+        pass
+
 
 @register_drain_method('noop')
 class NoopDrainMethod(DrainMethod):
@@ -166,10 +181,43 @@ SpoolInfo = TypedDict(
 )
 
 
+class SharedHacheckSession(object):
+    """Async context manager for the session shared by every hacheck request in flight on the current event loop, so
+    concurrent requests (e.g. a prefetch or a batch of drains) reuse connections to the same hacheck instead of each
+    opening a new session. The session is closed as soon as the last request using it finishes, so no session
+    outlives the event loop it was made for."""
+
+    async def __aenter__(self) -> aiohttp.ClientSession:
+        self.loop = asyncio.get_event_loop()
+        session, users = _hacheck_sessions.get(self.loop, (None, 0))
+        if session is None:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=HACHECK_CONNECTION_LIMIT,
+                    limit_per_host=HACHECK_CONNECTIONS_PER_HOST,
+                ),
+                conn_timeout=HACHECK_CONN_TIMEOUT,
+                read_timeout=HACHECK_READ_TIMEOUT,
+            )
+        _hacheck_sessions[self.loop] = (session, users + 1)
+        return session
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        session, users = _hacheck_sessions[self.loop]
+        if users > 1:
+            _hacheck_sessions[self.loop] = (session, users - 1)
+        else:
+            del _hacheck_sessions[self.loop]
+            await session.close()
+
+
 @register_drain_method('hacheck')
 class HacheckDrainMethod(DrainMethod):
     """This drain policy issues a POST to hacheck's /spool/{service}/{port}/status endpoint to cause healthchecks to
-    fail. It considers tasks safe to kill if they've been down in hacheck for more than a specified delay."""
+    fail. It considers tasks safe to kill if they've been down in hacheck for more than a specified delay.
+
+    A drain method only lives as long as one bounce, so the spool of each task is only fetched once per bounce, unless
+    the bounce itself changes it."""
 
     def __init__(
         self,
@@ -185,6 +233,7 @@ class HacheckDrainMethod(DrainMethod):
         self.delay = float(delay)
         self.hacheck_port = hacheck_port
         self.expiration = float(expiration) or float(delay) * 10
+        self.spools: Dict[str, asyncio.Future] = {}
 
     def spool_url(self, task: DrainTask) -> str:
         if task.ports == []:
@@ -207,16 +256,13 @@ class HacheckDrainMethod(DrainMethod):
                     'expiration': str(time.time() + self.expiration),
                     'reason': 'Drained by Paasta',
                 })
-            async with aiohttp.ClientSession(
-                conn_timeout=HACHECK_CONN_TIMEOUT,
-                read_timeout=HACHECK_READ_TIMEOUT,
-            ) as session:
-                async with session.post(
-                    self.spool_url(task),
-                    data=data,
-                    headers={'User-Agent': get_user_agent()},
-                ) as resp:
-                    resp.raise_for_status()
+            self.spools.pop(spool_url, None)
+            async with SharedHacheckSession() as session, session.post(
+                spool_url,
+                data=data,
+                headers={'User-Agent': get_user_agent()},
+            ) as resp:
+                resp.raise_for_status()
 
     async def get_spool(self, task: DrainTask) -> SpoolInfo:
         """Query hacheck for the state of a task, and parse the result into a dictionary."""
@@ -224,15 +270,22 @@ class HacheckDrainMethod(DrainMethod):
         if spool_url is None:
             return None
 
-        # TODO: aiohttp says not to create a session per request. Fix this.
-        async with aiohttp.ClientSession(
-            conn_timeout=HACHECK_CONN_TIMEOUT,
-            read_timeout=HACHECK_READ_TIMEOUT,
-        ) as session:
-            response = await session.get(
-                self.spool_url(task),
-                headers={'User-Agent': get_user_agent()},
-            )
+        if spool_url not in self.spools:
+            self.spools[spool_url] = asyncio.ensure_future(self.fetch_spool(spool_url))
+        spool = self.spools[spool_url]
+        try:
+            return await spool
+        except Exception:
+            # Don't remember failures, so that the next call for this task tries again
+            if self.spools.get(spool_url) is spool:
+                del self.spools[spool_url]
+            raise
+
+    async def fetch_spool(self, spool_url: str) -> SpoolInfo:
+        async with SharedHacheckSession() as session, session.get(
+            spool_url,
+            headers={'User-Agent': get_user_agent()},
+        ) as response:
             if response.status == 200:
                 return {
                     'state': 'up',
@@ -262,6 +315,12 @@ class HacheckDrainMethod(DrainMethod):
                 info['reason'] = groupdict['reason']
             return info
 
+    async def prefetch(self, tasks: Collection[DrainTask]) -> None:
+        """Fetch the spools of all of tasks concurrently. Failures are ignored here, and will be retried when
+        is_draining or is_safe_to_kill asks for that task."""
+        if tasks:
+            await asyncio.gather(*[self.get_spool(task) for task in tasks], return_exceptions=True)
+
     async def drain(self, task: DrainTask) -> None:
         return await self.post_spool(task, 'down')
 
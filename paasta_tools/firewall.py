@@ -7,11 +7,14 @@ import json
 import logging
 import os.path
 import re
+import threading
+import time
 from contextlib import contextmanager
 
 from paasta_tools import iptables
 from paasta_tools.cli.utils import get_instance_config
 from paasta_tools.marathon_tools import get_all_namespaces_for_service
+from paasta_tools.utils import get_docker_client
 from paasta_tools.utils import get_running_mesos_docker_containers
 from paasta_tools.utils import load_system_paasta_config
 from paasta_tools.utils import NoConfigurationForServiceError
@@ -28,6 +31,7 @@ PRIVATE_IP_RANGES = (
 DEFAULT_SYNAPSE_SERVICE_DIR = '/var/run/synapse/services'
 DEFAULT_FIREWALL_FLOCK_PATH = '/var/lib/paasta/firewall.flock'
 DEFAULT_FIREWALL_FLOCK_TIMEOUT_SECS = 5
+DEFAULT_CONTAINER_RESYNC_SECS = 60
 
 RESOLV_CONF = '/etc/resolv.conf'
 # not exactly correct, but sufficient to filter out ipv6 or other weird things
@@ -91,10 +95,6 @@ class ServiceGroup(collections.namedtuple(
         rules.extend(_cidr_rules(conf))
         return tuple(rules)
 
-    def update_rules(self, soa_dir, synapse_service_dir):
-        iptables.ensure_chain(self.chain_name, self.get_rules(soa_dir, synapse_service_dir))
-        iptables.reorder_chain(self.chain_name)
-
     @property
     def log_prefix(self):
         # log-prefix is limited to 29 characters total
@@ -332,25 +332,136 @@ def _cidr_rules(conf):
                 )
 
 
-def services_running_here():
-    """Generator helper that yields (service, instance, mac address) of both
-    marathon and chronos tasks.
+def _container_service_instance_mac_ip(container):
+    """Return (service, instance, mac address, ip) of a container as listed by
+    docker, or None if it isn't a PaaSTA container on the bridge network."""
+    if container['HostConfig']['NetworkMode'] != 'bridge':
+        return None
+
+    service = container['Labels'].get('paasta_service')
+    instance = container['Labels'].get('paasta_instance')
+
+    if service is None or instance is None:
+        return None
+
+    network_info = container['NetworkSettings']['Networks']['bridge']
+
+    mac = network_info['MacAddress']
+    ip = network_info['IPAddress']
+    return service, instance, mac, ip
+
+
+class ContainerIndex:
+    """The PaaSTA containers running on this host, indexed by IP address.
+
+    Until watch() is called, every lookup lists the running containers from
+    docker again, so that one-off commands always see the current state. Once
+    watching, the index is kept current from the docker events stream and
+    only fully resynced every resync_secs, so a lookup is a dict lookup.
     """
-    for container in get_running_mesos_docker_containers():
-        if container['HostConfig']['NetworkMode'] != 'bridge':
-            continue
 
-        service = container['Labels'].get('paasta_service')
-        instance = container['Labels'].get('paasta_instance')
+    def __init__(self, resync_secs=DEFAULT_CONTAINER_RESYNC_SECS):
+        self.resync_secs = resync_secs
+        self.watching = False
+        self.last_resync = 0.0
+        self.lock = threading.Lock()
+        # container id => (service, instance, mac, ip)
+        self.containers = {}
+        # ip => (service, instance)
+        self.by_ip = {}
+
+    def _set_containers(self, containers):
+        # Readers don't take the lock, so the dicts are replaced rather than changed.
+        self.by_ip = {ip: (service, instance) for service, instance, mac, ip in containers.values()}
+        self.containers = containers
+
+    def resync(self):
+        """Relist every running container from docker."""
+        with self.lock:
+            containers = {}
+            for container in get_running_mesos_docker_containers():
+                service_instance_mac_ip = _container_service_instance_mac_ip(container)
+                if service_instance_mac_ip is not None:
+                    containers[container['Id']] = service_instance_mac_ip
+            self._set_containers(containers)
+            self.last_resync = time.time()
+
+    def _maybe_resync(self):
+        if not self.watching or self.last_resync + self.resync_secs < time.time():
+            self.resync()
+
+    def services_running_here(self):
+        """Return a list of (service, instance, mac address, ip) of the containers."""
+        self._maybe_resync()
+        return list(self.containers.values())
+
+    def lookup_ip(self, ip):
+        """Return (service, instance) of the container with this ip, or (None, None)."""
+        self._maybe_resync()
+        return self.by_ip.get(ip, (None, None))
+
+    def handle_event(self, client, event):
+        """Update the index for a docker event."""
+        status, container_id = event.get('status'), event.get('id')
+        if status == 'start':
+            for container in client.containers(filters={'id': container_id}):
+                service_instance_mac_ip = _container_service_instance_mac_ip(container)
+                if service_instance_mac_ip is not None and 'mesos-' in container['Names'][0]:
+                    with self.lock:
+                        containers = dict(self.containers)
+                        containers[container['Id']] = service_instance_mac_ip
+                        self._set_containers(containers)
+        elif status in ('die', 'destroy'):
+            with self.lock:
+                if container_id in self.containers:
+                    containers = dict(self.containers)
+                    del containers[container_id]
+                    self._set_containers(containers)
+
+    def _watch_events(self):
+        while True:
+            try:
+                client = get_docker_client()
+                since = int(time.time())
+                self.resync()
+                for event in client.events(since=since, decode=True):
+                    self.handle_event(client, event)
+            except Exception:
+                log.exception('Error watching docker events, resyncing')
+                time.sleep(1)
+
+    def watch(self):
+        """Start keeping the index current from docker events in a daemon thread."""
+        if self.watching:
+            return
+        self.resync()
+        self.watching = True
+        thread = threading.Thread(target=self._watch_events, name='ContainerIndex')
+        thread.daemon = True
+        thread.start()
+
+
+_container_index = ContainerIndex()
+
+
+def watch_running_containers():
+    """Keep the running containers this process looks up current from docker
+    events, instead of listing them from docker for every lookup. Must be
+    called after forking."""
+    _container_index.watch()
 
-        if service is None or instance is None:
-            continue
 
-        network_info = container['NetworkSettings']['Networks']['bridge']
+def services_running_here():
+    """Generator helper that yields (service, instance, mac address, ip) of both
+    marathon and chronos tasks.
+    """
+    yield from _container_index.services_running_here()
+
 
-        mac = network_info['MacAddress']
-        ip = network_info['IPAddress']
-        yield service, instance, mac, ip
+def lookup_service_instance_by_ip(ip):
+    """Return (service, instance) of the container running here with this ip,
+    or (None, None)."""
+    return _container_index.lookup_ip(ip)
 
 
 def active_service_groups():
@@ -374,99 +485,104 @@ def _dns_servers():
                 yield parts[1]
 
 
-def ensure_shared_chains():
-    _ensure_dns_chain()
-    _ensure_internet_chain()
-    _ensure_common_chain()
+def shared_chains():
+    """Return the chains shared by all services, as {chain name: rules}."""
+    return {
+        'PAASTA-DNS': _dns_chain_rules(),
+        'PAASTA-INTERNET': _internet_chain_rules(),
+        'PAASTA-COMMON': _common_chain_rules(),
+    }
 
 
-def _ensure_common_chain():
+def _common_chain_rules():
     """The common chain allows access for all services to certain resources."""
-    iptables.ensure_chain(
-        'PAASTA-COMMON',
+    return (
+        # Allow return traffic for incoming connections
+        iptables.Rule(
+            protocol='ip',
+            src='0.0.0.0/0.0.0.0',
+            dst='0.0.0.0/0.0.0.0',
+            target='ACCEPT',
+            matches=(
+                ('conntrack', (('ctstate', ('ESTABLISHED',)),)),
+            ),
+            target_parameters=(),
+        ),
+        _yocalhost_rule(1463, 'scribed'),
+        _yocalhost_rule(8125, 'metrics-relay', protocol='udp'),
+        _yocalhost_rule(3030, 'sensu'),
+        iptables.Rule(
+            protocol='ip',
+            src='0.0.0.0/0.0.0.0',
+            dst='0.0.0.0/0.0.0.0',
+            target='PAASTA-DNS',
+            matches=(),
+            target_parameters=(),
+        ),
+    )
+
+
+def _dns_chain_rules():
+    return tuple(itertools.chain.from_iterable(
         (
-            # Allow return traffic for incoming connections
             iptables.Rule(
-                protocol='ip',
+                protocol='udp',
                 src='0.0.0.0/0.0.0.0',
-                dst='0.0.0.0/0.0.0.0',
+                dst='{}/255.255.255.255'.format(dns_server),
                 target='ACCEPT',
                 matches=(
-                    ('conntrack', (('ctstate', ('ESTABLISHED',)),)),
+                    ('udp', (('dport', ('53',)),)),
                 ),
                 target_parameters=(),
             ),
-            _yocalhost_rule(1463, 'scribed'),
-            _yocalhost_rule(8125, 'metrics-relay', protocol='udp'),
-            _yocalhost_rule(3030, 'sensu'),
+            # DNS goes over TCP sometimes, too!
             iptables.Rule(
-                protocol='ip',
+                protocol='tcp',
                 src='0.0.0.0/0.0.0.0',
-                dst='0.0.0.0/0.0.0.0',
-                target='PAASTA-DNS',
-                matches=(),
+                dst='{}/255.255.255.255'.format(dns_server),
+                target='ACCEPT',
+                matches=(
+                    ('tcp', (('dport', ('53',)),)),
+                ),
                 target_parameters=(),
             ),
-        ),
-    )
+        )
+        for dns_server in _dns_servers()
+    ))
 
 
-def _ensure_dns_chain():
-    iptables.ensure_chain(
-        'PAASTA-DNS',
-        tuple(itertools.chain.from_iterable(
-            (
-                iptables.Rule(
-                    protocol='udp',
-                    src='0.0.0.0/0.0.0.0',
-                    dst='{}/255.255.255.255'.format(dns_server),
-                    target='ACCEPT',
-                    matches=(
-                        ('udp', (('dport', ('53',)),)),
-                    ),
-                    target_parameters=(),
-                ),
-                # DNS goes over TCP sometimes, too!
-                iptables.Rule(
-                    protocol='tcp',
-                    src='0.0.0.0/0.0.0.0',
-                    dst='{}/255.255.255.255'.format(dns_server),
-                    target='ACCEPT',
-                    matches=(
-                        ('tcp', (('dport', ('53',)),)),
-                    ),
-                    target_parameters=(),
-                ),
-            )
-            for dns_server in _dns_servers()
-        )),
+def _internet_chain_rules():
+    return (
+        iptables.Rule(
+            protocol='ip',
+            src='0.0.0.0/0.0.0.0',
+            dst='0.0.0.0/0.0.0.0',
+            target='ACCEPT',
+            matches=(),
+            target_parameters=(),
+        ),
+    ) + tuple(
+        iptables.Rule(
+            protocol='ip',
+            src='0.0.0.0/0.0.0.0',
+            dst=ip_range,
+            target='RETURN',
+            matches=(),
+            target_parameters=(),
+        )
+        for ip_range in PRIVATE_IP_RANGES
     )
 
 
-def _ensure_internet_chain():
-    iptables.ensure_chain(
-        'PAASTA-INTERNET',
-        (
-            iptables.Rule(
-                protocol='ip',
-                src='0.0.0.0/0.0.0.0',
-                dst='0.0.0.0/0.0.0.0',
-                target='ACCEPT',
-                matches=(),
-                target_parameters=(),
-            ),
-        ) + tuple(
-            iptables.Rule(
-                protocol='ip',
-                src='0.0.0.0/0.0.0.0',
-                dst=ip_range,
-                target='RETURN',
-                matches=(),
-                target_parameters=(),
-            )
-            for ip_range in PRIVATE_IP_RANGES
-        ),
-    )
+def service_chains(service_groups, soa_dir, synapse_service_dir):
+    """Return the rules of each service chain, as {chain name: rules}.
+
+    service_groups is an iterable of ServiceGroups.
+    """
+    return {
+        service.chain_name: service.get_rules(soa_dir, synapse_service_dir)
+        for service in service_groups
+    }
 
 
 def ensure_service_chains(service_groups, soa_dir, synapse_service_dir):
@@ -476,11 +592,8 @@ def ensure_service_chains(service_groups, soa_dir, synapse_service_dir):
 
     Returns dictionary {[service chain] => [list of mac addresses]}.
     """
-    chains = {}
-    for service, macs in service_groups.items():
-        service.update_rules(soa_dir, synapse_service_dir)
-        chains[service.chain_name] = macs
-    return chains
+    iptables.ensure_chains(service_chains(service_groups, soa_dir, synapse_service_dir))
+    return {service.chain_name: macs for service, macs in service_groups.items()}
 
 
 def dispatch_rule(chain, mac):
@@ -496,16 +609,31 @@ def dispatch_rule(chain, mac):
     )
 
 
-def ensure_dispatch_chains(service_chains):
-    paasta_rules = set(itertools.chain.from_iterable(
+def dispatch_chain_rules(service_chains):
+    """Return the rules of the PAASTA chain, which sends traffic from each
+    MAC address to its service chain.
+
+    service_chains is a dict {[service chain] => [list of mac addresses]}.
+    """
+    return set(itertools.chain.from_iterable(
         (
             dispatch_rule(chain, mac)
             for mac in macs
         )
         for chain, macs in service_chains.items()
-
     ))
-    iptables.ensure_chain('PAASTA', paasta_rules)
+
+
+def general_update(soa_dir, synapse_service_dir):
+    """Update iptables to match the current PaaSTA state.
+
+    The whole filter table is diffed against the desired state and updated in
+    a single commit, no matter how many containers are running here.
+    """
+    service_groups = active_service_groups()
+    chains = shared_chains()
+    chains.update(service_chains(service_groups, soa_dir, synapse_service_dir))
+    chains['PAASTA'] = dispatch_chain_rules({service.chain_name: macs for service, macs in service_groups.items()})
 
     jump_to_paasta = iptables.Rule(
         protocol='ip',
@@ -515,35 +643,24 @@ def ensure_dispatch_chains(service_chains):
         matches=(),
         target_parameters=(),
     )
-    iptables.ensure_rule('INPUT', jump_to_paasta)
-    iptables.ensure_rule('FORWARD', jump_to_paasta)
-
-
-def garbage_collect_old_service_chains(desired_chains):
-    current_paasta_chains = {
-        chain
-        for chain in iptables.all_chains()
-        if chain.startswith('PAASTA.')
-    }
-    for chain in current_paasta_chains - set(desired_chains):
-        iptables.delete_chain(chain)
-
-
-def general_update(soa_dir, synapse_service_dir):
-    """Update iptables to match the current PaaSTA state."""
-    ensure_shared_chains()
-    service_chains = ensure_service_chains(active_service_groups(), soa_dir, synapse_service_dir)
-    ensure_dispatch_chains(service_chains)
-    garbage_collect_old_service_chains(service_chains)
+    iptables.ensure_chains(
+        chains,
+        required_rules=(('INPUT', jump_to_paasta), ('FORWARD', jump_to_paasta)),
+        stale_chain_prefix='PAASTA.',
+    )
 
 
 def prepare_new_container(soa_dir, synapse_service_dir, service, instance, mac):
     """Update iptables to include rules for a new (not yet running) MAC address
     """
-    ensure_shared_chains()  # probably already set, but just to be safe
     service_group = ServiceGroup(service, instance)
-    service_group.update_rules(soa_dir, synapse_service_dir)
-    iptables.insert_rule('PAASTA', dispatch_rule(service_group.chain_name, mac))
+    # the shared chains are probably already set, but just to be safe
+    chains = shared_chains()
+    chains.update(service_chains((service_group,), soa_dir, synapse_service_dir))
+    iptables.ensure_chains(
+        chains,
+        required_rules=(('PAASTA', dispatch_rule(service_group.chain_name, mac)),),
+    )
 
 
 @contextmanager
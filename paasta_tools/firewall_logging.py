@@ -8,7 +8,7 @@ import sys
 
 import syslogmp
 
-from paasta_tools.firewall import services_running_here
+from paasta_tools import firewall
 from paasta_tools.utils import _log
 from paasta_tools.utils import configure_log
 from paasta_tools.utils import load_system_paasta_config
@@ -82,11 +82,10 @@ def parse_syslog(data):
 
 
 def lookup_service_instance_by_ip(ip_lookup):
-    for service, instance, mac, ip in services_running_here():
-        if ip == ip_lookup:
-            return (service, instance)
-    log.info('Unable to find container for ip {}'.format(ip_lookup))
-    return (None, None)
+    service, instance = firewall.lookup_service_instance_by_ip(ip_lookup)
+    if service is None:
+        log.info('Unable to find container for ip {}'.format(ip_lookup))
+    return (service, instance)
 
 
 def parse_args(argv=None):
@@ -119,6 +118,8 @@ class MultiUDPServer(socketserver.UDPServer):
 
 
 def run_server(listen_host, listen_port):
+    # every packet looks up its container, so keep them in memory
+    firewall.watch_running_containers()
     server = MultiUDPServer((listen_host, listen_port), SyslogUDPHandler)
     server.serve_forever()
 
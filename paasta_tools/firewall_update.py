@@ -1,8 +1,7 @@
 import argparse
 import logging
-import os.path
+import os
 import time
-from collections import defaultdict
 
 from inotify.adapters import Inotify
 from inotify.constants import IN_MODIFY
@@ -17,6 +16,9 @@ from paasta_tools.utils import TimeoutError
 log = logging.getLogger(__name__)
 
 DEFAULT_UPDATE_SECS = 5
+DEFAULT_DEBOUNCE_SECS = 1
+# don't hold back firewall updates for longer than this during a continuous burst of synapse changes
+MAX_DEBOUNCE_SECS = 10
 
 
 def parse_args(argv):
@@ -46,6 +48,14 @@ def parse_args(argv):
         default=DEFAULT_UPDATE_SECS, type=int,
         help="Poll for new containers every N secs (default %(default)s)",
     )
+    daemon_parser.add_argument(
+        '--debounce-secs', dest="debounce_secs",
+        default=DEFAULT_DEBOUNCE_SECS, type=float,
+        help=(
+            "Wait until synapse files have stopped changing for N secs, then update the firewalls of all "
+            "the changes at once (default %(default)s)"
+        ),
+    )
 
     subparsers.add_parser(
         'cron', description=(
@@ -63,22 +73,39 @@ def setup_logging(verbose):
 
 
 def run_daemon(args):
+    firewall.watch_running_containers()
+    dependency_index = DependencyIndex(soa_dir=args.soa_dir)
+
     # Main loop waiting on inotify file events
     inotify = Inotify(block_duration_s=1)  # event_gen blocks for 1 second
     inotify.add_watch(args.synapse_service_dir.encode(), IN_MOVED_TO | IN_MODIFY)
     services_by_dependencies_time = 0
+    # smartstack namespaces whose synapse files changed since the last update
+    changed_namespaces = set()
+    first_change_time = last_change_time = 0
 
     for event in inotify.event_gen():  # blocks for only up to 1 second at a time
-        if services_by_dependencies_time + args.update_secs < time.time():
-            services_by_dependencies = smartstack_dependencies_of_running_firewalled_services(
-                soa_dir=args.soa_dir,
+        now = time.time()
+        if services_by_dependencies_time + args.update_secs < now:
+            services_by_dependencies = dependency_index.update()
+            services_by_dependencies_time = now
+
+        if event is not None:
+            namespace = process_inotify_event(event)
+            if namespace is not None and namespace in services_by_dependencies:
+                if not changed_namespaces:
+                    first_change_time = now
+                last_change_time = now
+                changed_namespaces.add(namespace)
+
+        if changed_namespaces and (
+            last_change_time + args.debounce_secs <= now or
+            first_change_time + MAX_DEBOUNCE_SECS <= now
+        ):
+            update_firewalls_for_namespaces(
+                changed_namespaces, services_by_dependencies, args.soa_dir, args.synapse_service_dir,
             )
-            services_by_dependencies_time = time.time()
-
-        if event is None:
-            continue
-
-        process_inotify_event(event, services_by_dependencies, args.soa_dir, args.synapse_service_dir)
+            changed_namespaces = set()
 
 
 def run_cron(args):
@@ -86,15 +113,24 @@ def run_cron(args):
         firewall.general_update(args.soa_dir, args.synapse_service_dir)
 
 
-def process_inotify_event(event, services_by_dependencies, soa_dir, synapse_service_dir):
+def process_inotify_event(event):
+    """Return the smartstack namespace whose synapse file an inotify event is
+    about, or None if it isn't about a synapse file."""
     filename = event[3].decode()
     log.debug('process_inotify_event on {}'.format(filename))
 
     service_instance, suffix = os.path.splitext(filename)
     if suffix != '.json':
-        return
+        return None
+    return service_instance
+
 
-    services_to_update = services_by_dependencies.get(service_instance, ())
+def update_firewalls_for_namespaces(namespaces, services_by_dependencies, soa_dir, synapse_service_dir):
+    """Update the chains of every service group depending on any of namespaces,
+    all at once."""
+    services_to_update = set()
+    for namespace in namespaces:
+        services_to_update.update(services_by_dependencies.get(namespace, ()))
     if not services_to_update:
         return
 
@@ -119,27 +155,78 @@ def process_inotify_event(event, services_by_dependencies, soa_dir, synapse_serv
         )
 
 
-def smartstack_dependencies_of_running_firewalled_services(soa_dir=DEFAULT_SOA_DIR):
-    dependencies_to_services = defaultdict(set)
-    for service, instance, _, _ in firewall.services_running_here():
+class DependencyIndex:
+    """Which firewalled service groups running here depend on each smartstack
+    namespace.
+
+    A service group's dependencies are only loaded from soa-configs when it
+    starts running here, or when a file in its service's soa-configs
+    directory changes; update() otherwise just checks what is running.
+    """
+
+    def __init__(self, soa_dir=DEFAULT_SOA_DIR):
+        self.soa_dir = soa_dir
+        self.cluster = None
+        # ServiceGroup => (fingerprint of its service's soa-configs, its smartstack dependencies)
+        self.dependencies = {}
+        # smartstack namespace => set of ServiceGroups
+        self.services_by_dependencies = {}
+
+    def _soa_config_fingerprint(self, service):
+        try:
+            with os.scandir(os.path.join(self.soa_dir, service)) as entries:
+                return tuple(sorted((entry.name, entry.stat().st_mtime) for entry in entries))
+        except OSError:
+            return None
+
+    def _smartstack_dependencies(self, service_group):
         config = get_instance_config(
-            service, instance,
-            load_system_paasta_config().get_cluster(),
+            service_group.service, service_group.instance,
+            self.cluster,
             load_deployments=False,
-            soa_dir=soa_dir,
+            soa_dir=self.soa_dir,
         )
         outbound_firewall = config.get_outbound_firewall()
         if not outbound_firewall:
-            continue
+            return ()
 
         dependencies = config.get_dependencies() or ()
 
-        smartstack_dependencies = [d['smartstack'] for d in dependencies if d.get('smartstack')]
-        for smartstack_dependency in smartstack_dependencies:
-            # TODO: filter down to only services that have no proxy_port
-            dependencies_to_services[smartstack_dependency].add(firewall.ServiceGroup(service, instance))
+        # TODO: filter down to only services that have no proxy_port
+        return tuple(d['smartstack'] for d in dependencies if d.get('smartstack'))
+
+    def update(self):
+        """Bring the index up to date with the containers running here and
+        their soa-configs, and return {smartstack namespace: set of ServiceGroups}."""
+        if self.cluster is None:
+            self.cluster = load_system_paasta_config().get_cluster()
+
+        fingerprints = {}
+        dependencies = {}
+        for service, instance, _, _ in firewall.services_running_here():
+            service_group = firewall.ServiceGroup(service, instance)
+            if service_group in dependencies:
+                continue
+            if service not in fingerprints:
+                fingerprints[service] = self._soa_config_fingerprint(service)
+            cached = self.dependencies.get(service_group)
+            if cached is not None and cached[0] == fingerprints[service]:
+                dependencies[service_group] = cached
+            else:
+                dependencies[service_group] = (fingerprints[service], self._smartstack_dependencies(service_group))
+
+        if dependencies != self.dependencies:
+            services_by_dependencies = {}
+            for service_group, (_, smartstack_dependencies) in dependencies.items():
+                for smartstack_dependency in smartstack_dependencies:
+                    services_by_dependencies.setdefault(smartstack_dependency, set()).add(service_group)
+            self.services_by_dependencies = services_by_dependencies
+            self.dependencies = dependencies
+        return self.services_by_dependencies
+
 
-    return dependencies_to_services
+def smartstack_dependencies_of_running_firewalled_services(soa_dir=DEFAULT_SOA_DIR):
+    return DependencyIndex(soa_dir=soa_dir).update()
 
 
 def main(argv=None):
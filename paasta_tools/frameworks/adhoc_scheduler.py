@@ -14,6 +14,7 @@
 # limitations under the License.
 from typing import Dict
 from typing import List
+from typing import Optional
 from typing import Tuple
 
 from pymesos import MesosSchedulerDriver
@@ -56,18 +57,19 @@ class AdhocScheduler(NativeScheduler):
         driver: MesosSchedulerDriver,
         offer,
         state: ConstraintState,
+        base_task: Optional[TaskInfo]=None,
     ) -> Tuple[List[TaskInfo], ConstraintState]:
         # In dry run satisfy exit-conditions after we got the offer
         if self.dry_run or self.need_to_stop():
             if self.dry_run:
                 tasks, _ = super(AdhocScheduler, self). \
-                    tasks_and_state_for_offer(driver, offer, state)
+                    tasks_and_state_for_offer(driver, offer, state, base_task=base_task)
                 paasta_print("Would have launched: ", tasks)
             driver.stop()
             return [], state
 
         return super(AdhocScheduler, self). \
-            tasks_and_state_for_offer(driver, offer, state)
+            tasks_and_state_for_offer(driver, offer, state, base_task=base_task)
 
     def kill_tasks_if_necessary(self, *args, **kwargs):
         return
@@ -51,6 +51,24 @@ UPDATE_OPS = {
     'UNIQUE': lambda *args: nested_inc('MAX_PER', *args),
 }
 
+# The part of the state each op's UPDATE_OPS lambda counts in
+COUNTER_OPS = {
+    'MAX_PER': 'MAX_PER',
+    'UNIQUE': 'MAX_PER',
+}
+
+
+def copy_constraint_state(state: ConstraintState, constraints) -> ConstraintState:
+    """Returns a copy of state that update_constraint_state can update for
+    constraints without changing state. Only the counters of the constrained
+    attributes are copied; everything else is shared with state."""
+    new_state = dict(state)
+    for (attr, op, val) in constraints:
+        if op in COUNTER_OPS:
+            op_state = new_state[COUNTER_OPS[op]] = dict(new_state.get(COUNTER_OPS[op], {}))
+            op_state[attr] = dict(op_state.get(attr, {}))
+    return new_state
+
 
 def check_offer_constraints(offer, constraints, state):
     """Returns True if all constraints are satisfied by offer's attributes,
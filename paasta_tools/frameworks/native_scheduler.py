@@ -9,6 +9,7 @@ import time
 import uuid
 from typing import Collection
 from typing import Dict
+from typing import Iterable
 from typing import List
 from typing import Mapping
 from typing import Optional
@@ -24,6 +25,7 @@ from paasta_tools import drain_lib
 from paasta_tools import mesos_tools
 from paasta_tools.frameworks.constraints import check_offer_constraints
 from paasta_tools.frameworks.constraints import ConstraintState
+from paasta_tools.frameworks.constraints import copy_constraint_state
 from paasta_tools.frameworks.constraints import update_constraint_state
 from paasta_tools.frameworks.native_service_config import load_paasta_native_job_config
 from paasta_tools.frameworks.native_service_config import NativeServiceConfig
@@ -60,6 +62,65 @@ class ConstraintFailAllTasksError(Exception):
     pass
 
 
+class PortRanges:
+    """The ports in an offer, kept as a list of inclusive [begin, end] ranges
+    (like mesos' ranges), so that random ports can be taken out of them
+    without expanding the ranges into every port they contain."""
+
+    def __init__(self, ranges: Iterable[Tuple[int, int]]) -> None:
+        self.ranges = [[begin, end] for begin, end in ranges if begin <= end]
+        self.count = sum(end - begin + 1 for begin, end in self.ranges)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def take_random_port(self) -> int:
+        """Removes a port chosen uniformly at random from the ranges and returns it"""
+        index = random.randrange(self.count)
+        for i, (begin, end) in enumerate(self.ranges):
+            if index > end - begin:
+                index -= end - begin + 1
+                continue
+            port = begin + index
+            if begin == end:
+                del self.ranges[i]
+            elif port == begin:
+                self.ranges[i][0] = port + 1
+            elif port == end:
+                self.ranges[i][1] = port - 1
+            else:
+                self.ranges[i:i + 1] = [[begin, port - 1], [port + 1, end]]
+            self.count -= 1
+            return port
+        raise IndexError("No ports left")
+
+
+def copy_task_with_port(base_task: TaskInfo, task_id: str, task_port: int) -> TaskInfo:
+    """Returns a copy of base_task with the given task id and host port. Only
+    the dicts and lists on the way to the fields that change are copied; the
+    rest is shared with base_task, so neither should be mutated afterwards."""
+    task = copy.copy(base_task)
+    task['task_id'] = {'value': task_id}
+
+    task['container'] = copy.copy(base_task['container'])
+    task['container']['docker'] = copy.copy(base_task['container']['docker'])
+    port_mapping, *other_port_mappings = base_task['container']['docker']['port_mappings']
+    port_mapping = copy.copy(port_mapping)
+    port_mapping['host_port'] = task_port
+    task['container']['docker']['port_mappings'] = [port_mapping, *other_port_mappings]
+
+    task['resources'] = []
+    for resource in base_task['resources']:
+        if resource['name'] == 'ports':
+            resource = copy.copy(resource)
+            port_range, *other_port_ranges = resource['ranges']['range']
+            port_range = copy.copy(port_range)
+            port_range['begin'] = port_range['end'] = task_port
+            resource['ranges'] = {'range': [port_range, *other_port_ranges]}
+        task['resources'].append(resource)
+    return task
+
+
 class NativeScheduler(Scheduler):
     task_store: TaskStore
 
@@ -179,12 +240,13 @@ class NativeScheduler(Scheduler):
         """For each offer tries to launch all tasks that can fit in there.
         Declines offer if no fitting tasks found."""
         launched_tasks: List[TaskInfo] = []
+        base_task = self.service_config.base_task(self.system_paasta_config)
 
         for offer in offers:
             with self.constraint_state_lock:
                 try:
                     tasks, new_state = self.tasks_and_state_for_offer(
-                        driver, offer, self.constraint_state,
+                        driver, offer, self.constraint_state, base_task=base_task,
                     )
 
                     if tasks is not None and len(tasks) > 0:
@@ -226,16 +288,13 @@ class NativeScheduler(Scheduler):
 
     def need_more_tasks(self, name, existingTasks, scheduledTasks):
         """Returns whether we need to start more tasks."""
-        num_have = 0
-        for task, parameters in existingTasks.items():
-            if self.is_task_new(name, task) and (parameters.mesos_task_state in LIVE_TASK_STATES):
-                num_have += 1
+        num_scheduled = sum(1 for task in scheduledTasks if task['name'] == name)
+        return num_scheduled < self.num_tasks_needed(name, existingTasks)
 
-        for task in scheduledTasks:
-            if task['name'] == name:
-                num_have += 1
-
-        return num_have < self.service_config.get_desired_instances()
+    def num_tasks_needed(self, name, existingTasks) -> int:
+        """Returns how many more tasks we need to start on top of existingTasks."""
+        num_have = len(self.get_new_tasks(name, existingTasks))
+        return self.service_config.get_desired_instances() - num_have
 
     def get_new_tasks(self, name, tasks_with_params: Dict[str, MesosTaskParameters]):
         return {
@@ -264,36 +323,42 @@ class NativeScheduler(Scheduler):
         driver: MesosSchedulerDriver,
         offer,
         state: ConstraintState,
+        base_task: Optional[TaskInfo]=None,
     ) -> Tuple[List[TaskInfo], ConstraintState]:
-        """Returns collection of tasks that can fit inside an offer."""
+        """Returns collection of tasks that can fit inside an offer.
+
+        :param base_task: The service's base_task(), if the caller already has it
+        """
         tasks: List[TaskInfo] = []
         offerCpus = 0.0
         offerMem = 0.0
-        offerPorts: List[int] = []
+        offerPortRanges: List[Tuple[int, int]] = []
         for resource in offer.resources:
             if resource.name == "cpus":
                 offerCpus += resource.scalar.value
             elif resource.name == "mem":
                 offerMem += resource.scalar.value
             elif resource.name == "ports":
-                for rg in resource.ranges.range:
-                    # I believe mesos protobuf ranges are inclusive, but range() is exclusive
-                    offerPorts += range(rg.begin, rg.end + 1)
+                # mesos protobuf ranges are inclusive
+                offerPortRanges.extend((rg.begin, rg.end) for rg in resource.ranges.range)
         remainingCpus = offerCpus
         remainingMem = offerMem
-        remainingPorts = set(offerPorts)
+        remainingPorts = PortRanges(offerPortRanges)
 
-        base_task = self.service_config.base_task(self.system_paasta_config)
-        base_task['agent_id']['value'] = offer['agent_id']['value']
+        if base_task is None:
+            base_task = self.service_config.base_task(self.system_paasta_config)
+        base_task = copy.copy(base_task)
+        base_task['agent_id'] = {'value': offer['agent_id']['value']}
 
         task_mem = self.service_config.get_mem()
         task_cpus = self.service_config.get_cpus()
 
         # don't mutate existing state
-        new_constraint_state = copy.deepcopy(state)
+        new_constraint_state = copy_constraint_state(state, self.constraints)
+        num_tasks_needed = self.num_tasks_needed(base_task['name'], self.task_store.get_all_tasks())
         total = 0
         failed_constraints = 0
-        while self.need_more_tasks(base_task['name'], self.task_store.get_all_tasks(), tasks):
+        while len(tasks) < num_tasks_needed:
             total += 1
 
             if not(
@@ -311,22 +376,16 @@ class NativeScheduler(Scheduler):
                 failed_constraints += 1
                 break
 
-            task_port = random.choice(list(remainingPorts))
-
-            task = copy.deepcopy(base_task)
-            task['task_id'] = {'value': '{}.{}'.format(task['name'], uuid.uuid4().hex)}
-
-            task['container']['docker']['port_mappings'][0]['host_port'] = task_port
-            for resource in task['resources']:
-                if resource['name'] == 'ports':
-                    resource['ranges']['range'][0]['begin'] = task_port
-                    resource['ranges']['range'][0]['end'] = task_port
-
+            task_port = remainingPorts.take_random_port()
+            task = copy_task_with_port(
+                base_task,
+                task_id='{}.{}'.format(base_task['name'], uuid.uuid4().hex),
+                task_port=task_port,
+            )
             tasks.append(task)
 
             remainingCpus -= task_cpus
             remainingMem -= task_mem
-            remainingPorts -= {task_port}
 
             update_constraint_state(offer, self.constraints, new_constraint_state)
 
@@ -1,7 +1,12 @@
 import copy
+import functools
 import json
+import logging
+import threading
 from typing import Any
+from typing import Callable
 from typing import Dict
+from typing import Optional
 from typing import Tuple
 from typing import Type
 from typing import TypeVar
@@ -11,10 +16,14 @@ from kazoo.client import KazooClient
 from kazoo.exceptions import BadVersionError
 from kazoo.exceptions import NodeExistsError
 from kazoo.exceptions import NoNodeError
+from kazoo.protocol.states import EventType
+from kazoo.protocol.states import WatchedEvent
 from kazoo.protocol.states import ZnodeStat
 
 from paasta_tools.utils import _log
 
+log = logging.getLogger(__name__)
+
 
 class MesosTaskParametersIsImmutableError(Exception):
     pass
@@ -137,6 +146,27 @@ class DictTaskStore(TaskStore):
 
 
 class ZKTaskStore(TaskStore):
+    """A TaskStore backed by zookeeper.
+
+    Every task is kept in memory too, so reads never go to zookeeper. The copy
+    is kept up to date with a ChildrenWatch on the store's root and a data
+    watch on each task, and our own writes are applied to it as soon as
+    zookeeper acknowledges them. Writes are checked against the version of the
+    task we have, so a write based on data someone else has since changed is
+    retried against a fresh copy rather than clobbering it.
+
+    Writes are made in the background. The written task is cached straight
+    away, so the scheduler reads its own writes, and a version conflict is
+    dealt with in the write's completion callback. Callbacks run on kazoo's
+    event thread and mustn't block, so everything they read or write is async
+    too. If a write fails for any other reason, the task we had before it is
+    put back, the task is reread, and the error is raised from the next call
+    to update_task or overwrite_task.
+    """
+
+    tasks: Dict[str, Tuple[Optional[MesosTaskParameters], ZnodeStat]]
+    write_error: Optional[Exception]
+
     def __init__(self, service_name, instance_name, framework_id, system_paasta_config):
         super(ZKTaskStore, self).__init__(service_name, instance_name, framework_id, system_paasta_config)
         self.zk_hosts = system_paasta_config.get_zk_hosts()
@@ -158,70 +188,273 @@ class ZKTaskStore(TaskStore):
         self.zk_client.start()
         self.zk_client.ensure_path('/')
 
+        self.tasks = {}
+        self.tasks_lock = threading.Lock()
+        self.write_error = None
+        self._load_all_tasks()
+        self.zk_client.ChildrenWatch('/', self._children_changed)
+
     def close(self):
         self.zk_client.stop()
         self.zk_client.close()
 
     def get_task(self, task_id: str) -> MesosTaskParameters:
-        params, stat = self._get_task(task_id)
-        return params
-
-    def _get_task(self, task_id: str) -> Tuple[MesosTaskParameters, ZnodeStat]:
-        """Like get_task, but also returns the ZnodeStat that self.zk_client.get() returns """
+        with self.tasks_lock:
+            params, stat = self.tasks.get(task_id, (None, None))
+        # None if we don't know about task_id, as TaskStore.get_task documents
+        return params  # type: ignore
+
+    def _get_task(self, task_id: str) -> Tuple[Optional[MesosTaskParameters], Optional[ZnodeStat]]:
+        """Like get_task, but reads the task from zookeeper, and also returns the ZnodeStat that
+        self.zk_client.get() returns"""
         try:
             data, stat = self.zk_client.get('/%s' % task_id)
-            return MesosTaskParameters.deserialize(data), stat
         except NoNodeError:
             return None, None
+        return self._deserialize_task(task_id, data), stat
+
+    def _deserialize_task(self, task_id: str, data: Union[str, bytes]) -> Optional[MesosTaskParameters]:
+        try:
+            return MesosTaskParameters.deserialize(data)
         except json.decoder.JSONDecodeError:
             _log(
                 service=self.service_name,
                 instance=self.instance_name,
                 level='debug',
                 component='deploy',
-                line='Warning: found non-json-decodable value in zookeeper for task %s: %s' % (task_id, data),
+                line='Warning: found non-json-decodable value in zookeeper for task %s: %r' % (task_id, data),
             )
-            return None, None
+            return None
 
     def get_all_tasks(self):
-        all_tasks = {}
-
-        for child_path in self.zk_client.get_children('/'):
-            task_id = self._task_id_from_zk_path(child_path)
-            params = self.get_task(task_id)
+        with self.tasks_lock:
             # sometimes there are bogus child ZK nodes. Ignore them.
-            if params is not None:
-                all_tasks[task_id] = params
-
-        return all_tasks
-
-    def update_task(self, task_id: str, **kwargs):
-        retry = True
-        while retry:
-            retry = False
-            existing_task, stat = self._get_task(task_id)
-
-            zk_path = self._zk_path_from_task_id(task_id)
-            if existing_task:
-                merged_params = existing_task.merge(**kwargs)
-                try:
-                    self.zk_client.set(zk_path, merged_params.serialize(), version=stat.version)
-                except BadVersionError:
-                    retry = True
-            else:
-                merged_params = MesosTaskParameters(**kwargs)
-                try:
-                    self.zk_client.create(zk_path, merged_params.serialize())
-                except NodeExistsError:
-                    retry = True
+            return {task_id: params for task_id, (params, stat) in self.tasks.items() if params is not None}
 
+    def update_task(self, task_id: str, **kwargs) -> MesosTaskParameters:
+        """Merges kwargs into our copy of the task, and returns the merged task while it is written to zookeeper.
+        If someone else changed the task since our copy was read, kwargs are merged into a fresh copy and the
+        write is retried."""
+        self._raise_write_error()
+        with self.tasks_lock:
+            replaced = self.tasks.get(task_id)
+        existing_task, stat = replaced or (None, None)
+        return self._update_task_async(task_id, existing_task, stat, kwargs, replaced)
+
+    def _update_task_async(
+        self,
+        task_id: str,
+        existing_task: Optional[MesosTaskParameters],
+        stat: Optional[ZnodeStat],
+        kwargs: Dict[str, Any],
+        replaced: Optional[Tuple[Optional[MesosTaskParameters], ZnodeStat]],
+    ) -> MesosTaskParameters:
+        zk_path = self._zk_path_from_task_id(task_id)
+        if stat is not None:
+            merged_params = (existing_task or MesosTaskParameters()).merge(**kwargs)
+            result = self.zk_client.set_async(zk_path, merged_params.serialize(), version=stat.version)
+        else:
+            merged_params = MesosTaskParameters(**kwargs)
+            result = self.zk_client.create_async(zk_path, merged_params.serialize(), include_data=True)
+        self._cache_pending_write(task_id, merged_params)
+        result.rawlink(functools.partial(
+            self._task_written,
+            task_id,
+            merged_params,
+            stat is None,
+            replaced,
+            functools.partial(self._refetch_and_update_task, task_id, kwargs, merged_params, replaced),
+        ))
         return merged_params
 
+    def _refetch_and_update_task(
+        self,
+        task_id: str,
+        kwargs: Dict[str, Any],
+        params: MesosTaskParameters,
+        replaced: Optional[Tuple[Optional[MesosTaskParameters], ZnodeStat]],
+        conflict: Exception,
+    ) -> None:
+        result = self.zk_client.get_async(self._zk_path_from_task_id(task_id))
+        result.rawlink(functools.partial(self._task_refetched, task_id, kwargs, params, replaced))
+
+    def _task_refetched(
+        self,
+        task_id: str,
+        kwargs: Dict[str, Any],
+        params: MesosTaskParameters,
+        replaced: Optional[Tuple[Optional[MesosTaskParameters], ZnodeStat]],
+        result,
+    ) -> None:
+        try:
+            data, stat = result.get()
+        except NoNodeError:
+            existing_task, stat = None, None
+        except Exception as e:
+            self._write_failed(task_id, params, replaced, e)
+            return
+        else:
+            existing_task = self._deserialize_task(task_id, data)
+        self._update_task_async(task_id, existing_task, stat, kwargs, replaced)
+
     def overwrite_task(self, task_id: str, params: MesosTaskParameters, version=-1) -> None:
+        """Writes params to zookeeper in the background, over the given version of the task or over whatever
+        version is there if version is -1, creating the task if it doesn't exist"""
+        self._raise_write_error()
+        params = MesosTaskParameters.deserialize(params.serialize())
+        with self.tasks_lock:
+            replaced = self.tasks.get(task_id)
+        self._overwrite_task_async(task_id, params, version, replaced, create=False)
+
+    def _overwrite_task_async(
+        self,
+        task_id: str,
+        params: MesosTaskParameters,
+        version: int,
+        replaced: Optional[Tuple[Optional[MesosTaskParameters], ZnodeStat]],
+        create: bool,
+    ) -> None:
+        zk_path = self._zk_path_from_task_id(task_id)
+        if create:
+            result = self.zk_client.create_async(zk_path, params.serialize(), include_data=True)
+        else:
+            result = self.zk_client.set_async(zk_path, params.serialize(), version=version)
+        self._cache_pending_write(task_id, params)
+        result.rawlink(functools.partial(
+            self._task_written,
+            task_id,
+            params,
+            create,
+            replaced,
+            functools.partial(self._overwrite_conflicted, task_id, params, version, replaced),
+        ))
+
+    def _overwrite_conflicted(
+        self,
+        task_id: str,
+        params: MesosTaskParameters,
+        version: int,
+        replaced: Optional[Tuple[Optional[MesosTaskParameters], ZnodeStat]],
+        conflict: Exception,
+    ) -> None:
+        if isinstance(conflict, NoNodeError):
+            self._overwrite_task_async(task_id, params, version, replaced, create=True)
+        elif isinstance(conflict, NodeExistsError):
+            self._overwrite_task_async(task_id, params, version, replaced, create=False)
+        else:
+            # The task is no longer at the version we were asked to overwrite
+            self._write_failed(task_id, params, replaced, conflict)
+
+    def _task_written(
+        self,
+        task_id: str,
+        params: MesosTaskParameters,
+        created: bool,
+        replaced: Optional[Tuple[Optional[MesosTaskParameters], ZnodeStat]],
+        on_conflict: Callable[[Exception], Any],
+        result,
+    ) -> None:
+        try:
+            if created:
+                _, stat = result.get()
+            else:
+                stat = result.get()
+        except (BadVersionError, NoNodeError, NodeExistsError) as e:
+            on_conflict(e)
+            return
+        except Exception as e:
+            self._write_failed(task_id, params, replaced, e)
+            return
+        self._cache_task(task_id, params, stat)
+
+    def _write_failed(
+        self,
+        task_id: str,
+        params: MesosTaskParameters,
+        replaced: Optional[Tuple[Optional[MesosTaskParameters], ZnodeStat]],
+        error: Exception,
+    ) -> None:
+        """Puts back the version of a task that a failed write had replaced in memory, unless something newer
+        has been cached since, rereads the task in case zookeeper has it after all, and saves the error for
+        _raise_write_error."""
+        log.warning("Failed to write task %s to zookeeper: %s" % (task_id, error))
+        with self.tasks_lock:
+            cached_params, cached_stat = self.tasks.get(task_id, (None, None))
+            if cached_params is params:
+                if replaced is None:
+                    del self.tasks[task_id]
+                else:
+                    self.tasks[task_id] = replaced
+            self.write_error = error
+        self._fetch_task_async(task_id)
+
+    def _raise_write_error(self) -> None:
+        """Raises the error a background write failed with, if one has failed since this was last called"""
+        with self.tasks_lock:
+            error, self.write_error = self.write_error, None
+        if error is not None:
+            raise error
+
+    def _cache_pending_write(self, task_id: str, params: MesosTaskParameters) -> None:
+        """Caches a task we are writing before zookeeper has acknowledged it. It keeps the stat of the version
+        it replaces until then, so it is superseded by anything newer zookeeper tells us about."""
+        with self.tasks_lock:
+            cached_params, cached_stat = self.tasks.get(task_id, (None, None))
+            self.tasks[task_id] = (params, cached_stat)
+
+    def _cache_task(self, task_id: str, params: Optional[MesosTaskParameters], stat: ZnodeStat) -> None:
+        """Stores a version of a task in memory, unless we already have a later one. Writes and watch
+        notifications can arrive in any order, so versions are ordered by the zxid that last modified them,
+        which unlike the version doesn't go back to 0 when a task is deleted and recreated."""
+        with self.tasks_lock:
+            cached_params, cached_stat = self.tasks.get(task_id, (None, None))
+            if cached_stat is None or stat.mzxid >= cached_stat.mzxid:
+                self.tasks[task_id] = (params, stat)
+
+    def _load_all_tasks(self) -> None:
+        """Reads every task into memory, with all the reads in flight at once. Unlike _fetch_task_async, this
+        waits for each read and caches it here, so every task is in memory when it returns."""
+        results = [
+            (task_id, self.zk_client.get_async(self._zk_path_from_task_id(task_id), watch=self._task_changed))
+            for task_id in map(self._task_id_from_zk_path, self.zk_client.get_children('/'))
+        ]
+        for task_id, result in results:
+            self._task_fetched(task_id, result)
+
+    def _fetch_task_async(self, task_id: str):
+        """Reads a task into memory in the background and watches it for changes"""
+        result = self.zk_client.get_async(self._zk_path_from_task_id(task_id), watch=self._task_changed)
+        result.rawlink(functools.partial(self._task_fetched, task_id))
+        return result
+
+    def _task_fetched(self, task_id: str, result) -> None:
         try:
-            self.zk_client.set(self._zk_path_from_task_id(task_id), params.serialize(), version=version)
+            data, stat = result.get()
         except NoNodeError:
-            self.zk_client.create(self._zk_path_from_task_id(task_id), params.serialize())
+            with self.tasks_lock:
+                self.tasks.pop(task_id, None)
+            return
+        except Exception as e:
+            log.warning("Failed to read task %s from zookeeper: %s" % (task_id, e))
+            return
+        self._cache_task(task_id, self._deserialize_task(task_id, data), stat)
+
+    def _task_changed(self, event: WatchedEvent) -> None:
+        task_id = self._task_id_from_zk_path(event.path)
+        if event.type == EventType.DELETED:
+            with self.tasks_lock:
+                self.tasks.pop(task_id, None)
+        else:
+            self._fetch_task_async(task_id)
+
+    def _children_changed(self, children) -> None:
+        task_ids = set(map(self._task_id_from_zk_path, children))
+        with self.tasks_lock:
+            for task_id in set(self.tasks) - task_ids:
+                del self.tasks[task_id]
+            new_task_ids = task_ids - set(self.tasks)
+        for task_id in new_task_ids:
+            self._fetch_task_async(task_id)
 
     def _zk_path_from_task_id(self, task_id: str) -> str:
         return '/%s' % task_id
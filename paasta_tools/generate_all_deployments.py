@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# Copyright 2015-2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Usage: ./generate_all_deployments [options]
+
+Generates the deployments.json of every PaaSTA service (one with at least one
+instance) in the soa-configs directory, like running generate_deployments_for_service
+for each service that ``paasta list`` prints, but in a single
+process: soa-configs files are only parsed once, and the remote refs of up to
+--workers services are fetched at the same time. deployments.json files are only
+rewritten if their contents changed.
+
+Command line options:
+
+- -d <SOA_DIR>, --soa-dir <SOA_DIR>: Specify a SOA config dir to read from
+- -j <WORKERS>, --workers <WORKERS>: How many services to generate deployments.json for at the same time
+- -v, --verbose: Verbose output, including how long each service took
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from typing import Iterable
+from typing import Tuple
+
+from paasta_tools.cli.utils import list_paasta_services
+from paasta_tools.generate_deployments_for_service import generate_deployments_for_service
+from paasta_tools.utils import DEFAULT_SOA_DIR
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Generates deployments.json for every service.')
+    parser.add_argument(
+        '-d', '--soa-dir', dest="soa_dir", metavar="SOA_DIR",
+        default=DEFAULT_SOA_DIR,
+        help="define a different soa config directory",
+    )
+    parser.add_argument(
+        '-j', '--workers', type=int, default=DEFAULT_WORKERS,
+        help="How many services to generate deployments.json for at the same time. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        '-v', '--verbose', action='store_true',
+        dest="verbose", default=False,
+    )
+    return parser.parse_args()
+
+
+def timed_generate_deployments_for_service(service: str, soa_dir: str) -> float:
+    start = time.time()
+    generate_deployments_for_service(service=service, soa_dir=soa_dir)
+    return time.time() - start
+
+
+def generate_all_deployments(
+    services: Iterable[str],
+    soa_dir: str,
+    workers: int=DEFAULT_WORKERS,
+) -> Tuple[Dict[str, float], Dict[str, Exception]]:
+    """Generates the deployments.json of each service, up to workers at a time.
+
+    :returns: A tuple of two dicts: how many seconds each service that succeeded took,
+              and the exception raised by each service that failed
+    """
+    timings: Dict[str, float] = {}
+    failures: Dict[str, Exception] = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(timed_generate_deployments_for_service, service, soa_dir): service
+            for service in services
+        }
+        for future in as_completed(futures):
+            service = futures[future]
+            try:
+                timings[service] = future.result()
+            except Exception as e:
+                log.error('Failed to generate deployments.json for %s: %s', service, e)
+                failures[service] = e
+            else:
+                log.info('Generated deployments.json for %s in %.2fs', service, timings[service])
+    return timings, failures
+
+
+def main() -> None:
+    args = parse_args()
+    soa_dir = os.path.abspath(args.soa_dir)
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.WARNING)
+
+    start = time.time()
+    timings, failures = generate_all_deployments(
+        services=list_paasta_services(soa_dir=soa_dir),
+        soa_dir=soa_dir,
+        workers=args.workers,
+    )
+    log.info(
+        'Generated deployments.json for %d services in %.2fs, %d failed',
+        len(timings), time.time() - start, len(failures),
+    )
+    if timings:
+        slowest = max(timings, key=lambda service: timings[service])
+        log.info('Slowest service was %s, which took %.2fs', slowest, timings[slowest])
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
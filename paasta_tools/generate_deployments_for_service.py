@@ -42,8 +42,11 @@ import json
 import logging
 import os
 import re
+from collections import defaultdict
 from typing import Any
 from typing import Dict
+from typing import List
+from typing import Optional
 from typing import Tuple
 
 from mypy_extensions import TypedDict
@@ -117,7 +120,75 @@ def parse_args() -> argparse.Namespace:
     return args
 
 
-def get_latest_deployment_tag(refs: Dict[str, str], deploy_group: str) -> Tuple[str, str]:
+# (?:paasta-){0,2} in start/stop tags supports a previous mistake where some tags would be called
+# paasta-paasta-cluster.instance
+CONTROL_TAG_PREFIXES = ('', 'paasta-', 'paasta-paasta-')
+DEPLOY_TIMESTAMP_RE = re.compile(r'\d{8}T\d{6}')
+
+
+class RefIndex:
+    """Classifies every ref of a repo in one pass, so that finding the latest
+    deployment tag of a deploy group or the desired state of a branch doesn't
+    have to match a pattern against every ref again.
+
+    Deploy tags look like refs/tags/paasta-<deploy_group>-<timestamp>-deploy and
+    start/stop tags look like refs/tags/paasta-<branch>-<force_bounce>-<start|stop>.
+    """
+
+    def __init__(self, refs: Dict[str, str]) -> None:
+        # deploy_group -> (timestamp, ref, sha) of its most recent deploy tag
+        self.latest_deploy_tags: Dict[str, Tuple[str, str, str]] = {}
+        # (branch, sha) -> [(state, force_bounce), ...] of the start/stop tags of branch pointing at sha
+        self.control_tags: Dict[Tuple[str, str], List[Tuple[str, str]]] = defaultdict(list)
+
+        for ref_name, sha in refs.items():
+            if not ref_name.startswith('refs/tags/'):
+                continue
+            parts = ref_name[len('refs/tags/'):].rsplit('-', 2)
+            if len(parts) != 3:
+                continue
+            name, middle, suffix = parts
+            if suffix == 'deploy':
+                if name.startswith('paasta-') and DEPLOY_TIMESTAMP_RE.fullmatch(middle):
+                    deploy_group = name[len('paasta-'):]
+                    latest = self.latest_deploy_tags.get(deploy_group)
+                    if latest is None or middle > latest[0]:
+                        self.latest_deploy_tags[deploy_group] = (middle, ref_name, sha)
+            elif (suffix == 'start' or suffix == 'stop') and middle:
+                for prefix in CONTROL_TAG_PREFIXES:
+                    if not name.startswith(prefix):
+                        break
+                    self.control_tags[(name[len(prefix):], sha)].append((suffix, middle))
+
+    def get_latest_deployment_tag(self, deploy_group: str) -> Tuple[Optional[str], Optional[str]]:
+        """Gets the latest deployment tag and sha for the specified deploy_group
+
+        :returns: A tuple of the form (ref, sha) where ref is the actual deployment
+                  tag (with the most recent timestamp) and sha is the sha it points at
+        """
+        latest = self.latest_deploy_tags.get(deploy_group)
+        if latest is None:
+            return None, None
+        _, ref_name, sha = latest
+        return ref_name, sha
+
+    def get_desired_state(self, branch: str, deploy_group: str) -> Tuple[str, Any]:
+        """Gets the desired state (start or stop) of branch at the latest deployment
+        of deploy_group, as well as an arbitrary value (which may be None) that will
+        change when a restart is desired.
+        """
+        _, head_sha = self.get_latest_deployment_tag(deploy_group)
+        states = self.control_tags.get((branch, head_sha)) if head_sha is not None else None
+        if states:
+            # there may be more than one that matches, so take the one that sorts
+            # last by the force_bounce key.
+            sorted_states = sorted(states, key=lambda x: x[1])
+            return sorted_states[-1]
+        else:
+            return ('start', None)
+
+
+def get_latest_deployment_tag(refs: Dict[str, str], deploy_group: str) -> Tuple[Optional[str], Optional[str]]:
     """Gets the latest deployment tag and sha for the specified deploy_group
 
     :param refs: A dictionary mapping git refs to shas
@@ -126,20 +197,7 @@ def get_latest_deployment_tag(refs: Dict[str, str], deploy_group: str) -> Tuple[
     :returns: A tuple of the form (ref, sha) where ref is the actual deployment
               tag (with the most recent timestamp)  and sha is the sha it points at
     """
-    most_recent_dtime = None
-    most_recent_ref = None
-    most_recent_sha = None
-    pattern = re.compile('^refs/tags/paasta-%s-(\d{8}T\d{6})-deploy$' % deploy_group)
-
-    for ref_name, sha in refs.items():
-        match = pattern.match(ref_name)
-        if match:
-            dtime = match.groups()[0]
-            if most_recent_dtime is None or dtime > most_recent_dtime:
-                most_recent_dtime = dtime
-                most_recent_ref = ref_name
-                most_recent_sha = sha
-    return most_recent_ref, most_recent_sha
+    return RefIndex(refs).get_latest_deployment_tag(deploy_group)
 
 
 def get_deploy_group_mappings(
@@ -184,16 +242,32 @@ def get_deploy_group_mappings(
     )
     remote_refs = remote_git.list_remote_refs(git_url)
 
+    return get_deploy_group_mappings_from_refs(service, deploy_group_branch_mappings, remote_refs)
+
+
+def get_deploy_group_mappings_from_refs(
+    service: str,
+    deploy_group_branch_mappings: Dict[str, str],
+    remote_refs: Dict[str, str],
+) -> Tuple[Dict[str, V1_Mapping], V2_Mappings]:
+    """Gets the mappings described in ``get_deploy_group_mappings`` from the
+    refs of the service's repo.
+
+    :param deploy_group_branch_mappings: A dictionary mapping control branches to deploy groups
+    :param remote_refs: A dictionary mapping git refs to shas
+    """
+    mappings: Dict[str, V1_Mapping] = {}
+    v2_mappings: V2_Mappings = {'deployments': {}, 'controls': {}}
+    ref_index = RefIndex(remote_refs)
+
     for control_branch, deploy_group in deploy_group_branch_mappings.items():
-        (deploy_ref_name, _) = get_latest_deployment_tag(remote_refs, deploy_group)
-        if deploy_ref_name in remote_refs:
-            commit_sha = remote_refs[deploy_ref_name]
+        (deploy_ref_name, commit_sha) = ref_index.get_latest_deployment_tag(deploy_group)
+        if deploy_ref_name is not None and commit_sha is not None:
             control_branch_alias = '%s:paasta-%s' % (service, control_branch)
             control_branch_alias_v2 = '%s:%s' % (service, control_branch)
             docker_image = build_docker_image_name(service, commit_sha)
-            desired_state, force_bounce = get_desired_state(
+            desired_state, force_bounce = ref_index.get_desired_state(
                 branch=control_branch,
-                remote_refs=remote_refs,
                 deploy_group=deploy_group,
             )
             log.info('Mapping %s to docker image %s', control_branch, docker_image)
@@ -234,27 +308,7 @@ def get_desired_state(branch: str, remote_refs: Dict[str, str], deploy_group: st
     an arbitrary value (which may be None) that will change when a restart is
     desired.
     """
-    # (?:paasta-){1,2} supports a previous mistake where some tags would be called
-    # paasta-paasta-cluster.instance
-    tag_pattern = r'^refs/tags/(?:paasta-){0,2}%s-(?P<force_bounce>[^-]+)-(?P<state>(start|stop))$' % branch
-
-    states = []
-    (_, head_sha) = get_latest_deployment_tag(remote_refs, deploy_group)
-
-    for ref_name, sha in remote_refs.items():
-        if sha == head_sha:
-            match = re.match(tag_pattern, ref_name)
-            if match:
-                gd = match.groupdict()
-                states.append((gd['state'], gd['force_bounce']))
-
-    if states:
-        # there may be more than one that matches, so take the one that sorts
-        # last by the force_bounce key.
-        sorted_states = sorted(states, key=lambda x: x[1])
-        return sorted_states[-1]
-    else:
-        return ('start', None)
+    return RefIndex(remote_refs).get_desired_state(branch, deploy_group)
 
 
 def get_deployments_dict_from_deploy_group_mappings(
@@ -164,6 +164,114 @@ def _rule_sort_key(rule_tuple):
     return (RULE_TARGET_SORT_ORDER.get(target_name, 0), old_index)
 
 
+def _sorted_rules(rules):
+    return tuple(rule for _, rule in sorted(enumerate(rules), key=_rule_sort_key))
+
+
+def list_all_chains(table):
+    """List the rules in every chain of a table.
+
+    Returns a dict {chain name: tuple of rules}, read from a single snapshot
+    of the table.
+    """
+    return {
+        chain.name: tuple(Rule.from_iptc(rule) for rule in chain.rules)
+        for chain in table.chains
+    }
+
+
+def _ensure_chain_result(current_rules, rules):
+    """Return the rules ensure_chain would leave in a chain that has
+    current_rules, before and after reorder_chain."""
+    wanted = set(rules)
+    current = set(current_rules)
+    inserted = tuple(reversed([rule for rule in rules if rule not in current]))
+    unsorted = inserted + tuple(rule for rule in current_rules if rule in wanted)
+    return unsorted, _sorted_rules(unsorted)
+
+
+def _update_chain(chain, current_rules, rules):
+    """Turn current_rules into rules the way ensure_chain and reorder_chain
+    would, but against a table that isn't committing each change."""
+    unsorted, final = _ensure_chain_result(current_rules, rules)
+
+    extra_rules = set(current_rules) - set(rules)
+    if extra_rules:
+        log.debug('deleting rules from {}: {}'.format(chain.name, extra_rules))
+        for potential_rule in chain.rules:
+            if Rule.from_iptc(potential_rule) in extra_rules:
+                chain.delete_rule(potential_rule)
+
+    current = set(current_rules)
+    for rule in rules:
+        if rule not in current:
+            log.debug('adding rule to {}: {}'.format(chain.name, rule))
+            chain.insert_rule(rule.to_iptc())
+
+    for index, (old_rule, new_rule) in enumerate(zip(unsorted, final)):
+        if old_rule != new_rule:
+            log.debug('reordering chain {} rule {} to #{}'.format(chain.name, new_rule, index))
+            chain.replace_rule(new_rule.to_iptc(), index)
+
+
+def ensure_chains(chains, required_rules=(), stale_chain_prefix=None):
+    """Idempotently ensure many chains exist and have an exact set of rules,
+    committing all the changes to the filter table at once.
+
+    The table is read once, and only the difference between it and the
+    desired state is applied, in a single transaction; nothing is committed
+    if there is no difference.
+
+    :param chains: dict {chain name: rules}. Each chain is updated the way
+                   ensure_chain followed by reorder_chain would update it.
+    :param required_rules: (chain name, rule) pairs for chains that aren't in
+                           chains, each ensured the way ensure_rule would.
+    :param stale_chain_prefix: if given, existing chains whose names start
+                               with this and aren't in chains are deleted.
+    :returns: whether anything was changed
+    """
+    table = iptc.Table(iptc.Table.FILTER)
+    table.refresh()
+    current_chains = list_all_chains(table)
+
+    chains_to_create = [chain for chain in chains if chain not in current_chains]
+    chains_to_update = [
+        chain for chain, rules in chains.items()
+        if _ensure_chain_result(current_chains.get(chain, ()), rules)[1] != current_chains.get(chain)
+    ]
+
+    rules_to_insert = []
+    for chain, rule in required_rules:
+        if chain not in current_chains:
+            raise ChainDoesNotExist(chain)
+        if rule not in current_chains[chain] and (chain, rule) not in rules_to_insert:
+            rules_to_insert.append((chain, rule))
+
+    chains_to_delete = sorted(
+        chain for chain in current_chains
+        if stale_chain_prefix is not None and chain.startswith(stale_chain_prefix) and chain not in chains
+    )
+
+    if not (chains_to_create or chains_to_update or rules_to_insert or chains_to_delete):
+        return False
+
+    with iptables_txn(table):
+        for chain_name in chains_to_create:
+            log.debug('creating chain: {}'.format(chain_name))
+            table.create_chain(chain_name)
+        for chain_name in chains_to_update:
+            _update_chain(iptc.Chain(table, chain_name), current_chains.get(chain_name, ()), chains[chain_name])
+        for chain_name, rule in rules_to_insert:
+            log.debug('adding rule to {}: {}'.format(chain_name, rule))
+            iptc.Chain(table, chain_name).insert_rule(rule.to_iptc())
+        for chain_name in chains_to_delete:
+            log.debug('deleting chain: {}'.format(chain_name))
+            chain = iptc.Chain(table, chain_name)
+            chain.flush()
+            chain.delete()
+    return True
+
+
 def reorder_chain(chain_name):
     """Ensure that any REJECT rules are last, and any LOG rules are second-to-last
     """
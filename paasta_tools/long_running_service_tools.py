@@ -5,7 +5,6 @@ from typing import List
 from typing import Optional
 from typing import Tuple
 
-import service_configuration_lib
 from kazoo.exceptions import NoNodeError
 from mypy_extensions import TypedDict
 
@@ -17,6 +16,7 @@ from paasta_tools.utils import InstanceConfig
 from paasta_tools.utils import InstanceConfigDict
 from paasta_tools.utils import InvalidInstanceConfig
 from paasta_tools.utils import InvalidJobNameError
+from paasta_tools.utils import read_service_configuration
 from paasta_tools.utils import ZookeeperPool
 
 DEFAULT_CONTAINER_PORT = 8888
@@ -311,9 +311,7 @@ def load_service_namespace_config(service: str, namespace: str, soa_dir: str=DEF
     :returns: A dict of the above keys, if they were defined
     """
 
-    service_config = service_configuration_lib.read_service_configuration(
-        service_name=service, soa_dir=soa_dir,
-    )
+    service_config = read_service_configuration(service, soa_dir=soa_dir)
     smartstack_config = service_config.get('smartstack', {})
     namespace_config_from_file = smartstack_config.get(namespace, {})
 
@@ -18,12 +18,15 @@ make the PaaSTA stack work.
 """
 import copy
 import datetime
+import hashlib
 import json
 import logging
 import os
 import sys
+import threading
 from collections import defaultdict
 from collections import namedtuple
+from collections import OrderedDict
 from math import ceil
 from typing import Any
 from typing import Callable
@@ -60,6 +63,7 @@ from paasta_tools.mesos_tools import get_mesos_slaves_grouped_by_attribute
 from paasta_tools.mesos_tools import mesos_services_running_here
 from paasta_tools.paasta_service_config_loader import PaastaServiceConfigLoader
 from paasta_tools.secret_tools import get_hmac_for_secret
+from paasta_tools.secret_tools import get_secret_path
 from paasta_tools.secret_tools import is_secret_ref
 from paasta_tools.utils import _log
 from paasta_tools.utils import BranchDictV2
@@ -72,6 +76,7 @@ from paasta_tools.utils import DockerParameter
 from paasta_tools.utils import DockerVolume
 from paasta_tools.utils import get_code_sha_from_dockerurl
 from paasta_tools.utils import get_config_hash
+from paasta_tools.utils import get_file_fingerprint
 from paasta_tools.utils import get_user_agent
 from paasta_tools.utils import InvalidJobNameError
 from paasta_tools.utils import load_system_paasta_config
@@ -80,6 +85,8 @@ from paasta_tools.utils import MarathonConfigDict
 from paasta_tools.utils import NoConfigurationForServiceError
 from paasta_tools.utils import paasta_print
 from paasta_tools.utils import PaastaNotConfiguredError
+from paasta_tools.utils import read_extra_service_information
+from paasta_tools.utils import read_service_configuration
 from paasta_tools.utils import SystemPaastaConfig
 from paasta_tools.utils import time_cache
 
@@ -353,12 +360,12 @@ def load_marathon_service_config_no_cache(
                              should also be loaded
     :param soa_dir: The SOA configuration directory to read from
     :returns: A dictionary of whatever was in the config for the service instance"""
-    general_config = service_configuration_lib.read_service_configuration(
+    general_config = read_service_configuration(
         service,
         soa_dir=soa_dir,
     )
     marathon_conf_file = "marathon-%s" % cluster
-    instance_configs = service_configuration_lib.read_extra_service_information(
+    instance_configs = read_extra_service_information(
         service,
         marathon_conf_file,
         soa_dir=soa_dir,
@@ -400,7 +407,6 @@ def load_marathon_service_config_no_cache(
     )
 
 
-@time_cache(ttl=5)
 def load_marathon_service_config(
     service: str,
     instance: str,
@@ -650,11 +656,22 @@ class MarathonServiceConfig(LongRunningServiceConfig):
         :returns: A dict containing all of the keys listed above"""
 
         system_paasta_config = load_system_paasta_config()
-        docker_url = self.get_docker_url()
         service_namespace_config = load_service_namespace_config(
             service=self.service,
             namespace=self.get_nerve_namespace(),
         )
+        return _formatted_app_dict_cache.get(
+            config=self,
+            system_paasta_config=system_paasta_config,
+            service_namespace_config=service_namespace_config,
+        )
+
+    def _format_marathon_app_dict(
+        self,
+        system_paasta_config: SystemPaastaConfig,
+        service_namespace_config: ServiceNamespaceConfig,
+    ) -> FormattedMarathonAppDict:
+        docker_url = self.get_docker_url()
         docker_volumes = self.get_volumes(system_volumes=system_paasta_config.get_volumes())
 
         net = get_mesos_network_for_net(self.get_net())
@@ -869,6 +886,131 @@ class MarathonServiceConfig(LongRunningServiceConfig):
         return self.config_dict.get('previous_marathon_shards', None)
 
 
+class FormattedMarathonAppDictCache:
+    """Process-wide cache of MarathonServiceConfig.format_marathon_app_dict results.
+
+    Entries are keyed by a fingerprint of everything the app dict is built
+    from: the instance's merged config, its branch dict, the system paasta
+    config, the service's smartstack namespace config and the secret files it
+    references. Changing any of those changes the fingerprint, so stale
+    entries are never returned, they just age out of the LRU. 'instances' is
+    recomputed on every lookup, as autoscaled instances come from zookeeper
+    rather than from the configs.
+
+    The cache is off until enable() is called, which long running processes
+    that format every app over and over (like paasta-deployd and the API) do.
+    clear() drops every entry.
+    """
+
+    def __init__(self, max_entries: int=8192) -> None:
+        self.max_entries = max_entries
+        self.enabled = False
+        self.entries: 'OrderedDict[str, FormattedMarathonAppDict]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def enable(self, max_entries: Optional[int]=None) -> None:
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+        self.clear()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def get_fingerprint(
+        self,
+        config: 'MarathonServiceConfig',
+        system_paasta_config: SystemPaastaConfig,
+        service_namespace_config: ServiceNamespaceConfig,
+    ) -> str:
+        secret_fingerprints = sorted(
+            (env_var_val, get_file_fingerprint(
+                get_secret_path(env_var_val=env_var_val, service=config.service, soa_dir=config.soa_dir),
+            ))
+            for env_var_val in config.config_dict.get('env', {}).values()
+            if is_secret_ref(env_var_val)
+        )
+        hasher = hashlib.sha1()
+        hasher.update(
+            json.dumps(
+                [
+                    type(config).__name__,
+                    config.service,
+                    config.instance,
+                    config.cluster,
+                    config.soa_dir,
+                    config.config_dict,
+                    config.branch_dict,
+                    system_paasta_config.config_dict,
+                    service_namespace_config,
+                    secret_fingerprints,
+                ],
+                sort_keys=True,
+                default=str,
+            ).encode('UTF-8'),
+        )
+        return hasher.hexdigest()
+
+    def get(
+        self,
+        config: 'MarathonServiceConfig',
+        system_paasta_config: SystemPaastaConfig,
+        service_namespace_config: ServiceNamespaceConfig,
+    ) -> FormattedMarathonAppDict:
+        if not self.enabled:
+            return config._format_marathon_app_dict(system_paasta_config, service_namespace_config)
+
+        key = self.get_fingerprint(config, system_paasta_config, service_namespace_config)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                complete_config = copy.deepcopy(entry)
+            else:
+                self.misses += 1
+        if entry is not None:
+            complete_config['instances'] = config.get_desired_instances()
+            return complete_config
+
+        complete_config = config._format_marathon_app_dict(system_paasta_config, service_namespace_config)
+        with self.lock:
+            self.entries[key] = copy.deepcopy(complete_config)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return complete_config
+
+
+_formatted_app_dict_cache = FormattedMarathonAppDictCache()
+
+
+def enable_formatted_app_dict_cache(max_entries: Optional[int]=None) -> None:
+    _formatted_app_dict_cache.enable(max_entries)
+
+
+def clear_formatted_app_dict_cache() -> None:
+    _formatted_app_dict_cache.clear()
+
+
+def get_formatted_app_dict_cache_stats() -> Dict[str, int]:
+    return _formatted_app_dict_cache.get_stats()
+
+
 class MarathonDeployStatus:
     """ An enum to represent Marathon app deploy status.
     Changing name of the keys will affect both the paasta CLI and API.
@@ -460,6 +460,67 @@ def calculate_resource_utilization_for_slaves(slaves: List, tasks: List) -> Reso
     }
 
 
+UTILIZATION_RESOURCES = ('cpus', 'mem', 'disk', 'gpus')
+
+
+def calculate_resource_utilization_for_slave_groupings(
+    slave_groupings: Dict[_KeyFuncRetT, List],
+    tasks: List,
+) -> Dict[_KeyFuncRetT, ResourceUtilizationDict]:
+    """ Given slaves grouped by ``group_slaves_by_key_func`` and every task in the
+    mesos cluster, calculate the resource utilization of each group.
+
+    This gives the same result as calling ``calculate_resource_utilization_for_slaves``
+    for each group with the non-terminal tasks running on its slaves, but walks the
+    tasks only once: each task is looked up in an index of slave id to group, and its
+    resources are subtracted from that group's running totals.
+
+    :param slave_groupings: a dict of key: [slaves]
+    :param tasks: the list of tasks running in the mesos cluster, terminal or not
+    :returns: a dict of key: resource usage, as returned by
+    ``calculate_resource_utilization_for_slaves``
+    """
+    groups = list(slave_groupings.values())
+    group_by_slave_id: Dict[str, int] = {}
+    totals = []
+    for index, slaves in enumerate(groups):
+        total = [0] * len(UTILIZATION_RESOURCES)
+        for slave in slaves:
+            group_by_slave_id[slave['id']] = index
+            resources = slave['resources']
+            for i, resource in enumerate(UTILIZATION_RESOURCES):
+                if resource in resources:
+                    total[i] += resources[resource]
+        totals.append(total)
+
+    frees = [list(total) for total in totals]
+    for task in tasks:
+        group_index = group_by_slave_id.get(task['slave_id'])
+        if group_index is None or is_task_terminal(task):
+            continue
+        free = frees[group_index]
+        resources = task['resources']
+        for i, resource in enumerate(UTILIZATION_RESOURCES):
+            if resource in resources:
+                free[i] -= resources[resource]
+
+    for slaves, free in zip(groups, frees):
+        for slave in slaves:
+            resources = reserved_maintenence_resources(slave['reserved_resources'])
+            for i, resource in enumerate(UTILIZATION_RESOURCES):
+                if resource in resources:
+                    free[i] -= resources[resource]
+
+    return {
+        key: {
+            "free": ResourceInfo(cpus=free[0], mem=free[1], disk=free[2], gpus=free[3]),
+            "total": ResourceInfo(cpus=total[0], mem=total[1], disk=total[2], gpus=total[3]),
+            "slave_count": len(slaves),
+        }
+        for key, slaves, total, free in zip(slave_groupings, groups, totals, frees)
+    }
+
+
 def filter_tasks_for_slaves(slaves, tasks):
     """ Given a list of slaves and a list of tasks, return a filtered
     list of tasks, where those returned belong to slaves in the list of
@@ -471,7 +532,7 @@ def filter_tasks_for_slaves(slaves, tasks):
     identical to that provided by the tasks param, but with only those where
     the task is running on one of the provided slaves included.
     """
-    slave_ids = [slave['id'] for slave in slaves]
+    slave_ids = {slave['id'] for slave in slaves}
     return [task for task in tasks if task['slave_id'] in slave_ids]
 
 
@@ -518,16 +579,9 @@ def get_resource_utilization_by_grouping(
         raise ValueError("There are no slaves registered in the mesos state.")
 
     tasks = get_all_tasks_from_state(mesos_state, include_orphans=True)
-    non_terminal_tasks = [task for task in tasks if not is_task_terminal(task)]
     slave_groupings = group_slaves_by_key_func(grouping_func, slaves, sort_func)
 
-    return {
-        attribute_value: calculate_resource_utilization_for_slaves(
-            slaves=slaves,
-            tasks=filter_tasks_for_slaves(slaves, non_terminal_tasks),
-        )
-        for attribute_value, slaves in slave_groupings.items()
-    }
+    return calculate_resource_utilization_for_slave_groupings(slave_groupings, tasks)
 
 
 def resource_utillizations_from_resource_info(total, free):
@@ -19,9 +19,6 @@ from typing import Tuple
 from typing import Type
 from typing import TypeVar
 
-from service_configuration_lib import read_extra_service_information
-from service_configuration_lib import read_service_configuration
-
 from paasta_tools import utils
 from paasta_tools.utils import deep_merge_dictionaries
 from paasta_tools.utils import DEFAULT_SOA_DIR
@@ -29,6 +26,8 @@ from paasta_tools.utils import InstanceConfig
 from paasta_tools.utils import list_clusters
 from paasta_tools.utils import load_v2_deployments_json
 from paasta_tools.utils import NoDeploymentsAvailable
+from paasta_tools.utils import read_extra_service_information
+from paasta_tools.utils import read_service_configuration
 
 
 log = logging.getLogger(__name__)
@@ -128,7 +127,7 @@ class PaastaServiceConfigLoader():
         conf_name = self._framework_config_filename(cluster, instance_type_class)
         log.info("Reading configuration file: %s.yaml", conf_name)
         instances = read_extra_service_information(
-            service_name=self._service,
+            service=self._service,
             extra_info=conf_name,
             soa_dir=self._soa_dir,
         )
@@ -145,7 +144,7 @@ class PaastaServiceConfigLoader():
     def _get_merged_config(self, config: utils.InstanceConfigDict) -> utils.InstanceConfigDict:
         if self._general_config is None:
             self._general_config = read_service_configuration(
-                service_name=self._service,
+                service=self._service,
                 soa_dir=self._soa_dir,
             )
         return deep_merge_dictionaries(
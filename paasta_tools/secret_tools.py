@@ -39,12 +39,7 @@ def get_hmac_for_secret(
     soa_dir: str,
     vault_environment: str,
 ) -> Optional[str]:
-    secret_name = get_secret_name_from_ref(env_var_val)
-    secret_path = os.path.join(
-        soa_dir,
-        service,
-        "secrets", "{}.json".format(secret_name),
-    )
+    secret_path = get_secret_path(env_var_val=env_var_val, service=service, soa_dir=soa_dir)
     try:
         with open(secret_path, 'r') as json_secret_file:
             secret_file = json.load(json_secret_file)
@@ -66,6 +61,14 @@ def get_secret_name_from_ref(env_var_val: str) -> str:
     return env_var_val.split('(')[1][:-1]
 
 
+def get_secret_path(env_var_val: str, service: str, soa_dir: str) -> str:
+    return os.path.join(
+        soa_dir,
+        service,
+        "secrets", "{}.json".format(get_secret_name_from_ref(env_var_val)),
+    )
+
+
 def get_secret_provider(
     secret_provider_name: str,
     soa_dir: str,
@@ -470,6 +470,12 @@ def get_tasks_by_state(
     old_app_draining_tasks = {}
     old_app_at_risk_tasks = {}
 
+    # Look up the drain state of every old task at once, rather than one app at a time.
+    a_sync.block(
+        drain_method.prefetch,
+        [task for app, client in other_apps_with_clients for task in app.tasks],
+    )
+
     for app, client in other_apps_with_clients:
 
         tasks_by_state = get_tasks_by_state_for_app(
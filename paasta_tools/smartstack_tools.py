@@ -14,14 +14,19 @@
 import collections
 import csv
 import socket
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import cast
+from typing import Collection
 from typing import DefaultDict
 from typing import Dict
 from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import Optional
 from typing import Tuple
 
 import requests
-from mypy_extensions import TypedDict
 
 from paasta_tools import marathon_tools
 from paasta_tools import mesos_tools
@@ -30,40 +35,166 @@ from paasta_tools.utils import DEFAULT_SOA_DIR
 from paasta_tools.utils import get_user_agent
 
 
-HaproxyBackend = TypedDict(
-    'HaproxyBackend',
-    {
-        'pxname': str,
-        'svname': str,
-    },
-    total=False,
+# The columns of the haproxy stats csv that paasta looks at. The rest are skipped while parsing.
+HAPROXY_BACKEND_FIELDS = (
+    'pxname',
+    'svname',
+    'status',
+    'check_status',
+    'check_code',
+    'check_duration',
+    'lastchg',
 )
 
 
-def retrieve_haproxy_csv(synapse_host, synapse_port, synapse_haproxy_url_format) -> Iterable[Dict[str, str]]:
-    """Retrieves the haproxy csv from the haproxy web interface
+class HaproxyBackend:
+    """A server in the haproxy stats csv, with only the columns listed in HAPROXY_BACKEND_FIELDS.
 
-    :param synapse_host_port: A string in host:port format that this check
-                              should contact for replication information.
-    :returns reader: a csv.DictReader object
+    Fields can be read as attributes or like the keys of a dict (backend['status']), so that a backend can be
+    used wherever a row of csv.DictReader used to be.
     """
-    synapse_uri = synapse_haproxy_url_format.format(host=synapse_host, port=synapse_port)
+    __slots__ = HAPROXY_BACKEND_FIELDS
+
+    def __init__(
+        self,
+        pxname: str,
+        svname: str,
+        status: str,
+        check_status: str='',
+        check_code: str='',
+        check_duration: str='',
+        lastchg: str='',
+    ) -> None:
+        self.pxname = pxname
+        self.svname = svname
+        self.status = status
+        self.check_status = check_status
+        self.check_code = check_code
+        self.check_duration = check_duration
+        self.lastchg = lastchg
+
+    def __getitem__(self, key: str) -> str:
+        if key not in HAPROXY_BACKEND_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any=None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def _astuple(self) -> Tuple[str, ...]:
+        return tuple(getattr(self, field) for field in HAPROXY_BACKEND_FIELDS)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, HaproxyBackend):
+            return NotImplemented
+        return self._astuple() == other._astuple()
+
+    def __hash__(self) -> int:
+        return hash(self._astuple())
+
+    def __repr__(self) -> str:
+        return 'HaproxyBackend(%s)' % ', '.join(
+            '%s=%r' % (field, getattr(self, field)) for field in HAPROXY_BACKEND_FIELDS
+        )
 
-    # timeout after 1 second and retry 3 times
-    haproxy_request = requests.Session()
-    haproxy_request.headers.update({'User-Agent': get_user_agent()})
-    haproxy_request.mount(
+
+# How many synapse hosts a HaproxyView fetches the haproxy csv from at once
+HAPROXY_FETCH_CONCURRENCY = 10
+# How much of the haproxy csv to read from the socket at a time
+HAPROXY_CSV_CHUNK_SIZE = 64 * 1024
+
+
+def get_haproxy_session(pool_maxsize: int=requests.adapters.DEFAULT_POOLSIZE) -> requests.Session:
+    """Returns a requests session for talking to the haproxy web interface, which retries failed requests 3 times.
+
+    :param pool_maxsize: The number of connections to keep open to each host.
+    """
+    session = requests.Session()
+    session.headers.update({'User-Agent': get_user_agent()})
+    session.mount(
         'http://',
-        requests.adapters.HTTPAdapter(max_retries=3),
+        requests.adapters.HTTPAdapter(max_retries=3, pool_maxsize=pool_maxsize),
     )
-    haproxy_request.mount(
+    session.mount(
         'https://',
-        requests.adapters.HTTPAdapter(max_retries=3),
+        requests.adapters.HTTPAdapter(max_retries=3, pool_maxsize=pool_maxsize),
     )
-    haproxy_response = haproxy_request.get(synapse_uri, timeout=1)
-    haproxy_data = haproxy_response.text
-    reader = csv.DictReader(haproxy_data.splitlines())
-    return reader
+    return session
+
+
+def retrieve_haproxy_csv(
+    synapse_host,
+    synapse_port,
+    synapse_haproxy_url_format,
+    session: Optional[requests.Session]=None,
+) -> Iterator[str]:
+    """Retrieves the haproxy csv from the haproxy web interface, one line at a time as it is downloaded
+
+    :param synapse_host_port: A string in host:port format that this check
+                              should contact for replication information.
+    :param session: The requests session to use. Defaults to a new one from get_haproxy_session.
+    :returns lines: an iterator over the lines of the csv, starting with the header
+    """
+    synapse_uri = synapse_haproxy_url_format.format(host=synapse_host, port=synapse_port)
+
+    if session is None:
+        session = get_haproxy_session()
+    # timeout after 1 second and retry 3 times
+    with session.get(synapse_uri, timeout=1, stream=True) as haproxy_response:
+        if haproxy_response.encoding is None:
+            haproxy_response.encoding = 'utf-8'
+        # With an encoding set, decode_unicode makes iter_lines yield str rather than bytes
+        yield from cast(
+            Iterator[str],
+            haproxy_response.iter_lines(chunk_size=HAPROXY_CSV_CHUNK_SIZE, decode_unicode=True),
+        )
+
+
+def parse_haproxy_csv(lines: Iterable[str], services: Optional[Collection[str]]=None) -> List[HaproxyBackend]:
+    """Parses the servers out of the lines of a haproxy stats csv.
+
+    Lines of proxies that aren't in services are skipped before they're split into columns, as are the fictional
+    FRONTEND/BACKEND rows, and only the columns in HAPROXY_BACKEND_FIELDS are kept.
+
+    :param lines: The lines of the csv, starting with the header, like the ones returned by retrieve_haproxy_csv.
+    :param services: If None, return backends for all services, otherwise only return backends for these particular
+                     services.
+    :returns backends: A list of HaproxyBackends
+    """
+    lines = iter(lines)
+    # The header has a leading "# " for no good reason, and a trailing comma like every other line.
+    header = next(lines, '').lstrip('# ').rstrip(',').split(',')
+    if 'pxname' not in header or 'svname' not in header:
+        return []
+    column_indexes = [header.index(field) if field in header else None for field in HAPROXY_BACKEND_FIELDS]
+    last_column = max(index for index in column_indexes if index is not None)
+    pxname_column = header.index('pxname')
+    svname_column = header.index('svname')
+    wanted = None if services is None else set(services)
+
+    backends = []
+    for line in lines:
+        if not line:
+            continue
+        if wanted is not None and pxname_column == 0 and line[:line.find(',')] not in wanted:
+            continue
+        if '"' in line:
+            # Only free-text columns are ever quoted, so fall back to the csv module for these rare lines.
+            row = next(csv.reader([line]))
+        else:
+            # There's no need to split up the columns after the last one we keep
+            row = line.split(',', last_column + 1)
+        if len(row) <= last_column:
+            continue
+        if wanted is not None and row[pxname_column] not in wanted:
+            continue
+        if row[svname_column] in ('FRONTEND', 'BACKEND'):
+            continue
+        backends.append(HaproxyBackend(*(row[index] if index is not None else '' for index in column_indexes)))
+    return backends
 
 
 def get_backends(service, synapse_host, synapse_port, synapse_haproxy_url_format):
@@ -74,7 +205,7 @@ def get_backends(service, synapse_host, synapse_port, synapse_haproxy_url_format
                     service.
     :param synapse_host_port: A string in host:port format that this check
                               should contact for replication information.
-    :returns backends: A list of dicts representing the backends of all
+    :returns backends: A list of HaproxyBackends representing the backends of all
                        services or the requested service
     """
     if service:
@@ -87,7 +218,7 @@ def get_backends(service, synapse_host, synapse_port, synapse_haproxy_url_format
     )
 
 
-def get_multiple_backends(services, synapse_host, synapse_port, synapse_haproxy_url_format):
+def get_multiple_backends(services, synapse_host, synapse_port, synapse_haproxy_url_format, session=None):
     """Fetches the CSV from haproxy and returns a list of backends,
     regardless of their state.
 
@@ -95,28 +226,14 @@ def get_multiple_backends(services, synapse_host, synapse_port, synapse_haproxy_
                      services.
     :param synapse_host_port: A string in host:port format that this check
                               should contact for replication information.
-    :returns backends: A list of dicts representing the backends of all
+    :param session: The requests session to fetch the CSV with. Defaults to a new one.
+    :returns backends: A list of HaproxyBackends representing the backends of all
                        services or the requested service
     """
-
-    reader = retrieve_haproxy_csv(synapse_host, synapse_port, synapse_haproxy_url_format=synapse_haproxy_url_format)
-    backends = []
-
-    for line in reader:
-        # clean up two irregularities of the CSV output, relative to
-        # DictReader's behavior there's a leading "# " for no good reason:
-        line['pxname'] = line.pop('# pxname')
-        # and there's a trailing comma on every line:
-        line.pop('')
-
-        # Look for the service in question and ignore the fictional
-        # FRONTEND/BACKEND hosts, use starts_with so that hosts that are UP
-        # with 1/X healthchecks to go before going down get counted as UP:
-        ha_slave, ha_service = line['svname'], line['pxname']
-        if (services is None or ha_service in services) and ha_slave not in ('FRONTEND', 'BACKEND'):
-            backends.append(line)
-
-    return backends
+    lines = retrieve_haproxy_csv(
+        synapse_host, synapse_port, synapse_haproxy_url_format=synapse_haproxy_url_format, session=session,
+    )
+    return parse_haproxy_csv(lines, services)
 
 
 def load_smartstack_info_for_service(service, namespace, blacklist, system_paasta_config, soa_dir=DEFAULT_SOA_DIR):
@@ -250,7 +367,7 @@ def get_replication_for_services(
 def backend_is_up(backend):
     """Returns whether a server is receiving traffic in HAProxy.
 
-    :param backend: backend dict, like one of those returned by smartstack_tools.get_multiple_backends.
+    :param backend: backend, like one of those returned by smartstack_tools.get_multiple_backends.
 
     :returns is_up: Whether the backend is in a state that receives traffic.
     """
@@ -425,3 +542,92 @@ class SmartstackReplicationChecker:
             attribute=discover_location_type,
         )
         return {attr: [s['hostname'] for s in slaves] for attr, slaves in slaves_grouped_by_attribute.items()}
+
+
+class HaproxyView:
+    """The haproxy backends of a set of synapse hosts, indexed by (pxname, ip, port).
+
+    The haproxy csv of each host is only downloaded once, no matter how many tasks are looked up on it, and hosts
+    are fetched in parallel over one pooled session. A view is a snapshot, so make a new one for each bounce rather
+    than keeping it around.
+    """
+
+    def __init__(
+        self,
+        synapse_port: int,
+        synapse_haproxy_url_format: str,
+        services: Optional[Collection[str]]=None,
+        max_workers: int=HAPROXY_FETCH_CONCURRENCY,
+    ) -> None:
+        """
+        :param synapse_port: The port of the haproxy web interface on each synapse host.
+        :param synapse_haproxy_url_format: The format of the synapse haproxy URL.
+        :param services: If given, only index the backends of these services (pxnames).
+        :param max_workers: How many hosts to fetch the csv from at once.
+        """
+        self.synapse_port = synapse_port
+        self.synapse_haproxy_url_format = synapse_haproxy_url_format
+        self.services = services
+        self.max_workers = max_workers
+        self.session = get_haproxy_session(pool_maxsize=max_workers)
+        self.backends_by_host: Dict[str, Dict[Tuple[str, str, int], List[HaproxyBackend]]] = {}
+        self.errors_by_host: Dict[str, Exception] = {}
+        self.ips_by_host: Dict[str, str] = {}
+
+    def fetch_host(self, synapse_host: str) -> Dict[Tuple[str, str, int], List[HaproxyBackend]]:
+        backends = get_multiple_backends(
+            self.services,
+            synapse_host=synapse_host,
+            synapse_port=self.synapse_port,
+            synapse_haproxy_url_format=self.synapse_haproxy_url_format,
+            session=self.session,
+        )
+        index: DefaultDict[Tuple[str, str, int], List[HaproxyBackend]] = collections.defaultdict(list)
+        for backend in backends:
+            ip, port, _ = ip_port_hostname_from_svname(backend['svname'])
+            index[backend['pxname'], ip, port].append(backend)
+        return dict(index)
+
+    def fetch(self, synapse_hosts: Iterable[str]) -> None:
+        """Fetches and indexes the haproxy csv of each of synapse_hosts that this view doesn't already know about.
+
+        Errors are remembered and raised again when looking up backends on the host that failed.
+        """
+        hosts = {
+            host for host in synapse_hosts
+            if host not in self.backends_by_host and host not in self.errors_by_host
+        }
+        if not hosts:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(hosts))) as executor:
+            futures = {host: executor.submit(self.fetch_host, host) for host in hosts}
+        for host, future in futures.items():
+            try:
+                self.backends_by_host[host] = future.result()
+            except Exception as e:
+                self.errors_by_host[host] = e
+
+    def get_backends(self, synapse_host: str, pxname: str, ip: str, port: int) -> List[HaproxyBackend]:
+        """Returns the backends of pxname at ip:port in the haproxy of synapse_host."""
+        self.fetch([synapse_host])
+        if synapse_host in self.errors_by_host:
+            raise self.errors_by_host[synapse_host]
+        return self.backends_by_host[synapse_host].get((pxname, ip, port), [])
+
+    def get_ip(self, host: str) -> str:
+        if host not in self.ips_by_host:
+            self.ips_by_host[host] = socket.gethostbyname(host)
+        return self.ips_by_host[host]
+
+    def is_task_registered(self, task: Any, service: str) -> bool:
+        """Returns whether a marathon task is UP in the haproxy of its own host under a given service (nerve_ns).
+
+        :param task: A MarathonTask object.
+        :param service: The haproxy service name (pxname) to look for the task under, like 'example_service.main'.
+        """
+        ip = self.get_ip(task.host)
+        return any(
+            backend_is_up(backend)
+            for port in task.ports
+            for backend in self.get_backends(task.host, service, ip, port)
+        )
@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import atexit
 import contextlib
 import copy
 import datetime
@@ -23,9 +24,11 @@ import json
 import logging
 import math
 import os
+import pickle
 import pwd
 import queue
 import re
+import select
 import shlex
 import signal
 import sys
@@ -134,6 +137,269 @@ class time_cache(object):
         return cache
 
 
+FileFingerprint = Optional[Tuple[int, int, int]]
+
+_SoaConfigsCacheRetT = TypeVar('_SoaConfigsCacheRetT')
+
+# The files service_configuration_lib.read_service_configuration reads from a service's directory
+SERVICE_CONFIGURATION_FILES = (
+    'port',
+    'monitoring.yaml',
+    'deploy.yaml',
+    'data.yaml',
+    'smartstack.yaml',
+    'service.yaml',
+    'dependencies.yaml',
+)
+
+SOA_CONFIGS_SNAPSHOT_VERSION = 1
+
+
+def get_file_fingerprint(path: str) -> FileFingerprint:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def get_file_checksum(path: str) -> Optional[str]:
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def get_soa_configs_snapshot_path(soa_dir: str) -> str:
+    return '%s.snapshot' % os.path.abspath(soa_dir).rstrip('/')
+
+
+class SoaConfigsCache(object):
+    """Process-wide cache of parsed soa-configs files.
+
+    Entries are keyed by path and are only reused while the (mtime, size, inode)
+    of every file they were parsed from is unchanged, so a long running process
+    only reparses the files that actually changed. The least recently used
+    entries are evicted once there are more than max_entries of them.
+
+    The cache can be saved to and preloaded from a snapshot (see
+    ``paasta compile-soa-configs``) so short lived processes don't have to
+    parse every file themselves. Preloaded entries are only checked for
+    freshness the first time their key is requested.
+    """
+
+    def __init__(self, max_entries: int=16384) -> None:
+        self.max_entries = max_entries
+        self.entries: 'OrderedDict[str, Tuple[Tuple[FileFingerprint, ...], Any]]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.parse_time = 0.0
+        self.snapshots_loaded: Set[str] = set()
+        self.compiled_entries: Dict[str, Tuple[List[Tuple[str, FileFingerprint]], Any]] = {}
+        self.compiled_checksums: Dict[str, str] = {}
+
+    def get(
+        self,
+        key: str,
+        paths: Sequence[str],
+        loader: Callable[[], _SoaConfigsCacheRetT],
+    ) -> _SoaConfigsCacheRetT:
+        """Returns a copy of the cached result of loader() for key, calling
+        loader() again if any of paths changed since it was cached. If none
+        of paths exist, loader() is called without caching the result.
+        """
+        fingerprints = tuple(get_file_fingerprint(path) for path in paths)
+        if all(fingerprint is None for fingerprint in fingerprints):
+            return loader()
+        with self.lock:
+            compiled_entry = self.compiled_entries.pop(key, None)
+        if compiled_entry is not None:
+            self._add_compiled_entry(key, paths, fingerprints, *compiled_entry)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == fingerprints:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+        start = time.time()
+        data = loader()
+        with self.lock:
+            self.parse_time += time.time() - start
+            self._add_entry(key, fingerprints, copy.deepcopy(data))
+        return data
+
+    def _add_entry(self, key: str, fingerprints: Tuple[FileFingerprint, ...], data: Any) -> None:
+        self.entries[key] = (fingerprints, data)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _add_compiled_entry(
+        self,
+        key: str,
+        paths: Sequence[str],
+        fingerprints: Tuple[FileFingerprint, ...],
+        compiled_fingerprints: List[Tuple[str, FileFingerprint]],
+        data: Any,
+    ) -> None:
+        """Adds an entry preloaded from a snapshot if it is still fresh. It is
+        fresh if each file it was parsed from either has the same fingerprint
+        or the same checksum as when it was compiled."""
+        if [path for path, _ in compiled_fingerprints] != list(paths):
+            return
+        for path, fingerprint, (_, compiled_fingerprint) in zip(paths, fingerprints, compiled_fingerprints):
+            if fingerprint != compiled_fingerprint and (
+                fingerprint is None or get_file_checksum(path) != self.compiled_checksums.get(path)
+            ):
+                return
+        with self.lock:
+            if key not in self.entries:
+                self._add_entry(key, fingerprints, data)
+
+    def get_stats(self) -> Dict[str, float]:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'parse_time': self.parse_time,
+            }
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.compiled_entries.clear()
+
+    def save_snapshot(self, snapshot_path: str, soa_dir: str, paths: Mapping[str, Sequence[str]]) -> None:
+        """Writes every cached entry for soa_dir to snapshot_path, along with a
+        checksum of each file the entries were parsed from.
+
+        Entries whose files changed after they were parsed are left out, since
+        the checksums would be of the new contents.
+
+        :param paths: The files each cache key was parsed from
+        """
+        with self.lock:
+            entries = {key: entry for key, entry in self.entries.items() if key in paths}
+        compiled_entries = {}
+        manifest = {}
+        for key, (fingerprints, data) in entries.items():
+            checksums = {path: get_file_checksum(path) for path in paths[key]}
+            if tuple(get_file_fingerprint(path) for path in paths[key]) != fingerprints:
+                continue
+            compiled_entries[key] = (list(zip(paths[key], fingerprints)), data)
+            manifest.update(checksums)
+        snapshot = {
+            'version': SOA_CONFIGS_SNAPSHOT_VERSION,
+            'soa_dir': os.path.abspath(soa_dir),
+            'entries': compiled_entries,
+            'manifest': manifest,
+        }
+        with atomic_file_write(snapshot_path, binary=True) as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load_snapshot(self, snapshot_path: str, soa_dir: str) -> int:
+        """Preloads the entries of a snapshot written by save_snapshot. Nothing
+        is read from soa_dir here: get() checks an entry is still fresh the
+        first time its key is requested.
+
+        :returns: The number of entries loaded
+        """
+        st = os.stat(snapshot_path)
+        if st.st_uid not in (0, os.getuid()):
+            log.warning("Ignoring soa-configs snapshot %s owned by uid %d" % (snapshot_path, st.st_uid))
+            return 0
+        with open(snapshot_path, 'rb') as f:
+            snapshot = pickle.load(f)
+        if snapshot.get('version') != SOA_CONFIGS_SNAPSHOT_VERSION or \
+                snapshot.get('soa_dir') != os.path.abspath(soa_dir):
+            log.warning("Ignoring incompatible soa-configs snapshot %s" % snapshot_path)
+            return 0
+        with self.lock:
+            self.compiled_checksums.update(snapshot['manifest'])
+            self.compiled_entries.update(snapshot['entries'])
+        return len(snapshot['entries'])
+
+    def ensure_snapshot_loaded(self, soa_dir: str) -> None:
+        """Loads the compiled snapshot of soa_dir the first time it is read from, if there is one"""
+        soa_dir = os.path.abspath(soa_dir)
+        with self.lock:
+            if soa_dir in self.snapshots_loaded:
+                return
+            self.snapshots_loaded.add(soa_dir)
+        snapshot_path = get_soa_configs_snapshot_path(soa_dir)
+        if not os.path.isfile(snapshot_path):
+            return
+        try:
+            loaded = self.load_snapshot(snapshot_path, soa_dir)
+        except Exception as e:
+            log.warning("Failed to load soa-configs snapshot %s: %s" % (snapshot_path, e))
+            return
+        log.debug("Loaded %d entries from soa-configs snapshot %s" % (loaded, snapshot_path))
+
+
+_soa_configs_cache = SoaConfigsCache()
+
+
+def get_soa_configs_cache_stats() -> Dict[str, float]:
+    return _soa_configs_cache.get_stats()
+
+
+def get_extra_service_information_paths(service: str, extra_info: str, soa_dir: str) -> List[str]:
+    return [os.path.join(os.path.abspath(soa_dir), service, '%s.yaml' % extra_info)]
+
+
+def get_service_configuration_paths(service: str, soa_dir: str) -> List[str]:
+    service_dir = os.path.join(os.path.abspath(soa_dir), service)
+    return [os.path.join(service_dir, filename) for filename in SERVICE_CONFIGURATION_FILES]
+
+
+def _read_extra_service_information(
+    cache: SoaConfigsCache,
+    service: str,
+    extra_info: str,
+    soa_dir: str,
+) -> Any:
+    paths = get_extra_service_information_paths(service, extra_info, soa_dir)
+    return cache.get(
+        key=paths[0],
+        paths=paths,
+        loader=lambda: service_configuration_lib.read_extra_service_information(
+            service,
+            extra_info,
+            soa_dir=soa_dir,
+        ),
+    )
+
+
+def _read_service_configuration(cache: SoaConfigsCache, service: str, soa_dir: str) -> Any:
+    return cache.get(
+        key=os.path.join(os.path.abspath(soa_dir), service),
+        paths=get_service_configuration_paths(service, soa_dir),
+        loader=lambda: service_configuration_lib.read_service_configuration(
+            service,
+            soa_dir=soa_dir,
+        ),
+    )
+
+
+def read_extra_service_information(service: str, extra_info: str, soa_dir: str=DEFAULT_SOA_DIR) -> Any:
+    """Like service_configuration_lib.read_extra_service_information, but only
+    reparses the file when it has changed since it was last read."""
+    _soa_configs_cache.ensure_snapshot_loaded(soa_dir)
+    return _read_extra_service_information(_soa_configs_cache, service, extra_info, soa_dir)
+
+
+def read_service_configuration(service: str, soa_dir: str=DEFAULT_SOA_DIR) -> Any:
+    """Like service_configuration_lib.read_service_configuration, but only
+    reparses the service's files when one of them has changed since they were last read."""
+    _soa_configs_cache.ensure_snapshot_loaded(soa_dir)
+    return _read_service_configuration(_soa_configs_cache, service, soa_dir)
+
+
 _SortDictsT = TypeVar('_SortDictsT', bound=Mapping)
 
 
@@ -743,11 +1009,17 @@ def stringify_constraints(uscs: Optional[List[UnstringifiedConstraint]]) -> List
     return [stringify_constraint(usc) for usc in uscs]
 
 
-@time_cache(ttl=60)
 def validate_service_instance(service: str, instance: str, cluster: str, soa_dir: str) -> str:
+    # Only this service's configs are read, and get_service_instance_list goes through the
+    # soa-configs cache, so they are only reparsed when they change
     for instance_type in INSTANCE_TYPES:
-        services = get_services_for_cluster(cluster=cluster, instance_type=instance_type, soa_dir=soa_dir)
-        if (service, instance) in services:
+        service_instances = get_service_instance_list(
+            service,
+            cluster=cluster,
+            instance_type=instance_type,
+            soa_dir=soa_dir,
+        )
+        if (service, instance) in service_instances:
             return instance_type
     else:
         raise NoConfigurationForServiceError(
@@ -975,7 +1247,7 @@ def get_git_url(service: str, soa_dir: str=DEFAULT_SOA_DIR) -> str:
 
     :param service: The service name to get a URL for
     :returns: A git url to the service's repository"""
-    general_config = service_configuration_lib.read_service_configuration(
+    general_config = read_service_configuration(
         service,
         soa_dir=soa_dir,
     )
@@ -1097,15 +1369,15 @@ def remove_ansi_escape_sequences(line: str) -> str:
     return no_escape.sub('', line)
 
 
-def format_log_line(
+def format_log_fields(
     level: str,
     cluster: str,
     service: str,
     instance: str,
     component: str,
     line: str,
-    timestamp: str=None,
-) -> str:
+    timestamp: Optional[str]=None,
+) -> Dict[str, str]:
     """Accepts a string 'line'.
 
     Returns an appropriately-formatted dictionary which can be serialized to
@@ -1115,18 +1387,34 @@ def format_log_line(
     if not timestamp:
         timestamp = _now()
     line = remove_ansi_escape_sequences(line)
-    message = json.dumps(
-        {
-            'timestamp': timestamp,
-            'level': level,
-            'cluster': cluster,
-            'service': service,
-            'instance': instance,
-            'component': component,
-            'message': line,
-        }, sort_keys=True,
+    return {
+        'timestamp': timestamp,
+        'level': level,
+        'cluster': cluster,
+        'service': service,
+        'instance': instance,
+        'component': component,
+        'message': line,
+    }
+
+
+def format_log_line(
+    level: str,
+    cluster: str,
+    service: str,
+    instance: str,
+    component: str,
+    line: str,
+    timestamp: Optional[str]=None,
+) -> str:
+    """Accepts a string 'line'.
+
+    Returns the JSON-serialized format_log_fields of 'line', for logging.
+    """
+    return json.dumps(
+        format_log_fields(level, cluster, service, instance, component, line, timestamp=timestamp),
+        sort_keys=True,
     )
-    return message
 
 
 def get_log_name_for_service(service: str, prefix: str=None) -> str:
@@ -1259,6 +1547,146 @@ class FileLogWriter(LogWriter):
             )
 
 
+def batch_lines(lines: Iterable[bytes], max_bytes: int) -> Iterator[bytes]:
+    """Joins consecutive lines into batches of at most max_bytes. A line longer than
+    max_bytes gets a batch of its own."""
+    batch: List[bytes] = []
+    size = 0
+    for line in lines:
+        if batch and size + len(line) > max_bytes:
+            yield b''.join(batch)
+            batch, size = [], 0
+        batch.append(line)
+        size += len(line)
+    if batch:
+        yield b''.join(batch)
+
+
+@register_log_writer('buffered_file')
+class BufferedFileLogWriter(FileLogWriter):
+    """A FileLogWriter that keeps the files it logs to open and buffers lines in memory,
+    so that logging lots of lines doesn't cost an open, flock, write and close each.
+
+    Buffered lines are written in batches of whole lines of at most PIPE_BUF bytes, each
+    with a single write call, so lines from other processes appending to the same file
+    are never interleaved with them. Buffers are flushed once they hold flush_bytes, once
+    the oldest buffered line is flush_interval seconds old, and when the process exits.
+    At most max_open_files files are kept open; the least recently written is closed first.
+    """
+
+    def __init__(
+        self,
+        path_format: str,
+        mode: str='a+',
+        line_delimeter: str='\n',
+        flock: bool=False,
+        max_open_files: int=32,
+        flush_bytes: int=65536,
+        flush_interval: float=1.0,
+    ) -> None:
+        super().__init__(path_format, mode=mode, line_delimeter=line_delimeter, flock=flock)
+        self.max_open_files = max_open_files
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.files: 'OrderedDict[str, io.FileIO]' = OrderedDict()
+        self.buffers: Dict[str, List[bytes]] = {}
+        self.buffered_bytes = 0
+        self.oldest_buffered_time: Optional[float] = None
+        self.lock = threading.RLock()
+        self.flusher: Optional[threading.Thread] = None
+        atexit.register(self.close)
+
+    def log(
+        self,
+        service: str,
+        line: str,
+        component: str,
+        level: str=DEFAULT_LOGLEVEL,
+        cluster: str=ANY_CLUSTER,
+        instance: str=ANY_INSTANCE,
+    ) -> None:
+        path = self.format_path(service, component, level, cluster, instance)
+        to_write = "%s%s" % (format_log_line(level, cluster, service, instance, component, line), self.line_delimeter)
+        encoded = to_write.encode('UTF-8')
+
+        with self.lock:
+            self.buffers.setdefault(path, []).append(encoded)
+            self.buffered_bytes += len(encoded)
+            now = time.time()
+            if self.oldest_buffered_time is None:
+                self.oldest_buffered_time = now
+            if self.buffered_bytes >= self.flush_bytes or now - self.oldest_buffered_time >= self.flush_interval:
+                self.flush()
+            elif self.flusher is None:
+                self.flusher = threading.Thread(target=self.flush_periodically, daemon=True)
+                self.flusher.start()
+
+    def flush(self) -> None:
+        with self.lock:
+            buffers = self.buffers
+            self.buffers = {}
+            self.buffered_bytes = 0
+            self.oldest_buffered_time = None
+            for path, lines in buffers.items():
+                self.write_lines(path, lines)
+
+    def flush_periodically(self) -> None:
+        """Flushes the buffers once they get stale. Returns once there is nothing left to flush,
+        the next call to log starts it again."""
+        while True:
+            time.sleep(self.flush_interval)
+            with self.lock:
+                if self.oldest_buffered_time is None:
+                    self.flusher = None
+                    return
+                if time.time() - self.oldest_buffered_time >= self.flush_interval:
+                    self.flush()
+
+    def write_lines(self, path: str, lines: List[bytes]) -> None:
+        try:
+            f = self.get_file(path)
+            for batch in batch_lines(lines, select.PIPE_BUF):
+                with self.maybe_flock(f):
+                    # remove type ignore comment below once https://github.com/python/typeshed/pull/1541 is merged.
+                    f.write(batch)  # type: ignore
+        except IOError as e:
+            self.close_file(path)
+            paasta_print(
+                "Could not log to %s: %s: %s -- would have logged: %s" % (
+                    path, type(e).__name__, str(e), b''.join(lines).decode('UTF-8'),
+                ),
+                file=sys.stderr,
+            )
+
+    def get_file(self, path: str) -> io.FileIO:
+        """Returns the open file for path, reopening it if it was moved away (e.g. by logrotate)."""
+        f = self.files.pop(path, None)
+        if f is not None:
+            fingerprint = get_file_fingerprint(path)
+            if fingerprint is None or fingerprint[2] != os.fstat(f.fileno()).st_ino:
+                f.close()
+                f = None
+        if f is None:
+            f = io.FileIO(path, mode=self.mode, closefd=True)
+            while len(self.files) >= self.max_open_files:
+                _, least_recently_used = self.files.popitem(last=False)
+                least_recently_used.close()
+        self.files[path] = f
+        return f
+
+    def close_file(self, path: str) -> None:
+        f = self.files.pop(path, None)
+        if f is not None:
+            f.close()
+
+    def close(self) -> None:
+        """Flushes the buffers and closes every open file."""
+        with self.lock:
+            self.flush()
+            for path in list(self.files):
+                self.close_file(path)
+
+
 @contextlib.contextmanager
 def flock(fd: _AnyIO) -> Iterator[None]:
     try:
@@ -1411,6 +1839,10 @@ SystemPaastaConfigDict = TypedDict(
         'deployd_startup_bounce_rate': float,
         'deployd_log_level': str,
         'deployd_startup_oracle_enabled': bool,
+        'deployd_marathon_app_snapshot_enabled': bool,
+        'deployd_marathon_app_snapshot_refresh_interval': float,
+        'deployd_use_worker_processes': bool,
+        'deployd_worker_process_timeout': float,
         'cluster_autoscaling_draining_enabled': bool,
         'use_mesos_healthchecks': bool,
         'taskproc': Dict,
@@ -1761,6 +2193,38 @@ class SystemPaastaConfig(object):
         """
         return self.config_dict.get("deployd_log_level", 'INFO')
 
+    def get_deployd_marathon_app_snapshot_enabled(self) -> bool:
+        """This controls whether deployd workers share one periodically refreshed
+        snapshot of all marathon apps instead of each listing every app on every bounce
+
+        :return: bool
+        """
+        return self.config_dict.get("deployd_marathon_app_snapshot_enabled", False)
+
+    def get_deployd_marathon_app_snapshot_refresh_interval(self) -> float:
+        """Get the number of seconds deployd waits between refreshes of its
+        shared marathon app snapshot
+
+        :return: float
+        """
+        return float(self.config_dict.get("deployd_marathon_app_snapshot_refresh_interval", 5))
+
+    def get_deployd_use_worker_processes(self) -> bool:
+        """This controls whether each deployd worker runs its deploys in a child
+        process of its own, so that workers can use more than one core
+
+        :return: bool
+        """
+        return self.config_dict.get("deployd_use_worker_processes", False)
+
+    def get_deployd_worker_process_timeout(self) -> float:
+        """Get the number of seconds a deployd worker waits for its child
+        process to deploy a service instance before killing it
+
+        :return: float
+        """
+        return float(self.config_dict.get("deployd_worker_process_timeout", 600))
+
     def get_use_mesos_healthchecks(self) -> bool:
         """Get a boolean indicating whether HTTP(S) healthchecks should
         be driven by Mesos, rather than Marathon
@@ -1912,7 +2376,7 @@ def get_user_agent() -> str:
 
 
 @contextlib.contextmanager
-def atomic_file_write(target_path: str) -> Iterator[IO]:
+def atomic_file_write(target_path: str, binary: bool=False) -> Iterator[IO]:
     dirname = os.path.dirname(target_path)
     basename = os.path.basename(target_path)
 
@@ -1920,7 +2384,7 @@ def atomic_file_write(target_path: str) -> Iterator[IO]:
         dir=dirname,
         prefix=('.%s-' % basename),
         delete=False,
-        mode='w',
+        mode='wb' if binary else 'w',
     ) as f:
         temp_target_path = f.name
         yield f
@@ -2145,7 +2609,7 @@ def get_service_instance_list_no_cache(
     for srv_instance_type in instance_types:
         conf_file = "%s-%s" % (srv_instance_type, cluster)
         log.info("Enumerating all instances for config file: %s/*/%s.yaml" % (soa_dir, conf_file))
-        instances = service_configuration_lib.read_extra_service_information(
+        instances = read_extra_service_information(
             service,
             conf_file,
             soa_dir=soa_dir,
@@ -2160,7 +2624,6 @@ def get_service_instance_list_no_cache(
     return instance_list
 
 
-@time_cache(ttl=5)
 def get_service_instance_list(
     service: str,
     cluster: Optional[str]=None,
@@ -2278,12 +2741,55 @@ def load_deployments_json(service: str, soa_dir: str=DEFAULT_SOA_DIR) -> 'Deploy
 def load_v2_deployments_json(service: str, soa_dir: str=DEFAULT_SOA_DIR) -> 'DeploymentsJsonV2':
     deployment_file = os.path.join(soa_dir, service, 'deployments.json')
     if os.path.isfile(deployment_file):
-        with open(deployment_file) as f:
-            return DeploymentsJsonV2(json.load(f)['v2'])
+        _soa_configs_cache.ensure_snapshot_loaded(soa_dir)
+        return DeploymentsJsonV2(_read_v2_deployments_dict(_soa_configs_cache, deployment_file))
     else:
         raise NoDeploymentsAvailable
 
 
+def _read_v2_deployments_dict(cache: SoaConfigsCache, deployment_file: str) -> Any:
+    return cache.get(
+        key=os.path.abspath(deployment_file),
+        paths=[os.path.abspath(deployment_file)],
+        loader=lambda: _load_v2_deployments_dict(deployment_file),
+    )
+
+
+def _load_v2_deployments_dict(deployment_file: str) -> Any:
+    with open(deployment_file) as f:
+        return json.load(f)['v2']
+
+
+def compile_soa_configs_snapshot(clusters: Iterable[str], soa_dir: str=DEFAULT_SOA_DIR) -> int:
+    """Parses every soa-configs file the config loaders read for the given
+    clusters and saves the result as the snapshot of soa_dir that
+    read_extra_service_information, read_service_configuration and
+    load_v2_deployments_json preload from.
+
+    :returns: The number of entries in the snapshot
+    """
+    cache = SoaConfigsCache(max_entries=sys.maxsize)
+    paths: Dict[str, List[str]] = {}
+    rootdir = os.path.abspath(soa_dir)
+    for service in sorted(os.listdir(rootdir)):
+        if not os.path.isdir(os.path.join(rootdir, service)):
+            continue
+        _read_service_configuration(cache, service, soa_dir)
+        paths[os.path.join(rootdir, service)] = get_service_configuration_paths(service, soa_dir)
+        for cluster in clusters:
+            for instance_type in INSTANCE_TYPES:
+                extra_info = '%s-%s' % (instance_type, cluster)
+                _read_extra_service_information(cache, service, extra_info, soa_dir)
+                extra_info_paths = get_extra_service_information_paths(service, extra_info, soa_dir)
+                paths[extra_info_paths[0]] = extra_info_paths
+        deployment_file = os.path.join(rootdir, service, 'deployments.json')
+        if os.path.isfile(deployment_file):
+            _read_v2_deployments_dict(cache, deployment_file)
+            paths[deployment_file] = [deployment_file]
+    cache.save_snapshot(get_soa_configs_snapshot_path(soa_dir), soa_dir, paths)
+    return int(cache.get_stats()['entries'])
+
+
 DeploymentsJsonV1Dict = Dict[str, BranchDictV1]
 
 DeployGroup = str
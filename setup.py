@@ -87,7 +87,6 @@ setup(
         'paasta_tools/cleanup_marathon_jobs.py',
         'paasta_tools/paasta_deploy_chronos_jobs',
         'paasta_tools/deploy_marathon_services',
-        'paasta_tools/generate_all_deployments',
         'paasta_tools/generate_deployments_for_service.py',
         'paasta_tools/generate_services_file.py',
         'paasta_tools/generate_services_yaml.py',
@@ -129,6 +128,7 @@ setup(
             'paasta_docker_wrapper=paasta_tools.docker_wrapper:main',
             'paasta_firewall_update=paasta_tools.firewall_update:main',
             'paasta_firewall_logging=paasta_tools.firewall_logging:main',
+            'paasta_generate_all_deployments=paasta_tools.generate_all_deployments:main',
             'paasta_oom_logger=paasta_tools.oom_logger:main',
             'paasta_broadcast_log=paasta_tools.marathon_tools:broadcast_log_all_services_running_here_from_stdin',
         ],
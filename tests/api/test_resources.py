@@ -14,13 +14,21 @@
 import json
 
 import mock
+import pytest
 from pyramid import testing
 
+from paasta_tools.api.views import resources
 from paasta_tools.api.views.resources import parse_filters
 from paasta_tools.api.views.resources import resources_utilization
 from paasta_tools.metrics import metastatus_lib
 
 
+@pytest.fixture(autouse=True)
+def reset_utilization_cache():
+    resources._mesos_master = None
+    resources._utilization_cache = (None, {})
+
+
 def test_parse_filters_empty():
     filters = None
     parsed = parse_filters(filters)
@@ -178,3 +186,30 @@ def test_resources_utilization_with_filter(mock_get_mesos_master):
 
     assert(resp.status_int == 200)
     assert(len(body) == 0)
+
+
+@mock.patch('paasta_tools.api.views.resources.metastatus_lib.get_resource_utilization_by_grouping', autospec=True)
+@mock.patch('paasta_tools.api.views.resources.get_mesos_master', autospec=True)
+def test_resources_utilization_memoized_per_state(
+    mock_get_mesos_master,
+    mock_get_resource_utilization_by_grouping,
+):
+    request = testing.DummyRequest()
+    mock_master = mock.Mock(state={'slaves': []})
+    mock_get_mesos_master.return_value = mock_master
+    mock_get_resource_utilization_by_grouping.return_value = {}
+
+    request.swagger_data = {'groupings': ['region'], 'filter': ['pool:default']}
+    resources_utilization(request)
+    resources_utilization(request)
+    assert mock_get_mesos_master.call_count == 1
+    assert mock_get_resource_utilization_by_grouping.call_count == 1
+
+    request.swagger_data = {'groupings': ['pool'], 'filter': None}
+    resources_utilization(request)
+    assert mock_get_resource_utilization_by_grouping.call_count == 2
+
+    mock_master.state = {'slaves': []}
+    resources_utilization(request)
+    assert mock_get_resource_utilization_by_grouping.call_count == 3
+    assert len(resources._utilization_cache[1]) == 1
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import asyncio
+import threading
 import unittest
 import warnings
 from math import floor
@@ -70,6 +71,33 @@ def is_resource_cancelled_sideeffect(self):
     return False
 
 
+def test_get_boto3_client_uses_a_session_per_thread():
+    with mock.patch(
+        'paasta_tools.autoscaling.autoscaling_cluster_lib.boto3.session.Session', autospec=True,
+    ) as mock_session, mock.patch(
+        'paasta_tools.autoscaling.autoscaling_cluster_lib._boto3_sessions', threading.local(),
+    ):
+        mock_session.side_effect = lambda: mock.Mock()
+        sessions = []
+
+        def get_clients():
+            autoscaling_cluster_lib.get_boto3_client('ec2', region_name='westeros-1')
+            autoscaling_cluster_lib.get_boto3_client('autoscaling', region_name='westeros-1')
+            sessions.append(autoscaling_cluster_lib._boto3_sessions.session)
+
+        threads = [threading.Thread(target=get_clients) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert mock_session.call_count == 2
+        assert sessions[0] is not sessions[1]
+        sessions[0].client.assert_has_calls([
+            mock.call('ec2', region_name='westeros-1'),
+            mock.call('autoscaling', region_name='westeros-1'),
+        ])
+
+
 def test_get_mesos_utilization_error():
     mock_system_config = mock.Mock(return_value={})
     with mock.patch(
@@ -105,6 +133,51 @@ def test_get_mesos_utilization_error():
         assert ret == 0
 
 
+def test_get_all_utilization_errors():
+    mock_system_config = mock.Mock(get_cluster_boost_enabled=mock.Mock(return_value=True))
+    mock_resources = {
+        'sfr-1': {'region': 'westeros-1', 'pool': 'default'},
+        'sfr-2': {'region': 'westeros-1', 'pool': 'default'},
+        'sfr-3': {'region': 'westeros-1', 'pool': 'batch'},
+        'sfr-4': {'region': 'westeros-2', 'pool': 'default'},
+    }
+    with mock.patch(
+        'paasta_tools.autoscaling.autoscaling_cluster_lib.get_resource_utilization_by_grouping',
+        autospec=True,
+    ) as mock_get_resource_utilization_by_grouping, mock.patch(
+        'paasta_tools.autoscaling.cluster_boost.get_boosted_loads', autospec=True,
+    ) as mock_get_boosted_loads, mock.patch(
+        'paasta_tools.autoscaling.cluster_boost.get_boosted_load', autospec=True,
+    ) as mock_get_boosted_load:
+        mock_get_resource_utilization_by_grouping.return_value = {
+            ('default', 'westeros-1'): {
+                'free': ResourceInfo(cpus=7.0, mem=2048.0, disk=30.0),
+                'total': ResourceInfo(cpus=10.0, mem=4096.0, disk=40.0),
+            },
+            ('batch', 'westeros-1'): {
+                'free': ResourceInfo(cpus=10.0, mem=2048.0, disk=30.0),
+                'total': ResourceInfo(cpus=20.0, mem=4096.0, disk=40.0),
+            },
+        }
+        mock_get_boosted_loads.return_value = {('westeros-1', 'default'): 6.0, ('westeros-1', 'batch'): 10.0}
+
+        ret = autoscaling_cluster_lib.get_all_utilization_errors(
+            autoscaling_resources=mock_resources,
+            all_pool_settings={'batch': {'target_utilization': 0.5}},
+            mesos_state=mock.sentinel.mesos_state,
+            system_config=mock_system_config,
+        )
+
+        assert ret == {
+            ('westeros-1', 'default'): 0.6 - 0.8,
+            ('westeros-1', 'batch'): 0.5 - 0.5,
+            ('westeros-2', 'default'): 0,
+        }
+        assert mock_get_resource_utilization_by_grouping.call_count == 1
+        mock_get_boosted_loads.assert_called_once_with({('westeros-1', 'default'): 3.0, ('westeros-1', 'batch'): 10.0})
+        assert not mock_get_boosted_load.called
+
+
 def test_get_instances_from_ip():
     mock_instances = []
     ret = autoscaling_cluster_lib.get_instances_from_ip('10.1.1.1', mock_instances)
@@ -326,7 +399,9 @@ def test_get_autoscaling_info_for_all_resources():
         'paasta_tools.autoscaling.autoscaling_cluster_lib.autoscaling_info_for_resource', autospec=True,
     ) as mock_autoscaling_info_for_resource, mock.patch(
         'paasta_tools.autoscaling.autoscaling_cluster_lib.get_mesos_utilization_error', autospec=True,
-    ) as mock_get_utilization_error:
+    ) as mock_get_utilization_error, mock.patch(
+        'paasta_tools.autoscaling.autoscaling_cluster_lib.ClusterUtilization', autospec=True,
+    ):
         mock_autoscaling_info_for_resource.side_effect = mock_autoscaling_info_for_resource_side_effect
         mock_state = mock.Mock()
         mock_get_utilization_error.return_value = 0
@@ -479,7 +554,9 @@ class TestAsgAutoscaler(unittest.TestCase):
         assert not self.autoscaler.is_resource_cancelled()
 
     def test_get_asg(self):
-        with mock.patch('boto3.client', autospec=True) as mock_ec2_client:
+        with mock.patch(
+            'paasta_tools.autoscaling.autoscaling_cluster_lib.get_boto3_client', autospec=True,
+        ) as mock_ec2_client:
             mock_asg = mock.Mock()
             mock_asgs = {'AutoScalingGroups': [mock_asg]}
             mock_describe_auto_scaling_groups = mock.Mock(return_value=mock_asgs)
@@ -495,7 +572,9 @@ class TestAsgAutoscaler(unittest.TestCase):
             assert ret is None
 
     def test_set_asg_capacity(self):
-        with mock.patch('boto3.client', autospec=True) as mock_ec2_client, mock.patch(
+        with mock.patch(
+            'paasta_tools.autoscaling.autoscaling_cluster_lib.get_boto3_client', autospec=True,
+        ) as mock_ec2_client, mock.patch(
             'time.sleep', autospec=True,
         ):
             mock_update_auto_scaling_group = mock.Mock()
@@ -706,7 +785,9 @@ class TestSpotAutoscaler(unittest.TestCase):
         assert self.autoscaler.current_capacity == 2
 
     def test_get_spot_fleet_instances(self):
-        with mock.patch('boto3.client', autospec=True) as mock_ec2_client:
+        with mock.patch(
+            'paasta_tools.autoscaling.autoscaling_cluster_lib.get_boto3_client', autospec=True,
+        ) as mock_ec2_client:
             mock_instances = mock.Mock()
             mock_sfr = {'ActiveInstances': mock_instances}
             mock_describe_spot_fleet_instances = mock.Mock(return_value=mock_sfr)
@@ -747,7 +828,9 @@ class TestSpotAutoscaler(unittest.TestCase):
         assert self.autoscaler.is_resource_cancelled()
 
     def test_get_sfr(self):
-        with mock.patch('boto3.client', autospec=True) as mock_ec2_client:
+        with mock.patch(
+            'paasta_tools.autoscaling.autoscaling_cluster_lib.get_boto3_client', autospec=True,
+        ) as mock_ec2_client:
             mock_sfr_config = mock.Mock()
             mock_sfr = {'SpotFleetRequestConfigs': [mock_sfr_config]}
             mock_describe_spot_fleet_requests = mock.Mock(return_value=mock_sfr)
@@ -764,7 +847,7 @@ class TestSpotAutoscaler(unittest.TestCase):
 
     def test_set_spot_fleet_request_capacity(self):
         with mock.patch(
-            'boto3.client', autospec=True,
+            'paasta_tools.autoscaling.autoscaling_cluster_lib.get_boto3_client', autospec=True,
         ) as mock_ec2_client, mock.patch(
             'time.sleep', autospec=True,
         ) as mock_sleep, mock.patch(
@@ -991,7 +1074,9 @@ class TestClusterAutoscaler(unittest.TestCase):
         )
 
     def test_describe_instance(self):
-        with mock.patch('boto3.client', autospec=True) as mock_ec2_client:
+        with mock.patch(
+            'paasta_tools.autoscaling.autoscaling_cluster_lib.get_boto3_client', autospec=True,
+        ) as mock_ec2_client:
             mock_instance_1 = mock.Mock()
             mock_instance_2 = mock.Mock()
             mock_instance_3 = mock.Mock()
@@ -1075,9 +1160,9 @@ class TestClusterAutoscaler(unittest.TestCase):
         with mock.patch(
             'paasta_tools.autoscaling.autoscaling_cluster_lib.get_mesos_task_count_by_slave', autospec=True,
         ) as mock_get_mesos_task_count_by_slave, mock.patch(
-            'paasta_tools.autoscaling.ec2_fitness.sort_by_ec2_fitness',
+            'paasta_tools.autoscaling.ec2_fitness.ec2_fitness_key',
             autospec=True,
-        ) as mock_sort_slaves_to_kill, mock.patch(
+        ) as mock_ec2_fitness_key, mock.patch(
             'paasta_tools.autoscaling.autoscaling_cluster_lib.ClusterAutoscaler.gracefully_terminate_slave',
             autospec=True,
         ) as mock_gracefully_terminate_slave, mock.patch(
@@ -1085,6 +1170,8 @@ class TestClusterAutoscaler(unittest.TestCase):
         ) as mock_timer:
             mock_timer_value = mock.Mock()
             mock_timer.return_value = mock_timer_value
+            # every slave is equally fit, so they are killed in the reverse of the order they are passed in
+            mock_ec2_fitness_key.return_value = (False, 0, 0, 0)
 
             mock_gracefully_terminate_slave.side_effect = just_sleep
             mock_task_counts = mock.Mock()
@@ -1103,14 +1190,12 @@ class TestClusterAutoscaler(unittest.TestCase):
             mock_get_mesos_task_count_by_slave.return_value = [{'task_counts': mock_task_counts}]
             self.autoscaler.resource = {'type': 'aws_spot_fleet_request', 'sfr': {'SpotFleetRequestState': 'active'}}
             self.autoscaler.sfr = {'SpotFleetRequestState': 'active'}
-            mock_filtered_slaves = mock.Mock()
             mock_sfr_sorted_slaves_1 = [mock_slave_1, mock_slave_2]
             mock_sfr_sorted_slaves_2 = [mock_slave_2]
 
             # test we kill only one instance on scale down and then reach capacity
-            mock_sort_slaves_to_kill.return_value = mock_sfr_sorted_slaves_2
             _run(self.autoscaler.downscale_aws_resource(
-                filtered_slaves=mock_filtered_slaves,
+                filtered_slaves=mock_sfr_sorted_slaves_2,
                 current_capacity=5,
                 target_capacity=4,
             ))
@@ -1130,9 +1215,8 @@ class TestClusterAutoscaler(unittest.TestCase):
                 task_counts=mock_task_counts,
                 instance_weight=2,
             )
-            mock_sort_slaves_to_kill.return_value = mock_sfr_sorted_slaves_2
             _run(self.autoscaler.downscale_aws_resource(
-                filtered_slaves=mock_filtered_slaves,
+                filtered_slaves=mock_sfr_sorted_slaves_2,
                 current_capacity=5,
                 target_capacity=4,
             ))
@@ -1152,9 +1236,8 @@ class TestClusterAutoscaler(unittest.TestCase):
                 task_counts=mock_task_counts,
                 instance_weight=2,
             )
-            mock_sort_slaves_to_kill.return_value = mock_sfr_sorted_slaves_2
             _run(self.autoscaler.downscale_aws_resource(
-                filtered_slaves=mock_filtered_slaves,
+                filtered_slaves=mock_sfr_sorted_slaves_2,
                 current_capacity=2,
                 target_capacity=1,
             ))
@@ -1164,7 +1247,7 @@ class TestClusterAutoscaler(unittest.TestCase):
             # unless this is a cancelled SFR in which case we can go to 0
             self.autoscaler.sfr = {'SpotFleetRequestState': 'cancelled'}
             _run(self.autoscaler.downscale_aws_resource(
-                filtered_slaves=mock_filtered_slaves,
+                filtered_slaves=mock_sfr_sorted_slaves_2,
                 current_capacity=2,
                 target_capacity=1,
             ))
@@ -1202,14 +1285,8 @@ class TestClusterAutoscaler(unittest.TestCase):
                 autoscaling_cluster_lib.FailSetResourceCapacity,
             )
             mock_sfr_sorted_slaves_1 = [mock_slave_2, mock_slave_1]
-            mock_sfr_sorted_slaves_2 = [mock_slave_2]
-            mock_sort_slaves_to_kill.side_effect = [
-                mock_sfr_sorted_slaves_1,
-                mock_sfr_sorted_slaves_2,
-                [],
-            ]
             _run(self.autoscaler.downscale_aws_resource(
-                filtered_slaves=mock_filtered_slaves,
+                filtered_slaves=mock_sfr_sorted_slaves_1,
                 current_capacity=5,
                 target_capacity=2,
             ))
@@ -1219,14 +1296,8 @@ class TestClusterAutoscaler(unittest.TestCase):
             mock_gracefully_terminate_slave.reset_mock()
             mock_gracefully_terminate_slave.side_effect = get_coro_with_exception(HTTPError)
             mock_sfr_sorted_slaves_1 = [mock_slave_2, mock_slave_1]
-            mock_sfr_sorted_slaves_2 = [mock_slave_2]
-            mock_sort_slaves_to_kill.side_effect = [
-                mock_sfr_sorted_slaves_1,
-                mock_sfr_sorted_slaves_2,
-                [],
-            ]
             _run(self.autoscaler.downscale_aws_resource(
-                filtered_slaves=mock_filtered_slaves,
+                filtered_slaves=mock_sfr_sorted_slaves_1,
                 current_capacity=5,
                 target_capacity=2,
             ))
@@ -1239,16 +1310,9 @@ class TestClusterAutoscaler(unittest.TestCase):
             mock_gracefully_terminate_slave.side_effect = just_sleep
             mock_gracefully_terminate_slave.reset_mock()
             mock_get_mesos_task_count_by_slave.reset_mock()
-            mock_sort_slaves_to_kill.reset_mock()
             mock_sfr_sorted_slaves_1 = [mock_slave_2, mock_slave_1]
-            mock_sfr_sorted_slaves_2 = [mock_slave_2]
-            mock_sort_slaves_to_kill.side_effect = [
-                mock_sfr_sorted_slaves_1,
-                mock_sfr_sorted_slaves_2,
-                [],
-            ]
             _run(self.autoscaler.downscale_aws_resource(
-                filtered_slaves=mock_filtered_slaves,
+                filtered_slaves=mock_sfr_sorted_slaves_1,
                 current_capacity=5,
                 target_capacity=2,
             ))
@@ -1268,16 +1332,13 @@ class TestClusterAutoscaler(unittest.TestCase):
             mock_gracefully_terminate_slave.side_effect = just_sleep
             mock_gracefully_terminate_slave.reset_mock()
             mock_get_mesos_task_count_by_slave.reset_mock()
-            mock_sort_slaves_to_kill.reset_mock()
             mock_sfr_sorted_slaves = [mock_slave_1] * 10
-            mock_sort_slaves_to_kill.side_effect = [mock_sfr_sorted_slaves] + \
-                [mock_sfr_sorted_slaves[x:-1] for x in range(0, 10)]
             mock_get_mesos_task_count_by_slave.return_value = [
                 {'task_counts': mock_slave_1}
                 for x in range(0, 9)
             ]
             _run(self.autoscaler.downscale_aws_resource(
-                filtered_slaves=mock_filtered_slaves,
+                filtered_slaves=mock_sfr_sorted_slaves,
                 current_capacity=8,
                 target_capacity=7,
             ))
@@ -1403,9 +1464,52 @@ class TestClusterAutoscaler(unittest.TestCase):
             assert not mock_set_capacity.called
             assert not mock_wait_and_terminate.called
 
+    def test_gracefully_terminate_slaves_in_parallel(self):
+        with mock.patch(
+            'paasta_tools.autoscaling.autoscaling_cluster_lib.drain', autospec=True,
+        ), mock.patch(
+            'paasta_tools.autoscaling.autoscaling_cluster_lib.ClusterAutoscaler.wait_and_terminate',
+            autospec=True,
+        ) as mock_wait_and_terminate, mock.patch(
+            'paasta_tools.autoscaling.autoscaling_cluster_lib.ClusterAutoscaler.set_capacity',
+            autospec=True,
+        ) as mock_set_capacity:
+            def _set_capacity(self, capacity):
+                # set_capacity runs in an executor, so the other coroutine must not read self.capacity meanwhile
+                assert self.capacity_lock.locked()
+                self.capacity = capacity
+
+            mock_set_capacity.side_effect = _set_capacity
+            mock_wait_and_terminate.side_effect = just_sleep
+            self.autoscaler.resource = {'id': 'sfr-blah', 'region': 'westeros-1', 'type': 'sfr'}
+            self.autoscaler.capacity = 5
+            mock_slaves = [
+                mock.Mock(
+                    hostname='host%d' % i,
+                    pid='slave(%d)@10.1.1.%d:5051' % (i, i),
+                    ip='10.1.1.%d' % i,
+                    instance_status={'SystemStatus': {'Status': 'ok'}, 'InstanceStatus': {'Status': 'ok'}},
+                )
+                for i in range(2)
+            ]
+
+            async def terminate_both():
+                await asyncio.gather(*[
+                    self.autoscaler.gracefully_terminate_slave(
+                        slave_to_kill=mock_slave,
+                        capacity_diff=-1,
+                        timer=mock.Mock(),
+                    )
+                    for mock_slave in mock_slaves
+                ])
+            _run(terminate_both())
+
+            mock_set_capacity.assert_has_calls([mock.call(self.autoscaler, 4), mock.call(self.autoscaler, 3)])
+            assert self.autoscaler.capacity == 3
+
     def test_wait_and_terminate(self):
         with mock.patch(
-            'boto3.client', autospec=True,
+            'paasta_tools.autoscaling.autoscaling_cluster_lib.get_boto3_client', autospec=True,
         ) as mock_ec2_client, mock.patch(
             'paasta_tools.autoscaling.autoscaling_cluster_lib.asyncio.sleep', autospec=True,
         ) as mock_sleep, mock.patch(
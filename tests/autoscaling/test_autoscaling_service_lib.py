@@ -14,6 +14,8 @@
 from datetime import datetime
 from datetime import timedelta
 
+import gevent
+from gevent.event import Event
 import mock
 from kazoo.exceptions import NoNodeError
 from pytest import raises
@@ -195,7 +197,7 @@ def test_mesos_cpu_metrics_provider_no_previous_cpu_data():
             autoscaling_service_lib.mesos_cpu_metrics_provider(
                 fake_marathon_service_config, fake_system_paasta_config, fake_marathon_tasks, (fake_mesos_task,),
             )
-        mock_zk_client.return_value.set.assert_has_calls(
+        mock_zk_client.return_value.set_async.assert_has_calls(
             [
                 mock.call(
                     '/autoscaling/fake-service/fake-instance/cpu_data',
@@ -283,7 +285,7 @@ def test_mesos_cpu_metrics_provider():
             (fake_mesos_task_2, fake_mesos_task_3, fake_mesos_task),
             log_utilization_data=log_utilization_data,
         )
-        mock_zk_client.return_value.set.assert_has_calls(
+        mock_zk_client.return_value.set_async.assert_has_calls(
             [
                 mock.call(
                     '/autoscaling/fake-service/fake-instance/cpu_last_time',
@@ -301,7 +303,7 @@ def test_mesos_cpu_metrics_provider():
         }
 
         # test noop mode
-        mock_zk_client.return_value.set.reset_mock()
+        mock_zk_client.return_value.set_async.reset_mock()
         assert 0.8 == autoscaling_service_lib.mesos_cpu_metrics_provider(
             fake_marathon_service_config,
             fake_system_paasta_config,
@@ -310,7 +312,7 @@ def test_mesos_cpu_metrics_provider():
             log_utilization_data=log_utilization_data,
             noop=True,
         )
-        assert not mock_zk_client.return_value.set.called
+        assert not mock_zk_client.return_value.set_async.called
 
 
 def test_mesos_cpu_metrics_provider_filter_bogus_values_big_cpu_limit():
@@ -586,6 +588,183 @@ def test_mesos_cpu_metrics_provider_filter_no_bogus_values_10_percent_cpu_limit(
         )
 
 
+def test_metrics_fetch_budget_limits_requests_per_host():
+    budget = autoscaling_service_lib.MetricsFetchBudget(concurrency=10, concurrency_per_host=2)
+    running = {'host1': 0, 'host2': 0}
+    most_running = {'host1': 0, 'host2': 0}
+
+    def fetch(host):
+        running[host] += 1
+        most_running[host] = max(most_running[host], running[host])
+        gevent.sleep(0)
+        running[host] -= 1
+        return host
+
+    jobs = [budget.spawn(host, fetch, host) for host in ['host1'] * 5 + ['host2'] * 5]
+    gevent.joinall(jobs)
+    assert [job.value for job in jobs] == ['host1'] * 5 + ['host2'] * 5
+    assert most_running == {'host1': 2, 'host2': 2}
+
+
+def test_metrics_fetch_budget_queues_requests_to_busy_hosts_outside_the_pool():
+    budget = autoscaling_service_lib.MetricsFetchBudget(concurrency=2, concurrency_per_host=1)
+    slow_host_answers = Event()
+
+    def fetch(host):
+        if host == 'slow-host':
+            slow_host_answers.wait()
+        return host
+
+    slow_jobs = [budget.spawn('slow-host', fetch, 'slow-host') for _ in range(3)]
+    fast_job = budget.spawn('fast-host', fetch, 'fast-host')
+    fast_job.join()
+    assert fast_job.value == 'fast-host'
+    assert not any(job.ready() for job in slow_jobs)
+
+    slow_host_answers.set()
+    gevent.joinall(slow_jobs)
+    assert [job.value for job in slow_jobs] == ['slow-host'] * 3
+
+
+def test_metrics_fetch_budget_kill():
+    budget = autoscaling_service_lib.MetricsFetchBudget(concurrency=2, concurrency_per_host=1)
+    fetched = []
+
+    def fetch(host):
+        fetched.append(host)
+        Event().wait()
+
+    jobs = [budget.spawn('slow-host', fetch, 'slow-host') for _ in range(3)]
+    gevent.sleep(0)
+    budget.kill()
+    gevent.sleep(0)
+    assert all(job.dead for job in jobs)
+    assert fetched == ['slow-host']
+    assert budget.jobs == set()
+
+
+def test_mesos_cpu_data_store_prefetch():
+    zookeeper_payload = {
+        '/autoscaling/fake-service/fake-instance/cpu_last_time': b'1234',
+        '/autoscaling/fake-service/fake-instance/cpu_data': b'480.0:fake-service.fake-instance',
+    }
+
+    def get_async(path):
+        if path in zookeeper_payload:
+            return mock.Mock(get=mock.Mock(return_value=(zookeeper_payload[path], None)))
+        return mock.Mock(get=mock.Mock(side_effect=NoNodeError))
+
+    configs = [
+        mock.Mock(service='fake-service', instance='fake-instance'),
+        mock.Mock(service='fake-service', instance='new-instance'),
+    ]
+    with mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.ZookeeperPool', autospec=True,
+    ) as mock_zookeeper_pool:
+        mock_zk = mock_zookeeper_pool.return_value.__enter__.return_value
+        mock_zk.get_async.side_effect = get_async
+        store = autoscaling_service_lib.MesosCpuDataStore()
+        store.prefetch(configs)
+
+        assert store.get('/autoscaling/fake-service/fake-instance') == ('1234', '480.0:fake-service.fake-instance')
+        assert store.get('/autoscaling/fake-service/new-instance') is None
+        assert mock_zk.get_async.call_count == 4
+        assert not mock_zk.get.called
+
+
+def test_mesos_cpu_data_store_flush():
+    with mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.ZookeeperPool', autospec=True,
+    ) as mock_zookeeper_pool:
+        mock_zk = mock_zookeeper_pool.return_value.__enter__.return_value
+        store = autoscaling_service_lib.MesosCpuDataStore()
+        store.data = {
+            '/autoscaling/fake-service/fake-instance': ('1234', ''),
+            '/autoscaling/fake-service/new-instance': None,
+        }
+        store.set('/autoscaling/fake-service/fake-instance', '1300', '1.0:a')
+        store.set('/autoscaling/fake-service/new-instance', '1300', '2.0:b')
+        assert not mock_zk.set_async.called
+
+        store.flush()
+        mock_zk.ensure_path.assert_has_calls([
+            mock.call('/autoscaling/fake-service/new-instance/cpu_data'),
+            mock.call('/autoscaling/fake-service/new-instance/cpu_last_time'),
+        ])
+        assert mock_zk.ensure_path.call_count == 2
+        mock_zk.set_async.assert_has_calls([
+            mock.call('/autoscaling/fake-service/fake-instance/cpu_data', b'1.0:a'),
+            mock.call('/autoscaling/fake-service/fake-instance/cpu_last_time', b'1300'),
+            mock.call('/autoscaling/fake-service/new-instance/cpu_data', b'2.0:b'),
+            mock.call('/autoscaling/fake-service/new-instance/cpu_last_time', b'1300'),
+        ], any_order=True)
+        assert store.get('/autoscaling/fake-service/new-instance') == ('1300', '2.0:b')
+        assert store.writes == {}
+
+
+def test_get_all_utilizations():
+    mock_configs = [mock.Mock(), mock.Mock()]
+    for mock_config in mock_configs:
+        mock_config.get_autoscaling_params.return_value = {'metrics_provider': 'mesos_cpu'}
+
+    def get_utilization(marathon_service_config, log_utilization_data, **kwargs):
+        if marathon_service_config is mock_configs[1]:
+            raise MetricsProviderNoDataError('no data')
+        log_utilization_data['1234'] = 'data'
+        return 0.5
+
+    with mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.get_utilization', autospec=True,
+        side_effect=get_utilization,
+    ) as mock_get_utilization, mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.MesosCpuDataStore', autospec=True,
+    ) as mock_cpu_data_store, mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.monkey', autospec=True,
+    ):
+        utilizations = autoscaling_service_lib.get_all_utilizations(
+            mock.sentinel.system_paasta_config,
+            [(mock_configs[0], [mock.sentinel.task1], []), (mock_configs[1], [mock.sentinel.task2], [])],
+        )
+        assert utilizations[0] == (0.5, {'1234': 'data'})
+        assert isinstance(utilizations[1], MetricsProviderNoDataError)
+        mock_cpu_data_store.return_value.prefetch.assert_called_once_with(mock_configs)
+        assert mock_cpu_data_store.return_value.flush.called
+        budgets = {call[1]['metrics_budget'] for call in mock_get_utilization.call_args_list}
+        assert len(budgets) == 1
+
+
+def test_get_all_utilizations_timeout():
+    mock_configs = [mock.Mock(), mock.Mock()]
+    for mock_config in mock_configs:
+        mock_config.get_autoscaling_params.return_value = {'metrics_provider': 'http'}
+    budget_jobs = []
+
+    def get_utilization(marathon_service_config, metrics_budget, **kwargs):
+        if marathon_service_config is mock_configs[1]:
+            job = metrics_budget.spawn('slow-host', Event().wait)
+            budget_jobs.append(job)
+            job.get()
+        return 0.5
+
+    with mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.get_utilization', autospec=True,
+        side_effect=get_utilization,
+    ), mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.MesosCpuDataStore', autospec=True,
+    ), mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.monkey', autospec=True,
+    ), mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.AUTOSCALING_METRICS_TIMEOUT', 0.01,
+    ):
+        utilizations = autoscaling_service_lib.get_all_utilizations(
+            mock.sentinel.system_paasta_config,
+            [(mock_configs[0], [], []), (mock_configs[1], [], [])],
+        )
+        assert utilizations[0] == (0.5, {})
+        assert isinstance(utilizations[1], MetricsProviderNoDataError)
+        assert all(job.dead for job in budget_jobs)
+
+
 def test_get_json_body_from_service():
     with mock.patch(
             'paasta_tools.autoscaling.autoscaling_service_lib.requests.get', autospec=True,
@@ -759,6 +938,43 @@ def test_autoscale_marathon_instance():
         mock_meteorite.create_gauge.call_count == 3
 
 
+def test_autoscale_marathon_instance_with_utilization():
+    fake_marathon_service_config = marathon_tools.MarathonServiceConfig(
+        service='fake-service',
+        instance='fake-instance',
+        cluster='fake-cluster',
+        config_dict={'min_instances': 1, 'max_instances': 10},
+        branch_dict=None,
+    )
+    with mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.set_instances_for_marathon_service',
+        autospec=True,
+    ) as mock_set_instances_for_marathon_service, mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.get_utilization', autospec=True,
+    ) as mock_get_utilization, mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.get_decision_policy', autospec=True,
+        return_value=mock.Mock(return_value=1),
+    ), mock.patch.object(
+        marathon_tools.MarathonServiceConfig, 'get_instances', autospec=True, return_value=1,
+    ), mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib._log', autospec=True,
+    ), mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.yelp_meteorite', autospec=True,
+    ):
+        autoscaling_service_lib.autoscale_marathon_instance(
+            fake_marathon_service_config,
+            mock.MagicMock(),
+            [mock.Mock()],
+            [mock.Mock()],
+            utilization=1.0,
+            log_utilization_data={},
+        )
+        assert not mock_get_utilization.called
+        mock_set_instances_for_marathon_service.assert_called_once_with(
+            service='fake-service', instance='fake-instance', instance_count=2,
+        )
+
+
 def test_autoscale_marathon_instance_up_to_min_instances():
     current_instances = 5
     fake_marathon_service_config = marathon_tools.MarathonServiceConfig(
@@ -1124,6 +1340,9 @@ def test_autoscale_services_happy_path():
     with mock.patch(
         'paasta_tools.autoscaling.autoscaling_service_lib.autoscale_marathon_instance', autospec=True,
     ) as mock_autoscale_marathon_instance, mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.get_all_utilizations', autospec=True,
+        return_value=[(0.5, mock.sentinel.log_utilization_data)],
+    ) as mock_get_all_utilizations, mock.patch(
         'paasta_tools.autoscaling.autoscaling_service_lib.get_marathon_clients', autospec=True,
     ), mock.patch(
         'paasta_tools.autoscaling.autoscaling_service_lib.get_marathon_servers', autospec=True,
@@ -1158,11 +1377,73 @@ def test_autoscale_services_happy_path():
         mock_paused.return_value = False
         mock_format_marathon_app_dict.return_value = {'id': 'fake-service.fake-instance.sha123.sha456'}
         autoscaling_service_lib.autoscale_services()
+        mock_get_all_utilizations.assert_called_once_with(
+            autoscaling_service_lib.load_system_paasta_config(),
+            [(fake_marathon_service_config, mock_marathon_tasks, mock_mesos_tasks)],
+        )
         mock_autoscale_marathon_instance.assert_called_once_with(
             fake_marathon_service_config,
             autoscaling_service_lib.load_system_paasta_config(),
             mock_marathon_tasks,
             mock_mesos_tasks,
+            utilization=0.5,
+            log_utilization_data=mock.sentinel.log_utilization_data,
+        )
+
+
+def test_autoscale_services_no_utilization():
+    fake_marathon_service_config = marathon_tools.MarathonServiceConfig(
+        service='fake-service',
+        instance='fake-instance',
+        cluster='fake-cluster',
+        config_dict={'min_instances': 1, 'max_instances': 10, 'desired_state': 'start'},
+        branch_dict=None,
+    )
+    mock_marathon_tasks = [mock.Mock(
+        id='fake-service.fake-instance.sha123.sha456',
+        health_check_results=[mock.Mock(alive=True)],
+    )]
+    mock_app = mock.Mock(tasks=mock_marathon_tasks, health_checks=[mock.Mock()])
+    with mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.autoscale_marathon_instance', autospec=True,
+    ) as mock_autoscale_marathon_instance, mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.get_all_utilizations', autospec=True,
+        return_value=[autoscaling_service_lib.MetricsProviderNoDataError('no data')],
+    ), mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.write_to_log', autospec=True,
+    ) as mock_write_to_log, mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.get_marathon_clients', autospec=True,
+    ), mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.get_marathon_servers', autospec=True,
+    ), mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.get_marathon_apps_with_clients', autospec=True,
+        return_value=[(mock_app, mock.Mock())],
+    ), mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.get_all_running_tasks', autospec=True,
+        return_value=[],
+    ), mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.load_system_paasta_config', autospec=True,
+    ), mock.patch(
+        'paasta_tools.utils.load_system_paasta_config', autospec=True,
+    ), mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.get_configs_of_services_to_scale', autospec=True,
+        return_value=[fake_marathon_service_config],
+    ), mock.patch(
+        'paasta_tools.utils.KazooClient', autospec=True,
+    ), mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.create_autoscaling_lock', autospec=True,
+    ), mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.autoscaling_is_paused', autospec=True,
+        return_value=False,
+    ), mock.patch(
+        'paasta_tools.marathon_tools.MarathonServiceConfig.format_marathon_app_dict', autospec=True,
+        return_value={'id': 'fake-service.fake-instance.sha123.sha456'},
+    ):
+        autoscaling_service_lib.autoscale_services()
+        assert not mock_autoscale_marathon_instance.called
+        mock_write_to_log.assert_called_once_with(
+            config=fake_marathon_service_config,
+            line='Caught Exception no data',
         )
 
 
@@ -1178,6 +1459,9 @@ def test_autoscale_services_not_healthy():
     with mock.patch(
         'paasta_tools.autoscaling.autoscaling_service_lib.autoscale_marathon_instance', autospec=True,
     ) as mock_autoscale_marathon_instance, mock.patch(
+        'paasta_tools.autoscaling.autoscaling_service_lib.get_all_utilizations', autospec=True,
+        side_effect=lambda system_paasta_config, instances: [(0.5, {}) for _ in instances],
+    ), mock.patch(
         'paasta_tools.autoscaling.autoscaling_service_lib.write_to_log', autospec=True,
     ) as mock_write_to_log, mock.patch(
         'paasta_tools.autoscaling.autoscaling_service_lib.get_marathon_clients', autospec=True,
@@ -1466,6 +1750,8 @@ def test_get_utilization():
             marathon_tasks=mock_marathon_tasks,
             mesos_tasks=mock_mesos_tasks,
             log_utilization_data=mock_log_utilization_data,
+            metrics_budget=None,
+            cpu_data_store=None,
             mock_param=2,
             metrics_provider='mock_provider',
         )
@@ -89,6 +89,34 @@ def test_get_boost_values_when_no_values_exist():
         )
 
 
+@freeze_time(TEST_CURRENT_TIME)
+def test_get_boosted_loads():
+    fake_end_time = float(TEST_CURRENT_TIME.timestamp()) + 10
+    fake_boost_path = cluster_boost.get_zk_boost_path('westeros-1', 'default')
+    with patch_zk_client({
+        fake_boost_path + '/end_time': str(fake_end_time).encode('utf-8'),
+        fake_boost_path + '/factor': b'1.5',
+        fake_boost_path + '/expected_load': b'80',
+    }) as mock_zk_client:
+        assert cluster_boost.get_boosted_loads({
+            ('westeros-1', 'default'): 50,
+            ('westeros-1', 'batch'): 20,
+        }) == {
+            ('westeros-1', 'default'): 80,
+            ('westeros-1', 'batch'): 20,
+        }
+        # both pools were looked up over the same connection
+        assert mock_zk_client.start.call_count == 1
+
+
+def test_get_boosted_loads_when_zookeeper_fails():
+    with mock.patch(
+        'paasta_tools.autoscaling.cluster_boost.ZookeeperPool', autospec=True,
+        side_effect=Exception('no zookeeper'),
+    ):
+        assert cluster_boost.get_boosted_loads({('westeros-1', 'default'): 50}) == {('westeros-1', 'default'): 50}
+
+
 @freeze_time(TEST_CURRENT_TIME)
 def test_set_boost_factor_with_defaults():
     fake_region = 'westeros-1'
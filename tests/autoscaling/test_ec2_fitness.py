@@ -208,3 +208,42 @@ def test_sort_by_fitness():
     # mock_slave_3 (we cant drain chronos tasks, so try and save them)
     # mock_slave_5 has fewer tasks than mock_slave_4, and so is a better candidate for killing
     assert ret == [mock_slave_3, mock_slave_4, mock_slave_5, mock_slave_2, mock_slave_1]
+
+
+def _make_slave(name, count, chronos_count, events=0, system_status='ok', instance_status='ok'):
+    mock_slave = Mock(name=name)
+    mock_slave.task_counts = SlaveTaskCount(count=count, slave=Mock(), chronos_count=chronos_count)
+    mock_slave.instance_status = {
+        'Events': [{'Code': 'instance-reboot'}] * events,
+        'SystemStatus': {'Status': system_status},
+        'InstanceStatus': {'Status': instance_status},
+    }
+    return mock_slave
+
+
+def test_ec2_fitness_key_matches_sort_by_ec2_fitness():
+    instances = [
+        _make_slave('slave1', count=3, chronos_count=1, system_status='impaired'),
+        _make_slave('slave2', count=3, chronos_count=1, events=1),
+        _make_slave('slave3', count=2, chronos_count=3),
+        _make_slave('slave4', count=3, chronos_count=1),
+        _make_slave('slave5', count=1, chronos_count=1),
+        _make_slave('slave6', count=3, chronos_count=1),
+        _make_slave('slave7', count=1, chronos_count=1, instance_status='impaired'),
+    ]
+    assert sorted(instances, key=ec2_fitness.ec2_fitness_key) == ec2_fitness.sort_by_ec2_fitness(instances)
+
+
+def test_kill_preference_heap():
+    instances = [
+        _make_slave('slave1', count=3, chronos_count=1, system_status='impaired'),
+        _make_slave('slave2', count=3, chronos_count=1),
+        _make_slave('slave3', count=2, chronos_count=3),
+        _make_slave('slave4', count=3, chronos_count=1),
+        _make_slave('slave5', count=1, chronos_count=1, events=2),
+    ]
+    expected = ec2_fitness.sort_by_ec2_fitness(instances)[::-1]
+    heap = ec2_fitness.make_kill_preference_heap(instances)
+    assert ec2_fitness.sort_by_kill_preference(heap) == expected
+    assert [ec2_fitness.pop_kill_preference(heap) for _ in instances] == expected
+    assert heap == []
@@ -0,0 +1,39 @@
+# Copyright 2015-2018 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import mock
+
+from paasta_tools.cli.cmds.compile_soa_configs import paasta_compile_soa_configs
+
+
+@mock.patch('paasta_tools.cli.cmds.compile_soa_configs.load_system_paasta_config', autospec=True)
+@mock.patch('paasta_tools.cli.cmds.compile_soa_configs.compile_soa_configs_snapshot', autospec=True)
+def test_paasta_compile_soa_configs(mock_compile_soa_configs_snapshot, mock_load_system_paasta_config, capfd):
+    mock_load_system_paasta_config.return_value.get_cluster.return_value = 'westeros-prod'
+    mock_compile_soa_configs_snapshot.return_value = 3
+    args = mock.Mock(clusters=None, soa_dir='/nail/etc/services')
+
+    assert paasta_compile_soa_configs(args) == 0
+    mock_compile_soa_configs_snapshot.assert_called_once_with(
+        clusters=['westeros-prod'],
+        soa_dir='/nail/etc/services',
+    )
+    output, _ = capfd.readouterr()
+    assert output == 'Wrote 3 entries to /nail/etc/services.snapshot\n'
+
+    args = mock.Mock(clusters=['westeros-prod', 'westeros-stage'], soa_dir='/nail/etc/services')
+    paasta_compile_soa_configs(args)
+    mock_compile_soa_configs_snapshot.assert_called_with(
+        clusters=['westeros-prod', 'westeros-stage'],
+        soa_dir='/nail/etc/services',
+    )
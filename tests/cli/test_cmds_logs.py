@@ -14,12 +14,14 @@
 import contextlib
 import datetime
 import json
+import os
 from multiprocessing import Queue
 from queue import Empty
 
 import isodate
 import mock
 import pytest
+import pytz
 from pytest import raises
 
 from paasta_tools.cli.cli import parse_args
@@ -638,6 +640,140 @@ def test_prettify_log_line_valid_json_requested_level_is_only_event():
     assert parsed_line['level'] not in actual
 
 
+def test_iterate_in_background():
+    assert list(logs.iterate_in_background(iter(range(10)), buffer_size=2)) == list(range(10))
+
+
+def test_iterate_in_background_reraises():
+    def fails():
+        yield 1
+        raise ValueError('hurp durp')
+
+    lines = logs.iterate_in_background(fails())
+    assert next(lines) == 1
+    with raises(ValueError):
+        next(lines)
+
+
+def test_merge_sorted_log_streams():
+    def stream(*hours):
+        return [
+            logs.LogRecord(datetime.datetime(2017, 1, 1, hour), {}, 'line %d' % hour) for hour in hours
+        ]
+
+    merged = logs.merge_sorted_log_streams([stream(1, 4, 5), stream(), stream(2, 3, 6)])
+    assert [record.raw_line for record in merged] == ['line %d' % hour for hour in range(1, 7)]
+
+
+def test_parse_log_record():
+    line = format_log_line('event', 'fake_cluster', 'fake_service', 'main', 'build', 'fake_line')
+    record = logs.parse_log_record(line)
+    assert record.raw_line == line
+    assert record.fields == json.loads(line)
+    assert record.timestamp == isodate.parse_datetime(record.fields['timestamp'])
+
+    assert logs.parse_log_record('not json') is None
+    assert logs.parse_log_record('[]') is None
+    assert logs.parse_log_record('{"message": "no timestamp"}').timestamp is None
+
+
+def test_log_record_sort_key():
+    assert logs.log_record_sort_key(logs.LogRecord(None, {}, '')) == logs.MIN_LOG_TIMESTAMP
+    assert logs.log_record_sort_key(
+        logs.LogRecord(datetime.datetime(2017, 1, 1), {}, ''),
+    ).isoformat() == '2017-01-01T00:00:00+00:00'
+
+
+def test_make_log_line_prefilter():
+    line = format_log_line('event', 'N/A', 'fake_service', 'main', 'build', 'fake_line')
+    assert logs.make_log_line_prefilter(['event'], ['build'], ['N/A'], None)(line) is True
+    assert logs.make_log_line_prefilter(['event'], ['build'], ['N/A'], None)(line.encode()) is True
+    assert logs.make_log_line_prefilter(['event'], ['build'], ['N/A'], None)(line.replace('/', '\\/')) is True
+    assert logs.make_log_line_prefilter(['debug'], ['build'])(line) is False
+    assert logs.make_log_line_prefilter(['event'], ['build'], ['other_cluster'])(line) is False
+    # Values that would be escaped in JSON can't be looked for in the line
+    assert logs.make_log_line_prefilter(['event'], ['build', 'quo"te'])(line) is True
+
+
+def test_paasta_log_line_prefilter_never_rejects_passing_lines():
+    levels = ['event', 'debug']
+    components = ['build', 'deploy']
+    clusters = ['fake_cluster1', 'fake_cluster2']
+    instances = ['main']
+    line_may_pass = logs.paasta_log_line_prefilter(levels, 'fake_service', components, clusters, instances)
+    for level in levels + ['other']:
+        for component in components + ['monitoring']:
+            for cluster in clusters + [ANY_CLUSTER, 'other']:
+                for instance in instances + ['canary']:
+                    line = format_log_line(level, cluster, 'fake_service', instance, component, 'fake_line')
+                    passes = logs.paasta_log_line_passes_filter(
+                        line, levels, 'fake_service', components, clusters, instances,
+                    )
+                    assert line_may_pass(line) is passes
+
+
+def test_marathon_log_line_prefilter():
+    line_may_pass = logs.marathon_log_line_prefilter([], 'fake_service', [], [], None)
+    assert line_may_pass(b'2015-07-22T10:38:46-07:00 launched fake--service.main.gitabc.config123') is True
+    assert line_may_pass(b'2015-07-22T10:38:46-07:00 launched other--service.main.gitabc.config123') is False
+
+
+def test_parse_marathon_log_record():
+    line = b'2015-07-22T10:38:46-07:00 this is a fake syslog test message'
+    record = logs.parse_marathon_log_record(line, ['fake_cluster'], 'fake_service')
+    assert record.timestamp == datetime.datetime(2015, 7, 22, 17, 38, 46)
+    assert record.fields == json.loads(record.raw_line)
+    assert record.fields['message'] == line.decode()
+    assert logs.parse_marathon_log_record(b'fake timestamp', ['fake_cluster'], 'fake_service') is None
+
+
+def test_filter_log_records():
+    lines = [
+        format_log_line('event', 'fake_cluster', 'fake_service', 'main', 'build', 'first'),
+        format_log_line('debug', 'fake_cluster', 'fake_service', 'main', 'build', 'second'),
+        format_log_line('event', 'fake_cluster', 'fake_service', 'canary', 'build', 'third'),
+    ]
+    records = list(logs.filter_log_records(
+        lines, ['event'], 'fake_service', ['build'], ['fake_cluster'], ['main', 'canary'],
+        filter_fn=logs.paasta_log_record_passes_filter,
+        parse_fn=logs.parse_log_record,
+        prefilter_fn=logs.paasta_log_line_prefilter,
+    ))
+    assert [record.fields['message'] for record in records] == ['first', 'third']
+
+
+def test_filter_scribe_logs():
+    lines = [
+        json.dumps({'timestamp': '2016-06-08T06:31:52.706609Z', 'message': 'first'}),
+        'not json',
+        json.dumps({'timestamp': '2016-06-08T06:31:53', 'message': 'second'}),
+        json.dumps({'message': 'third'}),
+    ]
+
+    @contextlib.contextmanager
+    def fake_context():
+        yield lines
+
+    with mock.patch('paasta_tools.cli.cmds.logs.scribereader', autospec=True):
+        filtered = logs.ScribeLogReader(cluster_map={}).filter_scribe_logs(
+            scribe_reader_ctx=fake_context(),
+            scribe_env='env1',
+            stream_name='stream',
+            levels=[],
+            service='fake_service',
+            components=[],
+            clusters=[],
+            instances=[],
+            filter_fn=lambda record, *args, **kwargs: record.raw_line != lines[2],
+        )
+        assert [
+            (logs.log_record_sort_key(record).isoformat(), record.raw_line) for record in filtered
+        ] == [
+            ('2016-06-08T06:31:52.706609+00:00', lines[0]),
+            ('0001-01-01T00:00:00+00:00', lines[3]),
+        ]
+
+
 def test_scribereader_run_code_over_scribe_envs():
     clusters = ['fake_cluster1', 'fake_cluster2']
     components = ['build', 'deploy', 'monitoring', 'marathon', 'chronos', 'stdout', 'stderr']
@@ -1143,3 +1279,149 @@ def test_pick_default_log_mode():
 
         # Supports tailing , time and line counts. Line counts should be prioritized
         assert logs_by_lines.call_count == 1
+
+
+def write_log_lines(path, hours, instance='main', level='event', cluster='fake_cluster'):
+    with open(str(path), 'a') as f:
+        for hour in hours:
+            f.write(format_log_line(
+                level, cluster, 'fake_service', instance, 'deploy', 'line %02d' % hour,
+                timestamp=(datetime.datetime(2017, 1, 1) + datetime.timedelta(hours=hour)).isoformat(),
+            ) + '\n')
+
+
+def test_read_lines_reversed(tmpdir):
+    tmpdir.join('log').write_binary(b'first\nsecond\n\nthird line\nlast')
+    with open(str(tmpdir.join('log')), 'rb') as f:
+        assert list(logs.read_lines_reversed(f, block_size=4)) == [
+            'last\n', 'third line\n', 'second\n', 'first\n',
+        ]
+
+
+def test_read_mmap_lines():
+    lines = b'first\nsecond\nincomplete'
+    assert list(logs.read_mmap_lines(lines, 0, len(lines))) == ['first\n', 'second\n']
+    assert list(logs.read_mmap_lines(lines, 6, 13)) == ['second\n']
+
+
+class TestFileLogIndex(object):
+    def update(self, index, path):
+        with open(str(path), 'rb') as f:
+            contents = f.read()
+        return index.update(contents, os.stat(str(path)).st_ino)
+
+    def test_update_and_get_byte_range(self, tmpdir):
+        path = tmpdir.join('log')
+        write_log_lines(path, range(24))
+        line_length = len(path.read_binary().splitlines()[0]) + 1
+        index = logs.FileLogIndex(str(path), interval=line_length * 4)
+        assert self.update(index, path) is True
+        assert index.offsets == [line_length * hour for hour in range(0, 24, 4)]
+
+        start, end = index.get_byte_range(
+            pytz.utc.localize(datetime.datetime(2017, 1, 1, 9, 30)),
+            pytz.utc.localize(datetime.datetime(2017, 1, 1, 13, 30)),
+        )
+        assert (start, end) == (line_length * 8, line_length * 16)
+
+    def test_update_extends_saved_index(self, tmpdir):
+        path = tmpdir.join('log')
+        write_log_lines(path, range(8))
+        line_length = len(path.read_binary().splitlines()[0]) + 1
+        index = logs.FileLogIndex(str(path), interval=line_length * 4)
+        self.update(index, path)
+        index.save()
+        assert tmpdir.join('.log.index').check()
+
+        write_log_lines(path, range(8, 16))
+        index = logs.FileLogIndex(str(path), interval=line_length * 4)
+        index.load()
+        assert index.offsets == [0, line_length * 4]
+        assert self.update(index, path) is True
+        assert index.offsets == [0, line_length * 4, line_length * 8, line_length * 12]
+        assert self.update(index, path) is False
+
+    def test_update_rebuilds_truncated_index(self, tmpdir):
+        path = tmpdir.join('log')
+        write_log_lines(path, range(8))
+        line_length = len(path.read_binary().splitlines()[0]) + 1
+        index = logs.FileLogIndex(str(path), interval=line_length * 4)
+        self.update(index, path)
+
+        path.write('')
+        write_log_lines(path, range(10, 20))
+        assert self.update(index, path) is True
+        assert index.offsets == [0, line_length * 4, line_length * 8]
+        assert index.timestamps[0] == pytz.utc.localize(datetime.datetime(2017, 1, 1, 10)).timestamp()
+
+
+class TestFileLogReader(object):
+    @pytest.fixture
+    def reader(self, tmpdir):
+        write_log_lines(tmpdir.join('fake_service-main.log'), range(0, 24, 2))
+        write_log_lines(tmpdir.join('fake_service-canary.log'), range(1, 24, 2), instance='canary')
+        write_log_lines(tmpdir.join('other_service-main.log'), range(24))
+        return logs.FileLogReader(str(tmpdir.join('{service}-{instance}.log')), index_interval=256)
+
+    def printed_messages(self, print_fn, reader, *args):
+        with mock.patch('paasta_tools.cli.cmds.logs.print_log_record', autospec=True) as mock_print_log_record:
+            print_fn(reader, 'fake_service', *args, ['event'], ['deploy'], ['fake_cluster'], None, False)
+        return [call[0][0].fields['message'] for call in mock_print_log_record.call_args_list]
+
+    def test_get_log_paths(self, reader, tmpdir):
+        assert reader.get_log_paths('fake_service', ['event'], ['deploy'], ['fake_cluster'], None) == [
+            str(tmpdir.join('fake_service-canary.log')), str(tmpdir.join('fake_service-main.log')),
+        ]
+        assert reader.get_log_paths('fake_service', ['event'], ['deploy'], ['fake_cluster'], ['main']) == [
+            str(tmpdir.join('fake_service-main.log')),
+        ]
+
+    def test_print_logs_by_time(self, reader, tmpdir):
+        assert self.printed_messages(
+            logs.FileLogReader.print_logs_by_time, reader,
+            pytz.utc.localize(datetime.datetime(2017, 1, 1, 4, 30)),
+            pytz.utc.localize(datetime.datetime(2017, 1, 1, 20, 30)),
+        ) == ['line %02d' % hour for hour in range(5, 21)]
+        assert tmpdir.join('.fake_service-main.log.index').check()
+
+    def test_print_last_n_logs(self, reader):
+        assert self.printed_messages(logs.FileLogReader.print_last_n_logs, reader, 5) == [
+            'line %02d' % hour for hour in range(19, 24)
+        ]
+
+    def test_paasta_logs_negative_line_count(self, reader):
+        args = mock.Mock(
+            service='fake_service', clusters='fake_cluster', instances=None, components='deploy',
+            line_count=-5, line_offset=None, time_from=None, time_to=None, tail=False, raw_mode=False,
+            verbose=False,
+        )
+        with mock.patch(
+            'paasta_tools.cli.cmds.logs.figure_out_service_name', autospec=True, return_value='fake_service',
+        ), mock.patch(
+            'paasta_tools.cli.cmds.logs.get_log_reader', autospec=True, return_value=reader,
+        ), mock.patch(
+            'paasta_tools.cli.cmds.logs.print_log_record', autospec=True,
+        ) as mock_print_log_record:
+            assert logs.paasta_logs(args) == 0
+        assert [call[0][0].fields['message'] for call in mock_print_log_record.call_args_list] == [
+            'line %02d' % hour for hour in range(19, 24)
+        ]
+
+    def test_print_logs_by_offset(self, reader):
+        assert self.printed_messages(logs.FileLogReader.print_logs_by_offset, reader, 3, 1) == [
+            'line 00', 'line 01', 'line 02',
+        ]
+        assert self.printed_messages(logs.FileLogReader.print_logs_by_offset, reader, -3, 10) == [
+            'line 07', 'line 08', 'line 09',
+        ]
+
+    def test_follow_log_files(self, reader, tmpdir):
+        def write_more(_):
+            write_log_lines(tmpdir.join('fake_service-main.log'), [24])
+            # A rotated file is read from its start
+            tmpdir.join('fake_service-canary.log').remove()
+            write_log_lines(tmpdir.join('fake_service-canary.log'), [25], instance='canary')
+
+        with mock.patch('paasta_tools.cli.cmds.logs.sleep', autospec=True, side_effect=write_more):
+            records = reader.follow_log_files('fake_service', ['event'], ['deploy'], ['fake_cluster'], None)
+            assert [next(records).fields['message'] for _ in range(2)] == ['line 25', 'line 24']
@@ -21,6 +21,7 @@ from pytest import mark
 
 from paasta_tools.chronos_tools import ChronosJobConfig
 from paasta_tools.chronos_tools import EXECUTION_DATE_FORMAT
+from paasta_tools.chronos_tools import get_related_jobs_configs
 from paasta_tools.cli.cmds.rerun import add_subparser
 from paasta_tools.cli.cmds.rerun import paasta_rerun
 
@@ -130,7 +131,7 @@ _service_name = 'a_service'
         ],
     ],
 )
-def test_rerun_validations(test_case, capfd, system_paasta_config):
+def test_rerun_validations(test_case, capfd, system_paasta_config, tmpdir):
     with patch(
         'paasta_tools.cli.cmds.rerun.figure_out_service_name', autospec=True,
     ) as mock_figure_out_service_name, patch(
@@ -152,8 +153,8 @@ def test_rerun_validations(test_case, capfd, system_paasta_config):
     ) as mock_load_system_paasta_config, patch(
         'paasta_tools.chronos_tools.read_chronos_jobs_for_service', autospec=True,
     ) as mock_read_chronos_jobs_for_service, patch(
-        'service_configuration_lib.read_services_configuration', autospec=True,
-    ) as mock_read_services_configuration:
+        'paasta_tools.cli.cmds.rerun.get_related_jobs_configs', autospec=True,
+    ) as mock_get_related_jobs_configs:
         (
             rerun_args,
             mock_figure_out_service_name.return_value,
@@ -185,7 +186,11 @@ def test_rerun_validations(test_case, capfd, system_paasta_config):
             'dependent_instance2': {'parents': ['{}.{}'.format(_service_name, 'dependent_instance1')]},
         }
 
-        mock_read_services_configuration.return_value = [_service_name]
+        for cluster in _list_clusters:
+            tmpdir.join(_service_name, 'chronos-%s.yaml' % cluster).ensure()
+        mock_get_related_jobs_configs.side_effect = lambda cluster, service, instance: get_related_jobs_configs(
+            cluster, service, instance, soa_dir=str(tmpdir), use_cache=False,
+        )
 
         args = MagicMock()
         args.service = rerun_args[0]
@@ -472,6 +472,11 @@ def test_list_paasta_services(
     expected = ['fake_service']
     actual = utils.list_paasta_services()
     assert actual == expected
+    mock_list_instances.assert_called_once_with('fake_service', soa_dir=utils.DEFAULT_SOA_DIR)
+
+    mock_list_instances.return_value = []
+    assert utils.list_paasta_services(soa_dir='/fake/soa/dir') == []
+    mock_list_services.assert_called_with(soa_dir='/fake/soa/dir')
 
 
 @patch('paasta_tools.cli.utils.guess_service_name', autospec=True)
@@ -104,46 +104,52 @@ class TestInbox(unittest.TestCase):
 
     def test_process_inbox(self):
         self.mock_inbox_q.get.side_effect = Empty
-        self.mock_inbox_q.empty.return_value = True
-        self.inbox.to_bounce = {}
         with mock.patch(
             'paasta_tools.deployd.master.Inbox.process_service_instance', autospec=True,
         ) as mock_process_service_instance, mock.patch(
             'paasta_tools.deployd.master.Inbox.process_to_bounce', autospec=True,
         ) as mock_process_to_bounce, mock.patch(
-            'time.sleep', autospec=True,
+            'paasta_tools.deployd.master.Inbox.time_until_next_bounce', autospec=True, return_value=None,
         ):
             self.inbox.process_inbox()
-            self.mock_inbox_q.get.assert_called_with(block=False)
+            self.mock_inbox_q.get.assert_called_with(timeout=None)
             assert not mock_process_service_instance.called
-            assert not mock_process_to_bounce.called
+            assert mock_process_to_bounce.call_count == 1
 
             mock_si = mock.Mock()
             self.mock_inbox_q.get.side_effect = None
             self.mock_inbox_q.get.return_value = mock_si
-            self.mock_inbox_q.empty.return_value = False
             self.inbox.process_inbox()
             mock_process_service_instance.assert_called_with(self.inbox, mock_si)
-            assert not mock_process_to_bounce.called
+            assert mock_process_to_bounce.call_count == 2
 
-            self.inbox.to_bounce = {'service.instance': mock_si}
-            self.mock_inbox_q.empty.return_value = True
-            self.inbox.process_inbox()
-            mock_process_service_instance.assert_called_with(self.inbox, mock_si)
-            assert mock_process_to_bounce.called
+    def test_time_until_next_bounce(self):
+        with mock.patch(
+            'time.time', autospec=True, return_value=50,
+        ):
+            assert self.inbox.time_until_next_bounce() is None
+
+            self.inbox.process_service_instance(mock.Mock(service='universe', instance='c137', bounce_by=60))
+            self.inbox.process_service_instance(mock.Mock(service='universe', instance='c138', bounce_by=55))
+            assert self.inbox.time_until_next_bounce() == 5
+
+            self.inbox.process_service_instance(mock.Mock(service='universe', instance='c139', bounce_by=10))
+            assert self.inbox.time_until_next_bounce() == 0
 
     def test_process_service_instance(self):
-        mock_service_instance = mock.Mock(service='universe', instance='c137')
+        mock_service_instance = mock.Mock(service='universe', instance='c137', bounce_by=10)
         with mock.patch(
             'paasta_tools.deployd.master.Inbox.should_add_to_bounce', autospec=True,
         ) as mock_should_add_to_bounce:
             mock_should_add_to_bounce.return_value = False
             self.inbox.process_service_instance(mock_service_instance)
             assert self.inbox.to_bounce == {}
+            assert self.inbox.to_bounce_heap == []
 
             mock_should_add_to_bounce.return_value = True
             self.inbox.process_service_instance(mock_service_instance)
             assert self.inbox.to_bounce == {'universe.c137': mock_service_instance}
+            assert self.inbox.to_bounce_heap == [(10, mock.ANY, 'universe.c137', mock_service_instance)]
 
     def test_should_add_to_bounce(self):
         mock_service_instance_1 = mock.Mock(bounce_by=10)
@@ -160,18 +166,37 @@ class TestInbox(unittest.TestCase):
             'time.time', autospec=True,
         ) as mock_time:
             mock_time.return_value = 50
-            mock_service_instance_1 = mock.Mock(bounce_by=10)
-            mock_service_instance_2 = mock.Mock(bounce_by=60)
-            self.inbox.to_bounce = {
-                'universe.c137': mock_service_instance_1,
-                'universe.c138': mock_service_instance_2,
-            }
+            mock_service_instance_1 = mock.Mock(service='universe', instance='c137', bounce_by=10)
+            mock_service_instance_2 = mock.Mock(service='universe', instance='c138', bounce_by=60)
+            self.inbox.process_service_instance(mock_service_instance_1)
+            self.inbox.process_service_instance(mock_service_instance_2)
             self.inbox.process_to_bounce()
             self.mock_bounce_q.put.assert_called_with(mock_service_instance_1.priority, mock_service_instance_1)
             assert self.mock_bounce_q.put.call_count == 1
+            assert self.inbox.to_bounce == {'universe.c138': mock_service_instance_2}
+
+            mock_time.return_value = 60
+            self.inbox.process_to_bounce()
+            self.mock_bounce_q.put.assert_called_with(mock_service_instance_2.priority, mock_service_instance_2)
+            assert self.mock_bounce_q.put.call_count == 2
+            assert self.inbox.to_bounce == {}
+            assert self.inbox.to_bounce_heap == []
+
+    def test_process_to_bounce_replaced(self):
+        with mock.patch(
+            'time.time', autospec=True, return_value=50,
+        ):
+            mock_service_instance_1 = mock.Mock(service='universe', instance='c137', bounce_by=40)
+            mock_service_instance_2 = mock.Mock(service='universe', instance='c137', bounce_by=20)
+            self.inbox.process_service_instance(mock_service_instance_1)
+            self.inbox.process_service_instance(mock_service_instance_2)
+            self.inbox.process_to_bounce()
+            self.mock_bounce_q.put.assert_called_once_with(mock_service_instance_2.priority, mock_service_instance_2)
+            assert self.inbox.to_bounce_heap == []
 
     def tearDown(self):
         self.inbox.to_bounce = {}
+        self.inbox.to_bounce_heap = []
 
 
 class TestDeployDaemon(unittest.TestCase):
@@ -184,6 +209,8 @@ class TestDeployDaemon(unittest.TestCase):
             'paasta_tools.deployd.master.Inbox', autospec=True,
         ) as self.mock_inbox, mock.patch(
             'paasta_tools.deployd.master.get_marathon_clients_from_config', autospec=True,
+        ), mock.patch(
+            'paasta_tools.deployd.master.enable_formatted_app_dict_cache', autospec=True,
         ), mock.patch(
             'paasta_tools.deployd.master.load_system_paasta_config', autospec=True,
         ) as mock_config_getter:
@@ -194,6 +221,9 @@ class TestDeployDaemon(unittest.TestCase):
                 get_cluster=mock.Mock(return_value='westeros-prod'),
                 get_log_writer=mock.Mock(return_value={'driver': None}),
                 get_deployd_startup_oracle_enabled=mock.Mock(return_value=False),
+                get_deployd_marathon_app_snapshot_enabled=mock.Mock(return_value=False),
+                get_deployd_marathon_app_snapshot_refresh_interval=mock.Mock(return_value=5),
+                get_deployd_use_worker_processes=mock.Mock(return_value=False),
             )
             mock_config_getter.return_value = mock_config
             self.deployd = DeployDaemon()
@@ -253,6 +283,28 @@ class TestDeployDaemon(unittest.TestCase):
             self.deployd.startup()
             assert mock_prioritise_bouncing_services.called
 
+    def test_startup_with_app_snapshot(self):
+        self.deployd.config.get_deployd_marathon_app_snapshot_enabled = mock.Mock(return_value=True)
+        with mock.patch(
+            'paasta_tools.deployd.master.QueueMetrics', autospec=True,
+        ), mock.patch(
+            'paasta_tools.deployd.master.get_metrics_interface', autospec=True,
+        ), mock.patch(
+            'paasta_tools.deployd.master.DeployDaemon.start_watchers', autospec=True,
+        ), mock.patch(
+            'paasta_tools.deployd.master.DeployDaemon.add_all_services', autospec=True,
+        ), mock.patch(
+            'paasta_tools.deployd.master.DeployDaemon.start_workers', autospec=True,
+        ), mock.patch(
+            'paasta_tools.deployd.master.DeployDaemon.main_loop', autospec=True,
+        ), mock.patch(
+            'paasta_tools.deployd.master.MarathonAppSnapshotter', autospec=True,
+        ) as mock_snapshotter:
+            self.deployd.startup()
+            mock_snapshotter.assert_called_with(self.deployd.marathon_clients, 5)
+            assert mock_snapshotter.return_value.start.called
+            assert self.deployd.app_snapshotter == mock_snapshotter.return_value
+
     def test_main_loop(self):
         with mock.patch(
             'time.sleep', autospec=True,
@@ -369,6 +421,19 @@ class TestDeployDaemon(unittest.TestCase):
             self.deployd.start_workers()
             assert mock_paasta_worker.call_count == 5
 
+    def test_start_workers_with_processes(self):
+        self.deployd.config.get_deployd_use_worker_processes = mock.Mock(return_value=True)
+        with mock.patch(
+            'paasta_tools.deployd.master.PaastaDeployWorker', autospec=True,
+        ) as mock_paasta_worker, mock.patch(
+            'paasta_tools.deployd.master.PaastaDeployProcessWorker', autospec=True,
+        ) as mock_paasta_process_worker:
+            self.deployd.metrics = mock.Mock()
+            self.deployd.start_workers()
+            assert not mock_paasta_worker.called
+            assert mock_paasta_process_worker.call_count == 5
+            assert mock_paasta_process_worker.return_value.start.call_count == 5
+
     def test_prioritise_bouncing_services(self):
         with mock.patch(
             'paasta_tools.deployd.common.get_priority', autospec=True, return_value=0,
@@ -0,0 +1,98 @@
+import unittest
+
+import mock
+
+from paasta_tools.deployd.snapshot import AppsSnapshot
+from paasta_tools.deployd.snapshot import get_client_key
+from paasta_tools.deployd.snapshot import MarathonAppSnapshotter
+
+
+def test_get_client_key():
+    mock_client = mock.Mock(servers=['http://b', 'http://a'])
+    assert get_client_key(mock_client) == ('http://a', 'http://b')
+
+
+class TestMarathonAppSnapshotter(unittest.TestCase):
+    def setUp(self):
+        self.mock_client = mock.Mock(servers=['http://marathon1'])
+        self.mock_other_client = mock.Mock(servers=['http://marathon2'])
+        self.mock_marathon_clients = mock.Mock(
+            get_all_clients=mock.Mock(return_value=[self.mock_client, self.mock_other_client]),
+        )
+        self.snapshotter = MarathonAppSnapshotter(self.mock_marathon_clients, 5)
+
+    def test_refresh(self):
+        mock_apps = [mock.Mock(), mock.Mock()]
+        with mock.patch(
+            'paasta_tools.deployd.snapshot.get_all_marathon_apps', autospec=True,
+            side_effect=[mock_apps, Exception],
+        ) as mock_get_all_marathon_apps, mock.patch(
+            'time.time', autospec=True, return_value=1,
+        ):
+            self.snapshotter.refresh()
+            mock_get_all_marathon_apps.assert_any_call(self.mock_client, embed_tasks=True)
+            assert self.snapshotter.snapshots == {
+                ('http://marathon1',): AppsSnapshot(fetched_at=1, apps=mock_apps),
+            }
+
+    def test_refresh_prunes_stale_since(self):
+        self.snapshotter.snapshots = {
+            ('http://marathon2',): AppsSnapshot(fetched_at=3, apps=[]),
+        }
+        self.snapshotter.stale_since = {
+            ('universe', 'c137'): 2,
+            ('universe', 'c138'): 4,
+        }
+        with mock.patch(
+            'paasta_tools.deployd.snapshot.get_all_marathon_apps', autospec=True,
+            side_effect=[[], Exception],
+        ), mock.patch(
+            'time.time', autospec=True, return_value=5,
+        ):
+            self.snapshotter.refresh()
+        # marathon2 still only has a snapshot from 3, so c138 must wait for a newer one
+        assert self.snapshotter.stale_since == {('universe', 'c138'): 4}
+
+    def test_get_apps_with_clients(self):
+        mock_app = mock.Mock()
+        mock_other_app = mock.Mock()
+        self.snapshotter.snapshots = {
+            ('http://marathon1',): AppsSnapshot(fetched_at=10, apps=[mock_app]),
+            ('http://marathon2',): AppsSnapshot(fetched_at=20, apps=[mock_other_app]),
+        }
+        ret = self.snapshotter.get_apps_with_clients(
+            service='universe',
+            instance='c137',
+            clients=[self.mock_client, self.mock_other_client],
+            timeout=0,
+        )
+        assert ret == [(mock_app, self.mock_client), (mock_other_app, self.mock_other_client)]
+
+    def test_get_apps_with_clients_stale(self):
+        self.snapshotter.snapshots = {
+            ('http://marathon1',): AppsSnapshot(fetched_at=10, apps=[mock.Mock()]),
+        }
+        with mock.patch(
+            'time.time', autospec=True, return_value=15,
+        ):
+            self.snapshotter.mark_stale('universe', 'c137')
+        assert self.snapshotter.get_apps_with_clients(
+            service='universe',
+            instance='c137',
+            clients=[self.mock_client],
+            timeout=0,
+        ) is None
+        assert self.snapshotter.get_apps_with_clients(
+            service='universe',
+            instance='c138',
+            clients=[self.mock_client],
+            timeout=0,
+        ) is not None
+
+    def test_get_apps_with_clients_missing_shard(self):
+        assert self.snapshotter.get_apps_with_clients(
+            service='universe',
+            instance='c137',
+            clients=[self.mock_client],
+            timeout=0,
+        ) is None
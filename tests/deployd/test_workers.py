@@ -1,3 +1,4 @@
+import logging
 import unittest
 
 import mock
@@ -6,6 +7,11 @@ from pytest import raises
 from paasta_tools.deployd.common import BaseServiceInstance
 from paasta_tools.deployd.common import BounceTimers
 from paasta_tools.deployd.workers import BounceResults
+from paasta_tools.deployd.workers import deploy_process_main
+from paasta_tools.deployd.workers import DeployProcessDied
+from paasta_tools.deployd.workers import DeployProcessError
+from paasta_tools.deployd.workers import DeployProcessTimedOut
+from paasta_tools.deployd.workers import PaastaDeployProcessWorker
 from paasta_tools.deployd.workers import PaastaDeployWorker
 from paasta_tools.marathon_tools import DEFAULT_SOA_DIR
 
@@ -18,6 +24,7 @@ class TestPaastaDeployWorker(unittest.TestCase):
         mock_config = mock.Mock(
             get_cluster=mock.Mock(return_value='westeros-prod'),
             get_deployd_worker_failure_backoff_factor=mock.Mock(return_value=30),
+            get_deployd_marathon_app_snapshot_refresh_interval=mock.Mock(return_value=5),
         )
         with mock.patch(
             'paasta_tools.deployd.workers.PaastaDeployWorker.setup', autospec=True,
@@ -79,8 +86,6 @@ class TestPaastaDeployWorker(unittest.TestCase):
         with mock.patch(
             'time.time', autospec=True, return_value=1,
         ), mock.patch(
-            'time.sleep', autospec=True,
-        ) as mock_sleep, mock.patch(
             'paasta_tools.deployd.workers.PaastaDeployWorker.process_service_instance', autospec=True,
         ) as mock_process_service_instance:
             mock_timers = mock.Mock()
@@ -90,14 +95,13 @@ class TestPaastaDeployWorker(unittest.TestCase):
                 bounce_timers=mock_timers,
             )
             mock_process_service_instance.return_value = mock_bounce_results
-            mock_sleep.side_effect = LoopBreak
             mock_si = mock.Mock(
                 service='universe',
                 instance='c137',
                 failures=0,
                 priority=0,
             )
-            self.mock_bounce_q.get.return_value = mock_si
+            self.mock_bounce_q.get.side_effect = [mock_si, LoopBreak]
             with raises(LoopBreak):
                 self.worker.run()
             mock_process_service_instance.assert_called_with(self.worker, mock_si)
@@ -118,6 +122,7 @@ class TestPaastaDeployWorker(unittest.TestCase):
                 failures=1,
                 priority=0,
             )
+            self.mock_bounce_q.get.side_effect = [mock_si, LoopBreak]
             with raises(LoopBreak):
                 self.worker.run()
             mock_process_service_instance.assert_called_with(self.worker, mock_si)
@@ -129,7 +134,7 @@ class TestPaastaDeployWorker(unittest.TestCase):
                 failures=0,
                 priority=0,
             )
-            self.mock_bounce_q.get.return_value = mock_si
+            self.mock_bounce_q.get.side_effect = [mock_si, LoopBreak]
             mock_process_service_instance.side_effect = Exception
             mock_queued_si = BaseServiceInstance(
                 service='universe',
@@ -200,6 +205,201 @@ class TestPaastaDeployWorker(unittest.TestCase):
             assert mock_setup_timers.return_value.processed_by_worker.start.called
             assert not mock_setup_timers.return_value.bounce_length.stop.called
 
+    def test_get_marathon_apps_with_clients(self):
+        mock_si = mock.Mock(service='universe', instance='c137')
+        assert self.worker.get_marathon_apps_with_clients(mock_si) is None
+
+        self.worker.marathon_clients = mock.Mock()
+        self.worker.app_snapshotter = mock.Mock()
+        ret = self.worker.get_marathon_apps_with_clients(mock_si)
+        assert ret == self.worker.app_snapshotter.get_apps_with_clients.return_value
+        self.worker.app_snapshotter.get_apps_with_clients.assert_called_with(
+            service='universe',
+            instance='c137',
+            clients=self.worker.marathon_clients.get_all_clients.return_value,
+            timeout=10,
+        )
+
+    def test_process_service_instance_with_app_snapshot(self):
+        self.worker.app_snapshotter = mock.Mock()
+        with mock.patch(
+            'paasta_tools.deployd.workers.PaastaDeployWorker.setup_timers', autospec=True,
+        ), mock.patch(
+            'paasta_tools.deployd.workers.deploy_marathon_service', autospec=True,
+            return_value=(0, None),
+        ) as mock_deploy_marathon_service:
+            self.worker.marathon_clients = mock.Mock()
+            mock_si = mock.Mock(
+                service='universe',
+                instance='c137',
+                failures=0,
+            )
+            self.worker.process_service_instance(mock_si)
+            mock_deploy_marathon_service.assert_called_with(
+                service='universe',
+                instance='c137',
+                clients=self.worker.marathon_clients,
+                soa_dir=DEFAULT_SOA_DIR,
+                marathon_apps_with_clients=self.worker.app_snapshotter.get_apps_with_clients.return_value,
+            )
+            self.worker.app_snapshotter.mark_stale.assert_called_with('universe', 'c137')
+
 
 class LoopBreak(Exception):
     pass
+
+
+class TestPaastaDeployProcessWorker(unittest.TestCase):
+    def setUp(self):
+        mock_config = mock.Mock(
+            get_cluster=mock.Mock(return_value='westeros-prod'),
+            get_deployd_log_level=mock.Mock(return_value='INFO'),
+            get_deployd_worker_process_timeout=mock.Mock(return_value=600),
+        )
+        with mock.patch(
+            'paasta_tools.deployd.workers.PaastaDeployWorker.setup', autospec=True,
+        ), mock.patch(
+            'paasta_tools.deployd.workers.PaastaDeployProcessWorker.start_process', autospec=True,
+        ):
+            self.worker = PaastaDeployProcessWorker(
+                1,
+                mock.Mock(),
+                mock.Mock(),
+                mock_config,
+                mock.Mock(),
+            )
+        self.worker.conn = mock.Mock()
+        self.worker.process = mock.Mock()
+        self.worker.log_listener = mock.Mock()
+
+    def test_start_process(self):
+        mock_handler = mock.Mock()
+        with mock.patch(
+            'paasta_tools.deployd.workers.multiprocessing.get_context', autospec=True,
+        ) as mock_get_context, mock.patch(
+            'paasta_tools.deployd.workers.logging.handlers.QueueListener', autospec=True,
+        ) as mock_queue_listener, mock.patch.object(
+            logging.getLogger(), 'handlers', [mock_handler],
+        ):
+            mock_context = mock_get_context.return_value
+            mock_parent_conn, mock_child_conn = mock.Mock(), mock.Mock()
+            mock_context.Pipe.return_value = (mock_parent_conn, mock_child_conn)
+            self.worker.start_process()
+            mock_get_context.assert_called_with('spawn')
+            mock_queue_listener.assert_called_with(
+                mock_context.Queue.return_value,
+                mock_handler,
+                respect_handler_level=True,
+            )
+            assert mock_queue_listener.return_value.start.called
+            mock_context.Process.assert_called_with(
+                target=deploy_process_main,
+                args=(mock_child_conn, mock_context.Queue.return_value, 'INFO'),
+                name='Worker1Process',
+                daemon=True,
+            )
+            assert self.worker.process.start.called
+            assert mock_child_conn.close.called
+            assert self.worker.conn is mock_parent_conn
+
+    def test_restart_process(self):
+        mock_process = self.worker.process
+        mock_log_listener = self.worker.log_listener
+        with mock.patch(
+            'paasta_tools.deployd.workers.PaastaDeployProcessWorker.start_process', autospec=True,
+        ) as mock_start_process:
+            self.worker.restart_process()
+            assert mock_process.terminate.called
+            assert mock_log_listener.stop.called
+            mock_start_process.assert_called_with(self.worker)
+
+    def test_deploy_service_instance(self):
+        mock_si = mock.Mock(service='universe', instance='c137')
+        mock_app = mock.Mock(id='/universe.c137.gitdeadbeef.config1337')
+        mock_other_app = mock.Mock(id='/universe.c138.gitdeadbeef.config1337')
+        mock_client = mock.Mock(servers=['http://marathon2', 'http://marathon1'])
+        self.worker.conn.poll.return_value = True
+        self.worker.conn.recv.return_value = ('ok', (0, 60))
+        assert self.worker.deploy_service_instance(
+            mock_si,
+            [(mock_app, mock_client), (mock_other_app, mock_client)],
+        ) == (0, 60)
+        self.worker.conn.send.assert_called_with(
+            ('universe', 'c137', [(mock_app, ('http://marathon1', 'http://marathon2'))]),
+        )
+        self.worker.conn.poll.assert_called_with(600)
+
+        assert self.worker.deploy_service_instance(mock_si, None) == (0, 60)
+        self.worker.conn.send.assert_called_with(('universe', 'c137', None))
+
+        self.worker.conn.recv.return_value = ('error', 'ValueError()')
+        with raises(DeployProcessError):
+            self.worker.deploy_service_instance(mock_si, None)
+
+    def test_deploy_service_instance_process_died(self):
+        self.worker.conn.poll.return_value = True
+        self.worker.conn.recv.side_effect = EOFError
+        with mock.patch(
+            'paasta_tools.deployd.workers.PaastaDeployProcessWorker.restart_process', autospec=True,
+        ) as mock_restart_process:
+            with raises(DeployProcessDied):
+                self.worker.deploy_service_instance(mock.Mock(service='universe', instance='c137'), None)
+            mock_restart_process.assert_called_with(self.worker)
+
+    def test_deploy_service_instance_process_timed_out(self):
+        self.worker.conn.poll.return_value = False
+        with mock.patch(
+            'paasta_tools.deployd.workers.PaastaDeployProcessWorker.restart_process', autospec=True,
+        ) as mock_restart_process:
+            with raises(DeployProcessTimedOut):
+                self.worker.deploy_service_instance(mock.Mock(service='universe', instance='c137'), None)
+            mock_restart_process.assert_called_with(self.worker)
+            assert not self.worker.conn.recv.called
+
+
+def test_deploy_process_main():
+    mock_client = mock.Mock(servers=['http://marathon1'])
+    mock_app = mock.Mock()
+    mock_conn = mock.Mock()
+    mock_conn.recv.side_effect = [
+        ('universe', 'c137', [(mock_app, ('http://marathon1',))]),
+        ('universe', 'c138', None),
+        EOFError,
+    ]
+    mock_log_queue = mock.Mock()
+    with mock.patch(
+        'paasta_tools.deployd.workers.logging.getLogger', autospec=True,
+    ) as mock_get_logger, mock.patch(
+        'paasta_tools.deployd.workers.logging.handlers.QueueHandler', autospec=True,
+    ) as mock_queue_handler, mock.patch(
+        'paasta_tools.deployd.workers.service_configuration_lib.disable_yaml_cache', autospec=True,
+    ), mock.patch(
+        'paasta_tools.deployd.workers.marathon_tools.enable_formatted_app_dict_cache', autospec=True,
+    ) as mock_enable_formatted_app_dict_cache, mock.patch(
+        'paasta_tools.deployd.workers.load_system_paasta_config', autospec=True,
+    ), mock.patch(
+        'paasta_tools.deployd.workers.marathon_tools.get_marathon_servers', autospec=True,
+    ), mock.patch(
+        'paasta_tools.deployd.workers.marathon_tools.get_marathon_clients', autospec=True,
+    ) as mock_get_marathon_clients, mock.patch(
+        'paasta_tools.deployd.workers.deploy_marathon_service', autospec=True,
+        side_effect=[(0, None), ValueError("nope")],
+    ) as mock_deploy_marathon_service:
+        mock_get_marathon_clients.return_value.get_all_clients.return_value = [mock_client]
+        deploy_process_main(mock_conn, mock_log_queue, 'INFO')
+
+        mock_queue_handler.assert_called_with(mock_log_queue)
+        mock_get_logger.return_value.addHandler.assert_any_call(mock_queue_handler.return_value)
+        assert mock_enable_formatted_app_dict_cache.called
+
+        mock_deploy_marathon_service.assert_any_call(
+            service='universe',
+            instance='c137',
+            clients=mock_get_marathon_clients.return_value,
+            soa_dir=DEFAULT_SOA_DIR,
+            marathon_apps_with_clients=[(mock_app, mock_client)],
+        )
+        mock_conn.send.assert_has_calls([
+            mock.call(('ok', (0, None))),
+            mock.call(('error', "ValueError('nope')")),
+        ])
@@ -39,3 +39,19 @@ def test_update_constraint_state_increments_counters():
     state: constraints.ConstraintState = {}
     constraints.update_constraint_state(offer, cons, state)
     assert state['MAX_PER']['pool']['test'] == 1
+
+
+def test_copy_constraint_state_does_not_change_original():
+    attr = Mock(text=Mock(value='test'))
+    attr.configure_mock(name='pool')
+    offer = Mock(attributes=[attr])
+    cons = [['pool', 'MAX_PER', '5'], ['region', 'EQUALS', 'a']]
+    state: constraints.ConstraintState = {'MAX_PER': {'pool': {'test': 1}, 'region': {'a': 2}}}
+    new_state = constraints.copy_constraint_state(state, cons)
+    constraints.update_constraint_state(offer, cons, new_state)
+    assert new_state == {'MAX_PER': {'pool': {'test': 2}, 'region': {'a': 2}}}
+    assert state == {'MAX_PER': {'pool': {'test': 1}, 'region': {'a': 2}}}
+
+    new_state = constraints.copy_constraint_state({}, cons)
+    constraints.update_constraint_state(offer, cons, new_state)
+    assert new_state == {'MAX_PER': {'pool': {'test': 1}}}
@@ -1,3 +1,5 @@
+import copy
+
 import mock
 import pytest
 from addict import Dict
@@ -275,6 +277,53 @@ class TestNativeScheduler(object):
         assert not scheduler.offer_matches_pool(make_fake_offer(port_begin=12345, port_end=12345, pool=None))
 
 
+class TestPortRanges(object):
+    def test_take_random_port_takes_every_port_once(self):
+        ports = native_scheduler.PortRanges([(31000, 31004), (32000, 32000), (5, 4)])
+        assert len(ports) == 6
+        taken = [ports.take_random_port() for _ in range(6)]
+        assert sorted(taken) == [31000, 31001, 31002, 31003, 31004, 32000]
+        assert len(ports) == 0
+        with pytest.raises(ValueError):
+            ports.take_random_port()
+
+    def test_take_random_port_splits_range(self):
+        ports = native_scheduler.PortRanges([(31000, 31004)])
+        with mock.patch('paasta_tools.frameworks.native_scheduler.random.randrange', autospec=True, return_value=2):
+            assert ports.take_random_port() == 31002
+        assert ports.ranges == [[31000, 31001], [31003, 31004]]
+        assert len(ports) == 4
+
+
+def test_copy_task_with_port():
+    base_task = {
+        'name': 'service_name.instance_name',
+        'task_id': {'value': ''},
+        'agent_id': {'value': 'super_big_slave'},
+        'container': {
+            'type': 'DOCKER',
+            'docker': {
+                'image': 'fake/busybox',
+                'network': 'BRIDGE',
+                'port_mappings': [{'container_port': 8888, 'host_port': 0, 'protocol': 'tcp'}],
+            },
+            'volumes': [],
+        },
+        'resources': [
+            {'name': 'cpus', 'type': 'SCALAR', 'scalar': {'value': 0.1}},
+            {'name': 'ports', 'type': 'RANGES', 'ranges': {'range': [{'begin': 0, 'end': 0}]}},
+        ],
+    }
+    expected = copy.deepcopy(base_task)
+    expected['task_id'] = {'value': 'foo.bar'}
+    expected['container']['docker']['port_mappings'][0]['host_port'] = 31337
+    expected['resources'][1]['ranges']['range'][0] = {'begin': 31337, 'end': 31337}
+
+    original = copy.deepcopy(base_task)
+    assert native_scheduler.copy_task_with_port(base_task, 'foo.bar', 31337) == expected
+    assert base_task == original
+
+
 class TestNativeServiceConfig(object):
     def test_base_task(self, system_paasta_config):
         service_name = "service_name"
@@ -4,8 +4,11 @@ import mock
 import pytest
 from kazoo.client import KazooClient
 from kazoo.exceptions import BadVersionError
+from kazoo.exceptions import ConnectionLoss
 from kazoo.exceptions import NodeExistsError
 from kazoo.exceptions import NoNodeError
+from kazoo.protocol.states import EventType
+from kazoo.protocol.states import WatchedEvent
 
 from paasta_tools.frameworks.task_store import DictTaskStore
 from paasta_tools.frameworks.task_store import MesosTaskParameters
@@ -50,22 +53,88 @@ class TestMesosTaskParameters(object):
         assert MesosTaskParameters.deserialize(json.dumps(param_dict)) == MesosTaskParameters(**param_dict)
 
 
+class FakeAsyncResult(object):
+    """Stands in for a kazoo IAsyncResult that has already completed"""
+
+    def __init__(self, value=None, exception=None):
+        self.value = value
+        self.exception = exception
+
+    def get(self):
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+    def rawlink(self, callback):
+        callback(self)
+
+
+class PendingAsyncResult(FakeAsyncResult):
+    """Stands in for a kazoo IAsyncResult that completes when the test says so"""
+
+    def __init__(self):
+        super(PendingAsyncResult, self).__init__()
+        self.callbacks = []
+
+    def rawlink(self, callback):
+        self.callbacks.append(callback)
+
+    def complete(self, value):
+        self.value = value
+        for callback in self.callbacks:
+            callback(self)
+
+
 class TestZKTaskStore(object):
     @pytest.yield_fixture
     def mock_zk_client(self):
         spec_zk_client = KazooClient()
         mock_zk_client = mock.Mock(spec=spec_zk_client)
+        mock_zk_client.get_children.return_value = []
         with mock.patch('paasta_tools.frameworks.task_store.KazooClient', autospec=True, return_value=mock_zk_client):
             yield mock_zk_client
 
-    def test_get_task(self, mock_zk_client):
-        zk_task_store = ZKTaskStore(
+    @pytest.fixture
+    def zk_task_store(self, mock_zk_client):
+        return ZKTaskStore(
             service_name="a",
             instance_name="b",
             framework_id="c",
             system_paasta_config=mock.Mock(),
         )
 
+    def test_init_loads_all_tasks(self, mock_zk_client):
+        mock_zk_client.get_children.return_value = ['task1', 'bogus']
+        results = {
+            '/task1': mock.Mock(get=mock.Mock(return_value=('{"health": "healthy"}', mock.Mock(mzxid=1)))),
+            '/bogus': mock.Mock(get=mock.Mock(return_value=('not json', mock.Mock(mzxid=2)))),
+        }
+        mock_zk_client.get_async.side_effect = lambda path, watch: results[path]
+
+        with mock.patch('paasta_tools.frameworks.task_store._log', autospec=True):
+            zk_task_store = ZKTaskStore(
+                service_name="a",
+                instance_name="b",
+                framework_id="c",
+                system_paasta_config=mock.Mock(),
+            )
+
+        assert zk_task_store.get_all_tasks() == {'task1': MesosTaskParameters(health='healthy')}
+        assert zk_task_store.get_task('task1') == MesosTaskParameters(health='healthy')
+        assert zk_task_store.get_task('bogus') is None
+        # each task is read and deserialized once
+        assert not results['/task1'].rawlink.called
+        mock_zk_client.ChildrenWatch.assert_called_once_with('/', zk_task_store._children_changed)
+
+        # reads come from memory
+        mock_zk_client.get.reset_mock()
+        mock_zk_client.get_async.reset_mock()
+        zk_task_store.get_all_tasks()
+        zk_task_store.get_task('task1')
+        assert not mock_zk_client.get.called
+        assert not mock_zk_client.get_async.called
+
+    def test_get_task(self, zk_task_store):
         fake_znodestat = mock.Mock()
         zk_task_store.zk_client.get.return_value = ('{"health": "healthy"}', fake_znodestat)
         params, stat = zk_task_store._get_task("d")
@@ -73,87 +142,167 @@ class TestZKTaskStore(object):
         assert stat == fake_znodestat
         assert params.health == "healthy"
 
-    def test_update_task(self, mock_zk_client):
-        zk_task_store = ZKTaskStore(
-            service_name="a",
-            instance_name="b",
-            framework_id="c",
-            system_paasta_config=mock.Mock(),
+    def test_watches(self, zk_task_store):
+        zk_task_store._cache_task('task1', MesosTaskParameters(health='healthy'), mock.Mock(mzxid=1))
+        zk_task_store._cache_task('task2', MesosTaskParameters(health='healthy'), mock.Mock(mzxid=1))
+
+        zk_task_store._children_changed(['task1', 'task3'])
+        assert set(zk_task_store.get_all_tasks()) == {'task1'}
+        zk_task_store.zk_client.get_async.assert_called_once_with('/task3', watch=zk_task_store._task_changed)
+
+        zk_task_store._task_fetched(
+            'task3',
+            mock.Mock(get=mock.Mock(return_value=('{"is_draining": true}', mock.Mock(mzxid=3)))),
         )
+        assert zk_task_store.get_task('task3') == MesosTaskParameters(is_draining=True)
+
+        zk_task_store.zk_client.get_async.reset_mock()
+        zk_task_store._task_changed(WatchedEvent(type=EventType.CHANGED, state=None, path='/task1'))
+        zk_task_store.zk_client.get_async.assert_called_once_with('/task1', watch=zk_task_store._task_changed)
+
+        zk_task_store._task_changed(WatchedEvent(type=EventType.DELETED, state=None, path='/task1'))
+        assert set(zk_task_store.get_all_tasks()) == {'task3'}
+
+        zk_task_store._task_fetched('task3', mock.Mock(get=mock.Mock(side_effect=NoNodeError)))
+        assert zk_task_store.get_all_tasks() == {}
 
+    def test_cache_task_ignores_older_versions(self, zk_task_store):
+        zk_task_store._cache_task('task1', MesosTaskParameters(health='new'), mock.Mock(mzxid=5))
+        zk_task_store._cache_task('task1', MesosTaskParameters(health='old'), mock.Mock(mzxid=4))
+        assert zk_task_store.get_task('task1') == MesosTaskParameters(health='new')
+
+    def test_overwrite_task(self, zk_task_store):
+        zk_task_store.zk_client.set_async.return_value = FakeAsyncResult(exception=NoNodeError())
+        zk_task_store.zk_client.create_async.return_value = FakeAsyncResult(('/task_id', mock.Mock(mzxid=1)))
+        zk_task_store.overwrite_task('task_id', MesosTaskParameters(health='healthy'))
+        zk_task_store.zk_client.set_async.assert_called_once_with('/task_id', mock.ANY, version=-1)
+        zk_task_store.zk_client.create_async.assert_called_once_with('/task_id', mock.ANY, include_data=True)
+        assert zk_task_store.get_task('task_id') == MesosTaskParameters(health='healthy')
+        assert zk_task_store.tasks['task_id'][1].mzxid == 1
+
+    def test_overwrite_task_is_cached_before_it_is_written(self, zk_task_store):
+        pending_write = PendingAsyncResult()
+        zk_task_store.zk_client.set_async.return_value = pending_write
+        zk_task_store.overwrite_task('task_id', MesosTaskParameters(health='healthy'))
+        assert zk_task_store.get_task('task_id') == MesosTaskParameters(health='healthy')
+
+        pending_write.complete(mock.Mock(mzxid=1))
+        assert zk_task_store.tasks['task_id'][1].mzxid == 1
+
+    def test_update_task(self, zk_task_store):
         # Happy case - task exists, no conflict on update.
-        fake_znodestat = mock.Mock(version=1)
-        zk_task_store.zk_client.get.return_value = ('{"health": "healthy"}', fake_znodestat)
+        zk_task_store._cache_task('task_id', MesosTaskParameters(health='healthy'), mock.Mock(version=1, mzxid=1))
+        zk_task_store.zk_client.set_async.return_value = FakeAsyncResult(mock.Mock(version=2, mzxid=2))
         new_params = zk_task_store.update_task("task_id", is_draining=True)
         assert new_params.is_draining is True
         assert new_params.health == 'healthy'
+        assert not zk_task_store.zk_client.get_async.called
+        zk_task_store.zk_client.set_async.assert_called_once_with('/task_id', mock.ANY, version=1)
+        assert zk_task_store.get_task('task_id') == new_params
+        assert zk_task_store.tasks['task_id'][1].mzxid == 2
 
         # Second happy case - no task exists.
-        fake_znodestat = mock.Mock(version=1)
-        zk_task_store.zk_client.get.side_effect = NoNodeError()
-        new_params = zk_task_store.update_task("task_id", is_draining=True)
+        zk_task_store.zk_client.create_async.return_value = FakeAsyncResult(
+            ('/task_id2', mock.Mock(version=0, mzxid=3)),
+        )
+        new_params = zk_task_store.update_task("task_id2", is_draining=True)
         assert new_params.is_draining is True
         assert new_params.health is None
+        zk_task_store.zk_client.create_async.assert_called_once_with('/task_id2', mock.ANY, include_data=True)
+        assert zk_task_store.get_task('task_id2') == new_params
 
         # Someone changed our data out from underneath us.
-        zk_task_store.zk_client.get.reset_mock()
-        zk_task_store.zk_client.set.reset_mock()
-        zk_task_store.zk_client.get.side_effect = [
-            ('{"health": "healthy"}', mock.Mock(version=1)),
-            ('{"health": "healthy", "offer": "offer"}', mock.Mock(version=2)),
-            ('{"health": "healthy", "offer": "offer", "resources": "resources"}', mock.Mock(version=3)),
+        zk_task_store.zk_client.set_async.reset_mock()
+        zk_task_store.zk_client.get_async.side_effect = [
+            FakeAsyncResult(('{"health": "healthy", "offer": "offer"}', mock.Mock(version=3, mzxid=3))),
+            FakeAsyncResult((
+                '{"health": "healthy", "offer": "offer", "resources": "resources"}',
+                mock.Mock(version=4, mzxid=4),
+            )),
         ]
-        zk_task_store.zk_client.set.side_effect = [
-            BadVersionError,
-            BadVersionError,
-            None,
+        zk_task_store.zk_client.set_async.side_effect = [
+            FakeAsyncResult(exception=BadVersionError()),
+            FakeAsyncResult(exception=BadVersionError()),
+            FakeAsyncResult(mock.Mock(version=5, mzxid=5)),
         ]
-        new_params = zk_task_store.update_task("task_id", is_draining=True)
-        assert zk_task_store.zk_client.get.call_count == 3
-        zk_task_store.zk_client.get.assert_has_calls([
-            mock.call('/task_id'),
+        zk_task_store.update_task("task_id", is_draining=True)
+        assert zk_task_store.zk_client.get_async.call_count == 2
+        zk_task_store.zk_client.get_async.assert_has_calls([
             mock.call('/task_id'),
             mock.call('/task_id'),
         ])
-        assert zk_task_store.zk_client.set.call_count == 3
-        zk_task_store.zk_client.set.assert_has_calls([
-            mock.call('/task_id', mock.ANY, version=1),
+        assert zk_task_store.zk_client.set_async.call_count == 3
+        zk_task_store.zk_client.set_async.assert_has_calls([
             mock.call('/task_id', mock.ANY, version=2),
             mock.call('/task_id', mock.ANY, version=3),
+            mock.call('/task_id', mock.ANY, version=4),
         ])
+        new_params = zk_task_store.get_task('task_id')
         assert new_params.is_draining is True
         assert new_params.health == 'healthy'
         assert new_params.offer == 'offer'
         assert new_params.resources == 'resources'
+        assert zk_task_store.tasks['task_id'][1].mzxid == 5
 
         # Data wasn't there when we read it, but then was when we tried to create it
-        zk_task_store.zk_client.get.reset_mock()
-        zk_task_store.zk_client.set.reset_mock()
-        zk_task_store.zk_client.create.reset_mock()
-        zk_task_store.zk_client.get.side_effect = [
-            NoNodeError,
-            ('{"health": "healthy"}', mock.Mock(version=1)),
+        zk_task_store.zk_client.get_async.reset_mock()
+        zk_task_store.zk_client.set_async.reset_mock()
+        zk_task_store.zk_client.create_async.reset_mock()
+        zk_task_store.zk_client.get_async.side_effect = [
+            FakeAsyncResult(('{"health": "healthy"}', mock.Mock(version=1, mzxid=6))),
         ]
-        zk_task_store.zk_client.create.side_effect = [
-            NodeExistsError,
+        zk_task_store.zk_client.create_async.side_effect = [
+            FakeAsyncResult(exception=NodeExistsError()),
         ]
-        zk_task_store.zk_client.set.side_effect = [
-            None,
+        zk_task_store.zk_client.set_async.side_effect = [
+            FakeAsyncResult(mock.Mock(version=2, mzxid=7)),
         ]
-        new_params = zk_task_store.update_task("task_id", is_draining=True)
-        assert zk_task_store.zk_client.get.call_count == 2
-        zk_task_store.zk_client.get.assert_has_calls([
-            mock.call('/task_id'),
-            mock.call('/task_id'),
-        ])
-        assert zk_task_store.zk_client.create.call_count == 1
-        zk_task_store.zk_client.create.assert_has_calls([
-            mock.call('/task_id', mock.ANY),
-        ])
-        assert zk_task_store.zk_client.set.call_count == 1
-        zk_task_store.zk_client.set.assert_has_calls([
-            mock.call('/task_id', mock.ANY, version=1),
-        ])
+        zk_task_store.update_task("task_id3", is_draining=True)
+        zk_task_store.zk_client.get_async.assert_called_once_with('/task_id3')
+        zk_task_store.zk_client.create_async.assert_called_once_with('/task_id3', mock.ANY, include_data=True)
+        zk_task_store.zk_client.set_async.assert_called_once_with('/task_id3', mock.ANY, version=1)
+        new_params = zk_task_store.get_task('task_id3')
         assert new_params.is_draining is True
         assert new_params.health == 'healthy'
         assert new_params.offer is None
+
+    def test_update_task_is_cached_before_it_is_written(self, zk_task_store):
+        zk_task_store._cache_task('task_id', MesosTaskParameters(health='healthy'), mock.Mock(version=1, mzxid=1))
+        pending_write = PendingAsyncResult()
+        zk_task_store.zk_client.set_async.return_value = pending_write
+        new_params = zk_task_store.update_task("task_id", is_draining=True)
+        assert zk_task_store.get_task('task_id') == new_params
+        assert zk_task_store.tasks['task_id'][1].mzxid == 1
+
+        pending_write.complete(mock.Mock(version=2, mzxid=2))
+        assert zk_task_store.get_task('task_id') == new_params
+        assert zk_task_store.tasks['task_id'][1].mzxid == 2
+
+    def test_failed_update_task_is_uncached_and_raised(self, zk_task_store):
+        zk_task_store._cache_task('task_id', MesosTaskParameters(health='healthy'), mock.Mock(version=1, mzxid=1))
+        pending_write = PendingAsyncResult()
+        zk_task_store.zk_client.set_async.return_value = pending_write
+        zk_task_store.zk_client.get_async.return_value = PendingAsyncResult()
+        zk_task_store.update_task("task_id", is_draining=True)
+
+        pending_write.exception = ConnectionLoss()
+        pending_write.complete(None)
+        assert zk_task_store.get_task('task_id') == MesosTaskParameters(health='healthy')
+        assert zk_task_store.tasks['task_id'][1].mzxid == 1
+        zk_task_store.zk_client.get_async.assert_called_once_with('/task_id', watch=zk_task_store._task_changed)
+
+        with pytest.raises(ConnectionLoss):
+            zk_task_store.update_task("task_id", is_draining=True)
+        zk_task_store.zk_client.set_async.return_value = FakeAsyncResult(mock.Mock(version=2, mzxid=2))
+        zk_task_store.update_task("task_id", is_draining=True)
+        assert zk_task_store.get_task('task_id').is_draining is True
+
+    def test_failed_overwrite_task_is_uncached_and_raised(self, zk_task_store):
+        zk_task_store.zk_client.set_async.return_value = FakeAsyncResult(exception=NoNodeError())
+        zk_task_store.zk_client.create_async.return_value = FakeAsyncResult(exception=ConnectionLoss())
+        zk_task_store.zk_client.get_async.return_value = FakeAsyncResult(exception=NoNodeError())
+        zk_task_store.overwrite_task('task_id', MesosTaskParameters(health='healthy'))
+        assert zk_task_store.get_task('task_id') is None
+
+        with pytest.raises(ConnectionLoss):
+            zk_task_store.overwrite_task('task_id', MesosTaskParameters(health='healthy'))
@@ -594,27 +594,13 @@ def test_group_slaves_by_key_func():
 
 
 @patch('paasta_tools.metrics.metastatus_lib.group_slaves_by_key_func', autospec=True)
-@patch('paasta_tools.metrics.metastatus_lib.calculate_resource_utilization_for_slaves', autospec=True)
+@patch('paasta_tools.metrics.metastatus_lib.calculate_resource_utilization_for_slave_groupings', autospec=True)
 @patch('paasta_tools.metrics.metastatus_lib.get_all_tasks_from_state', autospec=True)
 def test_get_resource_utilization_by_grouping(
         mock_get_all_tasks_from_state,
-        mock_calculate_resource_utilization_for_slaves,
+        mock_calculate_resource_utilization_for_slave_groupings,
         mock_group_slaves_by_key_func,
 ):
-    mock_group_slaves_by_key_func.return_value = {
-        'somenametest-habitat': [{
-            'id': 'abcd',
-            'hostname': 'test.somewhere.www',
-        }],
-        'somenametest-habitat-2': [{
-            'id': 'abcd',
-            'hostname': 'test2.somewhere.www',
-        }],
-    }
-    mock_calculate_resource_utilization_for_slaves.return_value = {
-        'free': metastatus_lib.ResourceInfo(cpus=10, mem=10, disk=10),
-        'total': metastatus_lib.ResourceInfo(cpus=20, mem=20, disk=20),
-    }
     state = {
         'frameworks': Mock(),
         'slaves': [{'id': 'abcd'}],
@@ -624,18 +610,45 @@ def test_get_resource_utilization_by_grouping(
         mesos_state=state,
     )
     mock_get_all_tasks_from_state.assert_called_with(state, include_orphans=True)
-    assert sorted(actual.keys()) == sorted(['somenametest-habitat', 'somenametest-habitat-2'])
-    for k, v in actual.items():
-        assert v['total'] == metastatus_lib.ResourceInfo(
-            cpus=20,
-            disk=20,
-            mem=20,
-        )
-        assert v['free'] == metastatus_lib.ResourceInfo(
-            cpus=10,
-            disk=10,
-            mem=10,
+    mock_group_slaves_by_key_func.assert_called_with(mock.sentinel.grouping_func, [{'id': 'abcd'}], None)
+    mock_calculate_resource_utilization_for_slave_groupings.assert_called_with(
+        mock_group_slaves_by_key_func.return_value,
+        mock_get_all_tasks_from_state.return_value,
+    )
+    assert actual == mock_calculate_resource_utilization_for_slave_groupings.return_value
+
+
+def test_calculate_resource_utilization_for_slave_groupings_matches_per_group():
+    slaves = [
+        {
+            'id': 'slave%d' % i,
+            'resources': {'cpus': 10.1, 'mem': 1024.5, 'disk': 400, 'gpus': i % 2, 'ports': '[31000-32000]'},
+            'reserved_resources': {'maintenance': {'cpus': 1.3, 'mem': 5, 'disk': 1}} if i == 3 else {},
+        }
+        for i in range(6)
+    ]
+    tasks = [
+        {
+            'state': 'TASK_FINISHED' if i % 7 == 0 else 'TASK_RUNNING',
+            'resources': {'cpus': 0.1 * i, 'mem': 10.7, 'disk': 3, 'ports': '[31000-31000]'},
+            'slave_id': 'slave%d' % (i % 7),
+        }
+        for i in range(40)
+    ]
+    slave_groupings = {'even': slaves[0::2], 'odd': slaves[1::2], 'empty': []}
+
+    actual = metastatus_lib.calculate_resource_utilization_for_slave_groupings(slave_groupings, tasks)
+
+    non_terminal_tasks = [task for task in tasks if task['state'] == 'TASK_RUNNING']
+    assert actual == {
+        key: metastatus_lib.calculate_resource_utilization_for_slaves(
+            slaves=slaves,
+            tasks=metastatus_lib.filter_tasks_for_slaves(slaves, non_terminal_tasks),
         )
+        for key, slaves in slave_groupings.items()
+    }
+    assert actual['odd']['total'].gpus == 3
+    assert actual['empty']['slave_count'] == 0
 
 
 def test_get_resource_utilization_by_grouping_correctly_groups():
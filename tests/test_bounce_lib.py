@@ -170,6 +170,7 @@ class TestBounceLib:
         nerve_ns = 'bar'
         fake_task = mock.Mock(host='foo', ports=[123456])
         fake_backend = {
+            "pxname": "foo.bar",
             "svname": "foo_256.256.256.256:123456",
             "status": "UP",
         }
@@ -189,13 +190,22 @@ class TestBounceLib:
                 )
 
         with mock.patch(
-            'paasta_tools.bounce_lib.get_registered_marathon_tasks', autospec=True,
-            side_effect=[[fake_task], [ConnectionError], [RequestException]],
-        ):
+            'paasta_tools.smartstack_tools.get_multiple_backends', autospec=True,
+            side_effect=[[fake_backend], ConnectionError, RequestException],
+        ), mock.patch('socket.gethostbyname', autospec=True, return_value='256.256.256.256'):
             assert bounce_lib.is_task_in_smartstack(fake_task, service, nerve_ns, self.fake_system_paasta_config())
             assert not bounce_lib.is_task_in_smartstack(fake_task, service, nerve_ns, self.fake_system_paasta_config())
             assert not bounce_lib.is_task_in_smartstack(fake_task, service, nerve_ns, self.fake_system_paasta_config())
 
+    def test_is_task_in_smartstack_with_haproxy_view(self):
+        fake_task = mock.Mock(host='foo', ports=[123456])
+        fake_haproxy_view = mock.Mock(is_task_registered=mock.Mock(return_value=True))
+        assert bounce_lib.is_task_in_smartstack(
+            fake_task, 'foo', 'bar', self.fake_system_paasta_config(),
+            haproxy_view=fake_haproxy_view,
+        )
+        fake_haproxy_view.is_task_registered.assert_called_once_with(fake_task, 'foo.bar')
+
     def test_get_happy_tasks_when_running_without_healthchecks_defined(self):
         """All running tasks with no health checks results are healthy if the app does not define healthchecks"""
         tasks = [mock.Mock(health_check_results=[]) for _ in range(5)]
@@ -283,7 +293,10 @@ class TestBounceLib:
         tasks = [mock.Mock(health_check_results=[mock.Mock(alive=True)]) for i in range(5)]
         fake_app = mock.Mock(tasks=tasks, health_checks=[])
         with mock.patch(
-            'paasta_tools.bounce_lib.get_registered_marathon_tasks', return_value=tasks[2:], autospec=True,
+            'paasta_tools.bounce_lib.HaproxyView.fetch', autospec=True,
+        ), mock.patch(
+            'paasta_tools.bounce_lib.HaproxyView.is_task_registered', autospec=True,
+            side_effect=lambda self, task, service: task in tasks[2:],
         ):
             actual = bounce_lib.get_happy_tasks(
                 fake_app, 'service', 'namespace', self.fake_system_paasta_config(),
@@ -298,24 +311,40 @@ class TestBounceLib:
         tasks = [mock.Mock(health_check_results=[mock.Mock(alive=False)]) for i in range(5)]
         fake_app = mock.Mock(tasks=tasks, health_checks=[])
         with mock.patch(
-            'paasta_tools.bounce_lib.get_registered_marathon_tasks', return_value=tasks[2:], autospec=True,
-        ):
+            'paasta_tools.bounce_lib.HaproxyView', autospec=True,
+        ) as mock_haproxy_view:
             actual = bounce_lib.get_happy_tasks(
                 fake_app, 'service', 'namespace', self.fake_system_paasta_config(),
                 check_haproxy=True,
             )
             expected = []
             assert actual == expected
+            assert mock_haproxy_view.call_count == 0
 
     def test_get_happy_tasks_check_each_host(self):
-        """If we specify that a task should be in haproxy, don't call it happy unless it's in haproxy."""
+        """The haproxy csv of each host should only be fetched once, no matter how many tasks run there."""
 
-        tasks = [mock.Mock(health_check_results=[mock.Mock(alive=True)], host='fake_host1') for i in range(5)]
+        tasks = [
+            mock.Mock(health_check_results=[mock.Mock(alive=True)], host='fake_host%d' % (i % 2), ports=[31000 + i])
+            for i in range(5)
+        ]
         fake_app = mock.Mock(tasks=tasks, health_checks=[])
+        backends = [
+            {"pxname": "service.namespace", "svname": "10.0.0.1:31002_fake_host0", "status": "UP"},
+            {"pxname": "service.namespace", "svname": "10.0.0.2:31003_fake_host1", "status": "UP"},
+            {"pxname": "service.namespace", "svname": "10.0.0.1:31004_fake_host0", "status": "UP"},
+        ]
+        hostnames = {
+            'fake_host0': '10.0.0.1',
+            'fake_host1': '10.0.0.2',
+        }
         with mock.patch(
-            'paasta_tools.bounce_lib.get_registered_marathon_tasks',
-            side_effect=[([t] if i >= 2 else []) for i, t in enumerate(tasks)], autospec=True,
-        ) as get_registered_marathon_tasks_patch:
+            'paasta_tools.smartstack_tools.get_multiple_backends', autospec=True,
+            return_value=backends,
+        ) as get_multiple_backends_patch, mock.patch(
+            'paasta_tools.smartstack_tools.socket.gethostbyname', autospec=True,
+            side_effect=lambda x: hostnames[x],
+        ):
             actual = bounce_lib.get_happy_tasks(
                 fake_app, 'service', 'namespace', self.fake_system_paasta_config(),
                 check_haproxy=True,
@@ -323,13 +352,14 @@ class TestBounceLib:
             expected = tasks[2:]
             assert actual == expected
 
-            for task in tasks:
-                get_registered_marathon_tasks_patch.assert_any_call(
-                    'fake_host1',
-                    123456,
-                    utils.DEFAULT_SYNAPSE_HAPROXY_URL_FORMAT,
-                    'service.namespace',
-                    [task],
+            assert get_multiple_backends_patch.call_count == 2
+            for host in ('fake_host0', 'fake_host1'):
+                get_multiple_backends_patch.assert_any_call(
+                    ['service.namespace'],
+                    synapse_host=host,
+                    synapse_port=123456,
+                    synapse_haproxy_url_format=utils.DEFAULT_SYNAPSE_HAPROXY_URL_FORMAT,
+                    session=mock.ANY,
                 )
 
     def test_flatten_tasks(self):
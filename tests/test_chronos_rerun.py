@@ -129,7 +129,6 @@ def test_clone_job_dependent_jobs(
 @mock.patch('paasta_tools.chronos_rerun.remove_parents', autospec=True)
 @mock.patch('paasta_tools.chronos_tools.create_complete_config', autospec=True)
 @mock.patch('paasta_tools.chronos_tools.load_v2_deployments_json', autospec=True)
-@mock.patch('service_configuration_lib.read_services_configuration', autospec=True)
 @mock.patch('paasta_tools.chronos_tools.read_chronos_jobs_for_service', autospec=True)
 @mock.patch('paasta_tools.chronos_tools.get_chronos_client', autospec=True)
 @mock.patch('paasta_tools.chronos_tools.load_chronos_config', autospec=True)
@@ -139,13 +138,12 @@ def test_chronos_rerun_main_with_independent_job(
     mock_load_chronos_config,
     mock_get_chronos_client,
     mock_read_chronos_jobs_for_service,
-    mock_read_services_configuration,
     mock_load_v2_deployments_json,
     mock_create_complete_config,
     mock_remove_parents,
     mock_get_job_type,
     mock_clone_job,
-    cluster, service, instance, run_all_related_jobs, is_dependent_job,
+    cluster, service, instance, run_all_related_jobs, is_dependent_job, tmpdir,
 ):
     mock_load_system_paasta_config.return_value.get_cluster.return_value = cluster
 
@@ -168,7 +166,7 @@ def test_chronos_rerun_main_with_independent_job(
     def gen_dependent_job(service, instance):
         return dict(parents='{}.{}'.format(service, instance), **generic_config_dict)
 
-    mock_read_services_configuration.return_value = [service]
+    tmpdir.join(service, 'chronos-%s.yaml' % cluster).ensure()
     mock_read_chronos_jobs_for_service.return_value = {
         'test_independent_instance_1': gen_scheduled_job(),
         'test_dependent_instance_1': gen_scheduled_job(),
@@ -187,7 +185,7 @@ def test_chronos_rerun_main_with_independent_job(
 
     execution_date = datetime.datetime.now().replace(microsecond=0)
 
-    testargs = ['chronos_rerun']
+    testargs = ['chronos_rerun', '--soa-dir', str(tmpdir)]
     if run_all_related_jobs:
         testargs.append('--run-all-related-jobs')
     testargs.extend(['{} {}'.format(service, instance), execution_date.isoformat()])
@@ -19,7 +19,6 @@ from mock import Mock
 from pytest import raises
 
 from paasta_tools import chronos_tools
-from paasta_tools.chronos_tools import _get_related_jobs_and_configs
 from paasta_tools.chronos_tools import ChronosJobConfig
 from paasta_tools.chronos_tools import get_related_jobs_configs
 from paasta_tools.utils import InvalidJobNameError
@@ -185,7 +184,7 @@ class TestChronosTools:
         with mock.patch(
             'paasta_tools.chronos_tools.load_v2_deployments_json', autospec=True,
         ) as mock_load_v2_deployments_json, mock.patch(
-            'service_configuration_lib.read_extra_service_information', autospec=True,
+            'paasta_tools.chronos_tools.read_extra_service_information', autospec=True,
         ) as mock_read_extra_service_information:
             mock_load_v2_deployments_json.return_value.get_branch_dict.return_value = self.fake_branch_dict
             mock_read_extra_service_information.return_value = self.fake_config_file
@@ -1974,89 +1973,146 @@ class TestChronosTools:
         mock_get_local_slave_state.assert_called_once_with(hostname=None)
         assert expected == actual
 
-    @mock.patch('service_configuration_lib.read_services_configuration', autospec=True)
+    def make_soa_dir(self, tmpdir, services):
+        for service in services:
+            tmpdir.join(service).ensure(dir=True)
+            tmpdir.join(service, 'chronos-%s.yaml' % self.fake_cluster).write('')
+        return str(tmpdir)
+
     @mock.patch('paasta_tools.chronos_tools.read_chronos_jobs_for_service', autospec=True)
     @mock.patch('paasta_tools.chronos_tools.load_v2_deployments_json', autospec=True)
-    def test__get_related_jobs_and_configs_only_independent_jobs(
-        self, mock_load_v2_deployments_json, mock_read_chronos_jobs_for_service, mock_read_services_configuration,
+    def test_chronos_job_graph_only_independent_jobs(
+        self, mock_load_v2_deployments_json, mock_read_chronos_jobs_for_service, tmpdir,
     ):
         mock_load_v2_deployments_json.return_value.get_branch_dict.return_value = self.fake_branch_dict
         mock_read_chronos_jobs_for_service.return_value = self.fake_config_file
-        mock_read_services_configuration.return_value = [self.fake_service]
-        jobs, configs = _get_related_jobs_and_configs(cluster=self.fake_cluster, ttl=-1)  # ttl=-1 to disable cache
-
-        expected_jobs = {
-            (self.fake_service, self.fake_job_name): {(self.fake_service, self.fake_job_name)},
-            (self.fake_service, self.fake_invalid_job_name): {(self.fake_service, self.fake_invalid_job_name)},
-        }
-        expected_configs = {}
-        expected_configs[(self.fake_service, self.fake_job_name)] = ChronosJobConfig(
-            service=self.fake_service,
+        graph = chronos_tools.ChronosJobGraph(
             cluster=self.fake_cluster,
-            instance=self.fake_job_name,
-            config_dict=self.fake_config_dict,
-            branch_dict=self.fake_branch_dict,
+            soa_dir=self.make_soa_dir(tmpdir, [self.fake_service]),
         )
-        expected_configs[(self.fake_service, self.fake_invalid_job_name)] = ChronosJobConfig(
-            service=self.fake_service,
+        graph.update()
+
+        job = (self.fake_service, self.fake_job_name)
+        invalid_job = (self.fake_service, self.fake_invalid_job_name)
+        assert graph.components == {job: {job}, invalid_job: {invalid_job}}
+        assert graph.configs == {
+            job: ChronosJobConfig(
+                service=self.fake_service,
+                cluster=self.fake_cluster,
+                instance=self.fake_job_name,
+                config_dict=self.fake_config_dict,
+                branch_dict=self.fake_branch_dict,
+            ),
+            invalid_job: ChronosJobConfig(
+                service=self.fake_service,
+                cluster=self.fake_cluster,
+                instance=self.fake_invalid_job_name,
+                config_dict=self.fake_invalid_config_dict,
+                branch_dict=self.fake_branch_dict,
+            ),
+        }
+
+    @mock.patch('paasta_tools.chronos_tools.read_chronos_jobs_for_service', autospec=True)
+    @mock.patch('paasta_tools.chronos_tools.load_v2_deployments_json', autospec=True)
+    def test_chronos_job_graph_with_dependent_jobs(
+        self, mock_load_v2_deployments_json, mock_read_chronos_jobs_for_service, tmpdir,
+    ):
+        mock_load_v2_deployments_json.return_value.get_branch_dict.return_value = self.fake_branch_dict
+        other_job_config_dict = dict(self.fake_dependent_job_config_dict, parents=['test-service.test_dependent'])
+        mock_read_chronos_jobs_for_service.side_effect = lambda service, cluster, **kwargs: {
+            self.fake_service: {
+                self.fake_job_name: self.fake_config_dict,
+                self.fake_invalid_job_name: self.fake_invalid_config_dict,
+                self.fake_dependent_job_name: self.fake_dependent_job_config_dict,
+                '_template': self.fake_config_dict,
+            },
+            'other-service': {'other': other_job_config_dict},
+        }[service]
+        graph = chronos_tools.ChronosJobGraph(
             cluster=self.fake_cluster,
-            instance=self.fake_invalid_job_name,
-            config_dict=self.fake_invalid_config_dict,
-            branch_dict=self.fake_branch_dict,
+            soa_dir=self.make_soa_dir(tmpdir, [self.fake_service, 'other-service']),
         )
-        assert jobs == expected_jobs
-        assert configs == expected_configs
+        graph.update()
+
+        job = (self.fake_service, self.fake_job_name)
+        dependent_job = (self.fake_service, self.fake_dependent_job_name)
+        other_job = ('other-service', 'other')
+        assert graph.related_jobs(*dependent_job) == {job, dependent_job, other_job}
+        assert graph.related_jobs(*other_job) == {job, dependent_job, other_job}
+        assert graph.related_jobs(self.fake_service, self.fake_invalid_job_name) == {
+            (self.fake_service, self.fake_invalid_job_name),
+        }
+        assert graph.topological_order(*other_job) == [job, dependent_job, other_job]
+        assert graph.configs[other_job].config_dict == other_job_config_dict
 
-    @mock.patch('service_configuration_lib.read_services_configuration', autospec=True)
     @mock.patch('paasta_tools.chronos_tools.read_chronos_jobs_for_service', autospec=True)
     @mock.patch('paasta_tools.chronos_tools.load_v2_deployments_json', autospec=True)
-    def test__get_related_jobs_and_configs_with_dependent_jobs(
-        self, mock_load_v2_deployments_json, mock_read_chronos_jobs_for_service, mock_read_services_configuration,
+    def test_chronos_job_graph_update_only_reloads_changed_services(
+        self, mock_load_v2_deployments_json, mock_read_chronos_jobs_for_service, tmpdir,
     ):
         mock_load_v2_deployments_json.return_value.get_branch_dict.return_value = self.fake_branch_dict
-        mock_read_chronos_jobs_for_service.return_value = {
-            self.fake_job_name: self.fake_config_dict,
-            self.fake_dependent_job_name: self.fake_dependent_job_config_dict,
+        jobs_by_service = {
+            self.fake_service: {self.fake_job_name: self.fake_config_dict},
+            'other-service': {'other': self.fake_config_dict},
+        }
+        mock_read_chronos_jobs_for_service.side_effect = lambda service, cluster, **kwargs: \
+            jobs_by_service[service]
+        soa_dir = self.make_soa_dir(tmpdir, [self.fake_service, 'other-service'])
+        graph = chronos_tools.ChronosJobGraph(cluster=self.fake_cluster, soa_dir=soa_dir)
+        graph._load_service = mock.Mock(wraps=graph._load_service)
+
+        def reloaded_services():
+            return [call[0][0] for call in graph._load_service.call_args_list]
+
+        assert graph.update() is True
+        assert sorted(reloaded_services()) == ['other-service', self.fake_service]
+        assert graph.update() is False
+        assert len(reloaded_services()) == 2
+
+        job = (self.fake_service, self.fake_job_name)
+        other_job = ('other-service', 'other')
+        jobs_by_service['other-service'] = {
+            'other': dict(self.fake_dependent_job_config_dict, parents=['test-service.test']),
         }
-        mock_read_services_configuration.return_value = [self.fake_service]
+        tmpdir.join('other-service', 'chronos-%s.yaml' % self.fake_cluster).write('changed')
+        assert graph.update() is True
+        assert reloaded_services()[2:] == ['other-service']
+        assert graph.related_jobs(*job) == {job, other_job}
+        assert graph.topological_order(*job) == [job, other_job]
 
-        jobs, configs = _get_related_jobs_and_configs(cluster=self.fake_cluster, ttl=-1)  # ttl=-1 to disable cache
+        tmpdir.join('other-service', 'chronos-%s.yaml' % self.fake_cluster).remove()
+        assert graph.update() is True
+        assert graph.related_jobs(*job) == {job}
+        assert other_job not in graph.configs
 
-        related_jobs = {(self.fake_service, self.fake_job_name), (self.fake_service, self.fake_dependent_job_name)}
-        expected_jobs = {
-            (self.fake_service, self.fake_job_name): related_jobs,
-            (self.fake_service, self.fake_dependent_job_name): related_jobs,
+    @mock.patch('paasta_tools.chronos_tools.read_chronos_jobs_for_service', autospec=True)
+    @mock.patch('paasta_tools.chronos_tools.load_v2_deployments_json', autospec=True)
+    def test_topological_sort_related_jobs_cycle(
+        self, mock_load_v2_deployments_json, mock_read_chronos_jobs_for_service, tmpdir,
+    ):
+        mock_load_v2_deployments_json.return_value.get_branch_dict.return_value = self.fake_branch_dict
+        mock_read_chronos_jobs_for_service.return_value = {
+            'a': dict(self.fake_dependent_job_config_dict, parents=['test-service.b']),
+            'b': dict(self.fake_dependent_job_config_dict, parents=['test-service.a']),
         }
-        expected_configs = {}
-        expected_configs[(self.fake_service, self.fake_job_name)] = ChronosJobConfig(
-            service=self.fake_service,
-            cluster=self.fake_cluster,
-            instance=self.fake_job_name,
-            config_dict=self.fake_config_dict,
-            branch_dict=self.fake_branch_dict,
-        )
-        expected_configs[(self.fake_service, self.fake_dependent_job_name)] = ChronosJobConfig(
-            service=self.fake_service,
-            cluster=self.fake_cluster,
-            instance=self.fake_dependent_job_name,
-            config_dict=self.fake_dependent_job_config_dict,
-            branch_dict=self.fake_branch_dict,
-        )
-
-        assert jobs == expected_jobs
-        assert configs == expected_configs
+        with raises(ValueError):
+            chronos_tools.topological_sort_related_jobs(
+                cluster=self.fake_cluster,
+                service=self.fake_service,
+                instance='a',
+                soa_dir=self.make_soa_dir(tmpdir, [self.fake_service]),
+            )
 
-    @mock.patch('service_configuration_lib.read_services_configuration', autospec=True)
     @mock.patch('paasta_tools.chronos_tools.read_chronos_jobs_for_service', autospec=True)
     @mock.patch('paasta_tools.chronos_tools.load_v2_deployments_json', autospec=True)
     def test_get_related_jobs_configs_only_independent_jobs(
-        self, mock_load_v2_deployments_json, mock_read_chronos_jobs_for_service, mock_read_services_configuration,
+        self, mock_load_v2_deployments_json, mock_read_chronos_jobs_for_service, tmpdir,
     ):
         mock_load_v2_deployments_json.return_value.get_branch_dict.return_value = self.fake_branch_dict
         mock_read_chronos_jobs_for_service.return_value = self.fake_config_file
-        mock_read_services_configuration.return_value = [self.fake_service]
         related_jobs_configs = get_related_jobs_configs(
-            cluster=self.fake_cluster, service=self.fake_service, instance=self.fake_job_name, use_cache=False,
+            cluster=self.fake_cluster, service=self.fake_service, instance=self.fake_job_name,
+            soa_dir=self.make_soa_dir(tmpdir, [self.fake_service]), use_cache=False,
         )
 
         expected_related_jobs_configs = {}
@@ -2070,20 +2126,19 @@ class TestChronosTools:
 
         assert related_jobs_configs == expected_related_jobs_configs
 
-    @mock.patch('service_configuration_lib.read_services_configuration', autospec=True)
     @mock.patch('paasta_tools.chronos_tools.read_chronos_jobs_for_service', autospec=True)
     @mock.patch('paasta_tools.chronos_tools.load_v2_deployments_json', autospec=True)
     def test_get_related_jobs_configs_with_dependent_jobs(
-        self, mock_load_v2_deployments_json, mock_read_chronos_jobs_for_service, mock_read_services_configuration,
+        self, mock_load_v2_deployments_json, mock_read_chronos_jobs_for_service, tmpdir,
     ):
         mock_load_v2_deployments_json.return_value.get_branch_dict.return_value = self.fake_branch_dict
         mock_read_chronos_jobs_for_service.return_value = {
             self.fake_job_name: self.fake_config_dict,
             self.fake_dependent_job_name: self.fake_dependent_job_config_dict,
         }
-        mock_read_services_configuration.return_value = [self.fake_service]
         related_jobs_configs = get_related_jobs_configs(
-            cluster=self.fake_cluster, service=self.fake_service, instance=self.fake_job_name, use_cache=False,
+            cluster=self.fake_cluster, service=self.fake_service, instance=self.fake_job_name,
+            soa_dir=self.make_soa_dir(tmpdir, [self.fake_service]), use_cache=False,
         )
 
         expected_related_jobs_configs = {}
@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 import contextlib
 
 import asynctest
@@ -56,8 +57,68 @@ def mock_ClientSession(**fake_session_kwargs):
         yield
 
 
+@contextlib.contextmanager
+def mock_hacheck_session(*responses):
+    """Patches the shared hacheck session so that each GET returns the next of responses."""
+    class FakeRequest:
+        def __init__(self, response):
+            self.response = response
+
+        async def __aenter__(self):
+            return self.response
+
+        async def __aexit__(self, *args):
+            pass
+
+    fake_session = mock.Mock(
+        name="session",
+        get=mock.Mock(side_effect=[FakeRequest(response) for response in responses]),
+        post=mock.Mock(return_value=FakeRequest(mock.Mock(name="post_response"))),
+    )
+    with mock.patch(
+        'paasta_tools.drain_lib.SharedHacheckSession',
+        autospec=True,
+        return_value=FakeRequest(fake_session),
+    ):
+        yield fake_session
+
+
+def fake_down_response():
+    return mock.Mock(
+        status=503,
+        text=asynctest.CoroutineMock(
+            return_value="Service service in down state since 1435694078.778886 "
+                         "until 1435694178.780000: Drained by Paasta",
+        ),
+    )
+
+
+def fake_up_response():
+    return mock.Mock(
+        status=200,
+        text=asynctest.CoroutineMock(
+            return_value="",
+        ),
+    )
+
+
+@pytest.mark.asyncio
+async def test_shared_hacheck_session():
+    with mock.patch.dict(drain_lib._hacheck_sessions, clear=True):
+        async with drain_lib.SharedHacheckSession() as session:
+            async with drain_lib.SharedHacheckSession() as other_session:
+                assert other_session is session
+            assert not session.closed
+        assert session.closed
+        assert drain_lib._hacheck_sessions == {}
+
+        async with drain_lib.SharedHacheckSession() as other_session:
+            assert other_session is not session
+
+
 class TestHacheckDrainMethod(object):
-    drain_method = drain_lib.HacheckDrainMethod("srv", "inst", "ns", hacheck_port=12345)
+    def setup_method(self, method):
+        self.drain_method = drain_lib.HacheckDrainMethod("srv", "inst", "ns", hacheck_port=12345)
 
     def test_spool_url(self):
         fake_task = mock.Mock(host="fake_host", ports=[54321])
@@ -73,16 +134,9 @@ class TestHacheckDrainMethod(object):
 
     @pytest.mark.asyncio
     async def test_get_spool(self):
-        fake_response = mock.Mock(
-            status=503,
-            text=asynctest.CoroutineMock(
-                return_value="Service service in down state since 1435694078.778886 "
-                             "until 1435694178.780000: Drained by Paasta",
-            ),
-        )
         fake_task = mock.Mock(host="fake_host", ports=[54321])
 
-        with mock_ClientSession(get=asynctest.CoroutineMock(return_value=fake_response)):
+        with mock_hacheck_session(fake_down_response()):
             actual = await self.drain_method.get_spool(fake_task)
 
         expected = {
@@ -101,28 +155,64 @@ class TestHacheckDrainMethod(object):
         assert actual is None
 
     @pytest.mark.asyncio
-    async def test_is_draining_yes(self):
-        fake_response = mock.Mock(
+    async def test_get_spool_only_fetches_once(self):
+        fake_task = mock.Mock(host="fake_host", ports=[54321])
+        with mock_hacheck_session(fake_down_response()) as fake_session:
+            assert await self.drain_method.is_draining(fake_task) is True
+            assert await self.drain_method.is_safe_to_kill(fake_task) is True
+        assert fake_session.get.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_get_spool_retries_after_failure(self):
+        fake_task = mock.Mock(host="fake_host", ports=[54321])
+        failing_response = mock.Mock(
             status=503,
-            text=asynctest.CoroutineMock(
-                return_value="Service service in down state since 1435694078.778886 "
-                             "until 1435694178.780000: Drained by Paasta",
-            ),
+            text=asynctest.CoroutineMock(side_effect=asyncio.TimeoutError),
+        )
+        with mock_hacheck_session(failing_response, fake_up_response()) as fake_session:
+            with raises(asyncio.TimeoutError):
+                await self.drain_method.get_spool(fake_task)
+            assert await self.drain_method.get_spool(fake_task) == {'state': 'up'}
+        assert fake_session.get.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_drain_refetches_spool(self):
+        fake_task = mock.Mock(host="fake_host", ports=[54321])
+        with mock_hacheck_session(fake_up_response(), fake_down_response()) as fake_session:
+            assert await self.drain_method.is_draining(fake_task) is False
+            await self.drain_method.drain(fake_task)
+            assert await self.drain_method.is_draining(fake_task) is True
+        fake_session.post.assert_called_once_with(
+            'http://fake_host:12345/spool/srv.ns/54321/status',
+            data={'status': 'down', 'expiration': mock.ANY, 'reason': 'Drained by Paasta'},
+            headers=mock.ANY,
         )
+
+    @pytest.mark.asyncio
+    async def test_prefetch(self):
+        fake_tasks = [
+            mock.Mock(host="fake_host1", ports=[54321]),
+            mock.Mock(host="fake_host2", ports=[54321]),
+            mock.Mock(host="fake_host3", ports=[]),
+        ]
+        with mock_hacheck_session(fake_up_response(), fake_down_response()) as fake_session:
+            await self.drain_method.prefetch(fake_tasks)
+            assert fake_session.get.call_count == 2
+            assert await self.drain_method.is_draining(fake_tasks[0]) is False
+            assert await self.drain_method.is_draining(fake_tasks[1]) is True
+            assert await self.drain_method.is_draining(fake_tasks[2]) is False
+        assert fake_session.get.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_is_draining_yes(self):
         fake_task = mock.Mock(host="fake_host", ports=[54321])
-        with mock_ClientSession(get=asynctest.CoroutineMock(return_value=fake_response)):
+        with mock_hacheck_session(fake_down_response()):
             assert await self.drain_method.is_draining(fake_task) is True
 
     @pytest.mark.asyncio
     async def test_is_draining_no(self):
-        fake_response = mock.Mock(
-            status=200,
-            text=asynctest.CoroutineMock(
-                return_value="",
-            ),
-        )
         fake_task = mock.Mock(host="fake_host", ports=[54321])
-        with mock_ClientSession(get=asynctest.CoroutineMock(return_value=fake_response)):
+        with mock_hacheck_session(fake_up_response()):
             assert await self.drain_method.is_draining(fake_task) is False
 
 
@@ -1,6 +1,7 @@
 import mock
 import pytest
 
+from paasta_tools import firewall
 from paasta_tools import firewall_logging
 
 
@@ -50,13 +51,13 @@ def test_syslog_to_paasta_log_bad_message(mock_lookup_service_instance_by_ip, sy
 
 
 @mock.patch.object(
-    firewall_logging, 'services_running_here', return_value=[
-        ('service1', 'instance1', '00:00:00:00:00', '1.1.1.1'),
-        ('service1', 'instance2', '00:00:00:00:00', '2.2.2.2'),
-    ],
+    firewall, 'lookup_service_instance_by_ip', autospec=True, side_effect=lambda ip: {
+        '1.1.1.1': ('service1', 'instance1'),
+        '2.2.2.2': ('service1', 'instance2'),
+    }.get(ip, (None, None)),
 )
 @mock.patch.object(firewall_logging, 'log')
-def test_lookup_service_instance_by_ip(my_mock_log, mock_services_running_here):
+def test_lookup_service_instance_by_ip(my_mock_log, mock_lookup_service_instance_by_ip):
     assert firewall_logging.lookup_service_instance_by_ip('1.1.1.1') == ('service1', 'instance1')
     assert firewall_logging.lookup_service_instance_by_ip('2.2.2.2') == ('service1', 'instance2')
     assert firewall_logging.lookup_service_instance_by_ip('3.3.3.3') == (None, None)
@@ -80,19 +81,22 @@ def test_setup_logging(logging_mock):
     assert logging_mock.basicConfig.mock_calls == [mock.call(level=logging_mock.DEBUG)]
 
 
+@mock.patch.object(firewall, 'watch_running_containers', autospec=True)
 @mock.patch.object(firewall_logging, 'MultiUDPServer')
-def test_run_server(udpserver_mock):
+def test_run_server(udpserver_mock, watch_running_containers_mock):
     firewall_logging.run_server('myhost', 1234)
+    assert watch_running_containers_mock.called is True
     assert udpserver_mock.mock_calls == [
         mock.call(('myhost', 1234), firewall_logging.SyslogUDPHandler),
         mock.call().serve_forever(),
     ]
 
 
+@mock.patch.object(firewall, 'watch_running_containers', autospec=True)
 @mock.patch.object(firewall_logging, 'logging')
 @mock.patch.object(firewall_logging, 'MultiUDPServer')
 @mock.patch.object(firewall_logging, 'signal')
-def test_main_single_worker(signal_mock, udpserver_mock, logging_mock):
+def test_main_single_worker(signal_mock, udpserver_mock, logging_mock, watch_running_containers_mock):
     firewall_logging.main(['-w', '1'])
     assert logging_mock.basicConfig.mock_calls == [mock.call(level=logging_mock.WARNING)]
     assert udpserver_mock.mock_calls == [
@@ -101,11 +105,12 @@ def test_main_single_worker(signal_mock, udpserver_mock, logging_mock):
     ]
 
 
+@mock.patch.object(firewall, 'watch_running_containers', autospec=True)
 @mock.patch.object(firewall_logging, 'logging')
 @mock.patch.object(firewall_logging, 'MultiUDPServer')
 @mock.patch.object(firewall_logging.os, 'fork', return_value=0)
 @mock.patch.object(firewall_logging, 'signal')
-def test_main_two_workers(signal_mock, fork_mock, udpserver_mock, logging_mock):
+def test_main_two_workers(signal_mock, fork_mock, udpserver_mock, logging_mock, watch_running_containers_mock):
     firewall_logging.main(['-w', '2'])
     assert logging_mock.basicConfig.mock_calls == [mock.call(level=logging_mock.WARNING)]
     assert udpserver_mock.mock_calls == [
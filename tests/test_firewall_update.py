@@ -120,9 +120,51 @@ def test_smartstack_dependencies_of_running_firewalled_services(_, __, tmpdir):
     }
 
 
-@mock.patch.object(firewall_update, 'smartstack_dependencies_of_running_firewalled_services', autospec=True)
-@mock.patch.object(firewall_update, 'process_inotify_event', side_effect=StopIteration, autospec=True)
-def test_run_daemon(process_inotify_mock, smartstack_deps_mock, mock_daemon_args):
+@mock.patch.object(
+    firewall_update, 'load_system_paasta_config', autospec=True,
+    return_value=mock.Mock(**{
+        'get_cluster.return_value': 'mycluster',
+    }),
+)
+@mock.patch.object(firewall_update, 'get_instance_config', autospec=True)
+@mock.patch.object(firewall, 'services_running_here', autospec=True)
+def test_dependency_index_only_reloads_changed_configs(mock_services_running_here, mock_get_instance_config, _, tmpdir):
+    soa_dir = tmpdir.mkdir('yelpsoa')
+    soa_dir.mkdir('myservice').join('marathon-mycluster.yaml').write('')
+    mock_get_instance_config.return_value.get_outbound_firewall.return_value = 'block'
+    mock_get_instance_config.return_value.get_dependencies.return_value = [{'smartstack': 'mydep.depinstance'}]
+    mock_services_running_here.return_value = (
+        ('myservice', 'main', '02:42:a9:fe:00:0a', '1.1.1.1'),
+        ('myservice', 'main', '02:42:a9:fe:00:0b', '2.2.2.2'),
+        ('myservice', 'canary', '02:42:a9:fe:00:0c', '3.3.3.3'),
+    )
+    index = firewall_update.DependencyIndex(soa_dir=str(soa_dir))
+
+    expected = {'mydep.depinstance': {('myservice', 'main'), ('myservice', 'canary')}}
+    assert index.update() == expected
+    assert index.update() == expected
+    assert mock_get_instance_config.call_count == 2
+
+    soa_dir.join('myservice', 'marathon-mycluster.yaml').setmtime(12345)
+    assert index.update() == expected
+    assert mock_get_instance_config.call_count == 4
+
+    mock_services_running_here.return_value = (
+        ('myservice', 'canary', '02:42:a9:fe:00:0c', '3.3.3.3'),
+    )
+    assert index.update() == {'mydep.depinstance': {('myservice', 'canary')}}
+    assert mock_get_instance_config.call_count == 4
+
+
+@mock.patch.object(firewall, 'watch_running_containers', autospec=True)
+@mock.patch.object(firewall_update.DependencyIndex, 'update', autospec=True)
+@mock.patch.object(firewall_update, 'update_firewalls_for_namespaces', side_effect=StopIteration, autospec=True)
+def test_run_daemon(
+    update_firewalls_mock,
+    dependency_index_update_mock,
+    watch_running_containers_mock,
+    mock_daemon_args,
+):
     class kill_after_too_long(object):
         def __init__(self):
             self.count = 0
@@ -130,17 +172,27 @@ def test_run_daemon(process_inotify_mock, smartstack_deps_mock, mock_daemon_args
         def __call__(self, *args, **kwargs):
             self.count += 1
             assert self.count <= 5, 'Took too long to detect file change'
-            return {}
+            return {'mydep.depinstance': {('myservice', 'myinstance')}}
 
-    smartstack_deps_mock.side_effect = kill_after_too_long()
+    dependency_index_update_mock.side_effect = kill_after_too_long()
     subprocess.Popen(
-        ['bash', '-c', 'sleep 0.2; echo > %s/mydep.depinstance.json' % mock_daemon_args.synapse_service_dir],
+        ['bash', '-c', 'sleep 0.2; for i in 1 2 3; do echo > %s/mydep.depinstance.json; echo > %s/other.json; done' % (
+            mock_daemon_args.synapse_service_dir, mock_daemon_args.synapse_service_dir,
+        )],
     )
     with pytest.raises(StopIteration):
         firewall_update.run_daemon(mock_daemon_args)
-    assert smartstack_deps_mock.call_count > 0
-    assert process_inotify_mock.call_args[0][0][3] == b'mydep.depinstance.json'
-    assert process_inotify_mock.call_args[0][1] == {}
+    assert dependency_index_update_mock.call_count > 0
+    # all the changes are applied at once
+    assert update_firewalls_mock.mock_calls == [
+        mock.call(
+            {'mydep.depinstance'},
+            {'mydep.depinstance': {('myservice', 'myinstance')}},
+            mock_daemon_args.soa_dir,
+            mock_daemon_args.synapse_service_dir,
+        ),
+    ]
+    assert watch_running_containers_mock.called is True
 
 
 @mock.patch.object(firewall, 'firewall_flock', autospec=True)
@@ -158,11 +210,25 @@ def test_run_cron_flock_error(mock_general_update, mock_firewall_flock, mock_cro
         firewall_update.run_cron(mock_cron_args)
 
 
+@mock.patch.object(firewall_update, 'log', autospec=True)
+def test_process_inotify_event(log_mock):
+    assert firewall_update.process_inotify_event((None, None, None, b'mydep.depinstance.json')) == 'mydep.depinstance'
+    assert log_mock.debug.call_count == 1
+
+    # Verify that tmp writes do not apply
+    assert firewall_update.process_inotify_event((None, None, None, b'mydep.depinstance.tmp')) is None
+
+
 @mock.patch.object(firewall_update, 'log', autospec=True)
 @mock.patch.object(firewall_update.firewall, 'ensure_service_chains', autospec=True)
 @mock.patch.object(firewall_update.firewall, 'active_service_groups', autospec=True)
 @mock.patch.object(firewall, 'firewall_flock', autospec=True)
-def test_process_inotify_event(firewall_flock_mock, active_service_groups_mock, ensure_service_chains_mock, log_mock):
+def test_update_firewalls_for_namespaces(
+    firewall_flock_mock,
+    active_service_groups_mock,
+    ensure_service_chains_mock,
+    log_mock,
+):
     active_service_groups_mock.return_value = {
         firewall.ServiceGroup('myservice', 'myinstance'): {'00:00:00:00:00:00'},
         firewall.ServiceGroup('anotherservice', 'instance'): {'11:11:11:11:11:11'},
@@ -170,17 +236,18 @@ def test_process_inotify_event(firewall_flock_mock, active_service_groups_mock,
     }
 
     services_by_dependencies = {
-        'mydep.depinstance': {('myservice', 'myinstance'), ('anotherservice', 'instance')},
+        'mydep.depinstance': {('myservice', 'myinstance')},
+        'otherdep.depinstance': {('myservice', 'myinstance'), ('anotherservice', 'instance')},
     }
     soa_dir = mock.Mock()
     synapse_service_dir = mock.Mock()
-    firewall_update.process_inotify_event(
-        (None, None, None, b'mydep.depinstance.json'),
+    firewall_update.update_firewalls_for_namespaces(
+        {'mydep.depinstance', 'otherdep.depinstance', 'unuseddep.depinstance'},
         services_by_dependencies,
         soa_dir,
         synapse_service_dir,
     )
-    assert log_mock.debug.call_count == 3
+    assert log_mock.debug.call_count == 2
     log_mock.debug.assert_any_call("Updated ('myservice', 'myinstance')")
     log_mock.debug.assert_any_call("Updated ('anotherservice', 'instance')")
     assert ensure_service_chains_mock.mock_calls == [
@@ -196,16 +263,14 @@ def test_process_inotify_event(firewall_flock_mock, active_service_groups_mock,
 
     assert firewall_flock_mock.return_value.__enter__.called is True
 
-    # Verify that tmp writes do not apply
-    log_mock.reset_mock()
+    # Namespaces nothing depends on don't update anything
     ensure_service_chains_mock.reset_mock()
-    firewall_update.process_inotify_event(
-        (None, None, None, b'mydep.depinstance.tmp'),
+    firewall_update.update_firewalls_for_namespaces(
+        {'unuseddep.depinstance'},
         services_by_dependencies,
         soa_dir,
         synapse_service_dir,
     )
-    assert log_mock.debug.call_count == 1
     assert ensure_service_chains_mock.call_count == 0
 
 
@@ -213,7 +278,7 @@ def test_process_inotify_event(firewall_flock_mock, active_service_groups_mock,
 @mock.patch.object(firewall_update.firewall, 'ensure_service_chains', autospec=True)
 @mock.patch.object(firewall_update.firewall, 'active_service_groups', autospec=True)
 @mock.patch.object(firewall, 'firewall_flock', autospec=True, side_effect=TimeoutError('Oh noes'))
-def test_process_inotify_event_flock_error(
+def test_update_firewalls_for_namespaces_flock_error(
     firewall_flock_mock,
     active_service_groups_mock,
     ensure_service_chains_mock,
@@ -230,13 +295,13 @@ def test_process_inotify_event_flock_error(
     }
     soa_dir = mock.Mock()
     synapse_service_dir = mock.Mock()
-    firewall_update.process_inotify_event(
-        (None, None, None, b'mydep.depinstance.json'),
+    firewall_update.update_firewalls_for_namespaces(
+        {'mydep.depinstance'},
         services_by_dependencies,
         soa_dir,
         synapse_service_dir,
     )
-    assert log_mock.debug.call_count == 1
+    assert log_mock.debug.call_count == 0
     assert log_mock.error.call_count == 1
 
 
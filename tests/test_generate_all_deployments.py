@@ -0,0 +1,64 @@
+# Copyright 2015-2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import mock
+import pytest
+
+from paasta_tools import generate_all_deployments
+from paasta_tools.remote_git import LSRemoteException
+
+
+def test_generate_all_deployments():
+    def fake_generate_deployments_for_service(service, soa_dir):
+        if service == 'broken':
+            raise LSRemoteException('no refs for you')
+
+    with mock.patch(
+        'paasta_tools.generate_all_deployments.generate_deployments_for_service', autospec=True,
+        side_effect=fake_generate_deployments_for_service,
+    ) as mock_generate_deployments_for_service:
+        timings, failures = generate_all_deployments.generate_all_deployments(
+            services=['fake_service', 'broken', 'other_service'],
+            soa_dir='/fake/soa/dir',
+            workers=2,
+        )
+    assert sorted(timings) == ['fake_service', 'other_service']
+    assert list(failures) == ['broken']
+    assert isinstance(failures['broken'], LSRemoteException)
+    assert sorted(call[1]['service'] for call in mock_generate_deployments_for_service.call_args_list) == [
+        'broken', 'fake_service', 'other_service',
+    ]
+    for call in mock_generate_deployments_for_service.call_args_list:
+        assert call[1]['soa_dir'] == '/fake/soa/dir'
+
+
+@pytest.mark.parametrize('failures,exit_code', [({}, 0), ({'broken': Exception()}, 1)])
+def test_main(failures, exit_code):
+    with mock.patch(
+        'paasta_tools.generate_all_deployments.parse_args', autospec=True,
+        return_value=mock.Mock(soa_dir='/fake/soa/dir', workers=3, verbose=False),
+    ), mock.patch(
+        'paasta_tools.generate_all_deployments.list_paasta_services', autospec=True,
+        return_value=['a_service', 'b_service', 'broken'],
+    ) as mock_list_paasta_services, mock.patch(
+        'paasta_tools.generate_all_deployments.generate_all_deployments', autospec=True,
+        return_value=({'a_service': 0.1, 'b_service': 0.2}, failures),
+    ) as mock_generate_all_deployments, pytest.raises(SystemExit) as excinfo:
+        generate_all_deployments.main()
+    mock_generate_all_deployments.assert_called_once_with(
+        services=['a_service', 'b_service', 'broken'],
+        soa_dir='/fake/soa/dir',
+        workers=3,
+    )
+    mock_list_paasta_services.assert_called_once_with(soa_dir='/fake/soa/dir')
+    assert excinfo.value.code == exit_code
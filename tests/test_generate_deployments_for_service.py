@@ -230,3 +230,35 @@ def test_get_desired_state_fails_gracefully_with_start():
     actual = generate_deployments_for_service.get_desired_state(branch, remote_refs, deploy_group)
 
     assert actual == expected_desired_state
+
+
+def test_ref_index_latest_deployment_tag():
+    ref_index = generate_deployments_for_service.RefIndex({
+        'refs/heads/master': 'aaa',
+        'refs/tags/paasta-cluster.instance-20160308T053933-deploy': 'bbb',
+        'refs/tags/paasta-cluster.instance-20160309T053933-deploy': 'ccc',
+        'refs/tags/paasta-cluster.instance-20160307T053933-deploy': 'ddd',
+        'refs/tags/paasta-clusterXinstance-20160310T053933-deploy': 'eee',
+        'refs/tags/paasta-cluster.instance-notatimestamp-deploy': 'fff',
+        'refs/tags/paasta-with-dashes-20160301T000000-deploy': 'ggg',
+    })
+    assert ref_index.get_latest_deployment_tag('cluster.instance') == (
+        'refs/tags/paasta-cluster.instance-20160309T053933-deploy', 'ccc',
+    )
+    assert ref_index.get_latest_deployment_tag('with-dashes') == (
+        'refs/tags/paasta-with-dashes-20160301T000000-deploy', 'ggg',
+    )
+    assert ref_index.get_latest_deployment_tag('nope') == (None, None)
+
+
+def test_ref_index_desired_state_only_looks_at_the_deployed_sha():
+    ref_index = generate_deployments_for_service.RefIndex({
+        'refs/tags/paasta-cluster.instance-20160308T053933-deploy': 'deployed',
+        'refs/tags/paasta-cluster.instance-20160101T000000-stop': 'old',
+        'refs/tags/paasta-paasta-cluster.instance-20160201T000000-stop': 'deployed',
+        'refs/tags/paasta-cluster.instance-20160202T000000-start': 'deployed',
+        'refs/tags/paasta-cluster.other-20160203T000000-stop': 'deployed',
+    })
+    assert ref_index.get_desired_state('cluster.instance', 'cluster.instance') == ('start', '20160202T000000')
+    assert ref_index.get_desired_state('cluster.other', 'cluster.instance') == ('stop', '20160203T000000')
+    assert ref_index.get_desired_state('cluster.instance', 'nope') == ('start', None)
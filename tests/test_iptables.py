@@ -294,6 +294,143 @@ def test_list_chain_does_not_exist(mock_Table, mock_Chain):
         iptables.list_chain('PAASTA.internet')
 
 
+def test_list_all_chains():
+    rule = iptc.Rule()
+    rule.create_target('DROP')
+    chain1 = mock.Mock(rules=[rule])
+    chain1.name = 'PAASTA.internet'
+    chain2 = mock.Mock(rules=[])
+    chain2.name = 'INPUT'
+    table = mock.Mock(chains=[chain1, chain2])
+    assert iptables.list_all_chains(table) == {
+        'PAASTA.internet': (EMPTY_RULE._replace(target='DROP'),),
+        'INPUT': (),
+    }
+
+
+def test_ensure_chain_result():
+    current_rules = (
+        EMPTY_RULE._replace(target='LOG'),
+        EMPTY_RULE._replace(target='DROP'),
+        EMPTY_RULE._replace(target='ACCEPT', src='1.0.0.0/255.255.255.0'),
+    )
+    rules = (
+        EMPTY_RULE._replace(target='ACCEPT', src='2.0.0.0/255.255.255.0'),
+        EMPTY_RULE._replace(target='DROP'),
+        EMPTY_RULE._replace(target='ACCEPT', src='3.0.0.0/255.255.255.0'),
+        EMPTY_RULE._replace(target='LOG'),
+    )
+    assert iptables._ensure_chain_result(current_rules, rules) == (
+        # new rules are inserted at the front, one by one
+        (
+            EMPTY_RULE._replace(target='ACCEPT', src='3.0.0.0/255.255.255.0'),
+            EMPTY_RULE._replace(target='ACCEPT', src='2.0.0.0/255.255.255.0'),
+            EMPTY_RULE._replace(target='LOG'),
+            EMPTY_RULE._replace(target='DROP'),
+        ),
+        # and then LOG rules are moved to the end
+        (
+            EMPTY_RULE._replace(target='ACCEPT', src='3.0.0.0/255.255.255.0'),
+            EMPTY_RULE._replace(target='ACCEPT', src='2.0.0.0/255.255.255.0'),
+            EMPTY_RULE._replace(target='DROP'),
+            EMPTY_RULE._replace(target='LOG'),
+        ),
+    )
+
+
+class TestEnsureChains(object):
+    @pytest.yield_fixture(autouse=True)
+    def mocks(self, mock_Table):
+        self.chains = {}
+
+        def get_chain(table, name):
+            if name not in self.chains:
+                self.chains[name] = mock.Mock(rules=[])
+                self.chains[name].name = name
+            return self.chains[name]
+
+        with mock.patch.object(
+            iptables, 'iptables_txn', autospec=True,
+        ) as self.mock_iptables_txn, mock.patch.object(
+            iptables, 'list_all_chains', autospec=True,
+        ) as self.mock_list_all_chains, mock.patch.object(
+            iptables.iptc, 'Chain', autospec=True, side_effect=get_chain,
+        ), mock.patch.object(
+            # so that the mock chains can be checked for plain Rules
+            iptables.Rule, 'to_iptc', autospec=True, side_effect=lambda rule: rule,
+        ), mock.patch.object(
+            iptables.Rule, 'from_iptc', side_effect=lambda rule: rule,
+        ):
+            self.mock_table = mock_Table.return_value
+            yield
+
+    def test_no_changes(self):
+        self.mock_list_all_chains.return_value = {
+            'INPUT': (EMPTY_RULE._replace(target='PAASTA'),),
+            'PAASTA': (EMPTY_RULE._replace(target='DROP'),),
+        }
+        assert iptables.ensure_chains(
+            {'PAASTA': (EMPTY_RULE._replace(target='DROP'),)},
+            required_rules=(('INPUT', EMPTY_RULE._replace(target='PAASTA')),),
+            stale_chain_prefix='PAASTA.',
+        ) is False
+        assert self.mock_iptables_txn.called is False
+        assert self.chains == {}
+
+    def test_applies_diff_in_one_transaction(self):
+        self.mock_list_all_chains.return_value = {
+            'INPUT': (),
+            'PAASTA': (EMPTY_RULE._replace(target='DROP'),),
+            'PAASTA.unchanged': (EMPTY_RULE._replace(target='ACCEPT'),),
+            'PAASTA.stale': (EMPTY_RULE._replace(target='ACCEPT'),),
+        }
+        self.chains['PAASTA'] = mock.Mock(rules=[EMPTY_RULE._replace(target='DROP')])
+        self.chains['PAASTA'].name = 'PAASTA'
+
+        assert iptables.ensure_chains(
+            {
+                'PAASTA': (EMPTY_RULE._replace(target='ACCEPT'), EMPTY_RULE._replace(target='LOG')),
+                'PAASTA.unchanged': (EMPTY_RULE._replace(target='ACCEPT'),),
+                'PAASTA.new': (EMPTY_RULE._replace(target='ACCEPT'),),
+            },
+            required_rules=(('INPUT', EMPTY_RULE._replace(target='PAASTA')),),
+            stale_chain_prefix='PAASTA.',
+        ) is True
+
+        assert self.mock_iptables_txn.mock_calls == [
+            mock.call(self.mock_table),
+            mock.call().__enter__(),
+            mock.call().__exit__(None, None, None),
+        ]
+        self.mock_table.create_chain.assert_called_once_with('PAASTA.new')
+        assert set(self.chains) == {'PAASTA', 'PAASTA.new', 'INPUT', 'PAASTA.stale'}
+
+        paasta = self.chains['PAASTA']
+        assert paasta.delete_rule.mock_calls == [mock.call(EMPTY_RULE._replace(target='DROP'))]
+        assert paasta.insert_rule.mock_calls == [
+            mock.call(EMPTY_RULE._replace(target='ACCEPT')),
+            mock.call(EMPTY_RULE._replace(target='LOG')),
+        ]
+        assert paasta.replace_rule.mock_calls == [
+            mock.call(EMPTY_RULE._replace(target='ACCEPT'), 0),
+            mock.call(EMPTY_RULE._replace(target='LOG'), 1),
+        ]
+        assert self.chains['PAASTA.new'].insert_rule.mock_calls == [
+            mock.call(EMPTY_RULE._replace(target='ACCEPT')),
+        ]
+        assert self.chains['INPUT'].insert_rule.mock_calls == [
+            mock.call(EMPTY_RULE._replace(target='PAASTA')),
+        ]
+
+        assert self.chains['PAASTA.stale'].flush.called is True
+        assert self.chains['PAASTA.stale'].delete.called is True
+
+    def test_required_rule_chain_does_not_exist(self):
+        self.mock_list_all_chains.return_value = {}
+        with pytest.raises(iptables.ChainDoesNotExist):
+            iptables.ensure_chains({}, required_rules=(('INPUT', EMPTY_RULE._replace(target='PAASTA')),))
+
+
 class TestReorderChain(object):
     class FakeRule(namedtuple('FakeRule', ('target', 'id'))):
         def to_iptc(self):
@@ -2728,3 +2728,143 @@ def test_rendezvous_hash_roughly_fractional_change():
     num_same = len([1 for x, y in zip(first_results, second_results) if x == y])
     assert num_same > 8900
     assert num_same < 9100
+
+
+class TestFormattedMarathonAppDictCache:
+    def setup_method(self):
+        self.cache = marathon_tools.FormattedMarathonAppDictCache(max_entries=2)
+        self.cache.enable()
+        self.system_paasta_config = SystemPaastaConfig({'cluster': 'clustername'}, '/fake/dir/')
+        self.service_namespace_config = long_running_service_tools.ServiceNamespaceConfig()
+
+    def make_config(self, instance='instance', docker_image='abcdef', env=None):
+        return marathon_tools.MarathonServiceConfig(
+            service='service',
+            cluster='clustername',
+            instance=instance,
+            config_dict={'instances': 3, 'env': env or {}},
+            branch_dict={
+                'docker_image': docker_image,
+                'git_sha': 'deadbeef',
+                'force_bounce': None,
+                'desired_state': 'start',
+            },
+            soa_dir='/fake/soa',
+        )
+
+    def get(self, config):
+        return self.cache.get(
+            config=config,
+            system_paasta_config=self.system_paasta_config,
+            service_namespace_config=self.service_namespace_config,
+        )
+
+    def test_get_reuses_app_dict(self):
+        config = self.make_config()
+        with mock.patch.object(
+            marathon_tools.MarathonServiceConfig, '_format_marathon_app_dict', autospec=True,
+            return_value={'id': 'service.instance.gitdeadbeef.config1', 'instances': 3, 'env': {}},
+        ) as mock_format, mock.patch.object(
+            marathon_tools.MarathonServiceConfig, 'get_desired_instances', autospec=True, return_value=5,
+        ):
+            first = self.get(config)
+            first['env']['FOO'] = 'bar'
+            second = self.get(self.make_config())
+            assert mock_format.call_count == 1
+            assert second == {'id': 'service.instance.gitdeadbeef.config1', 'instances': 5, 'env': {}}
+            assert self.cache.get_stats() == {'entries': 1, 'hits': 1, 'misses': 1}
+
+    def test_get_disabled(self):
+        self.cache.disable()
+        with mock.patch.object(
+            marathon_tools.MarathonServiceConfig, '_format_marathon_app_dict', autospec=True,
+            return_value={'id': 'service.instance.gitdeadbeef.config1'},
+        ) as mock_format:
+            self.get(self.make_config())
+            self.get(self.make_config())
+            assert mock_format.call_count == 2
+            assert self.cache.get_stats()['entries'] == 0
+
+    def test_get_fingerprint_changes_with_inputs(self):
+        fingerprint = self.cache.get_fingerprint(
+            self.make_config(), self.system_paasta_config, self.service_namespace_config,
+        )
+        assert fingerprint == self.cache.get_fingerprint(
+            self.make_config(), self.system_paasta_config, self.service_namespace_config,
+        )
+        assert fingerprint != self.cache.get_fingerprint(
+            self.make_config(docker_image='fedcba'), self.system_paasta_config, self.service_namespace_config,
+        )
+        assert fingerprint != self.cache.get_fingerprint(
+            self.make_config(),
+            SystemPaastaConfig({'cluster': 'clustername', 'volumes': []}, '/fake/dir/'),
+            self.service_namespace_config,
+        )
+        assert fingerprint != self.cache.get_fingerprint(
+            self.make_config(),
+            self.system_paasta_config,
+            long_running_service_tools.ServiceNamespaceConfig({'discover': 'region'}),
+        )
+
+    def test_get_fingerprint_changes_with_secret_files(self):
+        config = self.make_config(env={'FOO': 'SECRET(foo)', 'BAR': 'bar'})
+        with mock.patch(
+            'paasta_tools.marathon_tools.get_file_fingerprint', autospec=True,
+            side_effect=[(1, 10, 100), (2, 10, 100)],
+        ) as mock_get_file_fingerprint:
+            assert self.cache.get_fingerprint(
+                config, self.system_paasta_config, self.service_namespace_config,
+            ) != self.cache.get_fingerprint(
+                config, self.system_paasta_config, self.service_namespace_config,
+            )
+            mock_get_file_fingerprint.assert_called_with('/fake/soa/service/secrets/foo.json')
+
+    def test_get_evicts_least_recently_used(self):
+        with mock.patch.object(
+            marathon_tools.MarathonServiceConfig, '_format_marathon_app_dict', autospec=True,
+            side_effect=lambda config, *args: {'id': config.instance},
+        ) as mock_format, mock.patch.object(
+            marathon_tools.MarathonServiceConfig, 'get_desired_instances', autospec=True, return_value=3,
+        ):
+            self.get(self.make_config(instance='a'))
+            self.get(self.make_config(instance='b'))
+            self.get(self.make_config(instance='a'))
+            self.get(self.make_config(instance='c'))
+            assert mock_format.call_count == 3
+            self.get(self.make_config(instance='a'))
+            assert mock_format.call_count == 3
+            self.get(self.make_config(instance='b'))
+            assert mock_format.call_count == 4
+
+    def test_clear(self):
+        with mock.patch.object(
+            marathon_tools.MarathonServiceConfig, '_format_marathon_app_dict', autospec=True,
+            return_value={'id': 'service.instance.gitdeadbeef.config1'},
+        ) as mock_format:
+            self.get(self.make_config())
+            self.cache.clear()
+            self.get(self.make_config())
+            assert mock_format.call_count == 2
+
+
+def test_format_marathon_app_dict_uses_cache():
+    fake_marathon_service_config = marathon_tools.MarathonServiceConfig(
+        service='service',
+        cluster='clustername',
+        instance='instance',
+        config_dict={},
+        branch_dict=None,
+    )
+    with mock.patch(
+        'paasta_tools.marathon_tools.load_service_namespace_config', autospec=True,
+    ) as mock_load_service_namespace_config, mock.patch(
+        'paasta_tools.marathon_tools.load_system_paasta_config', autospec=True,
+    ) as mock_load_system_paasta_config, mock.patch(
+        'paasta_tools.marathon_tools._formatted_app_dict_cache', autospec=True,
+    ) as mock_cache:
+        assert fake_marathon_service_config.format_marathon_app_dict() == mock_cache.get.return_value
+        mock_cache.get.assert_called_once_with(
+            config=fake_marathon_service_config,
+            system_paasta_config=mock_load_system_paasta_config.return_value,
+            service_namespace_config=mock_load_service_namespace_config.return_value,
+        )
@@ -139,7 +139,7 @@ def test_marathon_instances(mock_read_extra_service_information):
     assert list(s.instances(TEST_CLUSTER_NAME, MarathonServiceConfig)) == ['main', 'canary', 'not_deployed']
     mock_read_extra_service_information.assert_called_once_with(
         extra_info='marathon-%s' % TEST_CLUSTER_NAME,
-        service_name=TEST_SERVICE_NAME, soa_dir=TEST_SOA_DIR,
+        service=TEST_SERVICE_NAME, soa_dir=TEST_SOA_DIR,
     )
 
 
@@ -193,7 +193,7 @@ def test_marathon_instances_configs(
     assert list(s.instance_configs(TEST_CLUSTER_NAME, MarathonServiceConfig)) == expected
     mock_read_extra_service_information.assert_called_once_with(
         extra_info='marathon-%s' % TEST_CLUSTER_NAME,
-        service_name=TEST_SERVICE_NAME, soa_dir=TEST_SOA_DIR,
+        service=TEST_SERVICE_NAME, soa_dir=TEST_SOA_DIR,
     )
     mock_load_deployments_json.assert_called_once_with(
         TEST_SERVICE_NAME,
@@ -254,7 +254,7 @@ def test_chronos_instances_configs(
     assert list(s.instance_configs(TEST_CLUSTER_NAME, ChronosJobConfig)) == expected
     mock_read_extra_service_information.assert_called_once_with(
         extra_info='chronos-%s' % TEST_CLUSTER_NAME,
-        service_name=TEST_SERVICE_NAME, soa_dir=TEST_SOA_DIR,
+        service=TEST_SERVICE_NAME, soa_dir=TEST_SOA_DIR,
     )
     mock_load_deployments_json.assert_called_once_with(
         TEST_SERVICE_NAME,
@@ -313,7 +313,7 @@ def test_adhoc_instances_configs(
     assert list(s.instance_configs(TEST_CLUSTER_NAME, AdhocJobConfig)) == expected
     mock_read_extra_service_information.assert_called_once_with(
         extra_info='adhoc-%s' % TEST_CLUSTER_NAME,
-        service_name=TEST_SERVICE_NAME, soa_dir=TEST_SOA_DIR,
+        service=TEST_SERVICE_NAME, soa_dir=TEST_SOA_DIR,
     )
     mock_load_deployments_json.assert_called_once_with(
         TEST_SERVICE_NAME,
@@ -352,7 +352,7 @@ def test_old_and_new_ways_load_the_same_marathon_configs(
 @patch('paasta_tools.paasta_service_config_loader.load_v2_deployments_json', autospec=True)
 @patch('paasta_tools.chronos_tools.load_v2_deployments_json', autospec=True)
 @patch('paasta_tools.paasta_service_config_loader.read_extra_service_information', autospec=True)
-@patch('paasta_tools.chronos_tools.service_configuration_lib.read_extra_service_information', autospec=True)
+@patch('paasta_tools.chronos_tools.read_extra_service_information', autospec=True)
 def test_old_and_new_ways_load_the_same_chronos_configs(
         mock_chronos_tools_read_extra_service_information,
         mock_read_extra_service_information,
@@ -17,6 +17,7 @@ import mock
 
 from paasta_tools.secret_tools import get_hmac_for_secret
 from paasta_tools.secret_tools import get_secret_name_from_ref
+from paasta_tools.secret_tools import get_secret_path
 from paasta_tools.secret_tools import get_secret_provider
 from paasta_tools.secret_tools import is_secret_ref
 
@@ -38,6 +39,14 @@ def test_get_secret_name_from_ref():
     assert get_secret_name_from_ref('SECRET(aaa-bbb-222_111)') == 'aaa-bbb-222_111'
 
 
+def test_get_secret_path():
+    assert get_secret_path(
+        env_var_val='SECRET(secret1)',
+        service='service-name',
+        soa_dir='/nail/blah',
+    ) == '/nail/blah/service-name/secrets/secret1.json'
+
+
 def test_get_hmac_for_secret():
     with mock.patch(
         'paasta_tools.secret_tools.open', autospec=False,
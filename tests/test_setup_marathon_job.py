@@ -1815,6 +1815,9 @@ def make_fake_drain_method(
         else:
             return task._drain_state == 'down'
 
+    async def prefetch(tasks):  # pragma: no cover
+        pass
+
     return mock.Mock(
         name='fake_drain_method',
         # wrap all the "methods" in Mocks so tests can assert calls, etc.
@@ -1822,6 +1825,7 @@ def make_fake_drain_method(
         is_safe_to_kill=mock.Mock(name='is_safe_to_kill', side_effect=is_safe_to_kill),
         drain=mock.Mock(name='drain', side_effect=drain),
         stop_draining=mock.Mock(name='stop_draining', side_effect=stop_draining),
+        prefetch=mock.Mock(name='prefetch', side_effect=prefetch),
     )
 
 
@@ -1937,9 +1941,10 @@ class TestGetOldHappyUnhappyDrainingTasks(object):
         ), mock.patch(
             'paasta_tools.setup_marathon_job.get_draining_hosts', autospec=True,
         ):
+            fake_drain_method = make_fake_drain_method()
             actual = setup_marathon_job.get_tasks_by_state(
                 other_apps_with_clients=fake_apps_with_clients,
-                drain_method=make_fake_drain_method(),
+                drain_method=fake_drain_method,
                 service=fake_name,
                 nerve_ns=fake_instance,
                 bounce_health_params={},
@@ -1952,6 +1957,7 @@ class TestGetOldHappyUnhappyDrainingTasks(object):
         assert actual_live_unhappy_tasks == expected_live_unhappy_tasks
         assert actual_draining_tasks == expected_draining_tasks
         assert actual_at_risk_tasks == expected_at_risk_tasks
+        fake_drain_method.prefetch.assert_called_once_with(fake_app_1.tasks + fake_app_2.tasks)
 
 
 class TestDrainTasksAndFindTasksToKill(object):
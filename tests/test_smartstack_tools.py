@@ -15,6 +15,7 @@ import os
 
 import mock
 import requests
+from pytest import raises
 
 from paasta_tools import smartstack_tools
 from paasta_tools.smartstack_tools import backend_is_up
@@ -100,8 +101,8 @@ def test_get_replication_for_service():
     with open(testdata, 'r') as fd:
         mock_haproxy_data = fd.read()
 
-    mock_response = mock.Mock()
-    mock_response.text = mock_haproxy_data
+    mock_response = mock.MagicMock()
+    mock_response.__enter__.return_value.iter_lines.return_value = iter(mock_haproxy_data.splitlines())
     mock_get = mock.Mock(return_value=(mock_response))
 
     with mock.patch.object(requests.Session, 'get', mock_get):
@@ -120,6 +121,45 @@ def test_get_replication_for_service():
         assert expected == replication_result
 
 
+def test_parse_haproxy_csv():
+    lines = [
+        '# pxname,svname,status,weight,check_status,check_code,check_duration,lastchg,',
+        'service1,FRONTEND,OPEN,,,,,,',
+        'service1,10.1.1.1:31000_box1,UP,1,L7OK,200,2,123,',
+        'service1,10.1.1.2:31000_box2,DOWN,1,"L7STS, with a comma",500,1,45,',
+        '',
+        'service1,BACKEND,UP,1,,,,0,',
+        'service2,10.1.1.3:31000_box3,MAINT,1,L4CON,,0,6,',
+    ]
+    assert smartstack_tools.parse_haproxy_csv(lines) == [
+        smartstack_tools.HaproxyBackend('service1', '10.1.1.1:31000_box1', 'UP', 'L7OK', '200', '2', '123'),
+        smartstack_tools.HaproxyBackend(
+            'service1', '10.1.1.2:31000_box2', 'DOWN', 'L7STS, with a comma', '500', '1', '45',
+        ),
+        smartstack_tools.HaproxyBackend('service2', '10.1.1.3:31000_box3', 'MAINT', 'L4CON', '', '0', '6'),
+    ]
+
+    backends = smartstack_tools.parse_haproxy_csv(lines, services=['service2'])
+    assert len(backends) == 1
+    assert backends[0]['svname'] == '10.1.1.3:31000_box3'
+    assert backends[0].status == 'MAINT'
+    assert backends[0].get('weight') is None
+    with raises(KeyError):
+        backends[0]['weight']
+
+    assert smartstack_tools.parse_haproxy_csv([]) == []
+
+
+def test_parse_haproxy_csv_missing_columns():
+    lines = [
+        '# pxname,svname,status,',
+        'service1,10.1.1.1:31000_box1,UP,',
+    ]
+    assert smartstack_tools.parse_haproxy_csv(lines) == [
+        smartstack_tools.HaproxyBackend('service1', '10.1.1.1:31000_box1', 'UP'),
+    ]
+
+
 def test_get_registered_marathon_tasks():
     backends = [
         {"pxname": "servicename.main", "svname": "10.50.2.4:31000_box4", "status": "UP"},
@@ -269,3 +309,59 @@ def test_get_replication_for_instance(
     )
     assert checker.get_replication_for_instance(instance_config) == \
         {'fake_region1': {'fake_service.fake_instance': 20}}
+
+
+def test_haproxy_view_is_task_registered():
+    backends = [
+        {"pxname": "servicename.main", "svname": "10.50.2.4:31000_box4", "status": "UP"},
+        {"pxname": "servicename.main", "svname": "10.50.2.4:31001_box4", "status": "DOWN"},
+        {"pxname": "otherservice.main", "svname": "10.50.2.4:31002_box4", "status": "UP"},
+    ]
+    with mock.patch(
+        'paasta_tools.smartstack_tools.get_multiple_backends',
+        return_value=backends,
+        autospec=True,
+    ) as mock_get_multiple_backends, mock.patch(
+        'paasta_tools.smartstack_tools.socket.gethostbyname',
+        return_value='10.50.2.4',
+        autospec=True,
+    ) as mock_gethostbyname:
+        view = smartstack_tools.HaproxyView(6666, DEFAULT_SYNAPSE_HAPROXY_URL_FORMAT)
+        assert view.is_task_registered(mock.Mock(host='box4', ports=[31000]), 'servicename.main')
+        assert not view.is_task_registered(mock.Mock(host='box4', ports=[31001]), 'servicename.main')
+        assert not view.is_task_registered(mock.Mock(host='box4', ports=[31002]), 'servicename.main')
+        assert view.is_task_registered(mock.Mock(host='box4', ports=[31002]), 'otherservice.main')
+
+        mock_get_multiple_backends.assert_called_once_with(
+            None,
+            synapse_host='box4',
+            synapse_port=6666,
+            synapse_haproxy_url_format=DEFAULT_SYNAPSE_HAPROXY_URL_FORMAT,
+            session=view.session,
+        )
+        mock_gethostbyname.assert_called_once_with('box4')
+
+
+def test_haproxy_view_fetch():
+    def fake_get_multiple_backends(services, synapse_host, **kwargs):
+        if synapse_host == 'bad_host':
+            raise requests.exceptions.ConnectionError()
+        return [{"pxname": "servicename.main", "svname": "10.50.2.4:31000_%s" % synapse_host, "status": "UP"}]
+
+    with mock.patch(
+        'paasta_tools.smartstack_tools.get_multiple_backends',
+        side_effect=fake_get_multiple_backends,
+        autospec=True,
+    ) as mock_get_multiple_backends:
+        view = smartstack_tools.HaproxyView(6666, DEFAULT_SYNAPSE_HAPROXY_URL_FORMAT, services=['servicename.main'])
+        view.fetch(['box4', 'box5', 'bad_host'])
+        view.fetch(['box4', 'bad_host'])
+        assert mock_get_multiple_backends.call_count == 3
+
+        assert view.get_backends('box5', 'servicename.main', '10.50.2.4', 31000) == [
+            {"pxname": "servicename.main", "svname": "10.50.2.4:31000_box5", "status": "UP"},
+        ]
+        assert view.get_backends('box5', 'servicename.main', '10.50.2.4', 31001) == []
+        with raises(requests.exceptions.ConnectionError):
+            view.get_backends('bad_host', 'servicename.main', '10.50.2.4', 31000)
+        assert mock_get_multiple_backends.call_count == 3
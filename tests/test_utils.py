@@ -158,6 +158,134 @@ def test_get_readable_files_in_glob_is_recursive(tmpdir):
     assert set(ret) == {a.strpath, b.strpath, c.strpath}
 
 
+def test_soa_configs_cache_reparses_changed_files(tmpdir):
+    cache = utils.SoaConfigsCache()
+    config_file = tmpdir.join('marathon-norcal-devc.yaml')
+    config_file.write('main: {}')
+    mock_loader = mock.Mock(return_value={'main': {}})
+
+    assert cache.get(config_file.strpath, [config_file.strpath], mock_loader) == {'main': {}}
+    assert cache.get(config_file.strpath, [config_file.strpath], mock_loader) == {'main': {}}
+    assert mock_loader.call_count == 1
+
+    config_file.write('main: {}\ncanary: {}')
+    mock_loader.return_value = {'main': {}, 'canary': {}}
+    assert cache.get(config_file.strpath, [config_file.strpath], mock_loader) == {'main': {}, 'canary': {}}
+    assert mock_loader.call_count == 2
+    assert cache.get_stats()['hits'] == 1
+    assert cache.get_stats()['misses'] == 2
+
+
+def test_soa_configs_cache_returns_copies(tmpdir):
+    cache = utils.SoaConfigsCache()
+    config_file = tmpdir.join('marathon-norcal-devc.yaml').ensure()
+    cache.get(config_file.strpath, [config_file.strpath], lambda: {'main': {}})['main']['cpus'] = 1
+    assert cache.get(config_file.strpath, [config_file.strpath], lambda: {}) == {'main': {}}
+
+
+def test_soa_configs_cache_evicts_least_recently_used(tmpdir):
+    cache = utils.SoaConfigsCache(max_entries=2)
+    paths = [tmpdir.join(name).ensure().strpath for name in ('a.yaml', 'b.yaml', 'c.yaml')]
+    for path in paths:
+        cache.get(path, [path], dict)
+    assert list(cache.entries.keys()) == paths[1:]
+
+
+def test_soa_configs_cache_does_not_cache_missing_files(tmpdir):
+    cache = utils.SoaConfigsCache()
+    path = tmpdir.join('missing.yaml').strpath
+    mock_loader = mock.Mock(return_value={})
+    cache.get(path, [path], mock_loader)
+    cache.get(path, [path], mock_loader)
+    assert mock_loader.call_count == 2
+    assert cache.get_stats()['entries'] == 0
+
+
+def test_read_extra_service_information(tmpdir):
+    tmpdir.join('fake_service').ensure_dir().join('marathon-norcal-devc.yaml').write('main:\n  cpus: 1\n')
+    assert utils.read_extra_service_information(
+        'fake_service',
+        'marathon-norcal-devc',
+        soa_dir=tmpdir.strpath,
+    ) == {'main': {'cpus': 1}}
+
+
+def test_compile_soa_configs_snapshot(tmpdir):
+    soa_dir = tmpdir.join('services').ensure_dir()
+    service_dir = soa_dir.join('fake_service').ensure_dir()
+    service_dir.join('service.yaml').write('git_url: git@github.com:fake_service\n')
+    service_dir.join('marathon-westeros-prod.yaml').write('main:\n  cpus: 1\n')
+    service_dir.join('deployments.json').write('{"v2": {"deployments": {}, "controls": {}}}')
+
+    assert utils.compile_soa_configs_snapshot(['westeros-prod'], soa_dir=soa_dir.strpath) == 3
+    snapshot_path = utils.get_soa_configs_snapshot_path(soa_dir.strpath)
+    assert snapshot_path == tmpdir.join('services.snapshot').strpath
+
+    cache = utils.SoaConfigsCache()
+    assert cache.load_snapshot(snapshot_path, soa_dir.strpath) == 3
+    mock_loader = mock.Mock()
+    path = service_dir.join('marathon-westeros-prod.yaml').strpath
+    assert cache.get(path, [path], mock_loader) == {'main': {'cpus': 1}}
+    assert not mock_loader.called
+
+
+def test_soa_configs_snapshot_skips_changed_files(tmpdir):
+    soa_dir = tmpdir.join('services').ensure_dir()
+    service_dir = soa_dir.join('fake_service').ensure_dir()
+    config_file = service_dir.join('marathon-westeros-prod.yaml')
+    config_file.write('main:\n  cpus: 1\n')
+    utils.compile_soa_configs_snapshot(['westeros-prod'], soa_dir=soa_dir.strpath)
+    snapshot_path = utils.get_soa_configs_snapshot_path(soa_dir.strpath)
+
+    # Rewriting a file with the same content keeps its compiled entry fresh
+    config_file.remove()
+    config_file.write('main:\n  cpus: 1\n')
+    cache = utils.SoaConfigsCache()
+    assert cache.load_snapshot(snapshot_path, soa_dir.strpath) == 1
+    assert cache.get(config_file.strpath, [config_file.strpath], mock.Mock()) == {'main': {'cpus': 1}}
+
+    config_file.write('main:\n  cpus: 2\n')
+    cache = utils.SoaConfigsCache()
+    with mock.patch('paasta_tools.utils.get_file_checksum', autospec=True) as mock_get_file_checksum:
+        assert cache.load_snapshot(snapshot_path, soa_dir.strpath) == 1
+        assert not mock_get_file_checksum.called
+    mock_loader = mock.Mock(return_value={'main': {'cpus': 2}})
+    assert cache.get(config_file.strpath, [config_file.strpath], mock_loader) == {'main': {'cpus': 2}}
+    assert mock_loader.call_count == 1
+    assert cache.load_snapshot(snapshot_path, tmpdir.strpath) == 0
+
+
+def test_soa_configs_snapshot_leaves_out_files_changed_since_they_were_parsed(tmpdir):
+    cache = utils.SoaConfigsCache()
+    changed_file = tmpdir.join('marathon-westeros-prod.yaml')
+    changed_file.write('main:\n  cpus: 1\n')
+    unchanged_file = tmpdir.join('marathon-westeros-stage.yaml')
+    unchanged_file.write('main:\n  cpus: 1\n')
+    for config_file in (changed_file, unchanged_file):
+        cache.get(config_file.strpath, [config_file.strpath], lambda: {'main': {'cpus': 1}})
+    changed_file.write('main:\n  cpus: 10\n')
+
+    snapshot_path = tmpdir.join('services.snapshot').strpath
+    cache.save_snapshot(snapshot_path, tmpdir.strpath, {
+        config_file.strpath: [config_file.strpath] for config_file in (changed_file, unchanged_file)
+    })
+    cache = utils.SoaConfigsCache()
+    assert cache.load_snapshot(snapshot_path, tmpdir.strpath) == 1
+    assert set(cache.compiled_entries) == {unchanged_file.strpath}
+    assert set(cache.compiled_checksums) == {unchanged_file.strpath}
+
+
+def test_ensure_snapshot_loaded_normalises_soa_dir(tmpdir):
+    soa_dir = tmpdir.join('services').ensure_dir()
+    cache = utils.SoaConfigsCache()
+    with mock.patch('paasta_tools.utils.get_soa_configs_snapshot_path', autospec=True) as mock_get_snapshot_path:
+        mock_get_snapshot_path.return_value = tmpdir.join('services.snapshot').strpath
+        cache.ensure_snapshot_loaded(soa_dir.strpath)
+        cache.ensure_snapshot_loaded(soa_dir.strpath + '/')
+        cache.ensure_snapshot_loaded(soa_dir.join('fake_service', '..').strpath)
+    assert mock_get_snapshot_path.call_count == 1
+
+
 def test_load_system_paasta_config():
     json_load_return_value: utils.SystemPaastaConfigDict = {'cluster': 'bar'}
     expected = utils.SystemPaastaConfig(json_load_return_value, '/some/fake/dir')
@@ -416,6 +544,20 @@ def test_SystemPaastaConfig_get_deployd_log_level():
     assert actual == expected
 
 
+def test_SystemPaastaConfig_get_deployd_use_worker_processes():
+    fake_config = utils.SystemPaastaConfig({}, '/some/fake/dir')
+    assert fake_config.get_deployd_use_worker_processes() is False
+    fake_config = utils.SystemPaastaConfig({"deployd_use_worker_processes": True}, '/some/fake/dir')
+    assert fake_config.get_deployd_use_worker_processes() is True
+
+
+def test_SystemPaastaConfig_get_deployd_worker_process_timeout():
+    fake_config = utils.SystemPaastaConfig({}, '/some/fake/dir')
+    assert fake_config.get_deployd_worker_process_timeout() == 600
+    fake_config = utils.SystemPaastaConfig({"deployd_worker_process_timeout": 30}, '/some/fake/dir')
+    assert fake_config.get_deployd_worker_process_timeout() == 30
+
+
 @pytest.yield_fixture
 def umask_022():
     old_umask = os.umask(0o022)
@@ -1658,10 +1800,10 @@ def test_validate_service_instance_valid_marathon():
     fake_cluster = 'fake_cluster'
     fake_soa_dir = 'fake_soa_dir'
     with mock.patch(
-        'paasta_tools.utils.get_services_for_cluster',
+        'paasta_tools.utils.get_service_instance_list',
         autospec=True,
         side_effect=[mock_marathon_services, mock_chronos_services],
-    ) as get_services_for_cluster_patch:
+    ) as get_service_instance_list_patch:
         assert utils.validate_service_instance(
             my_service,
             my_instance,
@@ -1669,10 +1811,11 @@ def test_validate_service_instance_valid_marathon():
             fake_soa_dir,
         ) == 'marathon'
         assert mock.call(
+            my_service,
             cluster=fake_cluster,
             instance_type='marathon',
             soa_dir=fake_soa_dir,
-        ) in get_services_for_cluster_patch.call_args_list
+        ) in get_service_instance_list_patch.call_args_list
 
 
 def test_validate_service_instance_valid_chronos():
@@ -1683,10 +1826,10 @@ def test_validate_service_instance_valid_chronos():
     fake_cluster = 'fake_cluster'
     fake_soa_dir = 'fake_soa_dir'
     with mock.patch(
-        'paasta_tools.utils.get_services_for_cluster',
+        'paasta_tools.utils.get_service_instance_list',
         autospec=True,
         side_effect=[mock_marathon_services, mock_chronos_services],
-    ) as get_services_for_cluster_patch:
+    ) as get_service_instance_list_patch:
         assert utils.validate_service_instance(
             my_service,
             my_instance,
@@ -1694,10 +1837,11 @@ def test_validate_service_instance_valid_chronos():
             fake_soa_dir,
         ) == 'chronos'
         assert mock.call(
+            my_service,
             cluster=fake_cluster,
             instance_type='chronos',
             soa_dir=fake_soa_dir,
-        ) in get_services_for_cluster_patch.call_args_list
+        ) in get_service_instance_list_patch.call_args_list
 
 
 def test_validate_service_instance_invalid():
@@ -1710,7 +1854,7 @@ def test_validate_service_instance_invalid():
     fake_cluster = 'fake_cluster'
     fake_soa_dir = 'fake_soa_dir'
     with mock.patch(
-        'paasta_tools.utils.get_services_for_cluster',
+        'paasta_tools.utils.get_service_instance_list',
         autospec=True,
         side_effect=[
             mock_marathon_services, mock_chronos_services,
@@ -1880,6 +2024,87 @@ class TestFileLogWriter:
         }
 
 
+def test_batch_lines():
+    lines = [b'a' * 3, b'b' * 3, b'c' * 10, b'd' * 2, b'e' * 2]
+    assert list(utils.batch_lines(lines, 6)) == [b'aaabbb', b'c' * 10, b'ddee']
+    assert list(utils.batch_lines([], 6)) == []
+
+
+class TestBufferedFileLogWriter:
+    def make_writer(self, tmpdir, **kwargs):
+        kwargs.setdefault('flush_interval', 3600)
+        fw = utils.BufferedFileLogWriter(str(tmpdir.join("{service}.log")), **kwargs)
+        fw.flusher = mock.Mock()  # don't start a background thread
+        return fw
+
+    def test_log_buffers_until_flush(self, tmpdir):
+        fw = self.make_writer(tmpdir)
+        fw.log('fake_service', 'fake_line', 'build', 'level')
+        assert not tmpdir.join('fake_service.log').check()
+
+        fw.flush()
+        [line] = tmpdir.join('fake_service.log').read().splitlines()
+        assert json.loads(line)['message'] == 'fake_line'
+        fw.close()
+
+    def test_log_flushes_at_flush_bytes(self, tmpdir):
+        fw = self.make_writer(tmpdir, flush_bytes=1)
+        fw.log('fake_service', 'fake_line', 'build', 'level')
+        assert len(tmpdir.join('fake_service.log').read().splitlines()) == 1
+        assert fw.buffers == {}
+        fw.close()
+
+    def test_flush_writes_batches_of_at_most_pipe_buf(self, tmpdir):
+        fw = self.make_writer(tmpdir)
+        for i in range(100):
+            fw.log('fake_service', 'x' * 100, 'build', 'level')
+        fake_file = mock.Mock()
+        with mock.patch.object(fw, 'get_file', return_value=fake_file, autospec=True):
+            fw.flush()
+
+        written = [call[0][0] for call in fake_file.write.call_args_list]
+        assert len(written) > 1
+        assert all(len(batch) <= utils.select.PIPE_BUF for batch in written)
+        assert all(batch.endswith(b'\n') for batch in written)
+        assert sum(batch.count(b'\n') for batch in written) == 100
+
+    def test_closes_least_recently_used_files(self, tmpdir):
+        fw = self.make_writer(tmpdir, max_open_files=2)
+        for service in ('a', 'b', 'c', 'b'):
+            fw.log(service, 'fake_line', 'build', 'level')
+            fw.flush()
+        assert list(fw.files) == [str(tmpdir.join('c.log')), str(tmpdir.join('b.log'))]
+        assert len(tmpdir.join('b.log').read().splitlines()) == 2
+        fw.close()
+        assert fw.files == {}
+
+    def test_reopens_rotated_file(self, tmpdir):
+        fw = self.make_writer(tmpdir)
+        fw.log('fake_service', 'before', 'build', 'level')
+        fw.flush()
+        tmpdir.join('fake_service.log').rename(tmpdir.join('fake_service.log.1'))
+
+        fw.log('fake_service', 'after', 'build', 'level')
+        fw.close()
+        assert json.loads(tmpdir.join('fake_service.log.1').read())['message'] == 'before'
+        assert json.loads(tmpdir.join('fake_service.log').read())['message'] == 'after'
+
+    def test_write_raises_IOError(self, tmpdir):
+        fw = self.make_writer(tmpdir)
+        fw.log('fake_service', 'fake_line', 'build', 'level')
+        with mock.patch.object(
+            fw, 'get_file', side_effect=IOError("hurp durp"), autospec=True,
+        ), mock.patch(
+            "paasta_tools.utils.paasta_print", autospec=True,
+        ) as mock_print:
+            fw.flush()
+
+        mock_print.assert_called_once_with(mock.ANY, file=sys.stderr)
+        assert mock_print.call_args[0][0].startswith(
+            "Could not log to %s: OSError: hurp durp -- would have logged: " % tmpdir.join('fake_service.log'),
+        )
+
+
 def test_deep_merge_dictionaries():
     overrides = {
         'common_key': 'value',